@@ -7,6 +7,8 @@ from pathlib import Path
 
 import psutil
 
+from atlasserver.taskrunner import status as runnerstatus
+
 ATLASSERVERPATH = Path(__file__).resolve().parent.parent
 
 
@@ -98,6 +100,23 @@ def stop() -> None:
         Path("/tmp/atlasforced/taskrunner.pid").unlink()
 
 
+def drain(handover: bool, seconds: float) -> None:
+    """Ask the task runner to finish its running tasks within `seconds` and exit, or restart after a handover."""
+    if not taskrunner_session_exists():
+        print("task runner tmux session does not exist")
+        sys.exit(1)
+
+    runnerstatus.write_drain_request(runnerstatus.DrainRequest.after(seconds, handover=handover))
+    if handover:
+        print(f"Asked the task runner to restart once its running tasks finish, or in {seconds:.0f} seconds at most")
+        print(
+            "With ATLASSERVER_TASKRUNNER_DETACHED, it restarts once each task's remote job is out, for the new runner"
+        )
+    else:
+        print(f"Asked the task runner to stop once its running tasks finish, or in {seconds:.0f} seconds at most")
+    print_tips()
+
+
 def main() -> None:
     """Handle commands for starting/stopping the task runner or viewing the log."""
     if len(sys.argv) == 2 and sys.argv[1] == "start":
@@ -110,6 +129,14 @@ def main() -> None:
     elif len(sys.argv) == 2 and sys.argv[1] == "stop":
         stop()
 
+    elif len(sys.argv) in {2, 3} and sys.argv[1] in {"drain", "handover"}:
+        try:
+            seconds = float(sys.argv[2]) if len(sys.argv) == 3 else runnerstatus.DRAIN_DEADLINE_SECONDS
+        except ValueError:
+            print(f"Not a number of seconds: {sys.argv[2]}")
+            sys.exit(3)
+        drain(handover=sys.argv[1] == "handover", seconds=seconds)
+
     elif len(sys.argv) >= 2 and sys.argv[1] == "log":
         run_command(
             [
@@ -123,6 +150,7 @@ def main() -> None:
 
     else:
         print("Usage: atlastaskrunner [start|restart|stop|log] [-f]")
+        print("       atlastaskrunner [drain|handover] [seconds]")
         print_tips()
         sys.exit(3)
 
@@ -0,0 +1 @@
+"""Timings of the server's hot paths against synthetic data, run by hand rather than by the test suite."""
@@ -0,0 +1,130 @@
+"""Time the queue position numbering at realistic and at extreme queue depths.
+
+    python -m atlasserver.benchmarks.queuepositions [--tasks 10000 100000] [--users 500]
+
+Runs against an in-memory SQLite database set up from atlasserver.settings_test, so it needs no
+server and touches no real data. For each queue depth it reports, in seconds:
+
+    order   round_robin_order() alone, and the pass-by-pass walk it replaced (only up to
+            --legacy-max tasks: the walk is quadratic in the deepest user's queue)
+    full    calculate_queue_positions() over the whole queue
+    tail    the same after one more submission by the user with most tasks queued, renumbering
+            only from first_position_after_user(), as the runner does for a submission
+
+The queue has one user holding HEAVY_USER_TASKS tasks, the shape that made the walk slowest, and
+the rest spread at random over the other users.
+"""
+
+import argparse
+import os
+import random
+import time
+import typing as t
+
+if t.TYPE_CHECKING:
+    from collections.abc import Iterable
+
+# the queue of one user with a radeclist or two in it
+HEAVY_USER_TASKS: int = 500
+
+
+def legacy_order(queued: "Iterable[tuple[int, int]]", runninguserid: int | None) -> list[int]:
+    """Return the order calculate_queue_positions() used to find, by walking the queue a pass at a time.
+
+    Kept here as the baseline to time against, and for the tests to check its replacement with.
+    Takes the same arguments as forcephot.queue.round_robin_order, without the tail renumbering.
+    """
+    unassigned = list(queued)
+    order: list[int] = []
+    passnum = 0
+    while unassigned:
+        # the running task's user has had its turn in the first pass
+        assigned_userids = {runninguserid} if passnum == 0 and runninguserid is not None else set()
+        remaining = []
+        for taskid, userid in unassigned:
+            if userid not in assigned_userids and (passnum != 0 or runninguserid is None or userid > runninguserid):
+                order.append(taskid)
+                assigned_userids.add(userid)
+            else:
+                remaining.append((taskid, userid))
+        unassigned = remaining
+        passnum += 1
+    return order
+
+
+def timed(func: t.Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def synthetic_userids(taskcount: int, usercount: int, rng: random.Random) -> list[int]:
+    """Return a user id for each task: HEAVY_USER_TASKS for the first user, the rest at random."""
+    heavy = min(HEAVY_USER_TASKS, taskcount)
+    return [1] * heavy + [rng.randint(2, max(2, usercount)) for _ in range(taskcount - heavy)]
+
+
+def run(taskcount: int, usercount: int, legacy_max: int, rng: random.Random) -> dict[str, float]:
+    import datetime
+
+    from django.contrib.auth.models import User
+
+    from atlasserver.forcephot import queue as taskqueue
+    from atlasserver.forcephot.models import Task
+
+    Task.objects.all().delete()
+    User.objects.all().delete()
+    User.objects.bulk_create([User(id=userid, username=f"bench{userid}") for userid in range(1, usercount + 2)])
+
+    userids = synthetic_userids(taskcount, usercount, rng)
+    submitted = datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=1)
+    Task.objects.bulk_create(
+        [
+            Task(user_id=userid, ra=1.0, dec=2.0, timestamp=submitted + datetime.timedelta(seconds=index))
+            for index, userid in enumerate(userids)
+        ],
+        batch_size=5000,
+    )
+    # one of them is running, which is what decides where the first pass starts
+    running = Task.objects.order_by("?").first()
+    assert running is not None
+    Task.objects.filter(id=running.id).update(starttimestamp=datetime.datetime.now(datetime.UTC))
+
+    queued = list(
+        Task.queued().exclude(id=running.id).order_by("user_id", "timestamp", "id").values_list("id", "user_id")
+    )
+    timings = {"order": timed(lambda: taskqueue.round_robin_order(queued, runninguserid=running.user_id))}
+    if taskcount <= legacy_max:
+        timings["order_legacy"] = timed(lambda: legacy_order(queued, runninguserid=running.user_id))
+
+    timings["full"] = timed(taskqueue.calculate_queue_positions)
+
+    from_position = taskqueue.first_position_after_user(1)
+    Task.objects.create(user_id=1, ra=1.0, dec=2.0, queuepos_relative=taskqueue.next_queuepos_relative())
+    timings["tail"] = timed(lambda: taskqueue.calculate_queue_positions(from_position=from_position))
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, nargs="+", default=[10_000, 100_000], help="queue depths to time")
+    parser.add_argument("--users", type=int, default=500, help="users the tasks are spread over")
+    parser.add_argument("--legacy-max", type=int, default=10_000, help="deepest queue to time the old walk on")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "atlasserver.settings_test")
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    rng = random.Random(args.seed)  # noqa: S311 (synthetic queues, nothing secret)
+    for taskcount in args.tasks:
+        timings = run(taskcount, args.users, args.legacy_max, rng)
+        print(f"{taskcount:>7} tasks: " + "  ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""Time the task runner's dispatch loop draining a synthetic queue, and write the results as JSON.
+
+    python -m atlasserver.benchmarks.taskrunner [--tasks 2000] [--users 50] [--slots 16]
+        [--mix FP=80 IMGZIP=10 SSOSTACK=10] [--simulation SETTINGS] [--output results.json]
+
+Seeds a scratch SQLite database with --tasks queued tasks spread over --users users in the given
+mix of request types, then runs taskrunner.main.main() until every one has finished. Nothing is
+remote: each slot is a thread rather than a process, and its runtask() sleeps for a draw from the
+same latency distributions as the simulated executor (--simulation takes the settings that
+ATLASSERVER_TASKRUNNER_SIMULATION does; see taskrunner/executors.py) and writes a small result file.
+What is left to measure is the runner's own work: dispatching, the database, the queue numbering
+and the status file. It reports
+
+    tasks_per_second            tasks finished, over the time until the last of them finished
+    submit_to_start_seconds     mean (overall and by request type), p50, p99 and max, from seeding
+                                to each task's first start
+    queries_per_dispatch        queries made by the dispatch loop itself, per task it started
+    queue_numbering             calls to and seconds in calculate_queue_positions (or, with the
+                                virtual queue, virtual_queue_order)
+    write_status                calls to and seconds in write_status
+
+along with the commit and the runner's modes. The modes are the ATLASSERVER_TASKRUNNER_* settings
+from the environment, so one configuration is compared with another by setting them, except those
+that depend on the slots being processes or the hosts being real, which are turned off: the worker
+pool and ssh multiplexing. The timings are SQLite's, so they compare commits and
+configurations with each other rather than predicting production; the query counts carry over.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import typing as t
+from pathlib import Path
+
+# how often the watcher asks whether the queue has drained
+DRAINED_CHECK_SECONDS: float = 0.5
+
+# What --simulation starts from, over executors.SIMULATION_DEFAULTS: tasks of a few tens of
+# milliseconds rather than minutes, so that the dispatch loop is what limits the rate
+DEFAULT_SIMULATION = "fp=lognormal:0.05:0.5 imgzip=lognormal:0.1:0.5 ssostack=lognormal:0.2:0.5 failure_rate=0"
+
+
+class LoopDone(Exception):  # noqa: N818 (a signal to stop, not an error)
+    """Raised into the dispatch loop once the queue has drained, to end main()."""
+
+
+class ThreadSlot:
+    """Stands in for the mp.Process of one slot: runs its task on a thread of this process.
+
+    The sentinel is the read end of a pipe whose write end closes when the task is done, so that
+    the runner's wakeup mode can wait on it as it does on a process's.
+    """
+
+    def __init__(self, target: t.Callable[..., object], kwargs: dict[str, t.Any]) -> None:
+        """Describe the slot's run; nothing starts until start(), as with a process."""
+        self.thread = threading.Thread(target=self.run, args=(target, kwargs), daemon=True)
+        self.exitcode: int | None = None
+        self.sentinel, self.donefd = os.pipe()
+
+    def run(self, target: t.Callable[..., object], kwargs: dict[str, t.Any]) -> None:
+        from django.db import connection
+
+        try:
+            target(**kwargs)
+        finally:
+            connection.close()
+            self.exitcode = 0
+            os.close(self.donefd)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def join(self) -> None:
+        self.thread.join()
+
+    def close(self) -> None:
+        os.close(self.sentinel)
+
+
+class Timings:
+    """Calls to a function and the seconds spent in them."""
+
+    def __init__(self) -> None:
+        """Start from nothing; wrap() the function to count it."""
+        self.calls = 0
+        self.seconds = 0.0
+
+    def wrap(self, func: t.Callable[..., t.Any]) -> t.Callable[..., t.Any]:
+        def timed(*args: t.Any, **kwargs: t.Any) -> t.Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.calls += 1
+                self.seconds += time.perf_counter() - start
+
+        return timed
+
+    def as_dict(self) -> dict[str, float]:
+        return {"calls": self.calls, "seconds": round(self.seconds, 6)}
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    """Return the nearest-rank percentile of the values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def parse_mix(entries: list[str]) -> dict[str, float]:
+    """Return the weight of each request type from TYPE=WEIGHT entries."""
+    mix = {}
+    for entry in entries:
+        request_type, _, weight = entry.partition("=")
+        if request_type not in {"FP", "IMGZIP", "SSOSTACK"} or not weight.replace(".", "", 1).isdecimal():
+            msg = f"--mix: {entry!r} is not FP, IMGZIP or SSOSTACK=WEIGHT"
+            raise SystemExit(msg)
+        mix[request_type] = float(weight)
+    return mix
+
+
+def commit_id() -> str | None:
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    return None
+
+
+def seed_queue(taskcount: int, usercount: int, mix: dict[str, float], rng: random.Random) -> None:
+    """Create the users and their queued tasks, and a finished forced photometry task per user.
+
+    The finished ones are what the image requests are for, as on the site.
+    """
+    from django.contrib.auth.models import User
+
+    from atlasserver.forcephot.models import Task
+
+    User.objects.bulk_create([User(id=userid, username=f"bench{userid}") for userid in range(1, usercount + 1)])
+    now = datetime.datetime.now(datetime.UTC)
+    parents = Task.objects.bulk_create(
+        [
+            Task(user_id=userid, ra=1.0, dec=2.0, send_email=False, starttimestamp=now, finishtimestamp=now)
+            for userid in range(1, usercount + 1)
+        ]
+    )
+    parent_ids = {parent.user_id: parent.id for parent in parents}
+
+    tasks = []
+    for index, request_type in enumerate(rng.choices(list(mix), weights=list(mix.values()), k=taskcount)):
+        userid = rng.randint(1, usercount)
+        target: dict[str, t.Any] = {"ra": rng.uniform(0.0, 360.0), "dec": rng.uniform(-90.0, 90.0)}
+        if request_type == "IMGZIP":
+            target["parent_task_id"] = parent_ids[userid]
+        elif request_type == "SSOSTACK":
+            target = {"mpc_name": f"{rng.randint(1, 500000)}"}
+        tasks.append(
+            Task(
+                user_id=userid,
+                request_type=request_type,
+                send_email=False,
+                mjd_min=60000.0,
+                timestamp=now + datetime.timedelta(microseconds=index),
+                **target,
+            )
+        )
+    Task.objects.bulk_create(tasks, batch_size=5000)
+
+
+def make_runtask(simulation: dict[str, t.Any], rng: random.Random) -> t.Callable[..., tuple[Path | None, str | None]]:
+    """Return a stand-in for taskrunner.main.runtask() that sleeps rather than running anything."""
+    from atlasserver import settings
+    from atlasserver.taskrunner.atlas_simulated import draw
+
+    def runtask(task: t.Any, logfunc: t.Any, **_kwargs: t.Any) -> tuple[Path | None, str | None]:
+        time.sleep(draw(rng, simulation[task.request_type.lower()]))
+        if rng.random() < simulation["failure_rate"]:
+            return None, None
+
+        suffix = {"FP": ".txt", "IMGZIP": ".zip", "SSOSTACK": ".fits"}[task.request_type]
+        resultfile = Path(settings.RESULTS_DIR, f"job{task.id:05d}{suffix}")
+        resultfile.write_text("###MJD uJy\n60000.0 100\n")
+        return resultfile, None
+
+    return runtask
+
+
+def run(args: argparse.Namespace, workdir: Path) -> dict[str, t.Any]:
+    from django.db import connection
+
+    from atlasserver import settings
+    from atlasserver.forcephot import queue as taskqueue
+    from atlasserver.forcephot.models import Task
+    from atlasserver.taskrunner import executors
+    from atlasserver.taskrunner import main as taskrunner_main
+    from atlasserver.taskrunner import status as runnerstatus
+
+    rng = random.Random(args.seed)  # noqa: S311 (synthetic queues, nothing secret)
+    simulation = executors.parse_simulation(f"{DEFAULT_SIMULATION} {args.simulation}")
+    seed_queue(args.tasks, args.users, parse_mix(args.mix), rng)
+
+    drained = threading.Event()
+    dispatches = 0
+    first_starts: dict[int, float] = {}
+    queries = 0
+    queue_numbering = Timings()
+    status_writes = Timings()
+    last_finish = 0.0
+    mark_started = taskrunner_main.mark_started
+    mark_finished = taskrunner_main.mark_finished
+    recalc_generation = taskqueue.recalc_generation
+
+    class CountingSlot(ThreadSlot):
+        def start(self) -> None:
+            nonlocal dispatches
+            dispatches += 1
+            super().start()
+
+    def timed_mark_started(task: t.Any) -> None:
+        first_starts.setdefault(task.id, time.perf_counter())
+        mark_started(task)
+
+    def timed_mark_finished(task: t.Any, *args: t.Any, **kwargs: t.Any) -> None:
+        nonlocal last_finish
+        mark_finished(task, *args, **kwargs)
+        last_finish = time.perf_counter()
+
+    def recalc_generation_until_drained() -> int:
+        # read by the loop every couple of seconds in every mode, so the place to stop it
+        if drained.is_set():
+            raise LoopDone
+        return recalc_generation()
+
+    def count_query(execute: t.Callable[..., t.Any], *args: t.Any) -> t.Any:
+        nonlocal queries
+        queries += 1
+        return execute(*args)
+
+    def watch_drained() -> None:
+        # on a connection of its own, so that its queries are not counted as the loop's
+        while Task.queued().exists():
+            time.sleep(DRAINED_CHECK_SECONDS)
+        connection.close()
+        drained.set()
+
+    (workdir / "results").mkdir()
+    patches = [
+        (runnerstatus, "LOG_DIR", workdir),
+        (runnerstatus, "STATUS_PATH", workdir / "taskrunner_status.json"),
+        (runnerstatus, "QUEUE_SNAPSHOT_PATH", workdir / "taskrunner_queue.json"),
+        (runnerstatus, "WAKEUP_SOCKET_PATH", workdir / "wakeup.sock"),
+        (runnerstatus, "NUMSLOTS", args.slots),
+        (settings, "RESULTS_DIR", workdir / "results"),
+        (settings, "TASKRUNNER_WORKER_POOL", False),
+        (settings, "TASKRUNNER_SSH_MULTIPLEX", False),
+        # a configured host pool probes its hosts; these answer from the scratch directory
+        (settings, "TASKRUNNER_EXECUTOR", "simulated"),
+        (executors, "SIMULATED_HOME_DIR", workdir / "hosts"),
+        (
+            taskrunner_main,
+            "mp",
+            types.SimpleNamespace(set_start_method=lambda _method: None, Process=CountingSlot, Event=threading.Event),
+        ),
+        (taskrunner_main, "runtask", make_runtask(simulation, rng)),
+        (taskrunner_main, "mark_started", timed_mark_started),
+        (taskrunner_main, "mark_finished", timed_mark_finished),
+        (taskqueue, "recalc_generation", recalc_generation_until_drained),
+        (taskrunner_main, "write_status", status_writes.wrap(taskrunner_main.write_status)),
+        (taskqueue, "calculate_queue_positions", queue_numbering.wrap(taskqueue.calculate_queue_positions)),
+        (taskqueue, "virtual_queue_order", queue_numbering.wrap(taskqueue.virtual_queue_order)),
+    ]
+    originals = [(target, name, getattr(target, name)) for target, name, _ in patches]
+    for target, name, value in patches:
+        setattr(target, name, value)
+
+    # as the runner sees them, so after the overrides above
+    modes = {name: getattr(settings, name) for name in dir(settings) if name.startswith("TASKRUNNER_")}
+
+    threading.Thread(target=watch_drained, daemon=True).start()
+    submitted = time.perf_counter()
+    try:
+        with (
+            (workdir / "runner.log").open("w") as runnerlog,
+            contextlib.redirect_stdout(runnerlog),
+            connection.execute_wrapper(count_query),
+        ):
+            taskrunner_main.main()
+    except LoopDone:
+        pass
+    finally:
+        for target, name, value in originals:
+            setattr(target, name, value)
+
+    elapsed = last_finish - submitted
+    waits = [start - submitted for start in first_starts.values()]
+    requesttypes = dict(Task.objects.filter(id__in=first_starts).values_list("id", "request_type"))
+    typewaits: dict[str, list[float]] = {}
+    for taskid, start in first_starts.items():
+        typewaits.setdefault(requesttypes[taskid], []).append(start - submitted)
+    finished = Task.objects.filter(finishtimestamp__isnull=False).count() - args.users
+    return {
+        "commit": commit_id(),
+        "parameters": {
+            "tasks": args.tasks,
+            "users": args.users,
+            "slots": args.slots,
+            "mix": parse_mix(args.mix),
+            "simulation": simulation,
+            "seed": args.seed,
+            "modes": modes,
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "tasks_finished": finished,
+        "dispatches": dispatches,
+        "tasks_per_second": round(finished / elapsed, 3) if elapsed > 0 else None,
+        "submit_to_start_seconds": {
+            "mean": round(statistics.fmean(waits), 3) if waits else None,
+            "mean_by_request_type": {
+                request_type: round(statistics.fmean(values), 3) for request_type, values in sorted(typewaits.items())
+            },
+            "p50": percentile(waits, 0.5),
+            "p99": percentile(waits, 0.99),
+            "max": max(waits, default=None),
+        },
+        "queries_per_dispatch": round(queries / dispatches, 2) if dispatches else None,
+        "queue_numbering": queue_numbering.as_dict(),
+        "write_status": status_writes.as_dict(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=2000, help="queued tasks to drain")
+    parser.add_argument("--users", type=int, default=50, help="users the tasks are spread over")
+    parser.add_argument("--slots", type=int, default=16, help="slots the runner dispatches to")
+    parser.add_argument("--mix", nargs="+", default=["FP=80", "IMGZIP=10", "SSOSTACK=10"], help="TYPE=WEIGHT ...")
+    parser.add_argument("--simulation", default="", help="as ATLASSERVER_TASKRUNNER_SIMULATION")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the results here as well as to stdout")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "atlasserver.settings_test")
+    with tempfile.TemporaryDirectory(prefix="atlasbench-") as tmpdir:
+        workdir = Path(tmpdir)
+        from django.conf import settings
+
+        # a file rather than settings_test's in-memory database, which each slot's thread would
+        # see as empty; set before anything connects
+        database: dict[str, t.Any] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": str(workdir / "benchmark.sqlite3"),
+            # the slots write from their threads alongside the loop: wait for the lock rather than
+            # failing, and take it at the start of a transaction rather than upgrading to it
+            "OPTIONS": {"timeout": 60, "transaction_mode": "IMMEDIATE"},
+        }
+        settings.DATABASES["default"] = database
+
+        import django
+        from django.core.management import call_command
+
+        django.setup()
+        call_command("migrate", verbosity=0)
+
+        results = run(args, workdir)
+
+    text = json.dumps(results, indent=2, default=str)
+    if args.output is not None:
+        args.output.write_text(text + "\n")
+    sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
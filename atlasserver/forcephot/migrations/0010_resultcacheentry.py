@@ -0,0 +1,39 @@
+# Generated by Django 6.1.2 on 2026-10-18 02:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("forcephot", "0009_task_attempt_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResultCacheEntry",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("sky_cell", models.BigIntegerField()),
+                ("ra", models.FloatField()),
+                ("dec", models.FloatField()),
+                ("use_reduced", models.BooleanField()),
+                ("mjd_min", models.FloatField(blank=True, null=True)),
+                ("covered_mjd_max", models.FloatField()),
+                ("created", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "task",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="resultcacheentry",
+                        to="forcephot.task",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["sky_cell", "use_reduced", "created"], name="resultcache_lookup_idx")],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 6.1.2 on 2026-10-18 03:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("forcephot", "0010_resultcacheentry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RunnerLease",
+            fields=[
+                ("name", models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ("holder", models.CharField(max_length=255)),
+                ("expires", models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TaskClaim",
+            fields=[
+                (
+                    "task",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="claim",
+                        serialize=False,
+                        to="forcephot.task",
+                    ),
+                ),
+                ("runner", models.CharField(max_length=255)),
+                ("slotid", models.IntegerField()),
+                ("claimed_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("lease_expires", models.DateTimeField(db_index=True)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="taskclaim",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+    ]
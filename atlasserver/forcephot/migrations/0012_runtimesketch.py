@@ -0,0 +1,40 @@
+# Generated by Django 6.1.2 on 2026-10-18 03:35
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("forcephot", "0011_taskclaim_runnerlease"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RuntimeSketch",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("metric", models.CharField(max_length=16)),
+                (
+                    "request_type",
+                    models.CharField(
+                        choices=[
+                            ("FP", "Forced Photometry Data"),
+                            ("IMGZIP", "Image Zip"),
+                            ("SSOSTACK", "Solar System object image stack"),
+                        ],
+                        max_length=8,
+                    ),
+                ),
+                ("hour", models.DateTimeField()),
+                ("count", models.IntegerField(default=0)),
+                ("total_seconds", models.FloatField(default=0.0)),
+                ("sketch", models.JSONField(default=dict)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("metric", "hour", "request_type"), name="runtimesketch_unique_hour")
+                ],
+            },
+        ),
+    ]
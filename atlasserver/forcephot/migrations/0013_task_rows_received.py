@@ -0,0 +1,23 @@
+# Generated by Django 6.1.2 on 2026-10-18 03:45
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("forcephot", "0012_runtimesketch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="last_mjd_received",
+            field=models.FloatField(blank=True, default=None, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="rows_received",
+            field=models.IntegerField(blank=True, default=None, editable=False, null=True),
+        ),
+    ]
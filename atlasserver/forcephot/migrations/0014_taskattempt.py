@@ -0,0 +1,37 @@
+# Generated by Django 6.1.2 on 2026-10-18 03:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("forcephot", "0013_task_rows_received"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaskAttempt",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("number", models.IntegerField()),
+                ("runner", models.CharField(max_length=255)),
+                ("host", models.CharField(max_length=255)),
+                ("remote_pid", models.IntegerField(blank=True, default=None, null=True)),
+                ("remote_prefix", models.CharField(max_length=255)),
+                ("started", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "task",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="attempts",
+                        to="forcephot.task",
+                    ),
+                ),
+            ],
+        ),
+    ]
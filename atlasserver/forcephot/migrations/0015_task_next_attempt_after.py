@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-18 04:08
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("forcephot", "0014_taskattempt"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="next_attempt_after",
+            field=models.DateTimeField(blank=True, default=None, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.1.2 on 2026-10-18 09:12
+
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("forcephot", "0016_notification"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="reused_result",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -1,4 +1,6 @@
+import contextlib
 import datetime
+import hashlib
 import typing as t
 from pathlib import Path
 from typing import override
@@ -18,6 +20,7 @@ from django.utils import timezone
 from atlasserver.forcephot.misc import country_code_to_name
 from atlasserver.forcephot.misc import datetime_to_mjd
 from atlasserver.forcephot.misc import resultplotdatajs_cachekey
+from atlasserver.taskrunner import status as runnerstatus
 
 
 def get_mjd_min_default() -> float:
@@ -112,6 +115,19 @@ class Task(models.Model):
     # describe only the attempt that produced the result, so this is the one record that a task
     # needed more than one. See taskrunner.main.mark_started.
     attempt_count = models.IntegerField(default=0, verbose_name="Execution attempts")
+    # With settings.TASKRUNNER_BACKOFF, when a task whose last attempt failed may be dispatched again,
+    # later with each failure; the runner passes over it until then. See taskrunner.main.retry_later.
+    next_attempt_after = models.DateTimeField(null=True, blank=True, default=None, editable=False)
+    # A task finished with a result that was not computed for it: a duplicate given a copy of the
+    # result of the task it duplicated, or a request answered from the result cache. Its finish minus
+    # start is the moment it took to copy, not a run, so the run time statistics leave it out (see
+    # queue.typical_runtime_seconds, prediction.py and sketches.py); its wait is real and is kept.
+    reused_result = models.BooleanField(default=False, editable=False)
+
+    # How far through the current attempt is, with settings.TASKRUNNER_STREAM_RESULTS: the rows of
+    # the light curve received so far and the MJD of the last of them. See taskrunner/streaming.py.
+    rows_received = models.IntegerField(null=True, blank=True, default=None, editable=False)
+    last_mjd_received = models.FloatField(null=True, blank=True, default=None, editable=False)
 
     queuepos_relative = models.IntegerField(null=True, blank=True, default=None, verbose_name="Queue position")
     userqueuedtasks_on_submit = models.IntegerField(
@@ -324,6 +340,14 @@ class Task(models.Model):
         """
         return Task.objects.filter(finishtimestamp__isnull=True, is_archived=False)
 
+    @staticmethod
+    def dispatchable() -> "models.QuerySet[Task]":
+        """Return the queued tasks that the runner may start now: those not waiting out a backoff."""
+        return Task.queued().filter(
+            models.Q(next_attempt_after__isnull=True)
+            | models.Q(next_attempt_after__lte=datetime.datetime.now(datetime.UTC))
+        )
+
     @staticmethod
     def min_queuepos_relative() -> int:
         """Return the lowest queue position currently assigned, or 0 if the queue is empty.
@@ -338,11 +362,35 @@ class Task(models.Model):
 
         return 0 if minqueuepos is None else int(minqueuepos)
 
+    @staticmethod
+    def queue_snapshot() -> runnerstatus.QueueSnapshot | None:
+        """Return the queue order the task runner published, or None to use the stored positions.
+
+        None unless settings.TASKRUNNER_VIRTUAL_QUEUE is on, and also when the runner has not
+        published an order since it was turned on, or has stopped keeping the one it published
+        current: queuepos_relative is still given to each task at submission, so a position read
+        from it is no worse than one between two renumberings.
+
+        Positions in the snapshot count from the front of the queue, so they need no offset from
+        min_queuepos_relative().
+        """
+        if not settings.TASKRUNNER_VIRTUAL_QUEUE:
+            return None
+
+        try:
+            return runnerstatus.read_queue_snapshot()
+        except (OSError, KeyError, TypeError, ValueError):
+            return None
+
     @property
     def queuepos(self) -> int | None:
         if self.finishtimestamp or self.queuepos_relative is None:
             return None
 
+        snapshot = Task.queue_snapshot()
+        if snapshot is not None:
+            return snapshot.position(self.id)
+
         return self.queuepos_relative - Task.min_queuepos_relative()
 
     def finished(self) -> bool:
@@ -372,6 +420,47 @@ class Task(models.Model):
 
         return None
 
+    def request_fingerprint(self, include_window: bool = True) -> str | None:
+        """Return a key shared by exactly the forced photometry requests that ask for the same result.
+
+        None for the other request types, whose results are tied to their own task. Without
+        `include_window`, the key leaves out the MJD bounds, and is shared by the requests that ask
+        for the same light curve over any window. Each field is
+        read the way taskrunner.main.build_fp_command reads it -- the epoch and proper motions by
+        truthiness, so an explicit 0 is the same request as none at all, and the MJD bounds by
+        "is not None" -- because what decides whether two requests are the same is whether they
+        produce the same remote command. Whether the user may request TDO data changes that command
+        too, so it is part of the key. Coordinates are rounded to 1e-7 degrees (well under a
+        milliarcsecond), so that the same position arriving by different float arithmetic matches.
+        """
+        if self.request_type != Task.RequestType.FP:
+            return None
+
+        target: tuple[t.Any, ...]
+        if self.mpc_name:
+            target = ("mpc", self.mpc_name)
+        else:
+            target = ("radec", round(float(t.cast("float", self.ra)), 7), round(float(t.cast("float", self.dec)), 7))
+
+        window = (
+            (
+                round(self.mjd_min, 5) if self.mjd_min is not None else None,
+                round(self.mjd_max, 5) if self.mjd_max is not None else None,
+            )
+            if include_window
+            else None
+        )
+        key = (
+            target,
+            window,
+            bool(self.use_reduced),
+            float(self.radec_epoch_year) if self.radec_epoch_year else None,
+            self.propermotion_ra or None,
+            self.propermotion_dec or None,
+            self.user_id in settings.TEST_USERS,
+        )
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
     @property
     def username(self) -> str:
         return self.user.username
@@ -424,15 +513,17 @@ class Task(models.Model):
             region=self.region,
         )
 
-    def delete_result_files(self) -> None:
-        """Delete the result files belonging to this task.
+    def delete_result_files(self) -> int:
+        """Delete the result files belonging to this task, and return how many there were.
 
         Split out of delete() so that the maintenance sweep can reclaim the files of many tasks and
-        then update or remove their rows in one statement, instead of one write per task.
+        then update or remove their rows in one statement, instead of one write per task. The count
+        is for the sweep's progress report.
         """
+        paths: list[Path] = []
         if self.request_type == "IMGZIP":
             if zipfile := self.localresultimagezipfile:
-                Path(settings.STATIC_ROOT, zipfile).unlink(missing_ok=True)
+                paths.append(Path(settings.STATIC_ROOT, zipfile))
 
             # the parent's .txt and .jpg are kept while a live image request needs them, so once
             # this was the last one they have to be collected here or nothing reclaims them until
@@ -441,8 +532,9 @@ class Task(models.Model):
             if parent is not None and parent.is_archived:
                 siblings = Task.objects.filter(parent_task_id=parent.id, is_archived=False).exclude(id=self.id)
                 if not siblings.exists():
-                    for ext in (".txt", ".jpg"):
-                        Path(settings.STATIC_ROOT, parent.localresultfileprefix() + ext).unlink(missing_ok=True)
+                    paths += [
+                        Path(settings.STATIC_ROOT, parent.localresultfileprefix() + ext) for ext in (".txt", ".jpg")
+                    ]
 
         else:
             delete_extlist = [".pdf", ".fits"]
@@ -451,8 +543,14 @@ class Task(models.Model):
                 # as the input that lists the observations to fetch images for
                 delete_extlist += [".jpg", ".txt"]
 
-            for ext in delete_extlist:
-                Path(settings.STATIC_ROOT, self.localresultfileprefix() + ext).unlink(missing_ok=True)
+            paths += [Path(settings.STATIC_ROOT, self.localresultfileprefix() + ext) for ext in delete_extlist]
+
+        deleted = 0
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+                deleted += 1
+        return deleted
 
     def forget_derived_cache(self) -> None:
         """Drop the cached plot data generated from this task's result file."""
@@ -498,3 +596,174 @@ class PendingEmailVerification(models.Model):
     def __str__(self) -> str:
         """Return a description for the admin changelist."""
         return f"awaiting verification since {self.created:%Y-%m-%d}: {self.user}"
+
+
+class ResultCacheEntry(models.Model):
+    """A finished forced photometry result that later requests at the same position may be answered from.
+
+    One row per cacheable task, written by the task runner when the task finishes; see
+    atlasserver.taskrunner.resultcache for what is cacheable and how a request is matched. Deleted
+    with its task. An archived task's file is gone, so the lookup skips those rather than relying
+    on the row being cleaned up in the same moment.
+    """
+
+    task = models.OneToOneField(Task, on_delete=models.CASCADE, related_name="resultcacheentry")
+    # which cell of the sky grid the position falls in; an index to narrow the exact separation test
+    sky_cell = models.BigIntegerField()
+    ra = models.FloatField()
+    dec = models.FloatField()
+    use_reduced = models.BooleanField()
+    mjd_min = models.FloatField(null=True, blank=True)
+    # the MJD up to which the file holds every observation there was: the task's mjd_max, or with
+    # no upper bound, when the task started
+    covered_mjd_max = models.FloatField()
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["sky_cell", "use_reduced", "created"], name="resultcache_lookup_idx"),
+        ]
+
+    def __str__(self) -> str:
+        """Return a description for the admin changelist."""
+        return f"task {self.task_id} RA Dec {self.ra:.6f} {self.dec:.6f} cached {self.created:%Y-%m-%d %H:%M}"
+
+
+class TaskClaim(models.Model):
+    """A task being run by one task runner instance, with settings.TASKRUNNER_CLAIMS.
+
+    The row is the lock: one per task, so two runners cannot both start it, and one per user, so
+    the rule that a user has one task running at a time holds across every runner rather than in
+    each runner's memory. The runner holding it renews lease_expires while the task runs and
+    deletes the row when its slot frees; a runner that dies stops renewing, and once the lease has
+    passed any other runner may remove the claim and run the task again. See
+    atlasserver.taskrunner.claims.
+    """
+
+    task = models.OneToOneField(Task, on_delete=models.CASCADE, primary_key=True, related_name="claim")
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="taskclaim")
+    # which runner instance holds it: host name and process id
+    runner = models.CharField(max_length=255)
+    slotid = models.IntegerField()
+    claimed_at = models.DateTimeField(default=timezone.now)
+    lease_expires = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        """Return a description for the admin changelist."""
+        return f"task {self.task_id} held by {self.runner} slot {self.slotid} until {self.lease_expires:%H:%M:%S}"
+
+
+class RunnerLease(models.Model):
+    """A named role that one task runner instance at a time holds, such as leading the others.
+
+    Held until `expires`, which the holder keeps pushing forward; another runner takes the role
+    over only once it has lapsed. See atlasserver.taskrunner.claims.acquire_lease.
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    holder = models.CharField(max_length=255)
+    expires = models.DateTimeField()
+
+    def __str__(self) -> str:
+        """Return a description for the admin changelist."""
+        return f"{self.name} held by {self.holder} until {self.expires:%Y-%m-%d %H:%M:%S}"
+
+
+class RuntimeSketch(models.Model):
+    """The run times or wait times of the tasks of one request type that finished in one hour, as a sketch.
+
+    With settings.TASKRUNNER_RUNTIME_SKETCHES, written by the task runner as each task finishes,
+    and read by the wait estimates and the stats page in place of reading the tasks themselves; see
+    atlasserver.forcephot.sketches for the sketch and the metrics.
+    """
+
+    metric = models.CharField(max_length=16)
+    request_type = models.CharField(max_length=8, choices=Task.RequestType.choices)
+    # the start of the hour, in UTC
+    hour = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    # for the mean, which the sketch does not keep
+    total_seconds = models.FloatField(default=0.0)
+    sketch = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["metric", "hour", "request_type"], name="runtimesketch_unique_hour"),
+        ]
+
+    def __str__(self) -> str:
+        """Return a description for the admin changelist."""
+        return f"{self.metric} of {self.request_type} tasks finished in the hour from {self.hour:%Y-%m-%d %H:%M}"
+
+
+class TaskAttempt(models.Model):
+    """An attempt at a task that runs detached on a remote host, with settings.TASKRUNNER_DETACHED.
+
+    Written before the remote job starts and deleted once the runner has its outcome, so that a
+    runner that restarts in between finds the job again: still running, to attach to; finished, to
+    collect; or gone, to run again. See atlasserver.taskrunner.detached.
+    """
+
+    # null once the task is deleted, so that a job still running for it can be found and stopped
+    task = models.ForeignKey(Task, on_delete=models.SET_NULL, null=True, blank=True, related_name="attempts")
+    # the task's attempt_count that this attempt made it
+    number = models.IntegerField()
+    # the task runner process that started it, as host name and process id, and the remote host it runs on
+    runner = models.CharField(max_length=255)
+    host = models.CharField(max_length=255)
+    # The remote job's process id, which is also its process group and session. Null until the job
+    # has started, and a job that never did is gone.
+    remote_pid = models.IntegerField(null=True, blank=True, default=None)
+    # where the job's pid, standard output, standard error and exit status go on the host, as
+    # this path with .pid, .out, .err and .exit after it
+    remote_prefix = models.CharField(max_length=255)
+    started = models.DateTimeField(default=timezone.now)
+
+    def __str__(self) -> str:
+        """Return a description for the admin changelist."""
+        return f"attempt {self.number} at task {self.task_id} on {self.host} pid {self.remote_pid} by {self.runner}"
+
+
+class Notification(models.Model):
+    """A completion callback or result email to be sent by the task runner, with settings.TASKRUNNER_NOTIFY_OUTBOX.
+
+    Written when a task finishes (see taskrunner.main.mark_finished) and sent by the runner's
+    delivery threads, which retry a failed delivery after a backoff and give up on it after
+    outbox.MAX_DELIVERY_ATTEMPTS, leaving it here as dead with its last error. Setting a dead one
+    back to pending sends it again. See atlasserver.taskrunner.outbox.
+    """
+
+    class Kind(models.TextChoices):
+        CALLBACK = "callback", "Completion callback"
+        EMAIL = "email", "Result email"
+
+    class State(models.TextChoices):
+        PENDING = "pending", "Pending"
+        DELIVERED = "delivered", "Delivered"
+        DEAD = "dead", "Dead"
+
+    kind = models.CharField(max_length=8, choices=Kind.choices)
+    # one per task's callback and one per submission's email, so that writing one twice, as the
+    # last two tasks of a submission finishing together may, leaves one
+    key = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notifications")
+    # the callback's target, and its body as it was when the task finished; for an email, the
+    # submission's timestamp, which the tasks in it share
+    url = models.URLField(max_length=500, blank=True, default="")
+    payload = models.JSONField(default=dict)
+    state = models.CharField(max_length=9, choices=State.choices, default=State.PENDING)
+    attempts = models.IntegerField(default=0)
+    # when it is next due, which also holds it for the delivery thread that took it meanwhile
+    next_attempt_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(default=timezone.now)
+    delivered = models.DateTimeField(null=True, blank=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["state", "next_attempt_after"], name="notification_due_idx"),
+        ]
+
+    def __str__(self) -> str:
+        """Return a description for the admin changelist."""
+        return f"{self.kind} {self.key} to {self.user_id}: {self.state} after {self.attempts} attempts"
@@ -0,0 +1,188 @@
+"""Per-task run time predictions, from the recent run times of finished tasks like each one.
+
+typical_runtime_seconds() in queue.py keeps one median per request type, and a request type is not
+what decides how long a task takes. A forced photometry request over the whole survey reads every
+image of its field since 2015, where the default request reads a month; a request by MPC name runs
+ssforce.sh, which first works out where the object was on each night; and an image request fetches
+one image per row of its parent's light curve, which is as many as that light curve's window held.
+
+So each finished task is filed under a bin of the tasks like it: its request type, whether it names
+a minor planet or a position, whether it reads reduced or difference images, and the length of its
+MJD window in powers of two. An image request has its parent's window and image kind (see
+Task.new_imagerequest), so its window stands in for the number of rows it fetches images for. A
+task's prediction is the median of the most recent run times in its bin, or in the coarser bin of
+its request type and target kind when the fine one has too few, or in that of its request type.
+
+The bins are kept in the usagestats cache and brought up to date incrementally by the task runner
+(with settings.TASKRUNNER_RUNTIME_PREDICTOR), which reads only the tasks that have finished since it
+last did (see refresh_runtime_predictor()). Everything else reads them from the cache and makes no
+query at all: the task list and the queue positions endpoint answer them for every open queue page,
+every few seconds.
+"""
+
+import datetime
+import math
+import statistics
+import time
+import typing as t
+
+from django.core.cache import caches
+from django.db.models import Q
+
+from atlasserver.forcephot.misc import datetime_to_mjd
+from atlasserver.forcephot.models import Task
+
+if t.TYPE_CHECKING:
+    from collections.abc import Iterable
+
+# (request_type, mjd_min, mjd_max, use_reduced, mpc_name): the fields of a task that it is binned by
+type Features = tuple[str, float | None, float | None, bool, str | None]
+
+# the Task fields that make up its Features, in order, for values_list() and only()
+FEATURE_FIELDS: t.Final = ("request_type", "mjd_min", "mjd_max", "use_reduced", "mpc_name")
+
+# Where a window with no lower bound starts: the first ATLAS observations that force.sh reads.
+SURVEY_START_MJD: t.Final = 57230.0
+
+# How many of the most recent run times each bin keeps. Enough for a steady median, and few enough
+# that a bin follows a change on the remote host within a day, as typical_runtime_seconds() does.
+BIN_SAMPLES: t.Final = 64
+
+# Below this many run times, a bin gives no prediction and the coarser one is asked instead. The
+# same floor as the medians of typical_runtime_seconds(), for the same reason.
+BIN_MIN_SAMPLES: t.Final = 5
+
+# When the bins are empty (a new deployment or a cleared cache), how far back the first refresh
+# reads. A week, as the stats page does, so that rare kinds of request are there from the start.
+PREDICTOR_WINDOW_HOURS: t.Final = 7 * 24
+
+# At most this many finished tasks are read by one refresh; the next one carries on from there.
+PREDICTOR_REFRESH_LIMIT: t.Final = 5000
+
+# How often the task runner folds the newly finished tasks into the bins.
+PREDICTOR_REFRESH_SECONDS: t.Final = 60.0
+
+PREDICTOR_CACHEKEY: t.Final = "runtime_predictor_v2"
+
+# How long each process keeps the medians of the bins in its own memory, as for the medians of
+# typical_runtime_seconds(): the cache is a file, and it is read for every open queue page.
+PREDICTOR_MEMO_SECONDS: t.Final = 15.0
+
+# the memo of this process: when it becomes too old, and the median of each bin with enough samples
+_predictor_memo: tuple[float, dict[str, float]] | None = None
+
+
+def task_features(task: Task) -> Features:
+    return (task.request_type, task.mjd_min, task.mjd_max, task.use_reduced, task.mpc_name)
+
+
+def bin_keys(features: Features, mjdnow: float) -> list[str]:
+    """Return the bins a task with these features is filed under, from the finest to the coarsest."""
+    request_type, mjd_min, mjd_max, use_reduced, mpc_name = features
+    span = (mjdnow if mjd_max is None else mjd_max) - (SURVEY_START_MJD if mjd_min is None else mjd_min)
+    spanbin = int(math.log2(span)) if span > 1.0 else 0
+    target = "mpc" if mpc_name else "radec"
+    return [
+        f"{request_type}:{target}:{'reduced' if use_reduced else 'diff'}:{spanbin}",
+        f"{request_type}:{target}",
+        request_type,
+    ]
+
+
+def bin_medians(samples: dict[str, list[float]]) -> dict[str, float]:
+    return {
+        key: round(statistics.median(runtimes), 1)
+        for key, runtimes in samples.items()
+        if len(runtimes) >= BIN_MIN_SAMPLES
+    }
+
+
+def refresh_runtime_predictor() -> int:
+    """Fold the tasks that have finished since the last refresh into the bins, and return how many.
+
+    For the task runner, on an interval of PREDICTOR_REFRESH_SECONDS. Two runners refreshing at once
+    each write the whole of what they read plus what they added, so the later write drops the other's
+    additions rather than counting them twice, and the next refresh reads them again.
+    """
+    global _predictor_memo  # noqa: PLW0603
+
+    state = caches["usagestats"].get(PREDICTOR_CACHEKEY, default=None)
+    if state is None:
+        since = datetime.datetime.now(datetime.UTC) - datetime.timedelta(hours=PREDICTOR_WINDOW_HOURS)
+        state = {"through": since.isoformat(), "through_id": 0, "samples": {}}
+    samples: dict[str, list[float]] = state["samples"]
+
+    # Carry on after the last task read, by its finish time and then its id: a refresh cut short by
+    # PREDICTOR_REFRESH_LIMIT can end partway through tasks that finished at the same moment (a
+    # batch, or duplicates given one result), and the rest of them must not be skipped.
+    through = datetime.datetime.fromisoformat(state["through"])
+    after_watermark = Q(finishtimestamp__gt=through) | Q(finishtimestamp=through, id__gt=state["through_id"])
+
+    # the same run time as typical_runtime_seconds() measures, failed tasks included and reused
+    # results not
+    finished = list(
+        Task.objects.filter(after_watermark, starttimestamp__isnull=False, reused_result=False)
+        .order_by("finishtimestamp", "id")
+        .values_list("id", "starttimestamp", "finishtimestamp", *FEATURE_FIELDS)[:PREDICTOR_REFRESH_LIMIT]
+    )
+
+    mjdnow = datetime_to_mjd(datetime.datetime.now(datetime.UTC))
+    for _, started, finishedat, *features in finished:
+        runtime = (finishedat - started).total_seconds()
+        for key in bin_keys(t.cast("Features", tuple(features)), mjdnow):
+            runtimes = samples.setdefault(key, [])
+            runtimes.append(runtime)
+            del runtimes[:-BIN_SAMPLES]
+
+    if finished:
+        state["through_id"], _, lastfinished, *_ = finished[-1]
+        state["through"] = lastfinished.isoformat()
+    caches["usagestats"].set(PREDICTOR_CACHEKEY, state, timeout=None)
+    _predictor_memo = (time.monotonic() + PREDICTOR_MEMO_SECONDS, bin_medians(samples))
+
+    return len(finished)
+
+
+def runtime_bin_medians() -> dict[str, float]:
+    """Return the median run time of each bin with enough samples, from the cache. Never queries."""
+    global _predictor_memo  # noqa: PLW0603
+
+    if _predictor_memo is not None and time.monotonic() < _predictor_memo[0]:
+        return _predictor_memo[1]
+
+    state = caches["usagestats"].get(PREDICTOR_CACHEKEY, default=None)
+    medians = bin_medians(state["samples"]) if state is not None else {}
+    _predictor_memo = (time.monotonic() + PREDICTOR_MEMO_SECONDS, medians)
+    return medians
+
+
+def runtime_bin_samples() -> dict[str, list[float]]:
+    """Return the recent run times kept in each bin, from the cache, for a caller that needs their spread."""
+    state = caches["usagestats"].get(PREDICTOR_CACHEKEY, default=None)
+    return state["samples"] if state is not None else {}
+
+
+def clear_runtime_predictor_memo() -> None:
+    """Discard the medians this process holds in its memory; for the tests, as clear_typical_runtime_memo."""
+    global _predictor_memo  # noqa: PLW0603
+    _predictor_memo = None
+
+
+def predict_runtimes(tasks: "Iterable[tuple[int, Features]]") -> dict[int, float]:
+    """Return the predicted run time in seconds of each (task id, features), for those that have one."""
+    medians = runtime_bin_medians()
+    if not medians:
+        return {}
+
+    mjdnow = datetime_to_mjd(datetime.datetime.now(datetime.UTC))
+    predictions = {}
+    for taskid, features in tasks:
+        prediction = next((medians[key] for key in bin_keys(features, mjdnow) if key in medians), None)
+        if prediction is not None:
+            predictions[taskid] = prediction
+
+    return predictions
+
+
+def predict_task_runtime(task: Task) -> float | None:
+    return predict_runtimes([(task.id, task_features(task))]).get(task.id)
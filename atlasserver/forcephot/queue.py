@@ -5,26 +5,42 @@ rest of the web stack, and so that the two processes cannot drift on what "queue
 """
 
 import datetime
-import operator
+import math
 import statistics
 import time
 import typing as t
 
+from django.conf import settings
 from django.core.cache import caches
 from django.db import models
 from django.db import transaction
 
 from atlasserver.forcephot.models import Task
+from atlasserver.forcephot.prediction import FEATURE_FIELDS
+from atlasserver.forcephot.prediction import predict_runtimes
+from atlasserver.forcephot.prediction import task_features
+from atlasserver.forcephot.sketches import window_summaries
+from atlasserver.taskrunner.wakeup import notify_runner
 
 if t.TYPE_CHECKING:
     from collections.abc import Iterable
 
+    from atlasserver.forcephot.prediction import Features
+
 # Bumped by the web app when the queued set changes; the runner watches it and remembers the value
 # it last acted on. A counter rather than a flag it clears, because clearing loses a request that
 # arrives between the read and the delete. Simultaneous bumps can collapse into one increment,
 # which does not matter: the question is whether the value changed, not by how much.
 RECALC_GENERATION_CACHEKEY: t.Final = "queue-positions-generation"
 
+# The lowest queue position that a change since the runner's last renumbering can have affected,
+# so that it renumbers only from there on; see calculate_queue_positions(). Absent means from the
+# start. Lowered with a read and a write rather than atomically, so two requests racing can leave
+# the higher of their positions, and the tail between them keeps a stale order until the next full
+# renumbering at RECALC_MAX_INTERVAL_SECONDS. A display glitch for seconds, against locking the
+# whole queue for every submission by a user whose new tasks all go to the back of it.
+RECALC_FROM_POSITION_CACHEKEY: t.Final = "queue-positions-from"
+
 # Renumber at least this often even when the flag says nothing changed. Covers the task runner's
 # own dispatches (which move the running task to the front) and any flag lost to a cache eviction
 # or a wiped cache directory, so a stale ordering can never persist.
@@ -39,6 +55,12 @@ RECALC_MAX_INTERVAL_SECONDS: t.Final = 30.0
 # round-robin reordering among users.
 RECALC_CHECK_INTERVAL_SECONDS: t.Final = 2.0
 
+# How many moved rows each UPDATE writes. bulk_update() sets the column with a CASE that has a
+# branch per row, and the database walks that CASE for every row it updates, so one statement for a
+# whole reordered queue is quadratic in its size: ten thousand rows took seconds, and a hundred
+# thousand exceeded SQLite's limit on bound parameters outright.
+QUEUEPOS_UPDATE_BATCH_SIZE: t.Final = 500
+
 # How far back typical_runtime_seconds() looks. A day rather than the stats page's week: this
 # figure tells a waiting user how long their task will take, so it should follow current conditions
 # -- a slow night, a backlog, a change on the remote host -- rather than average them away.
@@ -72,15 +94,27 @@ TYPICAL_RUNTIME_MEMO_SECONDS: t.Final = 15.0
 _typical_runtime_memo: tuple[float, dict[str, float]] | None = None
 
 
-def request_recalc() -> None:
-    """Ask the task runner to renumber the queue.
+def request_recalc(from_position: int = 0) -> None:
+    """Ask the task runner to renumber the queue, from `from_position` on.
+
+    `from_position` is for a caller that knows its change cannot have moved any task ahead of that
+    position: see first_position_after_user() for a submission, and the position of a deleted task.
 
     Cheaper than renumbering here: calculate_queue_positions() locks every queued row, so calling
     it inline made a submission wait for the whole queue and serialised concurrent submitters
     behind one another. The runner already polls this table twice a second, and it is the only
     process that changes which task is running, so it is the natural owner of the ordering.
+
+    Every change to the queued set comes through here, so this is also where the runner is nudged
+    to look at the queue now rather than on its next poll (settings.TASKRUNNER_WAKEUP).
     """
     cache = caches["default"]
+    # before the counter, so that a runner that sees the new count also sees the position
+    if not cache.add(RECALC_FROM_POSITION_CACHEKEY, from_position, timeout=None):
+        current = cache.get(RECALC_FROM_POSITION_CACHEKEY)
+        if current is None or from_position < current:
+            cache.set(RECALC_FROM_POSITION_CACHEKEY, from_position, timeout=None)
+
     try:
         cache.incr(RECALC_GENERATION_CACHEKEY)
     except ValueError:
@@ -89,6 +123,10 @@ def request_recalc() -> None:
         # does not matter: the runner is watching for a change, not counting submissions.
         cache.add(RECALC_GENERATION_CACHEKEY, 1, timeout=None)
 
+    # after the counter, so that the runner woken by this finds the request already recorded, and
+    # after the commit, so that it finds the task too
+    transaction.on_commit(notify_runner)
+
 
 def recalc_generation() -> int:
     """Return the current request counter, for a caller to compare against the one it last saw.
@@ -101,6 +139,29 @@ def recalc_generation() -> int:
     return int(caches["default"].get(RECALC_GENERATION_CACHEKEY) or 0)
 
 
+def take_recalc_from_position() -> int:
+    """Return the position to renumber from for the requests seen so far, and forget it.
+
+    Taken before renumbering. A request that arrives after this still moves the counter, and if its
+    position was forgotten along with the rest, the next pass finds none and renumbers everything.
+    """
+    cache = caches["default"]
+    from_position = cache.get(RECALC_FROM_POSITION_CACHEKEY)
+    cache.delete(RECALC_FROM_POSITION_CACHEKEY)
+    return int(from_position) if from_position is not None else 0
+
+
+def first_position_after_user(user_id: int) -> int:
+    """Return the position after the user's last numbered queued task: where their new tasks can first go.
+
+    Each new task is its user's latest, so it goes to a later pass than all their queued tasks, and
+    everything ahead of the last of those keeps its place. A user with nothing queued joins the
+    current pass, which can be anywhere, so that is zero.
+    """
+    lastpos = Task.queued().filter(user_id=user_id).aggregate(models.Max("queuepos_relative"))["queuepos_relative__max"]
+    return 0 if lastpos is None else lastpos + 1
+
+
 def next_queuepos_relative() -> int:
     """Return a queue position at the back of the current queue.
 
@@ -134,7 +195,8 @@ def typical_runtime_seconds() -> dict[str, float]:
 
     Failed tasks are counted. They usually fail quickly, which pulls the figure down, but what the
     estimate needs to know is how fast the queue drains -- and a task that errors frees its slot
-    just as surely as one that succeeds.
+    just as surely as one that succeeds. A task that reused another's result is not: it never held
+    a slot for a run at all, and its near-zero time would promise a drain that no run achieves.
     """
     global _typical_runtime_memo  # noqa: PLW0603
 
@@ -146,6 +208,18 @@ def typical_runtime_seconds() -> dict[str, float]:
         _typical_runtime_memo = (time.monotonic() + TYPICAL_RUNTIME_MEMO_SECONDS, cached)
         return cached
 
+    if settings.TASKRUNNER_RUNTIME_SKETCHES:
+        # the hourly sketches that the runner keeps, rather than the tasks themselves: one query of
+        # at most a day's rows per type, whatever the number of tasks (see sketches.py)
+        medians = {
+            request_type: round(median, 1)
+            for request_type, summary in window_summaries("runtime", TYPICAL_RUNTIME_WINDOW_HOURS).items()
+            if summary.count >= TYPICAL_RUNTIME_MIN_SAMPLES and (median := summary.quantile(0.5)) is not None
+        }
+        caches["usagestats"].set(TYPICAL_RUNTIME_CACHEKEY, medians, timeout=TYPICAL_RUNTIME_CACHE_SECONDS)
+        _typical_runtime_memo = (time.monotonic() + TYPICAL_RUNTIME_MEMO_SECONDS, medians)
+        return medians
+
     cutoff = datetime.datetime.now(datetime.UTC) - datetime.timedelta(hours=TYPICAL_RUNTIME_WINDOW_HOURS)
 
     medians = {}
@@ -166,7 +240,12 @@ def typical_runtime_seconds() -> dict[str, float]:
         # says so once, next to the filter that earns it.
         recent = t.cast(
             "Iterable[tuple[datetime.datetime, datetime.datetime]]",
-            Task.objects.filter(request_type=request_type, finishtimestamp__gt=cutoff, starttimestamp__isnull=False)
+            Task.objects.filter(
+                request_type=request_type,
+                finishtimestamp__gt=cutoff,
+                starttimestamp__isnull=False,
+                reused_result=False,
+            )
             .order_by("-finishtimestamp")
             .values_list("starttimestamp", "finishtimestamp")[:TYPICAL_RUNTIME_SAMPLE_LIMIT],
         )
@@ -194,78 +273,212 @@ def clear_typical_runtime_memo() -> None:
     _typical_runtime_memo = None
 
 
-def calculate_queue_positions() -> None:
-    """Assign every queued task its position, which is the order the task runner executes them in."""
-    with transaction.atomic():
-        # Lock the queued rows and read them once. Without the lock, two concurrent
-        # recalculations can each renumber from a snapshot that is missing the other's changes
-        # and end up assigning duplicate queue positions.
-        queuedtasks = list(Task.queued().select_for_update().order_by("user_id", "timestamp", "id"))
+def shortest_first() -> bool:
+    """Return whether each pass of the queue is ordered by expected run time rather than by user id.
+
+    settings.TASKRUNNER_SCHEDULER = "shortest_first"; see round_robin_order().
+    """
+    return settings.TASKRUNNER_SCHEDULER == "shortest_first"
+
+
+def expected_runtimes(tasks: "Iterable[tuple[int, Features]]") -> dict[int, float]:
+    """Return the expected run time in seconds of each (task id, features), by task id.
 
+    The task's own prediction (see prediction.py), or else the median of its request type (see
+    typical_runtime_seconds()). A task with neither is expected to take forever, so that it is
+    ordered after the tasks that are known and, while none is known, everything is ordered as
+    though none were.
+    """
+    tasks = list(tasks)
+    predictions = predict_runtimes(tasks)
+    medians = typical_runtime_seconds()
+    return {
+        taskid: predictions[taskid] if taskid in predictions else medians.get(features[0], math.inf)
+        for taskid, features in tasks
+    }
+
+
+def round_robin_order(
+    queued: "Iterable[tuple[int, int]]",
+    runninguserid: int | None,
+    ranks_before: dict[int, int] | None = None,
+    expected_seconds: dict[int, float] | None = None,
+    running_expected_seconds: float = 0.0,
+) -> list[int]:
+    """Return task ids in execution order: one task per user per pass, users in id order within a pass.
+
+    `queued` is (task id, user id) for each task to place, in (user_id, timestamp, id) order, and
+    without the running task, which the caller puts at position 0. The pass the running task was
+    dispatched in goes on where it left off: users with a higher id than its user still have their
+    turn in it, and its user and the users before it wait for the next.
+
+    A task's pass follows from its rank among its user's tasks, so each gets a sort key directly --
+    O(n log n), where the pass-by-pass walk this replaced rebuilt a list of every unplaced task on
+    every pass, and one user with hundreds of tasks made that quadratic while it held row locks.
+
+    `ranks_before` counts each user's tasks that are already placed ahead of these, for renumbering
+    only the tail of the queue; see calculate_queue_positions().
+
+    With `expected_seconds`, each task's expected run time by task id (the running task's is
+    `running_expected_seconds`), a pass takes its users' tasks shortest first, and the user id only
+    breaks ties. Each user still has one task in each pass, so a user with only long tasks waits
+    no more passes than before; what changes is that a minute's light curve no longer waits behind
+    every other user's quarter of an hour of images in the same pass. Whether a user has had their
+    turn in the running task's pass is decided by their first task, so the queue must be placed
+    from its start rather than only its tail.
+    """
+    expected = expected_seconds if expected_seconds is not None else {}
+    runningkey = (running_expected_seconds, runninguserid)
+    ranks = dict(ranks_before) if ranks_before is not None else {}
+    # users whose turn in the running task's pass is taken, so every task of theirs moves a pass on
+    turntaken: dict[int, bool] = {}
+    keyed: list[tuple[int, float, int, int]] = []
+    for taskid, userid in queued:
+        rank = ranks.get(userid, 0)
+        ranks[userid] = rank + 1
+        taskexpected = expected.get(taskid, 0.0)
+        if userid not in turntaken:
+            turntaken[userid] = runninguserid is not None and (
+                userid == runninguserid or (taskexpected, userid) <= runningkey
+            )
+        passnum = rank + 1 if turntaken[userid] else rank
+        keyed.append((passnum, taskexpected, userid, taskid))
+
+    # (pass, user) is unique per task, so the task id never decides the order
+    keyed.sort()
+    return [taskid for _, _, _, taskid in keyed]
+
+
+def running_since_field() -> str:
+    """Return the field that, when set on a queued task, says it is running and since when.
+
+    The start time, ordinarily, and the most recently started task is taken to be the running one.
+    With settings.TASKRUNNER_CLAIMS, it is the claim: a task is running while a runner holds it,
+    and a started task whose runner died is queued again, though it keeps its start time.
+    """
+    return "claim__claimed_at" if settings.TASKRUNNER_CLAIMS else "starttimestamp"
+
+
+def virtual_queue_order() -> list[tuple[int, int]]:
+    """Return (task id, user id) for every queued task in execution order, writing nothing.
+
+    The order calculate_queue_positions() stores, for settings.TASKRUNNER_VIRTUAL_QUEUE, where the
+    runner keeps it and publishes it instead (see taskrunner.status.write_queue_snapshot). Nothing
+    is locked, because no row is written: there is no concurrent renumbering to race, and a task
+    submitted or deleted during the read comes with a request_recalc() that orders it next time.
+    """
+    queued = list(
+        Task.queued()
+        .order_by("user_id", "timestamp", "id")
+        .values_list("id", "user_id", running_since_field(), *FEATURE_FIELDS)
+    )
+
+    # the running task is the one started last, as in calculate_queue_positions(), and it goes first
+    front: list[tuple[int, int]] = []
+    runninguserid = None
+    started = [(starttime, taskid, userid) for taskid, userid, starttime, *_ in queued if starttime is not None]
+    if started:
+        _, runningtaskid, runninguserid = max(started)
+        front.append((runningtaskid, runninguserid))
+
+    expected = (
+        expected_runtimes((taskid, t.cast("Features", tuple(features))) for taskid, _, _, *features in queued)
+        if shortest_first()
+        else None
+    )
+    userids = {taskid: userid for taskid, userid, *_ in queued}
+    order = round_robin_order(
+        ((taskid, userid) for taskid, userid, *_ in queued if not front or taskid != front[0][0]),
+        runninguserid=runninguserid,
+        expected_seconds=expected,
+        running_expected_seconds=expected[front[0][0]] if expected is not None and front else 0.0,
+    )
+    return front + [(taskid, userids[taskid]) for taskid in order]
+
+
+def calculate_queue_positions(from_position: int = 0) -> None:
+    """Assign every queued task its position, which is the order the task runner executes them in.
+
+    With `from_position`, only the tasks at that position or later (and any not yet numbered) are
+    renumbered and locked; the ones ahead keep theirs. That is only right when whatever changed
+    the queue cannot have moved a task ahead of it, which is what request_recalc() is told by its
+    callers. A different running task moves everything, so then the whole queue is renumbered, and
+    so is it always with settings.TASKRUNNER_SCHEDULER = "shortest_first"; see round_robin_order().
+    """
+    if shortest_first():
+        from_position = 0
+
+    with transaction.atomic():
         # to get position in current pass, check if job currently running (the one started last).
-        # attrgetter rather than a lambda: the generator's None filter cannot narrow the
-        # attribute type inside a lambda, so a lambda key would not type check
-        runningtask = max(
-            (tsk for tsk in queuedtasks if tsk.starttimestamp is not None),
-            key=operator.attrgetter("starttimestamp"),
-            default=None,
+        # Read unlocked: the rows it is chosen from are locked below, and the choice is checked
+        # against them.
+        runningsince = running_since_field()
+        runningtask = (
+            Task.queued()
+            .filter(**{f"{runningsince}__isnull": False})
+            .order_by(f"-{runningsince}", "-id")
+            .only("id", "user_id")
+            .first()
         )
         runningtaskid = runningtask.id if runningtask is not None else None
-        runningtask_userid = runningtask.user_id if runningtask is not None else None
+        runninguserid = runningtask.user_id if runningtask is not None else None
+
+        # the tail is only renumbered when the running task already holds position 0. After a
+        # dispatch, until the next full pass, that is not yet so, and nothing ahead can be trusted.
+        if from_position > 0 and (
+            runningtaskid is None or not Task.queued().filter(id=runningtaskid, queuepos_relative=0).exists()
+        ):
+            from_position = 0
+
+        # Lock the queued rows being renumbered and read them once. Without the lock, two concurrent
+        # recalculations can each renumber from a snapshot that is missing the other's changes
+        # and end up assigning duplicate queue positions.
+        renumbered = Task.queued()
+        if from_position > 0:
+            renumbered = renumbered.filter(
+                models.Q(queuepos_relative__gte=from_position) | models.Q(queuepos_relative__isnull=True)
+            )
+        queuedtasks = list(
+            renumbered.select_for_update()
+            .order_by("user_id", "timestamp", "id")
+            .only("id", "user_id", "queuepos_relative", *FEATURE_FIELDS)
+        )
 
-        queuedtaskcount = len(queuedtasks)
+        if from_position == 0 and runningtaskid not in {tsk.id for tsk in queuedtasks}:
+            # finished between the two reads
+            runningtaskid = runninguserid = None
+
+        ranks_before: dict[int, int] = {}
+        if from_position > 0 and runningtaskid is not None:
+            ranks_before = dict(
+                Task.queued()
+                .filter(queuepos_relative__lt=from_position)
+                .exclude(id=runningtaskid)
+                .order_by()
+                .values_list("user_id")
+                .annotate(count=models.Count("id"))
+            )
 
-        unassigned_taskids = [t.id for t in queuedtasks]
-        unassigned_task_userids = [t.user_id for t in queuedtasks]
+        expected = expected_runtimes((tsk.id, task_features(tsk)) for tsk in queuedtasks) if shortest_first() else None
+        order = round_robin_order(
+            ((tsk.id, tsk.user_id) for tsk in queuedtasks if tsk.id != runningtaskid),
+            runninguserid=runninguserid,
+            ranks_before=ranks_before,
+            expected_seconds=expected,
+            running_expected_seconds=expected[runningtaskid]
+            if expected is not None and runningtaskid is not None
+            else 0.0,
+        )
 
-        # work through passes (max one task per user in each pass) assigning queue positions from 0 (next) upwards
-        queuepos: int = 0
-        passnum: int = 0
         # collected and written in one statement at the end: issuing an UPDATE per task meant a
         # round trip per task while holding a lock on every queued row, so a deep queue made every
         # submission slow and serialised concurrent submitters behind it
         queuepos_updates: dict[int, int] = {}
-        while unassigned_taskids:
-            useridsassigned_currentpass = set()
-
-            if passnum == 0 and runningtaskid is not None:
-                # currently running task will be assigned position 0
-                try:
-                    index = unassigned_taskids.index(runningtaskid)
-                    unassigned_taskids.pop(index)
-                    unassigned_task_userids.pop(index)
-                    useridsassigned_currentpass.add(runningtask_userid)
-                    queuepos_updates[runningtaskid] = 0
-                    queuepos = 1
-                except ValueError:  # the task disappeared between the two queries?
-                    runningtaskid = None
-
-            # collect the tasks not assigned in this pass rather than popping from
-            # the lists during iteration (which would skip elements)
-            remaining_taskids: list[int] = []
-            remaining_task_userids: list[int] = []
-            for taskid, task_userid in zip(unassigned_taskids, unassigned_task_userids, strict=True):
-                if task_userid not in useridsassigned_currentpass and (
-                    passnum != 0 or runningtask_userid is None or (task_userid > runningtask_userid)
-                ):
-                    queuepos_updates[taskid] = queuepos
-                    useridsassigned_currentpass.add(task_userid)
-                    queuepos += 1
-                else:
-                    remaining_taskids.append(taskid)
-                    remaining_task_userids.append(task_userid)
-
-            unassigned_taskids = remaining_taskids
-            unassigned_task_userids = remaining_task_userids
-
-            # bail out rather than spin forever if a pass somehow assigns nothing. Not an assert:
-            # those are stripped under python -O, which is exactly when a hung request would be
-            # hardest to explain
-            if passnum >= (2 * queuedtaskcount + 1):
-                msg = f"queue position assignment made no progress after {passnum} passes over {queuedtaskcount} tasks"
-                raise RuntimeError(msg)
-
-            passnum += 1
+        if from_position == 0 and runningtaskid is not None:
+            # currently running task will be assigned position 0
+            queuepos_updates[runningtaskid] = 0
+        firstpos = max(from_position, len(queuepos_updates))
+        queuepos_updates |= {taskid: firstpos + index for index, taskid in enumerate(order)}
 
         # Only the rows that actually move. This used to write every queued row every time, which
         # was harmless when it ran on submit or delete, but the task runner now calls it on a
@@ -280,11 +493,16 @@ def calculate_queue_positions() -> None:
             # task_modified_datetime is written explicitly: it is an auto_now field, and auto_now
             # is applied by Model.save(), not by a bulk write. Without it a reordering would be
             # invisible to get_tasklist_etag() and a user could be served a stale queue position.
-            now = datetime.datetime.now(datetime.UTC)
+            # The timestamp is the same for every row, so it is one plain UPDATE rather than a
+            # second CASE in the bulk one, which would double the expressions Django builds per row.
             Task.objects.bulk_update(
-                [
-                    Task(id=taskid, queuepos_relative=newpos, task_modified_datetime=now)
-                    for taskid, newpos in moved.items()
-                ],
-                ["queuepos_relative", "task_modified_datetime"],
+                [Task(id=taskid, queuepos_relative=newpos) for taskid, newpos in moved.items()],
+                ["queuepos_relative"],
+                batch_size=QUEUEPOS_UPDATE_BATCH_SIZE,
             )
+            now = datetime.datetime.now(datetime.UTC)
+            movedids = list(moved)
+            for start in range(0, len(movedids), QUEUEPOS_UPDATE_BATCH_SIZE):
+                Task.objects.filter(id__in=movedids[start : start + QUEUEPOS_UPDATE_BATCH_SIZE]).update(
+                    task_modified_datetime=now
+                )
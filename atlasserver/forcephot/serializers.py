@@ -11,8 +11,10 @@ from atlasserver.forcephot.models import get_mjd_min_default
 from atlasserver.forcephot.models import MPC_NAME_WHITESPACE
 from atlasserver.forcephot.models import Task
 from atlasserver.forcephot.models import UNSET
+from atlasserver.forcephot.prediction import predict_task_runtime
 from atlasserver.forcephot.webhooks import CallbackUrlError
 from atlasserver.forcephot.webhooks import validate_callback_url
+from atlasserver.taskrunner import status as runnerstatus
 
 
 def is_finite_float(val):
@@ -31,6 +33,8 @@ def is_finite_float(val):
 class ForcePhotTaskSerializer(serializers.ModelSerializer[Task]):
     # memoised queue offset. 0 is a normal value, so it cannot double as "not computed yet".
     _min_queuepos_cache: t.Any = UNSET
+    # memoised queue snapshot, for the same reason; None is a normal value too (the mode is off)
+    _queue_snapshot_cache: t.Any = UNSET
 
     def get_result_url(self, obj) -> str | None:
         localresultfile = obj.localresultfile()
@@ -99,10 +103,21 @@ class ForcePhotTaskSerializer(serializers.ModelSerializer[Task]):
 
         return self._min_queuepos_cache
 
+    @property
+    def queue_snapshot(self) -> runnerstatus.QueueSnapshot | None:
+        """Return Task.queue_snapshot(), looked up once per serializer rather than with a stat per task."""
+        if self._queue_snapshot_cache is UNSET:
+            self._queue_snapshot_cache = Task.queue_snapshot()
+
+        return self._queue_snapshot_cache
+
     def get_queuepos(self, obj) -> int | None:
         if obj.finishtimestamp or obj.queuepos_relative is None:
             return None
 
+        if self.queue_snapshot is not None:
+            return self.queue_snapshot.position(obj.id)
+
         return obj.queuepos_relative - self.min_queuepos_relative
 
     @staticmethod
@@ -118,11 +133,19 @@ class ForcePhotTaskSerializer(serializers.ModelSerializer[Task]):
         """Seconds the task took to run."""
         return self._rounded_seconds(obj.runtime())
 
+    def get_expected_runtime_seconds(self, obj) -> float | None:
+        """Seconds an unfinished task is expected to run for, from recent tasks like it, if known."""
+        if obj.finishtimestamp:
+            return None
+
+        return predict_task_runtime(obj)
+
     queuepos = serializers.SerializerMethodField("get_queuepos")
     # declared rather than left to ModelSerializer, which would resolve these two model methods to
     # a plain ReadOnlyField and render their full float precision
     waittime = serializers.SerializerMethodField("get_waittime")
     runtime = serializers.SerializerMethodField("get_runtime")
+    expected_runtime_seconds = serializers.SerializerMethodField("get_expected_runtime_seconds")
     result_url = serializers.SerializerMethodField("get_result_url")
     parent_task_url = serializers.SerializerMethodField("get_parent_task_url")
     pdfplot_url = serializers.SerializerMethodField("get_pdfplot_url")
@@ -331,7 +354,10 @@ class ForcePhotTaskSerializer(serializers.ModelSerializer[Task]):
             "userqueuedtasks_on_submit",
             "waittime",
             "runtime",
+            "expected_runtime_seconds",
             "attempt_count",
+            "rows_received",
+            "last_mjd_received",
         ]
 
         read_only_fields = [
@@ -355,5 +381,8 @@ class ForcePhotTaskSerializer(serializers.ModelSerializer[Task]):
             "userqueuedtasks_on_submit",
             "waittime",
             "runtime",
+            "expected_runtime_seconds",
             "attempt_count",
+            "rows_received",
+            "last_mjd_received",
         ]
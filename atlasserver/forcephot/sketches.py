@@ -0,0 +1,265 @@
+"""Quantile sketches of the run and wait times of finished tasks, kept by the hour.
+
+typical_runtime_seconds() reads up to TYPICAL_RUNTIME_SAMPLE_LIMIT finished tasks per request type
+to take their median, and the stats page reads every task finished in the week, as model
+instances, to take the means of their wait and run times. Both grow with the number of tasks, and
+both only ever wanted a few numbers out of them.
+
+With settings.TASKRUNNER_RUNTIME_SKETCHES, the task runner adds each task to a sketch as it
+finishes (see taskrunner.main.mark_finished): one RuntimeSketch row per metric, request type and
+hour, holding a KLL sketch of the values, their count and their total. A window of hours is then
+the merge of its rows -- at most a few hundred numbers each, however many tasks finished -- and any
+quantile of it, or the mean, is read from that.
+
+The sketch is KLL (Karnin, Lang and Liberty, "Optimal quantile approximation in streams"): a stack
+of compactors, the one at level h holding values that each stand for 2**h of the values added.
+When the sketch is full, the lowest level that is over its capacity is sorted and every other
+value is promoted to the level above. Which half is kept alternates, rather than being drawn at
+random as in the paper, so that the same tasks give the same sketch.
+"""
+
+import datetime
+import math
+import typing as t
+from collections import defaultdict
+
+from django.db import IntegrityError
+from django.db import transaction
+
+from atlasserver.forcephot.models import RuntimeSketch
+from atlasserver.forcephot.models import Task
+
+# The size of the top compactor, which sets the accuracy: a quantile is within about 1.7/k of its
+# rank, so 200 gives the median of a week's tasks to within a percentile, in at most ~600 numbers.
+SKETCH_K: t.Final = 200
+
+# how much smaller each compactor is than the one above it
+SKETCH_CAPACITY_RATIO: t.Final = 2.0 / 3.0
+
+# What is sketched. "waittime_first" is the wait of a task whose user had nothing else queued when
+# they submitted it, which the stats page reports apart because it is the wait a new user sees.
+METRICS: t.Final = ("runtime", "waittime", "waittime_first")
+
+# When the table is empty (the mode has just been turned on), how far back the task runner fills it
+# from the tasks themselves: the stats page's week, and more than the wait estimates' day.
+BACKFILL_HOURS: t.Final = 7 * 24
+
+# How long the hourly rows are kept: the stats page's week, which is the longest window anything
+# reads, and a day more so that a window ending in the current hour is always whole.
+KEEP_HOURS: t.Final = 8 * 24
+
+
+class QuantileSketch:
+    """A KLL sketch of a stream of numbers, which answers any quantile of it to within about 1.7/k of its rank."""
+
+    def __init__(self, k: int = SKETCH_K) -> None:
+        """Start an empty sketch whose top compactor holds `k` values."""
+        self.k = k
+        self.compactors: list[list[float]] = [[]]
+        # how many times each level has been compacted, whose parity says which half it keeps next
+        self.compactions: list[int] = [0]
+
+    @classmethod
+    def from_json(cls, data: dict[str, t.Any]) -> "QuantileSketch":
+        sketch = cls(k=data.get("k", SKETCH_K))
+        if data.get("compactors"):
+            sketch.compactors = [list(compactor) for compactor in data["compactors"]]
+            sketch.compactions = list(data["compactions"])
+        return sketch
+
+    def to_json(self) -> dict[str, t.Any]:
+        return {"k": self.k, "compactors": self.compactors, "compactions": self.compactions}
+
+    def capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(2, math.ceil(self.k * SKETCH_CAPACITY_RATIO**depth))
+
+    def count(self) -> int:
+        """Return how many values have been added. Exact: a compaction halves the values and doubles their weight."""
+        return sum(len(compactor) << level for level, compactor in enumerate(self.compactors))
+
+    def add(self, value: float) -> None:
+        self.compactors[0].append(value)
+        self.compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Add every value that `other` holds, at the weight it holds it at."""
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+            self.compactions.append(0)
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+            self.compactions[level] += other.compactions[level]
+        self.compress()
+
+    def compress(self) -> None:
+        while sum(map(len, self.compactors)) >= sum(self.capacity(level) for level in range(len(self.compactors))):
+            level = next(
+                level for level, compactor in enumerate(self.compactors) if len(compactor) >= self.capacity(level)
+            )
+            if level + 1 == len(self.compactors):
+                self.compactors.append([])
+                self.compactions.append(0)
+
+            values = sorted(self.compactors[level])
+            # an odd one out stays where it is, so that no weight is lost
+            self.compactors[level] = [values.pop()] if len(values) % 2 else []
+            self.compactors[level + 1].extend(values[self.compactions[level] % 2 :: 2])
+            self.compactions[level] += 1
+
+    def quantile(self, fraction: float) -> float | None:
+        """Return the value at `fraction` (0 to 1) of the way through the values, or None if there are none."""
+        weighted = sorted((value, 1 << level) for level, compactor in enumerate(self.compactors) for value in compactor)
+        if not weighted:
+            return None
+
+        target = fraction * sum(weight for _, weight in weighted)
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen >= target:
+                return value
+        return weighted[-1][0]
+
+
+class WindowSummary:
+    """The values of one metric and request type over a window of hours: how many, their mean, and a sketch."""
+
+    def __init__(self) -> None:
+        """Start with nothing in the window."""
+        self.count = 0
+        self.total_seconds = 0.0
+        self.sketch = QuantileSketch()
+
+    def mean(self) -> float | None:
+        return self.total_seconds / self.count if self.count else None
+
+    def quantile(self, fraction: float) -> float | None:
+        return self.sketch.quantile(fraction)
+
+
+def task_metrics(task: Task) -> dict[str, float]:
+    """Return what is sketched of a finished task: its run time and its wait, for those it has.
+
+    A task that reused another's result has a wait but no run time of its own; see Task.reused_result.
+    """
+    metrics = {}
+    if not task.reused_result and (runtime := task.runtime()) is not None:
+        metrics["runtime"] = runtime
+    if (waittime := task.waittime()) is not None:
+        metrics["waittime"] = waittime
+        if task.userqueuedtasks_on_submit == 0:
+            metrics["waittime_first"] = waittime
+    return metrics
+
+
+def hour_of(moment: datetime.datetime) -> datetime.datetime:
+    return moment.astimezone(datetime.UTC).replace(minute=0, second=0, microsecond=0)
+
+
+def record_finished_task(task: Task) -> None:
+    """Add a task that has just finished to the sketches of the hour it finished in.
+
+    Each row is locked while it is read and written back, because every slot finishes its tasks
+    from a process of its own. The first task of the hour creates the row, and a slot that loses
+    that race to another locks the row the other created instead.
+    """
+    if task.finishtimestamp is None:
+        return
+
+    hour = hour_of(task.finishtimestamp)
+    for metric, seconds in task_metrics(task).items():
+        with transaction.atomic():
+            lookup = {"metric": metric, "request_type": task.request_type, "hour": hour}
+            row = RuntimeSketch.objects.select_for_update().filter(**lookup).first()
+            if row is None:
+                try:
+                    with transaction.atomic():
+                        row = RuntimeSketch.objects.create(**lookup)
+                except IntegrityError:
+                    row = RuntimeSketch.objects.select_for_update().get(**lookup)
+
+            sketch = QuantileSketch.from_json(row.sketch)
+            sketch.add(round(seconds, 1))
+            row.sketch = sketch.to_json()
+            row.count += 1
+            row.total_seconds += seconds
+            row.save(update_fields=["sketch", "count", "total_seconds"])
+
+
+def window_summaries(metric: str, hours: int) -> dict[str, WindowSummary]:
+    """Return the summary of `metric` over the last `hours` hours for each request type that has any.
+
+    One query, of at most `hours` rows per request type, whatever the number of tasks. The current
+    hour counts as one of them, so the window reaches back a little less than `hours` hours.
+    """
+    since = hour_of(datetime.datetime.now(datetime.UTC)) - datetime.timedelta(hours=hours - 1)
+    summaries: defaultdict[str, WindowSummary] = defaultdict(WindowSummary)
+    for request_type, count, total_seconds, sketch in RuntimeSketch.objects.filter(
+        metric=metric, hour__gte=since
+    ).values_list("request_type", "count", "total_seconds", "sketch"):
+        summary = summaries[request_type]
+        summary.count += count
+        summary.total_seconds += total_seconds
+        summary.sketch.merge(QuantileSketch.from_json(sketch))
+
+    return dict(summaries)
+
+
+def combined_summary(summaries: dict[str, WindowSummary]) -> WindowSummary:
+    """Return one summary of every request type's values together."""
+    combined = WindowSummary()
+    for summary in summaries.values():
+        combined.count += summary.count
+        combined.total_seconds += summary.total_seconds
+        combined.sketch.merge(summary.sketch)
+    return combined
+
+
+def prune_runtime_sketches(hours: int = KEEP_HOURS) -> int:
+    """Delete the rows of the hours that ended more than `hours` hours ago, and return how many.
+
+    For the hourly maintenance sweep: the table gains a row per metric and request type every hour
+    and no window reads further back than a week. Once the mode has been off for longer than that,
+    this also empties the table, so that turning it back on fills it again from the tasks.
+    """
+    cutoff = hour_of(datetime.datetime.now(datetime.UTC)) - datetime.timedelta(hours=hours)
+    deleted, _ = RuntimeSketch.objects.filter(hour__lt=cutoff).delete()
+    return deleted
+
+
+def backfill_runtime_sketches(hours: int = BACKFILL_HOURS) -> int:
+    """Fill an empty table from the tasks that finished in the last `hours` hours, and return how many.
+
+    For the task runner at startup, so that turning the mode on does not leave the wait estimates
+    and the stats page empty until a day or a week of tasks has gone by. A table with anything in
+    it is left alone: its tasks were recorded as they finished, and would be counted twice.
+    """
+    if RuntimeSketch.objects.exists():
+        return 0
+
+    cutoff = datetime.datetime.now(datetime.UTC) - datetime.timedelta(hours=hours)
+    rows: dict[tuple[str, str, datetime.datetime], RuntimeSketch] = {}
+    sketches: dict[tuple[str, str, datetime.datetime], QuantileSketch] = {}
+    finished = Task.objects.filter(finishtimestamp__gt=cutoff, starttimestamp__isnull=False).only(
+        "timestamp", "starttimestamp", "finishtimestamp", "request_type", "userqueuedtasks_on_submit", "reused_result"
+    )
+    taskcount = 0
+    for task in finished.iterator(chunk_size=2000):
+        taskcount += 1
+        assert task.finishtimestamp is not None  # for the type checker: filtered above
+        hour = hour_of(task.finishtimestamp)
+        for metric, seconds in task_metrics(task).items():
+            key = (metric, task.request_type, hour)
+            if key not in rows:
+                rows[key] = RuntimeSketch(metric=metric, request_type=task.request_type, hour=hour)
+                sketches[key] = QuantileSketch()
+            sketches[key].add(round(seconds, 1))
+            rows[key].count += 1
+            rows[key].total_seconds += seconds
+
+    for key, row in rows.items():
+        row.sketch = sketches[key].to_json()
+    RuntimeSketch.objects.bulk_create(rows.values(), batch_size=500, ignore_conflicts=True)
+
+    return taskcount
@@ -1,11 +1,15 @@
 import contextlib
 import datetime
 import hashlib
+import hmac
 import ipaddress
 import itertools
 import json
+import operator
 import os
+import random
 import re
+import shlex
 import signal
 import socket
 import subprocess
@@ -16,6 +20,7 @@ import time
 import typing as t
 import urllib.error
 import urllib.parse
+from email.message import Message
 from multiprocessing import Process
 from pathlib import Path
 from unittest import mock
@@ -28,7 +33,9 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import mail as django_mail
 from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
 from django.db import connection
+from django.db import DatabaseError
 from django.db import IntegrityError
 from django.db import models
 from django.test import Client
@@ -43,14 +50,23 @@ from django.utils import timezone
 from rest_framework.authtoken.models import Token
 from rest_framework.serializers import ValidationError
 
+from atlasserver.benchmarks.queuepositions import legacy_order
 from atlasserver.forcephot import misc
+from atlasserver.forcephot import prediction
 from atlasserver.forcephot import queue as taskqueue
+from atlasserver.forcephot import sketches
 from atlasserver.forcephot import verification
 from atlasserver.forcephot import views
 from atlasserver.forcephot.context_processors import queued_task_count
 from atlasserver.forcephot.misc import splitradeclist
+from atlasserver.forcephot.models import Notification
 from atlasserver.forcephot.models import PendingEmailVerification
+from atlasserver.forcephot.models import ResultCacheEntry
+from atlasserver.forcephot.models import RunnerLease
+from atlasserver.forcephot.models import RuntimeSketch
 from atlasserver.forcephot.models import Task
+from atlasserver.forcephot.models import TaskAttempt
+from atlasserver.forcephot.models import TaskClaim
 from atlasserver.forcephot.queue import calculate_queue_positions
 from atlasserver.forcephot.serializers import ForcePhotTaskSerializer
 from atlasserver.forcephot.serializers import is_finite_float
@@ -60,8 +76,20 @@ from atlasserver.forcephot.views import geoip_reader_forget
 from atlasserver.forcephot.webhooks import CallbackUrlError
 from atlasserver.forcephot.webhooks import send_task_callback
 from atlasserver.forcephot.webhooks import validate_callback_url
+from atlasserver.taskrunner import breaker
+from atlasserver.taskrunner import claims
+from atlasserver.taskrunner import detached
+from atlasserver.taskrunner import eta
+from atlasserver.taskrunner import executors
+from atlasserver.taskrunner import hosts
 from atlasserver.taskrunner import main as taskrunner_main
+from atlasserver.taskrunner import outbox
+from atlasserver.taskrunner import pool
+from atlasserver.taskrunner import resultcache
+from atlasserver.taskrunner import sshmux
 from atlasserver.taskrunner import status as runnerstatus
+from atlasserver.taskrunner import streaming
+from atlasserver.taskrunner import wakeup
 
 
 class TaskQueueTests(TestCase):
@@ -92,6 +120,288 @@ class TaskQueueTests(TestCase):
             assert {task.user_id for task in passtasks} == userids
 
 
+class QueueOrderTests(TestCase):
+    """The round-robin numbering computed from each task's rank, and the tail-only renumbering."""
+
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create_user(username=f"orderer{i}", email=f"orderer{i}@example.com", password=None)
+            for i in range(4)
+        ]
+        caches["default"].delete(taskqueue.RECALC_FROM_POSITION_CACHEKEY)
+
+    def positions(self) -> dict[int, int | None]:
+        return dict(Task.queued().values_list("id", "queuepos_relative"))
+
+    def test_the_order_is_the_one_the_pass_by_pass_walk_found(self) -> None:
+        rng = random.Random(1)  # noqa: S311 (synthetic queues, nothing secret)
+        for _ in range(200):
+            queued = sorted(
+                ((taskid, rng.randint(1, 6)) for taskid in range(rng.randint(0, 40))),
+                key=operator.itemgetter(1, 0),
+            )
+            runninguserid = rng.choice([None, *range(1, 7)])
+
+            assert taskqueue.round_robin_order(queued, runninguserid) == legacy_order(queued, runninguserid), (
+                queued,
+                runninguserid,
+            )
+
+    def make_queue(self) -> Task:
+        """Queue a few tasks for each user, number them, and return the running one."""
+        for index in range(12):
+            Task.objects.create(user=self.users[index % 3], ra=1.0, dec=2.0)
+        running = Task.queued().filter(user=self.users[1]).order_by("id").first()
+        assert running is not None
+        Task.objects.filter(id=running.id).update(starttimestamp=timezone.now())
+        calculate_queue_positions()
+        running.refresh_from_db()
+        return running
+
+    def test_a_submission_renumbers_only_the_tail_and_agrees_with_a_full_pass(self) -> None:
+        self.make_queue()
+        # two submissions between renumberings: the lower of their positions is the one kept
+        from_position = min(taskqueue.first_position_after_user(user.pk) for user in self.users[::2])
+        for user in self.users[::2]:
+            Task.objects.create(user=user, ra=1.0, dec=2.0, queuepos_relative=taskqueue.next_queuepos_relative())
+        assert from_position > 0
+        before = self.positions()
+
+        taskqueue.calculate_queue_positions(from_position=from_position)
+        tail = self.positions()
+        calculate_queue_positions()
+
+        assert tail == self.positions()
+        assert all(tail[taskid] == pos for taskid, pos in before.items() if pos is not None and pos < from_position)
+
+    def test_a_deletion_renumbers_from_the_deleted_task(self) -> None:
+        self.make_queue()
+        deleted = Task.queued().get(queuepos_relative=5)
+        deleted.delete()
+
+        taskqueue.calculate_queue_positions(from_position=5)
+        tail = self.positions()
+        calculate_queue_positions()
+
+        assert tail == self.positions()
+        assert sorted(pos for pos in tail.values() if pos is not None) == list(range(11))
+
+    def test_a_new_running_task_renumbers_everything(self) -> None:
+        running = self.make_queue()
+        nextup = Task.queued().get(queuepos_relative=1)
+        assert running.starttimestamp is not None
+        Task.objects.filter(id=nextup.id).update(starttimestamp=running.starttimestamp + datetime.timedelta(seconds=1))
+
+        # the tail alone would leave the new running task where it was
+        taskqueue.calculate_queue_positions(from_position=8)
+
+        assert Task.objects.get(id=nextup.id).queuepos_relative == 0
+
+    def test_the_lowest_requested_position_is_kept_until_taken(self) -> None:
+        taskqueue.request_recalc(from_position=9)
+        taskqueue.request_recalc(from_position=4)
+        taskqueue.request_recalc(from_position=7)
+
+        assert taskqueue.take_recalc_from_position() == 4
+        # forgotten, so a request whose position was lost with it renumbers everything
+        assert taskqueue.take_recalc_from_position() == 0
+
+
+@override_settings(TASKRUNNER_VIRTUAL_QUEUE=True)
+class VirtualQueueTests(TestCase):
+    """The queue order kept by the runner and read from its published snapshot, with no positions written."""
+
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create_user(username=f"virtual{i}", email=f"virtual{i}@example.com", password=None)
+            for i in range(3)
+        ]
+        snapshotdir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshotdir.cleanup)
+        patcher = mock.patch.object(runnerstatus, "QUEUE_SNAPSHOT_PATH", Path(snapshotdir.name) / "queue.json")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_queue(self) -> Task:
+        """Queue a few tasks for each user, with one of them running, and return the running one."""
+        for index in range(9):
+            Task.objects.create(user=self.users[index % 3], ra=1.0, dec=2.0, queuepos_relative=100 + index)
+        running = Task.queued().filter(user=self.users[1]).order_by("id").first()
+        assert running is not None
+        Task.objects.filter(id=running.id).update(starttimestamp=timezone.now())
+        return running
+
+    def test_the_order_is_the_one_calculate_queue_positions_stores(self) -> None:
+        running = self.make_queue()
+
+        order = taskqueue.virtual_queue_order()
+        calculate_queue_positions()
+
+        assert order[0] == (running.id, running.user_id)
+        assert [taskid for taskid, _ in order] == list(
+            Task.queued().order_by("queuepos_relative").values_list("id", flat=True)
+        )
+
+    def test_publishing_writes_no_task_rows(self) -> None:
+        self.make_queue()
+        before = dict(Task.queued().values_list("id", "task_modified_datetime"))
+
+        with CaptureQueriesContext(connection) as queries:
+            runnerstatus.write_queue_snapshot(taskqueue.virtual_queue_order())
+
+        assert not [query for query in queries if not query["sql"].startswith("SELECT")], queries.captured_queries
+        assert dict(Task.queued().values_list("id", "task_modified_datetime")) == before
+
+    def test_positions_are_read_from_the_snapshot(self) -> None:
+        self.make_queue()
+        order = taskqueue.virtual_queue_order()
+        runnerstatus.write_queue_snapshot(order)
+        late = Task.objects.create(user=self.users[0], ra=1.0, dec=2.0, queuepos_relative=200)
+
+        self.client.force_login(self.users[0])
+        data = self.client.get(reverse("queuepositions")).json()
+
+        expected = {taskid: position for position, (taskid, userid) in enumerate(order) if userid == self.users[0].pk}
+        # submitted since the runner published, so counted at the back until it places it
+        expected[late.id] = len(order)
+        assert data["queuepositions"] == {str(taskid): position for taskid, position in expected.items()}
+        assert data["queueoffset"] == 0
+        for taskid, position in expected.items():
+            task = Task.objects.get(id=taskid)
+            assert task.queuepos == position
+            assert ForcePhotTaskSerializer().get_queuepos(task) == position
+
+    def test_a_reordering_of_other_users_leaves_an_etag_alone(self) -> None:
+        self.make_queue()
+        runnerstatus.write_queue_snapshot(taskqueue.virtual_queue_order())
+        self.client.force_login(self.users[0])
+        etag = self.client.get(reverse("task-list"), HTTP_ACCEPT="application/json")["ETag"]
+
+        # the other two users' tasks change places; this user's stay where they were
+        order = taskqueue.virtual_queue_order()
+        mine = self.users[0].pk
+        others = [pair for pair in order if pair[1] != mine][::-1]
+        runnerstatus.write_queue_snapshot([pair if pair[1] == mine else others.pop(0) for pair in order])
+        response = self.client.get(reverse("task-list"), HTTP_ACCEPT="application/json", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+        # and when this user's tasks move, the tag changes with them
+        runnerstatus.write_queue_snapshot(order[::-1])
+        response = self.client.get(reverse("task-list"), HTTP_ACCEPT="application/json", HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_dispatch_follows_the_order_and_skips_busy_users_and_deleted_tasks(self) -> None:
+        running = self.make_queue()
+        order = taskqueue.virtual_queue_order()
+        nextup = next(taskid for taskid, userid in order if userid != running.user_id)
+        Task.objects.filter(id=nextup).delete()
+
+        task = taskrunner_main.next_task_in_order(order, busy_userids={running.user_id}, running_fingerprints=set())
+
+        assert task is not None
+        assert task.id == next(taskid for taskid, userid in order if userid != running.user_id and taskid != nextup)
+        assert (
+            taskrunner_main.next_task_in_order(
+                order, busy_userids={u.pk for u in self.users}, running_fingerprints=set()
+            )
+            is None
+        )
+
+    def test_an_order_no_longer_kept_current_gives_way_to_the_stored_positions(self) -> None:
+        self.make_queue()
+        # the stored positions say this task is last, and the published order that it is first
+        last = Task.queued().order_by("queuepos_relative").last()
+        assert last is not None
+        runnerstatus.write_queue_snapshot([(last.id, last.user_id)])
+        assert last.queuepos == 0
+
+        stale = time.time() - runnerstatus.QUEUE_SNAPSHOT_STALE_SECONDS - 1
+        os.utime(runnerstatus.QUEUE_SNAPSHOT_PATH, (stale, stale))
+        assert Task.queue_snapshot() is None
+        assert last.queuepos == 8
+        assert ForcePhotTaskSerializer().get_queuepos(last) == 8
+
+        # which a live runner's touch, on every status write, does not let happen
+        runnerstatus.touch_queue_snapshot()
+        assert last.queuepos == 0
+
+    @override_settings(TASKRUNNER_VIRTUAL_QUEUE=False)
+    def test_the_stored_positions_are_used_with_the_mode_off(self) -> None:
+        self.make_queue()
+        runnerstatus.write_queue_snapshot([])
+
+        assert Task.queue_snapshot() is None
+        task = Task.queued().order_by("queuepos_relative").last()
+        assert task is not None
+        assert task.queuepos == 8
+
+
+class SchedulerTests(TestCase):
+    """The scheduler policies of settings.TASKRUNNER_SCHEDULER, against the one-task-per-user-per-pass guarantee."""
+
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create_user(username=f"scheduled{i}", email=f"scheduled{i}@example.com", password=None)
+            for i in range(3)
+        ]
+        caches["usagestats"].set(taskqueue.TYPICAL_RUNTIME_CACHEKEY, {"FP": 60.0, "IMGZIP": 900.0}, timeout=None)
+        taskqueue.clear_typical_runtime_memo()
+        self.addCleanup(caches["usagestats"].clear)
+        self.addCleanup(taskqueue.clear_typical_runtime_memo)
+
+    def test_without_expected_run_times_the_order_is_plain_round_robin(self) -> None:
+        queued = [(1, 1), (2, 1), (3, 2), (4, 3), (5, 3)]
+        expected = dict.fromkeys(range(1, 6), 30.0)
+
+        assert taskqueue.round_robin_order(
+            queued, runninguserid=2, expected_seconds=expected, running_expected_seconds=30.0
+        ) == taskqueue.round_robin_order(queued, runninguserid=2)
+
+    def test_each_pass_takes_the_shortest_tasks_first_and_one_per_user(self) -> None:
+        # user 1's tasks are all long, and they still get one in each pass
+        queued = [(1, 1), (2, 1), (3, 2), (4, 2), (5, 3), (6, 3)]
+        expected = {1: 900.0, 2: 900.0, 3: 60.0, 4: 900.0, 5: 60.0, 6: 60.0}
+
+        order = taskqueue.round_robin_order(queued, runninguserid=None, expected_seconds=expected)
+
+        assert order == [3, 5, 1, 6, 2, 4]
+
+    @override_settings(TASKRUNNER_SCHEDULER="shortest_first")
+    def test_positions_put_short_request_types_first_in_each_pass(self) -> None:
+        for user in self.users:
+            Task.objects.create(user=user, ra=1.0, dec=2.0, request_type="IMGZIP" if user == self.users[0] else "FP")
+            Task.objects.create(user=user, ra=1.0, dec=2.0, request_type="FP")
+
+        # the tail alone would keep the order ahead of it, which was not found shortest first
+        calculate_queue_positions(from_position=3)
+
+        queued = list(Task.queued().order_by("queuepos_relative"))
+        assert [task.queuepos_relative for task in queued] == list(range(6))
+        assert [(task.user_id, task.request_type) for task in queued] == [
+            (self.users[1].pk, "FP"),
+            (self.users[2].pk, "FP"),
+            (self.users[0].pk, "IMGZIP"),
+            (self.users[0].pk, "FP"),
+            (self.users[1].pk, "FP"),
+            (self.users[2].pk, "FP"),
+        ]
+
+    def test_the_short_lane_keeps_slots_for_short_types_once_long_tasks_fill_the_rest(self) -> None:
+        with (
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_SCHEDULER", "short_lane"),
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_SHORT_LANE_SLOTS", 2),
+        ):
+            # SSOSTACK has no median, and only forced photometry is taken to be short without one
+            assert taskrunner_main.short_request_types() == {"FP"}
+            assert taskrunner_main.lane_request_types(["IMGZIP", "FP", "FP"], 4, None) is None
+            assert taskrunner_main.lane_request_types(["IMGZIP", "SSOSTACK"], 4, None) == {"FP"}
+            assert taskrunner_main.lane_request_types(["IMGZIP", "SSOSTACK"], 4, {"IMGZIP", "SSOSTACK"}) == set()
+            # the long types always keep one slot
+            assert taskrunner_main.lane_request_types([], 2, None) is None
+
+        assert taskrunner_main.lane_request_types(["IMGZIP"] * 4, 4, None) is None
+
+
 class EmailChangeTests(TestCase):
     def setUp(self) -> None:
         self.user = User.objects.create_user(
@@ -2191,6 +2501,190 @@ class CallbackSendingTests(TestCase):
         assert len(django_mail.outbox) == 1, "an exploding callback must not suppress the result email"
 
 
+@contextlib.contextmanager
+def stub_callback_endpoint(status: int = 200) -> t.Iterator[mock.MagicMock]:
+    """Resolve every host name to a public address, and answer each callback with `status`; yield the opener."""
+    response = mock.MagicMock()
+    response.status = status
+    response.__enter__.return_value = response
+    answer: dict[str, t.Any] = (
+        {"return_value": response}
+        if 200 <= status < 300
+        else {"side_effect": urllib.error.HTTPError("https://example.com/hook", status, "error", Message(), None)}
+    )
+    with (
+        mock.patch("socket.getaddrinfo", return_value=[(socket.AF_INET, None, None, "", ("93.184.216.34", 443))]),
+        mock.patch("urllib.request.OpenerDirector.open", **answer) as opener,
+    ):
+        yield opener
+
+
+class NotificationOutboxTests(TestCase):
+    """Callbacks and result emails written to the outbox and sent from there (TASKRUNNER_NOTIFY_OUTBOX)."""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="outbox", email="outbox@example.com", password=None)
+        self.token = Token.objects.create(user=self.user)
+        self.stamp = timezone.now()
+        django_mail.outbox.clear()
+        patcher = mock.patch.object(taskrunner_main.settings, "TASKRUNNER_NOTIFY_OUTBOX", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.logged: list[str] = []
+
+    def make_task(self, **kwargs: t.Any) -> Task:
+        return Task.objects.create(user=self.user, ra=1.0, dec=2.0, timestamp=self.stamp, **kwargs)
+
+    def finish(self, task: Task, error_msg: str | None = None) -> None:
+        taskrunner_main.mark_finished(task=task, error_msg=error_msg)
+        taskrunner_main.notify_finished(task=task, logfunc=self.logged.append)
+
+    def deliver_due(self) -> list[Notification]:
+        taken = outbox.take_due_notifications(limit=10)
+        for notification in taken:
+            outbox.deliver(notification, self.logged.append)
+        return taken
+
+    def test_a_finished_task_is_written_to_the_outbox_rather_than_sent_from_its_slot(self) -> None:
+        task = self.make_task(from_api=True, callback_url="https://example.com/hook")
+
+        with mock.patch("urllib.request.OpenerDirector.open") as opener:
+            self.finish(task, error_msg="No data returned")
+
+        opener.assert_not_called()
+        notification = Notification.objects.get()
+        assert notification.kind == Notification.Kind.CALLBACK
+        assert notification.state == Notification.State.PENDING
+        assert notification.url == "https://example.com/hook"
+        assert notification.payload["task_id"] == task.id
+        assert notification.payload["success"] is False
+        assert notification.payload["finishtimestamp"] is not None
+
+    def test_a_task_is_finished_only_with_its_notifications_written(self) -> None:
+        task = self.make_task(from_api=True, callback_url="https://example.com/hook")
+
+        with (
+            mock.patch.object(outbox, "write_notification", side_effect=DatabaseError("lost connection")),
+            contextlib.suppress(DatabaseError),
+        ):
+            taskrunner_main.mark_finished(task=task, error_msg=None)
+
+        # left for the runner to finish again, rather than finished with nobody told
+        assert Task.objects.get(id=task.id).finishtimestamp is None
+        assert not Notification.objects.exists()
+
+    def test_a_delivered_callback_is_signed_with_the_users_token(self) -> None:
+        self.finish(self.make_task(from_api=True, callback_url="https://example.com/hook"))
+
+        with stub_callback_endpoint() as opener:
+            (notification,) = self.deliver_due()
+
+        request = opener.call_args.args[0]
+        timestamp = request.get_header("X-atlas-timestamp")
+        expected = hmac.new(self.token.key.encode(), f"{timestamp}.".encode() + request.data, hashlib.sha256)
+        assert request.get_header("X-atlas-signature") == f"sha256={expected.hexdigest()}"
+        assert request.get_header("X-atlas-delivery") == str(notification.id)
+        notification.refresh_from_db()
+        assert notification.state == Notification.State.DELIVERED
+        assert notification.attempts == 1
+        assert notification.delivered is not None
+
+    def test_a_failing_endpoint_is_retried_after_a_backoff_and_then_dead_lettered(self) -> None:
+        self.finish(self.make_task(from_api=True, callback_url="https://example.com/hook"))
+
+        with stub_callback_endpoint(status=503):
+            (notification,) = self.deliver_due()
+            notification.refresh_from_db()
+            assert notification.state == Notification.State.PENDING
+            assert notification.attempts == 1
+            assert notification.next_attempt_after > timezone.now()
+            assert self.deliver_due() == []
+
+            Notification.objects.filter(id=notification.id).update(
+                attempts=outbox.MAX_DELIVERY_ATTEMPTS - 1, next_attempt_after=timezone.now()
+            )
+            self.deliver_due()
+
+        notification.refresh_from_db()
+        assert notification.state == Notification.State.DEAD
+        assert notification.last_error == "HTTP 503"
+
+    def test_a_client_error_is_dead_lettered_at_once(self) -> None:
+        self.finish(self.make_task(from_api=True, callback_url="https://example.com/hook"))
+
+        with stub_callback_endpoint(status=404):
+            (notification,) = self.deliver_due()
+
+        notification.refresh_from_db()
+        assert notification.state == Notification.State.DEAD
+        assert notification.attempts == 1
+
+    def test_a_notification_is_taken_for_delivery_once(self) -> None:
+        self.finish(self.make_task(from_api=True, callback_url="https://example.com/hook"))
+
+        assert len(outbox.take_due_notifications(limit=10)) == 1
+        assert outbox.take_due_notifications(limit=10) == []
+
+    def test_the_email_of_a_submission_is_written_once_its_last_task_finishes(self) -> None:
+        first = self.make_task(send_email=True)
+        last = self.make_task(send_email=True)
+
+        self.finish(first)
+        assert not Notification.objects.exists()
+        self.finish(last)
+        # as when both finish together and each sees the other finished
+        outbox.enqueue_notifications(first)
+        assert Notification.objects.filter(kind=Notification.Kind.EMAIL).count() == 1
+        assert not django_mail.outbox
+
+        self.deliver_due()
+
+        assert len(django_mail.outbox) == 1
+        assert django_mail.outbox[0].to == ["outbox@example.com"]
+        for task in (first, last):
+            assert f"Task {task.id}:" in django_mail.outbox[0].body
+        assert Notification.objects.get().state == Notification.State.DELIVERED
+
+    def test_a_mail_server_that_is_down_is_retried(self) -> None:
+        self.finish(self.make_task(send_email=True))
+
+        with mock.patch("django.core.mail.message.EmailMessage.send", side_effect=ConnectionRefusedError("down")):
+            (notification,) = self.deliver_due()
+
+        notification.refresh_from_db()
+        assert notification.state == Notification.State.PENDING
+        assert "down" in notification.last_error
+
+
+class OutboxDeliveryThreadTests(TransactionTestCase):
+    """The delivery threads, which need to see the rows committed by the test's own connection."""
+
+    def test_the_threads_send_what_is_due(self) -> None:
+        user = User.objects.create_user(username="outboxthreads", email="ot@example.com", password=None)
+        for taskid in range(3):
+            outbox.write_notification(
+                kind=Notification.Kind.CALLBACK,
+                key=f"callback:{taskid}",
+                user_id=user.id,
+                url="https://example.com/hook",
+                payload={"task_id": taskid},
+            )
+        delivery = outbox.OutboxDelivery(logfunc=lambda _msg: None, threads=2)
+
+        with stub_callback_endpoint() as opener:
+            delivery.start()
+            try:
+                deadline = time.monotonic() + 10
+                while Notification.objects.exclude(state=Notification.State.DELIVERED).exists():
+                    assert time.monotonic() < deadline, "the notifications were not delivered"
+                    delivery.wake()
+                    time.sleep(0.05)
+            finally:
+                delivery.stop()
+
+        assert opener.call_count == 3
+
+
 class QueuePositionsEndpointTests(TestCase):
     """The cheap endpoint the queue page can poll instead of re-fetching the whole task list."""
 
@@ -2282,6 +2776,33 @@ class TaskRunnerStatusTests(TestCase):
                 taskrunner_main.write_status(numslots=runnerstatus.NUMSLOTS, **write_status_kwargs)
                 return self.client.get(reverse("taskrunnerstatus"))
 
+    def test_several_runners_statuses_are_merged_and_a_stale_one_left_out(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            statuspath = Path(tmpdir, "taskrunner_status.json")
+            with mock.patch.object(runnerstatus, "STATUS_PATH", statuspath):
+                for runnerid, running in (("sc01:1", {0: 11, 1: 12}), ("sc02:2", {0: 13}), ("sc03:3", {0: 14})):
+                    taskrunner_main.write_status(
+                        procs_taskids=running,
+                        numslots=4,
+                        statuspath=runnerstatus.runner_path(statuspath, runnerid),
+                        draining={"handover": True} if runnerid == "sc02:2" else None,
+                    )
+                stalepath = runnerstatus.runner_path(statuspath, "sc03:3")
+                stale = json.loads(stalepath.read_text())
+                stale["written"] = (timezone.now() - datetime.timedelta(hours=1)).isoformat()
+                stalepath.write_text(json.dumps(stale))
+
+                status, age_seconds = runnerstatus.read_status()
+                data = self.client.get(reverse("taskrunnerstatus")).json()
+
+        assert age_seconds < runnerstatus.STALE_AFTER_SECONDS
+        assert (status["numslots"], status["slots_busy"]) == (8, 3)
+        assert status["running_taskids"] == [11, 12, 13]
+        assert status["draining"] == {"handover": True}
+        assert sorted(runner["slots_busy"] for runner in status["runners"]) == [1, 2]
+        assert data["stale"] is False
+        assert data["slots_busy"] == 3
+
     def test_missing_status_file_reports_not_running(self) -> None:
         with (
             tempfile.TemporaryDirectory() as tmpdir,
@@ -2605,6 +3126,13 @@ class TypicalRuntimeTests(TestCase):
 
         assert taskqueue.typical_runtime_seconds()["FP"] == 30.0
 
+    def test_tasks_that_reused_a_result_are_not_run_times(self) -> None:
+        self._finished_tasks(10.0, 20.0, 30.0, 40.0, 50.0)
+        for _ in range(6):
+            self._finished_task(0.0, reused_result=True)
+
+        assert taskqueue.typical_runtime_seconds()["FP"] == 30.0
+
     def test_a_type_with_too_few_samples_is_omitted(self) -> None:
         # below the threshold nothing is reported for the type, and the queue page shows no
         # estimate at all rather than one drawn from two tasks
@@ -2664,6 +3192,384 @@ class TypicalRuntimeTests(TestCase):
         assert taskqueue.typical_runtime_seconds()["FP"] == 30.0
 
 
+class RuntimePredictionTests(TestCase):
+    """The binned medians that predict each task's run time from the finished tasks like it."""
+
+    def setUp(self) -> None:
+        caches["usagestats"].clear()
+        prediction.clear_runtime_predictor_memo()
+        self.addCleanup(prediction.clear_runtime_predictor_memo)
+        self.user = User.objects.create_user(username="predicted", email="predicted@example.com", password=None)
+
+    def finish_tasks(self, runtime_seconds: float, count: int = 5, **kwargs: t.Any) -> None:
+        finished = timezone.now() - datetime.timedelta(minutes=10)
+        for _ in range(count):
+            Task.objects.create(
+                user=self.user,
+                starttimestamp=finished - datetime.timedelta(seconds=runtime_seconds),
+                finishtimestamp=finished,
+                **{"ra": 1.0, "dec": 2.0} | kwargs,
+            )
+
+    def test_the_window_of_a_request_decides_its_prediction(self) -> None:
+        self.finish_tasks(60.0, mjd_min=60000.0, mjd_max=60030.0)
+        self.finish_tasks(600.0, mjd_min=None, mjd_max=60030.0)
+        assert prediction.refresh_runtime_predictor() == 10
+
+        month = Task.objects.create(user=self.user, ra=3.0, dec=4.0, mjd_min=60100.0, mjd_max=60130.0)
+        survey = Task.objects.create(user=self.user, ra=3.0, dec=4.0, mjd_min=None, mjd_max=60130.0)
+
+        assert prediction.predict_task_runtime(month) == 60.0
+        assert prediction.predict_task_runtime(survey) == 600.0
+
+    def test_tasks_that_reused_a_result_are_not_folded_in(self) -> None:
+        self.finish_tasks(60.0)
+        self.finish_tasks(0.0, count=10, reused_result=True)
+
+        assert prediction.refresh_runtime_predictor() == 5
+        assert prediction.predict_task_runtime(Task(id=0, user=self.user, ra=1.0, dec=2.0)) == 60.0
+
+    def test_a_bin_with_too_few_tasks_falls_back_to_the_coarser_ones(self) -> None:
+        self.finish_tasks(60.0, mjd_min=60000.0, mjd_max=60030.0)
+        self.finish_tasks(30.0, count=2, mjd_min=60000.0, mjd_max=60030.0, use_reduced=True)
+        prediction.refresh_runtime_predictor()
+
+        reduced = Task.objects.create(
+            user=self.user, ra=1.0, dec=2.0, mjd_min=60000.0, mjd_max=60030.0, use_reduced=True
+        )
+        byname = Task.objects.create(user=self.user, ra=None, dec=None, mpc_name="Ceres")
+
+        # the two reduced tasks are too few, so the request type and target kind answer, from all seven
+        assert prediction.predict_task_runtime(reduced) == 60.0
+        assert prediction.predict_task_runtime(byname) == 60.0
+        assert prediction.predict_task_runtime(Task(id=0, user=self.user, request_type="SSOSTACK")) is None
+
+    def test_a_refresh_reads_only_the_tasks_finished_since_the_last(self) -> None:
+        self.finish_tasks(60.0)
+        assert prediction.refresh_runtime_predictor() == 5
+        assert prediction.refresh_runtime_predictor() == 0
+
+        later = timezone.now()
+        Task.objects.create(user=self.user, ra=1.0, dec=2.0, starttimestamp=later, finishtimestamp=later)
+        assert prediction.refresh_runtime_predictor() == 1
+
+    def test_a_refresh_cut_short_carries_on_among_tasks_that_finished_together(self) -> None:
+        self.finish_tasks(60.0)
+
+        with mock.patch.object(prediction, "PREDICTOR_REFRESH_LIMIT", 3):
+            assert prediction.refresh_runtime_predictor() == 3
+            assert prediction.refresh_runtime_predictor() == 2
+            assert prediction.refresh_runtime_predictor() == 0
+
+        assert prediction.runtime_bin_samples()["FP"] == [60.0] * 5
+
+    def test_predictions_are_read_from_the_cache_without_a_query(self) -> None:
+        self.finish_tasks(60.0)
+        prediction.refresh_runtime_predictor()
+        prediction.clear_runtime_predictor_memo()
+        queued = Task.objects.create(user=self.user, ra=1.0, dec=2.0)
+
+        with CaptureQueriesContext(connection) as queries:
+            assert prediction.predict_runtimes([(queued.id, prediction.task_features(queued))]) == {queued.id: 60.0}
+
+        assert not queries.captured_queries
+
+    def test_the_predictions_reach_the_api_and_the_queue_positions(self) -> None:
+        self.finish_tasks(60.0)
+        prediction.refresh_runtime_predictor()
+        queued = Task.objects.create(user=self.user, ra=1.0, dec=2.0, queuepos_relative=0)
+        self.client.force_login(self.user)
+
+        detail = self.client.get(reverse("task-detail", args=[queued.id]), HTTP_ACCEPT="application/json").json()
+        positions = self.client.get(reverse("queuepositions")).json()
+
+        assert detail["expected_runtime_seconds"] == 60.0
+        assert positions["expectedruntimes"] == {str(queued.id): 60.0}
+
+
+class RuntimeSketchTests(TestCase):
+    """The hourly sketches of run and wait times, which the wait estimates and stats page read instead of the tasks."""
+
+    def setUp(self) -> None:
+        caches["usagestats"].clear()
+        taskqueue.clear_typical_runtime_memo()
+        self.addCleanup(taskqueue.clear_typical_runtime_memo)
+        self.user = User.objects.create_user(username="sketched", email="sketched@example.com", password=None)
+
+    def finish_task(self, runtime_seconds: float, waittime_seconds: float = 10.0, **kwargs: t.Any) -> None:
+        finished = timezone.now()
+        started = finished - datetime.timedelta(seconds=runtime_seconds)
+        task = Task.objects.create(
+            user=self.user, ra=1.0, dec=2.0, starttimestamp=started, finishtimestamp=finished, **kwargs
+        )
+        # timestamp is set on creation, so the wait is made by moving it back afterwards
+        task.timestamp = started - datetime.timedelta(seconds=waittime_seconds)
+        Task.objects.filter(pk=task.id).update(timestamp=task.timestamp)
+        sketches.record_finished_task(task)
+
+    def test_quantiles_stay_close_to_the_exact_ones_in_little_space(self) -> None:
+        rng = random.Random(1)  # noqa: S311 (synthetic run times, nothing secret)
+        values = [rng.lognormvariate(3.0, 1.0) for _ in range(20000)]
+        sketch = sketches.QuantileSketch()
+        for value in values:
+            sketch.add(value)
+
+        ordered = sorted(values)
+        assert sketch.count() == len(values)
+        assert sum(map(len, sketch.compactors)) < 3 * sketches.SKETCH_K
+        for fraction in (0.5, 0.9, 0.99):
+            estimate = sketch.quantile(fraction)
+            assert estimate is not None
+            rank = sum(value <= estimate for value in ordered) / len(ordered)
+            assert abs(rank - fraction) < 0.02
+
+    def test_merged_sketches_answer_for_all_their_values(self) -> None:
+        first, second = sketches.QuantileSketch(), sketches.QuantileSketch()
+        for value in range(1000):
+            first.add(float(value))
+            second.add(float(value + 1000))
+
+        first.merge(sketches.QuantileSketch.from_json(second.to_json()))
+
+        assert first.count() == 2000
+        median = first.quantile(0.5)
+        assert median is not None
+        assert abs(median - 1000.0) < 40.0
+        assert sketches.QuantileSketch().quantile(0.5) is None
+
+    def test_finishing_a_task_adds_it_to_the_hours_sketches(self) -> None:
+        for _ in range(3):
+            self.finish_task(60.0, waittime_seconds=30.0)
+        self.finish_task(120.0, waittime_seconds=30.0, request_type="IMGZIP", userqueuedtasks_on_submit=0)
+
+        runtimes = sketches.window_summaries("runtime", hours=1)
+        assert runtimes["FP"].count == 3
+        assert runtimes["FP"].mean() == 60.0
+        assert runtimes["IMGZIP"].quantile(0.5) == 120.0
+        assert sketches.window_summaries("waittime", hours=1)["FP"].quantile(0.5) == 30.0
+        assert set(sketches.window_summaries("waittime_first", hours=1)) == {"IMGZIP"}
+        # one row per metric, request type and hour, however many tasks
+        assert RuntimeSketch.objects.filter(metric="runtime", request_type="FP").count() == 1
+
+    def test_a_task_that_reused_a_result_adds_its_wait_but_no_run_time(self) -> None:
+        self.finish_task(60.0, waittime_seconds=30.0)
+        self.finish_task(0.0, waittime_seconds=50.0, reused_result=True)
+
+        assert sketches.window_summaries("runtime", hours=1)["FP"].count == 1
+        assert sketches.window_summaries("waittime", hours=1)["FP"].count == 2
+
+    def test_the_runner_records_each_task_it_marks_finished(self) -> None:
+        task = Task.objects.create(user=self.user, ra=1.0, dec=2.0)
+        taskrunner_main.mark_started(task)
+
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_RUNTIME_SKETCHES", new=False):
+            taskrunner_main.mark_finished(task=task, error_msg=None)
+        assert not RuntimeSketch.objects.exists()
+
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_RUNTIME_SKETCHES", new=True):
+            taskrunner_main.mark_finished(task=task, error_msg=None)
+        assert sketches.window_summaries("runtime", hours=1)["FP"].count == 1
+
+    @override_settings(TASKRUNNER_RUNTIME_SKETCHES=True)
+    def test_the_typical_runtimes_come_from_the_sketches(self) -> None:
+        for _ in range(taskqueue.TYPICAL_RUNTIME_MIN_SAMPLES):
+            self.finish_task(45.0)
+        # a finished task that never went through the runner is not in the sketches
+        Task.objects.create(
+            user=self.user, ra=1.0, dec=2.0, starttimestamp=timezone.now(), finishtimestamp=timezone.now()
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            assert taskqueue.typical_runtime_seconds() == {"FP": 45.0}
+
+        assert len(queries.captured_queries) == 1
+
+    @override_settings(TASKRUNNER_RUNTIME_SKETCHES=True)
+    def test_the_stats_page_shows_means_and_percentiles_from_the_sketches(self) -> None:
+        for runtime in (10.0, 20.0, 30.0):
+            self.finish_task(runtime, waittime_seconds=5.0)
+
+        content = self.client.get(reverse("statsshortterm")).content.decode()
+
+        assert "Average task running time: 20.0s" in content
+        assert "Task running time percentiles (50th / 90th / 99th): 20.0s / 30.0s / 30.0s" in content
+        assert "Queue waiting time percentiles (50th / 90th / 99th): 5.0s / 5.0s / 5.0s" in content
+
+    def test_an_empty_table_is_filled_from_the_recent_tasks_once(self) -> None:
+        finished = timezone.now() - datetime.timedelta(hours=2)
+        for _ in range(4):
+            Task.objects.create(
+                user=self.user,
+                ra=1.0,
+                dec=2.0,
+                starttimestamp=finished - datetime.timedelta(seconds=90),
+                finishtimestamp=finished,
+            )
+
+        assert sketches.backfill_runtime_sketches() == 4
+        assert sketches.backfill_runtime_sketches() == 0
+
+        summary = sketches.window_summaries("runtime", hours=24)["FP"]
+        assert summary.count == 4
+        assert summary.quantile(0.5) == 90.0
+
+    def test_the_maintenance_sweep_deletes_the_hours_no_window_reads(self) -> None:
+        self.finish_task(60.0)
+        thishour = sketches.hour_of(timezone.now())
+        for hoursago in (7 * 24, sketches.KEEP_HOURS + 1, 30 * 24):
+            RuntimeSketch.objects.create(
+                metric="runtime", request_type="FP", hour=thishour - datetime.timedelta(hours=hoursago)
+            )
+
+        with (
+            mock.patch.object(taskrunner_main, "remove_old_tasks"),
+            mock.patch.object(taskrunner_main, "log_general"),
+        ):
+            taskrunner_main.do_maintenance()
+
+        kept = RuntimeSketch.objects.filter(metric="runtime").values_list("hour", flat=True)
+        assert sorted(kept) == [thishour - datetime.timedelta(hours=7 * 24), thishour]
+
+
+class StartEstimateTests(TestCase):
+    """The simulation of the runner draining the queue, which estimates when each queued task will start."""
+
+    def setUp(self) -> None:
+        caches["usagestats"].clear()
+        taskqueue.clear_typical_runtime_memo()
+        prediction.clear_runtime_predictor_memo()
+        self.addCleanup(taskqueue.clear_typical_runtime_memo)
+        self.addCleanup(prediction.clear_runtime_predictor_memo)
+        estimatesdir = tempfile.TemporaryDirectory()
+        self.addCleanup(estimatesdir.cleanup)
+        patcher = mock.patch.object(runnerstatus, "START_ESTIMATES_PATH", Path(estimatesdir.name) / "estimates.json")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users = [
+            User.objects.create_user(username=f"eta{i}", email=f"eta{i}@example.com", password=None) for i in range(3)
+        ]
+
+    def test_each_user_has_one_task_running_at_a_time(self) -> None:
+        queued = [(1, 1, "FP"), (2, 1, "FP"), (3, 2, "FP"), (4, 1, "FP")]
+
+        starts = eta.simulate_starts(queued, runtimes=[10.0, 10.0, 50.0, 10.0], running=[], numslots=4)
+
+        assert starts == [0.0, 10.0, 0.0, 20.0]
+
+    def test_a_running_task_holds_its_slot_and_its_user_for_what_it_has_left(self) -> None:
+        queued = [(1, 1, "FP"), (2, 2, "FP"), (3, 3, "FP")]
+
+        starts = eta.simulate_starts(
+            queued, runtimes=[10.0, 10.0, 10.0], running=[(1, 30.0, "FP"), (4, 5.0, "FP")], numslots=3
+        )
+
+        # user 1 waits for their running task; user 2 takes the free slot, and user 3 the next one
+        assert starts == [30.0, 0.0, 5.0]
+
+    def test_the_short_lane_keeps_long_tasks_to_their_slots(self) -> None:
+        queued = [(1, 1, "IMGZIP"), (2, 2, "IMGZIP"), (3, 3, "FP")]
+
+        starts = eta.simulate_starts(
+            queued, runtimes=[100.0, 100.0, 10.0], running=[], numslots=3, short_types={"FP"}, long_slots=1
+        )
+
+        assert starts == [0.0, 100.0, 0.0]
+
+    def finish_tasks(self, runtime_seconds: float, count: int = 5) -> None:
+        finished = timezone.now() - datetime.timedelta(minutes=10)
+        for _ in range(count):
+            Task.objects.create(
+                user=self.users[0],
+                ra=1.0,
+                dec=2.0,
+                starttimestamp=finished - datetime.timedelta(seconds=runtime_seconds),
+                finishtimestamp=finished,
+            )
+
+    def test_nothing_is_estimated_before_any_task_has_finished(self) -> None:
+        Task.objects.create(user=self.users[0], ra=1.0, dec=2.0, queuepos_relative=0)
+
+        assert eta.estimate_start_times(running_taskids=[], numslots=2) is None
+
+    def test_the_estimates_reach_the_queue_positions_and_the_status(self) -> None:
+        self.finish_tasks(60.0)
+        prediction.refresh_runtime_predictor()
+        running = Task.objects.create(
+            user=self.users[0], ra=1.0, dec=2.0, queuepos_relative=0, starttimestamp=timezone.now()
+        )
+        first = Task.objects.create(user=self.users[0], ra=1.0, dec=2.0, queuepos_relative=1)
+        other = Task.objects.create(user=self.users[1], ra=1.0, dec=2.0, queuepos_relative=2)
+        second = Task.objects.create(user=self.users[0], ra=1.0, dec=2.0, queuepos_relative=3)
+
+        drain = taskrunner_main.publish_start_estimates(running_taskids=[running.id], numslots=2, order=None)
+
+        # the running task has its minute left, and holds up only its own user's tasks
+        self.client.force_login(self.users[0])
+        estimates = self.client.get(reverse("queuepositions")).json()["startestimates"]
+        assert set(estimates) == {str(first.id), str(second.id)}
+        assert 59.0 <= estimates[str(first.id)][0] <= 60.0
+        assert 119.0 <= estimates[str(second.id)][1] <= 120.0
+        assert drain is not None
+        assert 119.0 <= drain[0] <= 120.0
+
+        with (
+            tempfile.TemporaryDirectory() as tmpdir,
+            mock.patch.object(runnerstatus, "STATUS_PATH", Path(tmpdir, "s.json")),
+        ):
+            taskrunner_main.write_status(procs_taskids={}, numslots=2, queue_drain_seconds=drain)
+            assert self.client.get(reverse("taskrunnerstatus")).json()["queue_drain_seconds"] == list(drain)
+
+        self.client.force_login(self.users[1])
+        assert self.client.get(reverse("queuepositions")).json()["startestimates"] == {str(other.id): [0.0, 0.0]}
+
+    def test_with_claims_every_runners_slots_take_the_queue(self) -> None:
+        self.finish_tasks(60.0)
+        prediction.refresh_runtime_predictor()
+        for runnerid, user in (("here:1", self.users[0]), ("there:2", self.users[1])):
+            running = Task.objects.create(
+                user=user, ra=1.0, dec=2.0, queuepos_relative=0, starttimestamp=timezone.now()
+            )
+            TaskClaim.objects.create(task=running, user=user, runner=runnerid, slotid=0, lease_expires=timezone.now())
+        queued = Task.objects.create(user=self.users[2], ra=1.0, dec=2.0, queuepos_relative=1)
+
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_CLAIMS", True):
+            taskrunner_main.publish_start_estimates(running_taskids=[], numslots=2, order=None, runnerid="here:1")
+
+        # both runners' tasks are running, on four slots between them, and two are free
+        published = runnerstatus.read_start_estimates()
+        assert published is not None
+        assert published.remaining(queued.id) == [0.0, 0.0]
+
+    def test_the_estimates_are_made_off_the_dispatch_loop(self) -> None:
+        release = threading.Event()
+
+        def fake_publish(*_args: t.Any) -> tuple[float, float]:
+            release.wait(timeout=30)
+            return (30.0, 60.0)
+
+        estimator = taskrunner_main.StartEstimator()
+        with mock.patch.object(taskrunner_main, "publish_start_estimates", side_effect=fake_publish):
+            assert estimator.start(running_taskids=[], numslots=2, order=None, runnerid="") is True
+            self.addCleanup(release.set)
+            # the loop carries on, with the last estimate's drain until the new one is done
+            assert estimator.drain_seconds() is None
+            assert estimator.start(running_taskids=[], numslots=2, order=None, runnerid="") is False
+
+            release.set()
+            assert estimator.thread is not None
+            estimator.thread.join(timeout=30)
+
+        assert estimator.drain_seconds() == (30.0, 60.0)
+
+    def test_estimates_too_old_to_trust_are_not_served(self) -> None:
+        queued = Task.objects.create(user=self.users[0], ra=1.0, dec=2.0, queuepos_relative=0)
+        written = timezone.now() - datetime.timedelta(seconds=runnerstatus.START_ESTIMATES_STALE_SECONDS + 1)
+        runnerstatus.write_start_estimates(written, {queued.id: (30.0, 60.0)})
+        self.client.force_login(self.users[0])
+
+        assert self.client.get(reverse("queuepositions")).json()["startestimates"] == {}
+
+
 class TaskTimingSerializerTests(TestCase):
     """waittime and runtime, which the model has always computed and nothing ever showed."""
 
@@ -3140,26 +4046,729 @@ class RunRsyncTests(TestCase):
         assert any("exited with code 12" in line for line in logged), logged
 
 
-class RemoveOldTasksTests(TestCase):
-    """The hourly maintenance sweep, which now writes once per batch rather than once per task."""
+class TarRetrievalTests(SimpleTestCase):
+    """Bringing a task's result files back as one tar stream (settings.TASKRUNNER_TAR_RETRIEVAL).
+
+    The "remote host" is a local directory, with sh -c standing in for ssh, so the remote command
+    that is sent really runs and the archive that comes back is a real one.
+    """
 
     def setUp(self) -> None:
-        self.user = User.objects.create_user(username="sweeper", email="sw@example.com", password=None)
+        remotedir = tempfile.TemporaryDirectory()
+        localdir = tempfile.TemporaryDirectory()
+        self.addCleanup(remotedir.cleanup)
+        self.addCleanup(localdir.cleanup)
+        self.remotedir = Path(remotedir.name)
+        self.localdir = Path(localdir.name)
+        for patcher in (
+            mock.patch.object(sshmux, "ssh_argv", return_value=["sh", "-c"]),
+            mock.patch.object(taskrunner_main.settings, "RESULTS_DIR", self.localdir),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_files_are_moved_and_missing_ones_skipped(self) -> None:
+        (self.remotedir / "job00001.txt").write_text(RESULTFILE_HEADER + "\n")
+        (self.remotedir / "job00001.jpg").write_bytes(b"\xff\xd8 not really a jpeg")
+        remotefiles = [self.remotedir / name for name in ("job00001.txt", "job00001.jpg", "job00001.fits")]
+
+        assert taskrunner_main.retrieve_results_tar(remotefiles, lambda _msg: None)
+
+        assert (self.localdir / "job00001.txt").read_text() == RESULTFILE_HEADER + "\n"
+        assert (self.localdir / "job00001.jpg").read_bytes() == b"\xff\xd8 not really a jpeg"
+        assert not (self.localdir / "job00001.fits").exists()
+        # deleted remotely only now that they are safely here, and no scratch directory left behind
+        assert not list(self.remotedir.iterdir())
+        assert sorted(path.name for path in self.localdir.iterdir()) == ["job00001.jpg", "job00001.txt"]
+
+    def test_nothing_to_retrieve_is_not_a_failure(self) -> None:
+        assert taskrunner_main.retrieve_results_tar([self.remotedir / "job00001.txt"], lambda _msg: None)
+        assert not list(self.localdir.iterdir())
+
+    def test_a_broken_stream_leaves_the_remote_files_and_no_local_ones(self) -> None:
+        # what a dropped connection looks like: some bytes, then a failed exit
+        (self.remotedir / "job00001.txt").write_text("data")
+        logged: list[str] = []
 
-    def make_old_task(self, days: int, **kwargs: t.Any) -> Task:
-        return Task.objects.create(
-            user=self.user,
-            ra=1.0,
-            dec=2.0,
-            finishtimestamp=timezone.now() - datetime.timedelta(days=days),
-            **kwargs,
-        )
+        with mock.patch.object(sshmux, "ssh_argv", return_value=["sh", "-c", "printf junk; exit 255", "sh"]):
+            assert not taskrunner_main.retrieve_results_tar([self.remotedir / "job00001.txt"], logged.append)
 
-    def test_old_tasks_are_archived_and_recent_ones_are_left_alone(self) -> None:
-        old = self.make_old_task(days=200)
-        recent = self.make_old_task(days=1)
+        assert (self.remotedir / "job00001.txt").exists()
+        assert not list(self.localdir.iterdir())
+        assert any("ERROR" in line for line in logged), logged
 
-        taskrunner_main.remove_old_tasks(days_ago=183, request_type="FP", logfunc=lambda _msg: None)
+    def test_a_remote_that_writes_a_lot_to_stderr_does_not_stall(self) -> None:
+        # far more than a pipe buffer holds, written before any of the archive
+        (self.remotedir / "job00001.txt").write_text("data")
+        noisy = "head -c 1000000 /dev/zero | tr '\\0' x >&2; " + 'eval "$1"'
+        logged: list[str] = []
+
+        with (
+            mock.patch.object(sshmux, "ssh_argv", return_value=["sh", "-c", noisy, "sh"]),
+            mock.patch.object(taskrunner_main, "TASK_MAXTIME_SECONDS", 10),
+        ):
+            assert taskrunner_main.retrieve_results_tar([self.remotedir / "job00001.txt"], logged.append)
+
+        assert (self.localdir / "job00001.txt").read_text() == "data"
+        assert any(line.startswith("STDERR: xxx") for line in logged)
+
+    def test_a_file_that_cannot_be_moved_into_place_is_a_failure(self) -> None:
+        (self.remotedir / "job00001.txt").write_text("data")
+        logged: list[str] = []
+
+        with mock.patch.object(Path, "replace", side_effect=OSError("disk full")):
+            assert not taskrunner_main.retrieve_results_tar([self.remotedir / "job00001.txt"], logged.append)
+
+        # left for the rsync fallback, and nothing half-moved locally
+        assert (self.remotedir / "job00001.txt").exists()
+        assert not list(self.localdir.iterdir())
+        assert any("could not move" in line for line in logged), logged
+
+    def test_unexpected_members_are_refused(self) -> None:
+        # a member that was not asked for (or a path escaping the directory) aborts the whole unpack
+        (self.remotedir / "job00001.txt").write_text("data")
+        (self.remotedir / "other.txt").write_text("data")
+        tarcommand = f"cd {shlex.quote(str(self.remotedir))} && tar -cf - job00001.txt other.txt"
+
+        with mock.patch.object(sshmux, "ssh_argv", return_value=["sh", "-c", tarcommand, "sh"]):
+            assert not taskrunner_main.retrieve_results_tar([self.remotedir / "job00001.txt"], lambda _msg: None)
+
+        assert (self.remotedir / "job00001.txt").exists()
+        assert not list(self.localdir.iterdir())
+
+
+class FpBatchTests(TestCase):
+    """Running a user's compatible forced photometry tasks in one remote session (TASKRUNNER_FP_BATCH)."""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="batcher", email="b@example.com", password=None)
+        resultsdir = tempfile.TemporaryDirectory()
+        self.addCleanup(resultsdir.cleanup)
+        self.resultsdir = Path(resultsdir.name)
+        for patcher in (
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_FP_BATCH", True),
+            mock.patch.object(taskrunner_main.settings, "RESULTS_DIR", self.resultsdir),
+            mock.patch.object(taskrunner_main, "log_general"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_task(self, **kwargs: t.Any) -> Task:
+        # a fixed window: the default is thirty days before now, to five decimals, so two tasks made
+        # across a tick of that would not be companions
+        fields: dict[str, t.Any] = {
+            "user": self.user,
+            "ra": 1.0,
+            "dec": 2.0,
+            "mjd_min": 60000.0,
+            "send_email": False,
+        } | kwargs
+        return Task.objects.create(**fields)
+
+    def test_companions_are_the_same_users_compatible_tasks(self) -> None:
+        task = self.make_task()
+        companion = self.make_task(ra=3.0)
+        self.make_task(use_reduced=True)
+        self.make_task(mjd_min=60100.0)
+        self.make_task(ra=None, dec=None, mpc_name="Makemake")
+        self.make_task(user=User.objects.create_user(username="other", email="o@example.com", password=None))
+        self.make_task(finishtimestamp=timezone.now())
+
+        assert taskrunner_main.find_batch_companions(task) == [companion]
+
+    def test_a_batch_is_bounded_and_the_setting_turns_it_off(self) -> None:
+        task = self.make_task()
+        for _ in range(taskrunner_main.FP_BATCH_MAX_TASKS + 5):
+            self.make_task()
+
+        assert len(taskrunner_main.find_batch_companions(task)) == taskrunner_main.FP_BATCH_MAX_TASKS - 1
+        assert len(taskrunner_main.find_batch_companions(task, limit=3)) == 2
+        assert taskrunner_main.find_batch_companions(task, limit=1) == []
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_FP_BATCH", False):
+            assert taskrunner_main.find_batch_companions(task) == []
+
+    def test_a_batch_is_held_to_the_users_turn_share_while_others_wait(self) -> None:
+        task = self.make_task()
+        self.make_task(ra=3.0)
+        maxtasks = taskrunner_main.FP_BATCH_MAX_TASKS
+
+        # nobody else waiting: as long as it may be, but only while slots are going spare
+        assert taskrunner_main.batch_size_limit(task, freeslots=3, numslots=16) == maxtasks
+        assert taskrunner_main.batch_size_limit(task, freeslots=0, numslots=4) == 4
+
+        # two users waiting alongside this one share the slots three ways
+        for username in ("other1", "other2"):
+            self.make_task(user=User.objects.create_user(username=username, email=f"{username}@example.com"))
+        assert taskrunner_main.batch_size_limit(task, freeslots=3, numslots=6) == 2
+        assert taskrunner_main.batch_size_limit(task, freeslots=3, numslots=2) == 1
+
+        minorplanet = self.make_task(ra=None, dec=None, mpc_name="Ceres")
+        assert taskrunner_main.batch_size_limit(minorplanet, freeslots=3, numslots=16) == 1
+
+    def test_the_batch_command_runs_each_task_between_markers(self) -> None:
+        tasks = [self.make_task(), self.make_task(ra=3.0)]
+
+        command = taskrunner_main.build_fp_batch_command(tasks, Path("~/atlasserver/results"))
+
+        for task in tasks:
+            assert f"{taskrunner_main.BATCH_MARKER} start {task.id} " in command
+            assert f"{taskrunner_main.BATCH_MARKER} end {task.id} " in command
+            assert f"tee ~/atlasserver/results/job{task.id:05d}.txt" in command
+        assert command.count("/atlas/bin/force.sh") == 2
+
+    def test_runtimes_are_read_from_the_markers(self) -> None:
+        marker = taskrunner_main.BATCH_MARKER
+        stdout = f"{marker} start 1 100\n  60000.1 17.0\n{marker} end 1 130\n{marker} start 2 130\n"
+
+        assert taskrunner_main.parse_batch_runtimes(stdout) == {1: 30.0}
+
+    def test_each_task_of_a_batch_is_finished_with_its_own_result_and_run_time(self) -> None:
+        task = self.make_task()
+        companion = self.make_task(ra=3.0)
+        marker = taskrunner_main.BATCH_MARKER
+        stdout = (
+            f"{marker} start {task.id} 1000\n{marker} end {task.id} 1040\n"
+            f"{marker} start {companion.id} 1040\n{marker} end {companion.id} 1050\n"
+        )
+
+        def retrieve(remotefiles: list[Path], *_args: t.Any, **_kwargs: t.Any) -> None:
+            # the first task has data, the second only the header row
+            (self.resultsdir / f"job{task.id:05d}.txt").write_text(RESULTFILE_HEADER + "\n60000.0 " + "1 " * 18 + "\n")
+            (self.resultsdir / f"job{companion.id:05d}.txt").write_text(RESULTFILE_HEADER + "\n")
+            assert len(remotefiles) == 4
+
+        def run_remote(*_args: t.Any, on_line: t.Callable[[str], None], **_kwargs: t.Any) -> str:
+            for line in stdout.splitlines():
+                on_line(line)
+            return stdout
+
+        with (
+            mock.patch.object(taskrunner_main, "run_remote_command", side_effect=run_remote) as remote,
+            mock.patch.object(taskrunner_main, "retrieve_results", side_effect=retrieve),
+        ):
+            taskrunner_main.do_task(task=Task.objects.select_related("user").get(id=task.id), slotid=0)
+
+        remote.assert_called_once()  # one session for both
+        task.refresh_from_db()
+        companion.refresh_from_db()
+        assert task.finishtimestamp is not None
+        assert task.error_msg is None
+        assert companion.error_msg == "No data returned"
+        for batchtask, expected in ((task, 40), (companion, 10)):
+            assert batchtask.attempt_count == 1
+            runtime = batchtask.runtime()
+            assert runtime is not None
+            assert abs(runtime - expected) <= 1, runtime
+
+    def test_a_killed_session_leaves_every_task_to_be_retried(self) -> None:
+        task = self.make_task()
+        companion = self.make_task(ra=3.0)
+
+        with (
+            mock.patch.object(taskrunner_main, "run_remote_command", return_value=None),
+            mock.patch.object(taskrunner_main.time, "sleep"),
+        ):
+            taskrunner_main.do_task(task=Task.objects.select_related("user").get(id=task.id), slotid=0)
+
+        assert Task.queued().filter(id__in=[task.id, companion.id]).count() == 2
+
+    def test_a_companion_is_started_only_when_its_own_run_begins(self) -> None:
+        task = self.make_task()
+        companion = self.make_task(ra=3.0)
+        startedcompanion: list[Task] = []
+
+        def run_remote(*_args: t.Any, on_line: t.Callable[[str], None], **_kwargs: t.Any) -> None:
+            on_line(f"{taskrunner_main.BATCH_MARKER} start {task.id} 1000")
+            startedcompanion.append(Task.objects.get(id=companion.id))
+            # the session is lost before the companion's turn
+
+        with (
+            mock.patch.object(taskrunner_main, "run_remote_command", side_effect=run_remote),
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_BACKOFF", True),
+        ):
+            taskrunner_main.do_task(task=Task.objects.select_related("user").get(id=task.id), slotid=0)
+
+        assert startedcompanion[0].starttimestamp is None
+        task.refresh_from_db()
+        companion.refresh_from_db()
+        assert task.attempt_count == 1
+        assert task.next_attempt_after is not None
+        # never attempted, so neither counted nor held back
+        assert companion.attempt_count == 0
+        assert companion.starttimestamp is None
+        assert companion.next_attempt_after is None
+
+
+class DeduplicationTests(TestCase):
+    """Identical forced photometry requests sharing one remote run (TASKRUNNER_DEDUPLICATE)."""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="dedup", email="d@example.com", password=None)
+        self.otheruser = User.objects.create_user(username="dedup2", email="d2@example.com", password=None)
+        resultsdir = tempfile.TemporaryDirectory()
+        self.addCleanup(resultsdir.cleanup)
+        self.resultsdir = Path(resultsdir.name)
+        for patcher in (
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_DEDUPLICATE", True),
+            mock.patch.object(taskrunner_main.settings, "RESULTS_DIR", self.resultsdir),
+            mock.patch.object(taskrunner_main, "log_general"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_task(self, **kwargs: t.Any) -> Task:
+        fields: dict[str, t.Any] = {
+            "user": self.user,
+            "ra": 150.1,
+            "dec": -20.2,
+            "mjd_min": 60000.0,
+            "send_email": False,
+        } | kwargs
+        return Task.objects.create(**fields)
+
+    def test_the_fingerprint_follows_what_the_remote_command_would_be(self) -> None:
+        task = self.make_task()
+        fingerprint = task.request_fingerprint()
+
+        assert fingerprint is not None
+        # another user, float noise, and a zero that build_fp_command would leave out all match
+        assert self.make_task(user=self.otheruser).request_fingerprint() == fingerprint
+        assert self.make_task(ra=150.1 + 1e-12).request_fingerprint() == fingerprint
+        assert self.make_task(propermotion_ra=0.0).request_fingerprint() == fingerprint
+
+        for different in ({"ra": 150.2}, {"use_reduced": True}, {"mjd_max": 60100.0}, {"mjd_min": None}):
+            assert self.make_task(**different).request_fingerprint() != fingerprint, different
+
+        with override_settings(TEST_USERS=[self.user.id]):
+            assert task.request_fingerprint() != fingerprint  # tdo=1 is added to their command
+
+        assert (
+            self.make_task(request_type="SSOSTACK", ra=None, dec=None, mpc_name="Ceres").request_fingerprint() is None
+        )
+
+    def test_a_finished_task_finishes_its_waiting_duplicates(self) -> None:
+        task = self.make_task()
+        duplicate = self.make_task(user=self.otheruser, callback_url="https://example.com/hook")
+        started = self.make_task()
+        Task.objects.filter(pk=started.id).update(starttimestamp=timezone.now())
+        unrelated = self.make_task(ra=10.0)
+        resultfile = self.resultsdir / f"job{task.id:05d}.txt"
+        resultfile.write_text(RESULTFILE_HEADER + "\n")
+        (self.resultsdir / f"job{task.id:05d}.jpg").write_bytes(b"jpeg")
+
+        with mock.patch.object(taskrunner_main, "send_task_callback") as callback:
+            taskrunner_main.finish_attempt(task, resultfile, None, None, 1.0, 0, mock.Mock(), mock.Mock())
+
+        duplicate.refresh_from_db()
+        assert duplicate.finishtimestamp is not None
+        assert duplicate.error_msg is None
+        assert duplicate.reused_result
+        assert not Task.objects.get(id=task.id).reused_result
+        linked = self.resultsdir / f"job{duplicate.id:05d}.txt"
+        assert linked.read_text() == RESULTFILE_HEADER + "\n"
+        assert linked.stat().st_ino == resultfile.stat().st_ino
+        assert (self.resultsdir / f"job{duplicate.id:05d}.jpg").exists()
+        # the duplicate's own callback, reporting the duplicate
+        assert [call.kwargs["task"].id for call in callback.call_args_list] == [duplicate.id]
+
+        assert Task.queued().filter(id__in=[started.id, unrelated.id]).count() == 2
+
+    def test_dispatch_skips_duplicates_of_running_tasks(self) -> None:
+        running = self.make_task()
+        self.make_task(user=self.otheruser)
+        later = self.make_task(user=self.otheruser, ra=10.0)
+        fingerprint = running.request_fingerprint()
+        assert fingerprint is not None
+
+        candidates = Task.queued().exclude(user_id=self.user.id).order_by("id")
+
+        assert taskrunner_main.next_dispatchable_task(candidates, running_fingerprints={fingerprint}) == later
+        assert taskrunner_main.next_dispatchable_task(candidates, running_fingerprints=set()) == candidates.first()
+
+
+class ResultCacheTests(TestCase):
+    """Answering a request from an earlier task's result at the same position (TASKRUNNER_RESULT_CACHE_HOURS)."""
+
+    ROWS: t.ClassVar = [
+        "60000.100 17.0 0.1 100 5 o 0 1.0 150.1 -20.2 0 0 0 0 0 0 19 0 01a60000o0001o",
+        "60010.200 17.1 0.1 100 5 o 0 1.0 150.1 -20.2 0 0 0 0 0 0 19 0 01a60010o0002o",
+        "60020.300 17.2 0.1 100 5 c 0 1.0 150.1 -20.2 0 0 0 0 0 0 19 0 01a60020o0003c",
+    ]
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="cacher", email="c@example.com", password=None)
+        resultsdir = tempfile.TemporaryDirectory()
+        self.addCleanup(resultsdir.cleanup)
+        self.resultsdir = Path(resultsdir.name)
+        for patcher in (
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_RESULT_CACHE_HOURS", 24),
+            mock.patch.object(taskrunner_main.settings, "RESULTS_DIR", self.resultsdir),
+            mock.patch.object(taskrunner_main, "log_general"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_task(self, **kwargs: t.Any) -> Task:
+        fields: dict[str, t.Any] = {
+            "user": self.user,
+            "ra": 150.1,
+            "dec": -20.2,
+            "mjd_min": 59990.0,
+            "mjd_max": 60030.0,
+            "send_email": False,
+        } | kwargs
+        return Task.objects.create(**fields)
+
+    def cache_result(self, **kwargs: t.Any) -> Task:
+        """Return a finished task whose result holds ROWS, recorded in the cache."""
+        task = self.make_task(**kwargs)
+        Path(self.resultsdir / f"job{task.id:05d}.txt").write_text(
+            RESULTFILE_HEADER + "\n" + "\n".join(self.ROWS) + "\n"
+        )
+        Task.objects.filter(pk=task.id).update(starttimestamp=timezone.now(), finishtimestamp=timezone.now())
+        task.refresh_from_db()
+        resultcache.record_result(task)
+        return task
+
+    def test_a_narrower_window_is_answered_with_the_rows_inside_it(self) -> None:
+        cached = self.cache_result()
+        task = self.make_task(ra=150.1 + 0.01 / 3600, mjd_min=60005.0, mjd_max=60015.0)
+
+        resultfile = resultcache.answer_from_cache(task, lambda _msg: None)
+
+        assert resultfile == self.resultsdir / f"job{task.id:05d}.txt"
+        assert resultfile.read_text() == RESULTFILE_HEADER + "\n" + self.ROWS[1] + "\n"
+        assert resultcache.find_entry(task) == cached.resultcacheentry
+
+    def test_requests_the_cached_result_does_not_cover_are_not_answered(self) -> None:
+        self.cache_result()
+
+        for uncovered in (
+            {"mjd_min": 59980.0},  # starts earlier
+            {"mjd_min": None},  # the whole history
+            {"mjd_max": 60040.0},  # ends later
+            {"use_reduced": True},
+            {"ra": 150.1 + 1 / 3600},  # an arcsecond away
+            {"propermotion_ra": 5.0},
+        ):
+            assert resultcache.find_entry(self.make_task(**uncovered)) is None, uncovered
+
+    def test_entries_older_than_the_window_or_archived_are_not_used(self) -> None:
+        cached = self.cache_result()
+        ResultCacheEntry.objects.filter(task=cached).update(created=timezone.now() - datetime.timedelta(hours=25))
+        assert resultcache.find_entry(self.make_task()) is None
+
+        cached = self.cache_result()
+        Task.objects.filter(pk=cached.id).update(is_archived=True)
+        assert resultcache.find_entry(self.make_task()) is None
+
+    def test_an_open_ended_request_needs_an_open_ended_result(self) -> None:
+        # a result bounded at 60030 cannot answer "everything up to now"
+        self.cache_result()
+        assert resultcache.find_entry(self.make_task(mjd_max=None)) is None
+
+        self.cache_result(mjd_max=None)
+        assert resultcache.find_entry(self.make_task(mjd_max=None)) is not None
+
+    def test_matches_are_found_across_a_cell_boundary(self) -> None:
+        ra = 10 * resultcache.SKY_CELL_DEGREES  # the edge of a cell
+        self.cache_result(ra=ra - 0.01 / 3600)
+        task = self.make_task(ra=ra + 0.01 / 3600)
+
+        assert resultcache.sky_cell(ra - 0.01 / 3600, -20.2) != resultcache.sky_cell(ra + 0.01 / 3600, -20.2)
+        assert resultcache.find_entry(task) is not None
+
+    def test_do_task_answers_from_the_cache_without_going_remote(self) -> None:
+        self.cache_result()
+        task = self.make_task(mjd_min=60015.0)
+
+        with mock.patch.object(taskrunner_main, "run_remote_command") as remote:
+            taskrunner_main.do_task(task=Task.objects.select_related("user").get(id=task.id), slotid=0)
+
+        remote.assert_not_called()
+        task.refresh_from_db()
+        assert task.finishtimestamp is not None
+        assert task.error_msg is None
+        # not cached in turn: it is only as fresh as the result it was sliced from
+        assert not ResultCacheEntry.objects.filter(task=task).exists()
+        # nor is its moment of slicing a run time
+        assert task.reused_result
+
+    def test_with_the_cache_off_nothing_is_recorded(self) -> None:
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_RESULT_CACHE_HOURS", 0):
+            self.cache_result()
+        assert not ResultCacheEntry.objects.exists()
+
+
+class IncrementalTests(TestCase):
+    """Extending an earlier open-ended result with only the newer observations (TASKRUNNER_INCREMENTAL)."""
+
+    ROWS: t.ClassVar = ResultCacheTests.ROWS
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="monitor", email="m@example.com", password=None)
+        resultsdir = tempfile.TemporaryDirectory()
+        self.addCleanup(resultsdir.cleanup)
+        self.resultsdir = Path(resultsdir.name)
+        for patcher in (
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_INCREMENTAL", True),
+            mock.patch.object(taskrunner_main.settings, "RESULTS_DIR", self.resultsdir),
+            mock.patch.object(taskrunner_main, "log_general"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_task(self, **kwargs: t.Any) -> Task:
+        fields: dict[str, t.Any] = {
+            "user": self.user,
+            "ra": 150.1,
+            "dec": -20.2,
+            "mjd_min": None,
+            "mjd_max": None,
+            "send_email": False,
+        } | kwargs
+        return Task.objects.create(**fields)
+
+    def finished_task(self, rows: list[str], **kwargs: t.Any) -> Task:
+        task = self.make_task(**kwargs)
+        Path(self.resultsdir / f"job{task.id:05d}.txt").write_text(RESULTFILE_HEADER + "\n" + "\n".join(rows) + "\n")
+        Task.objects.filter(pk=task.id).update(starttimestamp=timezone.now(), finishtimestamp=timezone.now())
+        task.refresh_from_db()
+        return task
+
+    def test_an_earlier_open_ended_result_is_extended_from_its_last_row(self) -> None:
+        prior = self.finished_task(self.ROWS)
+
+        assert resultcache.find_incremental_base(self.make_task()) == (
+            self.resultsdir / f"job{prior.id:05d}.txt",
+            60020.3,
+        )
+        # a later start is fine: the earlier rows outside the window are dropped in the merge
+        assert resultcache.find_incremental_base(self.make_task(mjd_min=60005.0)) is not None
+
+    def test_results_that_are_not_the_same_light_curve_are_not_extended(self) -> None:
+        self.finished_task(self.ROWS, mjd_max=60030.0)  # bounded, so it may be missing rows before 60020
+        self.finished_task(self.ROWS, mjd_min=60005.0)  # starts later than the new task
+        self.finished_task(self.ROWS, use_reduced=True)
+        self.finished_task(self.ROWS, ra=150.2)
+        old = self.finished_task(self.ROWS)
+        Task.objects.filter(pk=old.id).update(
+            finishtimestamp=timezone.now() - datetime.timedelta(days=resultcache.INCREMENTAL_MAX_AGE_DAYS + 1)
+        )
+
+        assert resultcache.find_incremental_base(self.make_task()) is None
+
+    def test_nothing_is_extended_when_the_window_has_nothing_new_or_the_flag_is_off(self) -> None:
+        self.finished_task(self.ROWS)
+
+        assert resultcache.find_incremental_base(self.make_task(mjd_max=60015.0)) is None
+        assert resultcache.find_incremental_base(self.make_task(mjd_min=60025.0)) is None
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_INCREMENTAL", False):
+            assert resultcache.find_incremental_base(self.make_task()) is None
+
+    def test_the_merge_keeps_one_row_per_observation_in_mjd_order(self) -> None:
+        base = self.resultsdir / "base.txt"
+        base.write_text(RESULTFILE_HEADER + "\n" + "\n".join(self.ROWS) + "\n")
+        newfile = self.resultsdir / "new.txt"
+        remeasured = self.ROWS[2].replace(" 17.2 ", " 17.3 ")
+        later = "60030.400 17.4 0.1 100 5 o 0 1.0 150.1 -20.2 0 0 0 0 0 0 19 0 01a60030o0004o"
+        newfile.write_text(RESULTFILE_HEADER + "\n" + later + "\n" + remeasured + "\n")
+
+        rowcount = resultcache.merge_incremental_result(base, newfile, None, None, lambda _msg: None)
+
+        assert rowcount == 4
+        assert newfile.read_text() == RESULTFILE_HEADER + "\n" + "\n".join([*self.ROWS[:2], remeasured, later]) + "\n"
+
+    def test_the_merge_applies_the_window_and_falls_back_to_the_earlier_header(self) -> None:
+        base = self.resultsdir / "base.txt"
+        base.write_text(RESULTFILE_HEADER + "\n" + "\n".join(self.ROWS) + "\n")
+        newfile = self.resultsdir / "new.txt"
+        newfile.write_text("")  # sc01 had nothing newer
+
+        resultcache.merge_incremental_result(base, newfile, 60005.0, None, lambda _msg: None)
+
+        assert newfile.read_text() == RESULTFILE_HEADER + "\n" + "\n".join(self.ROWS[1:]) + "\n"
+
+    def test_the_command_starts_at_the_given_mjd(self) -> None:
+        task = self.make_task(mjd_min=59000.0)
+        remoteresultfile = Path("/tmp/result.txt")
+
+        assert " m0=59000.0" in taskrunner_main.build_fp_command(task, remoteresultfile=remoteresultfile)
+        command = taskrunner_main.build_fp_command(task, remoteresultfile=remoteresultfile, m0=60020.3)
+        assert " m0=60020.3" in command
+        assert "59000" not in command
+
+
+class WakeupTests(TestCase):
+    """The web app nudging the runner over a unix socket instead of waiting for its next poll (TASKRUNNER_WAKEUP)."""
+
+    def setUp(self) -> None:
+        socketdir = tempfile.TemporaryDirectory()
+        self.addCleanup(socketdir.cleanup)
+        self.path = Path(socketdir.name, "wakeup.sock")
+        for patcher in (
+            mock.patch.object(wakeup.settings, "TASKRUNNER_WAKEUP", True),
+            mock.patch.object(wakeup.runnerstatus, "WAKEUP_SOCKET_PATH", self.path),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def listen(self) -> wakeup.WakeupListener:
+        listener = wakeup.WakeupListener()
+        self.addCleanup(listener.close)
+        return listener
+
+    def test_any_number_of_nudges_are_read_as_one(self) -> None:
+        listener = self.listen()
+        for _ in range(3):
+            wakeup.notify_runner()
+
+        assert listener.wait([], timeout=1.0) is True
+        assert listener.wait([], timeout=0.0) is False
+
+    def test_a_slot_coming_free_ends_the_wait_without_a_nudge(self) -> None:
+        listener = self.listen()
+        reader, writer = socket.socketpair()
+        self.addCleanup(reader.close)
+        self.addCleanup(writer.close)
+        writer.send(b"done")
+
+        start = time.monotonic()
+        assert listener.wait([reader], timeout=5.0) is False
+        assert time.monotonic() - start < 1.0
+
+    def test_with_claims_every_runner_has_a_socket_and_is_nudged(self) -> None:
+        listeners = [wakeup.WakeupListener(runnerstatus.runner_path(self.path, f"host:{pid}")) for pid in (1, 2)]
+        for listener in listeners:
+            self.addCleanup(listener.close)
+        # one that went without closing its socket stops none of the others being nudged
+        deadlistener = wakeup.WakeupListener(runnerstatus.runner_path(self.path, "host:3"))
+        deadlistener.sock.close()
+
+        with mock.patch.object(wakeup.settings, "TASKRUNNER_CLAIMS", True):
+            wakeup.notify_runner()
+
+        assert [listener.wait([], timeout=1.0) for listener in listeners] == [True, True]
+
+    def test_a_stale_socket_is_replaced_and_removed_on_close(self) -> None:
+        self.path.write_text("")  # what a runner that was killed leaves behind
+        listener = wakeup.WakeupListener()
+        assert self.path.is_socket()
+
+        listener.close()
+        assert not self.path.exists()
+
+    def test_nudging_a_runner_that_is_not_listening_is_harmless(self) -> None:
+        wakeup.notify_runner()
+        self.listen().close()
+        wakeup.notify_runner()
+
+    def test_a_queue_change_nudges_the_runner_once_committed(self) -> None:
+        listener = self.listen()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            taskqueue.request_recalc()
+            assert listener.wait([], timeout=0.0) is False, "nudged before the task was visible"
+
+        assert listener.wait([], timeout=1.0) is True
+
+    def test_nothing_is_sent_with_the_setting_off(self) -> None:
+        listener = self.listen()
+
+        with mock.patch.object(wakeup.settings, "TASKRUNNER_WAKEUP", False):
+            wakeup.notify_runner()
+
+        assert listener.wait([], timeout=0.1) is False
+
+
+class CancelWatchTests(TestCase):
+    """The dispatcher finding cancelled running tasks for every slot at once (TASKRUNNER_CANCEL_WATCH)."""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="canceller", email="cx@example.com", password=None)
+        patcher = mock.patch.object(sshmux, "ssh_argv", return_value=["sh", "-c"])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_all_running_slots_are_checked_in_one_query(self) -> None:
+        tasks = [Task.objects.create(user=self.user, ra=1.0, dec=2.0) for _ in range(3)]
+        procs_taskids = {slotid: task.id for slotid, task in enumerate(tasks)}
+        tasks[1].delete()
+
+        with self.assertNumQueries(1):
+            assert taskrunner_main.watch_cancellations(procs_taskids) == [1]
+        with self.assertNumQueries(0):
+            assert taskrunner_main.watch_cancellations({}) == []
+
+    def test_a_signalled_command_is_killed_once_the_cancellation_is_confirmed(self) -> None:
+        event = threading.Event()
+        event.set()
+        is_cancelled = mock.Mock(return_value=True)
+
+        start = time.monotonic()
+        stdout = taskrunner_main.run_remote_command(
+            "sleep 30",
+            lambda _msg: None,
+            is_cancelled=is_cancelled,
+            cancel_event=event,  # type: ignore[arg-type]
+        )
+
+        assert stdout is None
+        assert time.monotonic() - start < 10
+        is_cancelled.assert_called_once_with()
+
+    def test_an_unsignalled_command_never_asks_the_database(self) -> None:
+        is_cancelled = mock.Mock(return_value=True)
+
+        stdout = taskrunner_main.run_remote_command(
+            "sleep 1.5; echo done",
+            lambda _msg: None,
+            is_cancelled=is_cancelled,
+            cancel_event=threading.Event(),  # type: ignore[arg-type]
+        )
+
+        assert stdout == "done\n"
+        is_cancelled.assert_not_called()
+
+    def test_a_pooled_worker_starts_each_task_with_its_signal_clear(self) -> None:
+        # set as the previous task finished, and meant for it
+        event = threading.Event()
+        event.set()
+        seen: list[bool] = []
+        conn = mock.Mock()
+        conn.recv.side_effect = [("task", 1, {}), None]
+        self.addCleanup(setattr, pool, "slot_cancel_event", None)
+
+        def run_task(_taskid: int, _slotid: int) -> None:
+            assert pool.slot_cancel_event is not None
+            seen.append(pool.slot_cancel_event.is_set())
+
+        pool.worker_loop(conn, slotid=0, run_task=run_task, cancel_event=event)  # type: ignore[arg-type]
+
+        assert seen == [False]
+        conn.send.assert_called_once_with(("done", 1, None))
+
+
+class RemoveOldTasksTests(TestCase):
+    """The hourly maintenance sweep, which now writes once per batch rather than once per task."""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="sweeper", email="sw@example.com", password=None)
+
+    def make_old_task(self, days: int, **kwargs: t.Any) -> Task:
+        return Task.objects.create(
+            user=self.user,
+            ra=1.0,
+            dec=2.0,
+            finishtimestamp=timezone.now() - datetime.timedelta(days=days),
+            **kwargs,
+        )
+
+    def test_old_tasks_are_archived_and_recent_ones_are_left_alone(self) -> None:
+        old = self.make_old_task(days=200)
+        recent = self.make_old_task(days=1)
+
+        taskrunner_main.remove_old_tasks(days_ago=183, request_type="FP", logfunc=lambda _msg: None)
 
         old.refresh_from_db()
         recent.refresh_from_db()
@@ -3246,6 +4855,168 @@ class RemoveOldTasksTests(TestCase):
         raise AssertionError(msg)
 
 
+class BackgroundMaintenanceTests(TestCase):
+    """The hourly sweep on a thread of its own, reporting its progress (TASKRUNNER_BACKGROUND_MAINTENANCE)."""
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="bgsweeper", email="bg@example.com", password=None)
+        patcher = mock.patch.object(taskrunner_main, "log_general")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_batch_reports_the_tasks_and_files_it_removed(self) -> None:
+        tasks = [
+            Task.objects.create(
+                user=self.user, ra=1.0, dec=2.0, finishtimestamp=timezone.now() - datetime.timedelta(days=200)
+            )
+            for _ in range(3)
+        ]
+        reports: list[tuple[int, int]] = []
+
+        with tempfile.TemporaryDirectory() as staticroot, override_settings(STATIC_ROOT=staticroot):
+            for task in tasks[:2]:
+                Path(staticroot, task.localresultfileprefix() + ".txt").parent.mkdir(parents=True, exist_ok=True)
+                Path(staticroot, task.localresultfileprefix() + ".txt").write_text("")
+            with mock.patch.object(taskrunner_main, "MAINTENANCE_BATCH_SIZE", 2):
+                taskrunner_main.remove_old_tasks(
+                    days_ago=183,
+                    request_type="FP",
+                    logfunc=lambda _msg: None,
+                    progress=lambda *args: reports.append(args),
+                )
+
+        assert sum(tasks for tasks, _ in reports) == 3
+        assert sum(files for _, files in reports) == 2
+        assert len(reports) == 2
+
+    def test_progress_is_reported_while_the_sweep_runs_and_overlapping_sweeps_are_skipped(self) -> None:
+        release = threading.Event()
+
+        def fake_maintenance(sweep: taskrunner_main.MaintenanceSweep, pause_seconds: float) -> None:
+            sweep.report(current_sweep=2, sweep_count=6, sweep_days_ago=14)
+            sweep.count(500, 1200)
+            release.wait(timeout=30)
+
+        sweep = taskrunner_main.MaintenanceSweep()
+        with mock.patch.object(taskrunner_main, "do_maintenance", side_effect=fake_maintenance):
+            assert sweep.start() is True
+            self.addCleanup(release.set)
+            deadline = time.monotonic() + 30
+            while (sweep.snapshot() or {}).get("files_deleted") != 1200 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            progress = sweep.snapshot()
+            assert progress is not None
+            assert progress["current_sweep"] == 2
+            assert progress["tasks_processed"] == 500
+            assert sweep.start() is False
+
+            release.set()
+            assert sweep.thread is not None
+            sweep.thread.join(timeout=30)
+
+        assert sweep.snapshot() is None
+
+    def test_the_status_file_carries_the_progress(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            statuspath = Path(tmpdir, "taskrunner_status.json")
+            with mock.patch.object(runnerstatus, "STATUS_PATH", statuspath):
+                taskrunner_main.write_status(
+                    procs_taskids={0: 1}, numslots=runnerstatus.NUMSLOTS, maintenance_progress={"current_sweep": 3}
+                )
+            status = json.loads(statuspath.read_text())
+
+        # dispatch goes on during a background sweep, so the slot fields are not frozen
+        assert status["maintenance"] is False
+        assert status["maintenance_progress"] == {"current_sweep": 3}
+
+
+class ClaimTests(TestCase):
+    """Runners sharing the queue through claims in the database (TASKRUNNER_CLAIMS)."""
+
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create_user(username=f"claimer{i}", email=f"claimer{i}@example.com", password=None)
+            for i in range(2)
+        ]
+        for index in range(4):
+            Task.objects.create(user=self.users[index % 2], ra=1.0, dec=2.0)
+        calculate_queue_positions()
+
+    def test_runners_claim_in_queue_order_and_one_task_per_user(self) -> None:
+        first = claims.claim_next_task("host-a:1", slotid=0)
+        second = claims.claim_next_task("host-b:1", slotid=0)
+
+        assert first is not None
+        assert second is not None
+        assert first == Task.queued().order_by("queuepos_relative").first()
+        assert second.user_id != first.user_id
+        # both users are running a task, whichever runner asks
+        assert claims.claim_next_task("host-a:1", slotid=1) is None
+
+    def test_the_database_refuses_a_second_claim_for_a_user(self) -> None:
+        first, second = Task.queued().filter(user=self.users[0])
+        TaskClaim.objects.create(task=first, user=self.users[0], runner="a", slotid=0, lease_expires=timezone.now())
+
+        try:
+            TaskClaim.objects.create(
+                task=second, user=self.users[0], runner="b", slotid=0, lease_expires=timezone.now()
+            )
+        except IntegrityError:
+            return
+        msg = "a second running task for the same user was accepted"
+        raise AssertionError(msg)
+
+    def test_a_lapsed_claim_is_taken_over(self) -> None:
+        task = claims.claim_next_task("host-a:1", slotid=0)
+        assert task is not None
+        TaskClaim.objects.filter(task=task).update(lease_expires=timezone.now() - datetime.timedelta(seconds=1))
+
+        # still first in the queue, since its runner never finished it
+        assert claims.claim_next_task("host-b:1", slotid=0) == task
+        assert TaskClaim.objects.get(task=task).runner == "host-b:1"
+
+    def test_releasing_frees_the_user_for_any_runner(self) -> None:
+        task = claims.claim_next_task("host-a:1", slotid=0)
+        assert task is not None
+        claims.claim_next_task("host-a:1", slotid=1)
+        assert claims.renew_claims("host-a:1") == 2
+
+        claims.release_claims("host-b:1", [task.id])
+        assert TaskClaim.objects.filter(task=task).exists(), "only the runner holding a claim releases it"
+        claims.release_claims("host-a:1", [task.id])
+
+        nexttask = claims.claim_next_task("host-b:1", slotid=0)
+        assert nexttask is not None
+        assert nexttask.user_id == task.user_id
+
+    def test_one_runner_leads_until_its_lease_lapses(self) -> None:
+        assert claims.acquire_lease(claims.LEADER_LEASE_NAME, "host-a:1")
+        assert not claims.acquire_lease(claims.LEADER_LEASE_NAME, "host-b:1")
+        assert claims.acquire_lease(claims.LEADER_LEASE_NAME, "host-a:1"), "the holder renews it"
+
+        RunnerLease.objects.filter(name=claims.LEADER_LEASE_NAME).update(
+            expires=timezone.now() - datetime.timedelta(seconds=1)
+        )
+        assert claims.acquire_lease(claims.LEADER_LEASE_NAME, "host-b:1")
+        assert not claims.acquire_lease(claims.LEADER_LEASE_NAME, "host-a:1")
+
+    @override_settings(TASKRUNNER_CLAIMS=True)
+    def test_the_running_task_is_the_latest_claimed(self) -> None:
+        # started earlier, and since orphaned by its runner: no longer the running one
+        orphan = Task.queued().filter(user=self.users[0]).order_by("id").first()
+        assert orphan is not None
+        Task.objects.filter(id=orphan.id).update(starttimestamp=timezone.now())
+        claimed = Task.queued().filter(user=self.users[1]).order_by("-id").first()
+        assert claimed is not None
+        TaskClaim.objects.create(task=claimed, user=self.users[1], runner="a", slotid=0, lease_expires=timezone.now())
+
+        calculate_queue_positions()
+
+        assert Task.objects.get(id=claimed.id).queuepos_relative == 0
+        assert taskqueue.virtual_queue_order()[0] == (claimed.id, self.users[1].pk)
+
+
 class QueuePositionConcurrencyTests(TransactionTestCase):
     """calculate_queue_positions() holds a lock precisely to stop this from producing duplicates.
 
@@ -3293,6 +5064,911 @@ class QueuePositionConcurrencyTests(TransactionTestCase):
         assert sorted(positions) == list(range(len(positions))), sorted(positions)
 
 
+class WorkerPoolTests(SimpleTestCase):
+    """The warm per-slot workers that settings.TASKRUNNER_WORKER_POOL swaps in for a process per task.
+
+    max() stands in for do_pooled_task: it takes the (taskid, slotid) pair and returns at once. A
+    stdlib callable rather than a helper defined here, for the reason given on ProcessTimeoutTests
+    below -- a spawned child cannot import this module.
+    """
+
+    def make_pool(self) -> pool.WorkerPool:
+        workerpool = pool.WorkerPool(numslots=1, run_task=max, logfunc=lambda _msg: None)
+        workerpool.start()
+        self.addCleanup(workerpool.shutdown)
+        return workerpool
+
+    @staticmethod
+    def wait_for_free_slot(workerpool: pool.WorkerPool) -> list[int]:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if freed := workerpool.reap():
+                return freed
+            time.sleep(0.05)
+        msg = "the worker never reported its task done"
+        raise AssertionError(msg)
+
+    def test_consecutive_tasks_run_in_the_same_process(self) -> None:
+        # the whole point: the second task pays for no interpreter start or django.setup()
+        workerpool = self.make_pool()
+        pid = workerpool.workers[0].pid
+
+        for taskid in (1, 2):
+            workerpool.submit(0, taskid)
+            assert self.wait_for_free_slot(workerpool) == [0]
+
+        assert workerpool.workers[0].pid == pid
+        assert workerpool.workers[0].tasks_run == 2
+
+    def test_a_worker_is_recycled_once_it_has_served_its_limit(self) -> None:
+        workerpool = self.make_pool()
+        pid = workerpool.workers[0].pid
+
+        with mock.patch.object(pool, "WORKER_MAX_TASKS", 1):
+            workerpool.submit(0, 1)
+            self.wait_for_free_slot(workerpool)
+            workerpool.maintain()
+
+        assert workerpool.workers[0].is_alive()
+        assert workerpool.workers[0].pid != pid
+
+    def test_a_worker_that_dies_holding_a_task_frees_its_slot_and_is_replaced(self) -> None:
+        # the task is still unfinished in the database, so freeing the slot is what lets it be
+        # dispatched again -- as it would be had a per-task process died
+        workerpool = self.make_pool()
+        worker = workerpool.workers[0]
+        worker.taskid = 42  # as though it had been handed one
+        pid = worker.pid
+        assert worker.process is not None
+        worker.process.kill()
+        worker.process.join()
+
+        assert workerpool.reap() == [0]
+        assert worker.is_alive()
+        assert worker.pid != pid
+        assert worker.taskid is None
+
+    def test_a_health_check_is_answered_on_a_later_pass(self) -> None:
+        workerpool = self.make_pool()
+        worker = workerpool.workers[0]
+        pid = worker.pid
+        worker.last_healthcheck = float("-inf")
+
+        workerpool.maintain()
+        assert worker.ping_sent is not None
+        deadline = time.monotonic() + 30
+        while worker.ping_sent is not None and time.monotonic() < deadline:
+            time.sleep(0.05)
+            workerpool.maintain()
+
+        assert worker.ping_sent is None
+        assert worker.pid == pid
+
+    def test_a_wedged_worker_is_replaced_without_holding_up_the_dispatch_loop(self) -> None:
+        workerpool = self.make_pool()
+        worker = workerpool.workers[0]
+        pid = worker.pid
+        assert pid is not None
+        os.kill(pid, signal.SIGSTOP)
+        worker.last_healthcheck = float("-inf")
+
+        with mock.patch.object(pool, "WORKER_HEALTHCHECK_TIMEOUT_SECONDS", 0.2):
+            started = time.monotonic()
+            workerpool.maintain()
+            assert worker.pid == pid
+            time.sleep(0.3)
+            workerpool.maintain()
+            elapsed = time.monotonic() - started
+
+        assert worker.pid != pid
+        assert worker.is_alive()
+        assert elapsed < pool.WORKER_STOP_TIMEOUT_SECONDS
+
+    def test_what_the_task_returned_comes_back_with_the_slot(self) -> None:
+        workerpool = self.make_pool()
+        workerpool.submit(0, 5)
+
+        assert self.wait_for_free_slot(workerpool) == [0]
+        assert workerpool.workers[0].result == 5
+
+
+class SshMultiplexTests(SimpleTestCase):
+    """Routing each slot's ssh and rsync through a shared ControlMaster (TASKRUNNER_SSH_MULTIPLEX)."""
+
+    def setUp(self) -> None:
+        controldir = tempfile.TemporaryDirectory()
+        self.addCleanup(controldir.cleanup)
+        patcher = mock.patch.object(sshmux, "CONTROL_DIR", Path(controldir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_without_the_setting_commands_are_unchanged(self) -> None:
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_SSH_MULTIPLEX", False):
+            assert sshmux.ssh_argv("atlas", 3) == ["ssh", "atlas"]
+            assert sshmux.rsync_argv("atlas", 3) == ["rsync"]
+
+    def test_slots_share_masters_round_robin_for_both_ssh_and_rsync(self) -> None:
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_SSH_MULTIPLEX", True):
+            socket_a = sshmux.control_path("atlas", 1)
+            ssh = sshmux.ssh_argv("atlas", 1)
+            assert f"ControlPath={socket_a}" in ssh
+            assert "ControlMaster=no" in ssh
+            assert ssh[-1] == "atlas"
+            assert sshmux.ssh_argv("atlas", 1 + sshmux.SSH_MASTER_COUNT) == ssh
+            assert sshmux.ssh_argv("atlas", 2) != ssh
+
+            # the transport rsync runs must survive its word splitting with the socket path intact
+            rsync = sshmux.rsync_argv("atlas", 1)
+            assert rsync[:2] == ["rsync", "-e"]
+            assert shlex.split(rsync[2]) == ssh[:-1]
+
+    def test_a_dead_master_is_restarted_and_a_healthy_one_checked(self) -> None:
+        dead = mock.Mock(**{"poll.return_value": 1})
+        alive = mock.Mock(**{"poll.return_value": None})
+        check = mock.Mock(**{"poll.return_value": None})
+        messages: list[str] = []
+        multiplexer = sshmux.SshMultiplexer("atlas", logfunc=messages.append, count=2)
+
+        with mock.patch.object(sshmux.subprocess, "Popen", side_effect=[dead, alive, alive, check]) as popen:
+            multiplexer.start()
+            multiplexer.last_check = float("-inf")
+            multiplexer.maintain()
+
+        assert popen.call_count == 4
+        assert all("-M" in call.args[0] for call in popen.call_args_list[:3])
+        assert popen.call_args_list[3].args[0][:3] == ["ssh", "-O", "check"]
+        assert messages == ["ssh master 0 to atlas is down, restarting it"]
+        assert [master.proc for master in multiplexer.masters] == [alive, alive]
+        assert multiplexer.masters[1].check is check
+
+    def test_a_master_that_fails_its_check_is_restarted_on_a_later_pass(self) -> None:
+        first = mock.Mock(**{"poll.return_value": None})
+        second = mock.Mock(**{"poll.return_value": None})
+        # started on the first pass, and found to have failed on the next
+        check = mock.Mock(**{"poll.return_value": 255})
+        messages: list[str] = []
+        multiplexer = sshmux.SshMultiplexer("atlas", logfunc=messages.append, count=1)
+
+        with mock.patch.object(sshmux.subprocess, "Popen", side_effect=[first, check, second]):
+            multiplexer.start()
+            multiplexer.last_check = float("-inf")
+            multiplexer.maintain()
+            assert messages == []
+            multiplexer.maintain()
+
+        assert messages == ["ssh master 0 to atlas is down, restarting it"]
+        first.kill.assert_called_once()
+        assert multiplexer.masters[0].proc is second
+
+    def test_a_check_that_hangs_is_given_up_on_after_its_timeout(self) -> None:
+        check = mock.Mock(**{"poll.return_value": None})
+        multiplexer = sshmux.SshMultiplexer("atlas", logfunc=lambda _msg: None, count=1)
+
+        with mock.patch.object(
+            sshmux.subprocess, "Popen", side_effect=[mock.Mock(**{"poll.return_value": None}), check, mock.Mock()]
+        ):
+            multiplexer.start()
+            multiplexer.last_check = float("-inf")
+            multiplexer.maintain()
+            multiplexer.masters[0].check_started -= sshmux.SSH_MASTER_COMMAND_TIMEOUT_SECONDS
+            multiplexer.maintain()
+
+        check.kill.assert_called_once()
+        assert multiplexer.masters[0].check is None
+
+    def test_masters_are_not_checked_more_often_than_the_interval(self) -> None:
+        multiplexer = sshmux.SshMultiplexer("atlas", logfunc=lambda _msg: None, count=1)
+        with mock.patch.object(
+            sshmux.subprocess, "Popen", return_value=mock.Mock(**{"poll.return_value": None})
+        ) as popen:
+            multiplexer.start()
+            multiplexer.maintain()
+
+        assert popen.call_count == 1
+
+
+class RemoteHostPoolTests(SimpleTestCase):
+    """Routing tasks among several remote hosts by capacity, type and health (TASKRUNNER_REMOTE_HOSTS)."""
+
+    def make_pool(self, spec: str) -> hosts.HostPool:
+        hostpool = hosts.HostPool(
+            hosts.parse_remote_hosts(spec, request_types=["FP", "IMGZIP", "SSOSTACK"], default_slots=16),
+            logfunc=lambda _msg: None,
+        )
+        self.addCleanup(hostpool.shutdown)
+        return hostpool
+
+    def test_the_configuration_is_parsed_with_defaults(self) -> None:
+        atlas, sc02 = hosts.parse_remote_hosts("atlas sc02:4:FP", request_types=["FP", "IMGZIP"], default_slots=16)
+
+        assert (atlas.name, atlas.slots, atlas.request_types) == ("atlas", 16, {"FP", "IMGZIP"})
+        assert (sc02.name, sc02.slots, sc02.request_types) == ("sc02", 4, {"FP"})
+
+    def test_a_bad_configuration_names_itself(self) -> None:
+        for spec in ("atlas:many", "atlas:0", ":4", "atlas:4:FP,BOGUS", "atlas atlas:2"):
+            try:
+                hosts.parse_remote_hosts(spec, request_types=["FP"], default_slots=16)
+            except ImproperlyConfigured as ex:
+                message = str(ex)
+            else:
+                msg = f"{spec!r} was accepted"
+                raise AssertionError(msg)
+            assert "ATLASSERVER_TASKRUNNER_REMOTE_HOSTS" in message
+
+    def test_a_host_is_found_by_name_while_the_pool_has_it(self) -> None:
+        hostpool = self.make_pool("atlas sc02:4")
+
+        sc02 = hostpool.host_named("sc02")
+        assert sc02 is not None
+        assert sc02.slots == 4
+        assert hostpool.host_named("sc03") is None
+
+    def test_tasks_go_to_the_least_loaded_host_that_runs_their_type(self) -> None:
+        hostpool = self.make_pool("big:4 small:2 fponly:2:FP")
+        big, small, fponly = hostpool.hosts
+
+        assert hostpool.route("FP") is big
+        hostpool.assign(0, big)
+        assert hostpool.route("FP") is small
+        hostpool.assign(1, small)
+        assert hostpool.route("FP") is fponly
+        hostpool.assign(2, fponly)
+        # a quarter of big against half of the others
+        assert hostpool.route("IMGZIP") is big
+
+        hostpool.release(1)
+        assert small.busy == 0
+
+    def test_full_and_down_hosts_take_nothing(self) -> None:
+        hostpool = self.make_pool("only:1 fponly:1:FP")
+        only, fponly = hostpool.hosts
+        hostpool.assign(0, only)
+        fponly.healthy = False
+
+        assert hostpool.route("FP") is None
+        assert hostpool.routable_types() == set()
+
+        hostpool.release(0)
+        assert hostpool.routable_types() == {"FP", "IMGZIP", "SSOSTACK"}
+
+    def probe_until(self, hostpool: hosts.HostPool, condition: t.Callable[[], bool]) -> None:
+        deadline = time.monotonic() + 30
+        while not condition():
+            assert time.monotonic() < deadline, "the probes never settled"
+            hostpool.maintain()
+            time.sleep(0.02)
+
+    def test_a_host_failing_its_probes_is_routed_around_until_it_answers(self) -> None:
+        hostpool = self.make_pool("flaky")
+        flaky = hostpool.hosts[0]
+
+        with mock.patch.object(hosts, "HOST_PROBE_SECONDS", 0.0):
+            with mock.patch.object(hosts, "probe_argv", return_value=["sh", "-c", "exit 255"]):
+                self.probe_until(hostpool, lambda: flaky.failures >= 1)
+                # one failure could be a dropped connection
+                assert flaky.healthy
+                self.probe_until(hostpool, lambda: not flaky.healthy)
+            assert hostpool.route("FP") is None
+
+            with mock.patch.object(hosts, "probe_argv", return_value=["sh", "-c", "exit 0"]):
+                self.probe_until(hostpool, lambda: flaky.healthy)
+            assert hostpool.route("FP") is flaky
+
+    def test_a_hung_probe_is_killed_and_counts_as_a_failure(self) -> None:
+        hostpool = self.make_pool("hung")
+        hung = hostpool.hosts[0]
+
+        with (
+            mock.patch.object(hosts, "HOST_PROBE_TIMEOUT_SECONDS", 0.1),
+            mock.patch.object(hosts, "probe_argv", return_value=["sleep", "60"]),
+        ):
+            self.probe_until(hostpool, lambda: hung.failures >= 1)
+
+        assert hung.probe is None or hung.probe.poll() is None, "only the next probe may still be running"
+
+    def test_the_remote_command_goes_to_the_routed_host(self) -> None:
+        with mock.patch.object(sshmux, "ssh_argv", return_value=["sh", "-c"]) as ssh_argv:
+            stdout = taskrunner_main.run_remote_command(
+                "echo ran", logfunc=lambda _msg: None, is_cancelled=lambda: False, slotid=3, host="sc02"
+            )
+
+        assert stdout == "ran\n"
+        ssh_argv.assert_called_once_with("sc02", 3)
+
+
+class SimulatedExecutorTests(TestCase):
+    """Running tasks against the stand-in for sc01 (settings.TASKRUNNER_EXECUTOR = "simulated").
+
+    Everything that runs is real -- the runner's commands, the stand-in ssh and tools, the copying
+    back -- only with latencies of zero, so that a task takes as long as starting a few processes.
+    """
+
+    SIMULATION = "connect=fixed:0 fp=fixed:0 imgzip=fixed:0 ssostack=fixed:0 failure_rate=0 nodata_rate=0 rows=5"
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="sim", email="sim@example.com", password=None)
+        homedir = tempfile.TemporaryDirectory()
+        resultsdir = tempfile.TemporaryDirectory()
+        self.addCleanup(homedir.cleanup)
+        self.addCleanup(resultsdir.cleanup)
+        self.homedir = Path(homedir.name)
+        self.resultsdir = Path(resultsdir.name)
+        for patcher in (
+            mock.patch.object(executors, "SIMULATED_HOME_DIR", self.homedir),
+            mock.patch.object(taskrunner_main.settings, "RESULTS_DIR", self.resultsdir),
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_EXECUTOR", "simulated"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_task(self, simulation: str = "", **kwargs: t.Any) -> tuple[Path | None, str | None]:
+        kwargs.setdefault("ra", 100.0)
+        kwargs.setdefault("dec", -20.0)
+        task = Task.objects.create(user=self.user, **kwargs)
+        with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_SIMULATION", f"{self.SIMULATION} {simulation}"):
+            return taskrunner_main.runtask(task, logfunc=lambda _msg: None)
+
+    def test_an_executor_must_build_every_command_line(self) -> None:
+        class HalfExecutor(executors.Executor):
+            def shell_argv(self, slotid: int) -> list[str]:
+                return ["sh", str(slotid)]
+
+        assert HalfExecutor.__abstractmethods__ == {"copy_to_argv", "move_from_argv", "probe_argv"}
+        assert not executors.SshExecutor.__abstractmethods__
+        assert not executors.SimulatedExecutor.__abstractmethods__
+
+    def test_a_forced_photometry_result_comes_back(self) -> None:
+        for tar_retrieval in (False, True):
+            with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_TAR_RETRIEVAL", tar_retrieval):
+                resultfile, error_msg = self.run_task(mjd_min=60000.0, mjd_max=60100.0)
+
+            assert resultfile is not None
+            assert error_msg is None
+            lines = resultfile.read_text().splitlines()
+            assert lines[0] == RESULTFILE_HEADER
+            assert len(lines) == 1 + 5
+            assert all(60000.0 <= float(line.split()[0]) <= 60100.0 for line in lines[1:])
+            assert resultfile.with_suffix(".jpg").exists()
+            # moved, not copied, as from sc01
+            assert not list((self.homedir / "atlas" / "atlasserver" / "results").iterdir())
+
+    def test_no_observations_is_an_answer_and_a_failed_connection_is_not(self) -> None:
+        resultfile, error_msg = self.run_task("nodata_rate=1")
+        assert resultfile is not None
+        assert error_msg == "No data returned"
+
+        # retried rather than finished, as when ssh to sc01 fails
+        assert self.run_task("failure_rate=1") == (None, None)
+
+    def test_an_image_zip_and_a_stack_are_made(self) -> None:
+        parent = Task.objects.create(user=self.user, ra=100.0, dec=-20.0)
+        (self.resultsdir / f"job{parent.id:05d}.txt").write_text(RESULTFILE_HEADER + "\n")
+
+        zipfile, error_msg = self.run_task(request_type="IMGZIP", parent_task=parent)
+        assert zipfile == self.resultsdir / f"job{parent.id:05d}.zip"
+        assert zipfile.exists()
+        assert error_msg is None
+
+        stackfile, error_msg = self.run_task(
+            request_type="SSOSTACK", mpc_name="Ceres", ra=None, dec=None, mjd_min=60000, mjd_max=60100
+        )
+        assert stackfile is not None
+        assert stackfile.read_bytes().startswith(b"SIMPLE  =")
+        assert error_msg is None
+
+        _, error_msg = self.run_task("nodata_rate=1", request_type="SSOSTACK", mpc_name="Ceres", ra=None, dec=None)
+        assert error_msg is not None
+        assert error_msg.startswith("No observations of Ceres")
+
+    def test_a_seed_makes_a_task_repeatable(self) -> None:
+        first, _ = self.run_task("seed=7", mjd_min=60000.0, mjd_max=60100.0)
+        assert first is not None
+        firstlines = first.read_text()
+        second, _ = self.run_task("seed=7", mjd_min=60000.0, mjd_max=60100.0)
+        assert second is not None
+        # the same request, so the same light curve, though under another task id
+        assert second.read_text() == firstlines
+
+    def test_a_cancelled_task_stops_its_tools(self) -> None:
+        with (
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_SIMULATION", f"{self.SIMULATION} fp=fixed:60"),
+            mock.patch.object(taskrunner_main, "CANCEL_CHECK_SECONDS", 0.0),
+        ):
+            starttime = time.perf_counter()
+            stdout = taskrunner_main.run_remote_command(
+                "/atlas/bin/force.sh 1 2 | tee ~/atlasserver/results/job00001.txt",
+                logfunc=lambda _msg: None,
+                is_cancelled=lambda: True,
+            )
+
+        assert stdout is None
+        assert time.perf_counter() - starttime < 30
+        # the stand-in was stopped along with the session, so it never writes its light curve
+        time.sleep(0.5)
+        assert (self.homedir / "atlas" / "atlasserver" / "results" / "job00001.txt").read_text() == ""
+
+    def test_a_streamed_result_matches_a_copied_one(self) -> None:
+        progress: list[tuple[int, float | None]] = []
+        with mock.patch.object(taskrunner_main, "record_progress", lambda _task, *args: progress.append(args)):
+            copied, _ = self.run_task("seed=3 rows=40", mjd_min=60000.0, mjd_max=60100.0)
+            assert copied is not None
+            copiedlines = copied.read_text()
+            with mock.patch.object(taskrunner_main.settings, "TASKRUNNER_STREAM_RESULTS", True):
+                streamed, error_msg = self.run_task("seed=3 rows=40", mjd_min=60000.0, mjd_max=60100.0)
+
+        assert streamed is not None
+        assert error_msg is None
+        # sorted here as it would have been there, with the header first
+        assert streamed.read_text() == copiedlines
+        assert streamed.with_suffix(".jpg").exists()
+        assert not streamed.with_name(f"{streamed.name}.part").exists()
+        # nothing is left on sc01, the result file having never been copied from it
+        assert not list((self.homedir / "atlas" / "atlasserver" / "results").iterdir())
+        # the last report is of the whole light curve, and only the streamed task reports
+        assert progress[-1][0] == 40
+        assert 60000.0 <= t.cast("float", progress[-1][1]) <= 60100.0
+
+    def test_a_bad_simulation_names_itself(self) -> None:
+        for spec in ("fp=normal:1", "fp=lognormal:1", "fp=fixed:-1", "failure_rate=2", "rows=many", "speed=1"):
+            try:
+                executors.parse_simulation(spec)
+            except ImproperlyConfigured as ex:
+                message = str(ex)
+            else:
+                msg = f"{spec!r} was accepted"
+                raise AssertionError(msg)
+            assert "ATLASSERVER_TASKRUNNER_SIMULATION" in message
+
+
+class OutputStreamTests(TestCase):
+    """Reading a command's standard output into a file as it arrives (taskrunner/streaming.py)."""
+
+    def setUp(self) -> None:
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = Path(tmpdir.name) / "job00001.txt.part"
+        self.progress: list[tuple[int, float | None]] = []
+
+    def stream_output(self, script: str) -> tuple[streaming.OutputStream, str]:
+        stream = streaming.OutputStream(self.path, on_progress=lambda *args: self.progress.append(args))
+        proc = subprocess.Popen(["sh", "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        while True:
+            try:
+                stream.pump(proc, timeout=1)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        return stream, stream.close()
+
+    def test_rows_are_counted_and_written_as_they_come(self) -> None:
+        stream, stderr = self.stream_output(
+            f"echo '{RESULTFILE_HEADER}'; printf '60001.5 1\\n60000.25 2\\n'; echo made a jpg >&2; printf '60002.0 3'"
+        )
+        assert stderr == "made a jpg\n"
+        # the header is not a row, and a last line without its newline is
+        assert stream.rows == 3
+        assert stream.last_mjd == 60002.0
+        assert self.path.read_text() == f"{RESULTFILE_HEADER}\n60001.5 1\n60000.25 2\n60002.0 3"
+        assert self.progress == [(3, 60002.0)]
+
+    def test_progress_is_reported_while_the_command_runs(self) -> None:
+        with mock.patch.object(streaming, "PROGRESS_SECONDS", 0.0):
+            self.stream_output("printf '60000.0 1\\n'; sleep 0.2; printf '60001.0 2\\n'")
+        assert self.progress[0] == (1, 60000.0)
+        assert self.progress[-1] == (2, 60001.0)
+        # each report is a change, not a repeat
+        assert len(set(self.progress)) == len(self.progress)
+
+    def test_a_line_reader_shows_each_line_as_it_comes_and_keeps_them_all(self) -> None:
+        seen: list[tuple[str, bool]] = []
+        proc = subprocess.Popen(
+            ["sh", "-c", "echo first; echo warning >&2; sleep 0.2; printf 'second\\nthird'"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # whether the command was still running when the line was shown
+        reader = streaming.LineReader(on_line=lambda line: seen.append((line, proc.poll() is None)))
+        while True:
+            try:
+                reader.pump(proc, timeout=1)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+
+        assert reader.close() == "warning\n"
+        assert seen[0] == ("first", True)
+        assert [line for line, _ in seen] == ["first", "second", "third"]
+        assert reader.stdout == "first\nsecond\nthird\n"
+
+    def test_a_progress_report_moves_the_task_on(self) -> None:
+        user = User.objects.create_user(username="streamer", email="streamer@example.com", password=None)
+        task = Task.objects.create(user=user, ra=100.0, dec=-20.0)
+        modified = Task.objects.get(pk=task.id).task_modified_datetime
+        taskrunner_main.record_progress(task, 12, 60010.5)
+        task.refresh_from_db()
+        assert (task.rows_received, task.last_mjd_received) == (12, 60010.5)
+        assert task.task_modified_datetime > modified
+
+        # a new attempt starts from nothing
+        taskrunner_main.mark_started(task)
+        task.refresh_from_db()
+        assert task.rows_received is None
+        assert task.last_mjd_received is None
+
+
+class DetachedJobTests(TestCase):
+    """Remote jobs that outlive their ssh session, and resuming them (TASKRUNNER_DETACHED)."""
+
+    SIMULATION = "connect=fixed:0 fp=fixed:0 imgzip=fixed:0 ssostack=fixed:0 failure_rate=0 nodata_rate=0 rows=5"
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="detached", email="detached@example.com", password=None)
+        homedir = tempfile.TemporaryDirectory()
+        resultsdir = tempfile.TemporaryDirectory()
+        self.addCleanup(homedir.cleanup)
+        self.addCleanup(resultsdir.cleanup)
+        self.homedir = Path(homedir.name)
+        self.resultsdir = Path(resultsdir.name)
+        for patcher in (
+            mock.patch.object(executors, "SIMULATED_HOME_DIR", self.homedir),
+            mock.patch.object(taskrunner_main.settings, "RESULTS_DIR", self.resultsdir),
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_EXECUTOR", "simulated"),
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_DETACHED", True),
+            mock.patch.object(taskrunner_main, "log_general"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.attemptsdir = self.homedir / taskrunner_main.REMOTE_SERVER / "atlasserver" / "attempts"
+
+    def simulate(self, simulation: str = "") -> t.Any:
+        return mock.patch.object(taskrunner_main.settings, "TASKRUNNER_SIMULATION", f"{self.SIMULATION} {simulation}")
+
+    def make_task(self) -> Task:
+        return Task.objects.select_related("user").get(
+            id=Task.objects.create(user=self.user, ra=100.0, dec=-20.0, mjd_min=60000.0, mjd_max=60100.0).id
+        )
+
+    def launch(self, task: Task, command: str) -> detached.RemoteJob:
+        job = detached.launch_job(task, command, host=taskrunner_main.REMOTE_SERVER, slotid=0, logfunc=lambda _: None)
+        assert job is not None
+        return job
+
+    def test_a_detached_task_comes_back_and_leaves_nothing_behind(self) -> None:
+        task = self.make_task()
+        with self.simulate():
+            taskrunner_main.do_task(task=task, slotid=0)
+
+        task.refresh_from_db()
+        assert task.finishtimestamp is not None
+        assert task.error_msg is None
+        assert len((self.resultsdir / f"job{task.id:05d}.txt").read_text().splitlines()) == 1 + 5
+        assert not TaskAttempt.objects.exists()
+        assert not list(self.attemptsdir.iterdir())
+
+    def test_a_job_left_by_a_stopped_runner_is_resumed_rather_than_run_again(self) -> None:
+        task = self.make_task()
+        taskrunner_main.mark_started(task)
+        started = task.starttimestamp
+        remoteresultfile = Path("~/atlasserver/results") / f"job{task.id:05d}.txt"
+        with self.simulate("fp=fixed:1"):
+            # what the runner had started when it stopped, as runtask() starts it
+            self.launch(task, taskrunner_main.build_fp_command(task, remoteresultfile=remoteresultfile))
+            assert detached.job_status(detached.RemoteJob(TaskAttempt.objects.get()), 0) == detached.JOB_RUNNING
+
+            taskrunner_main.do_task(task=task, slotid=0)
+
+        task.refresh_from_db()
+        assert task.finishtimestamp is not None
+        assert task.error_msg is None
+        # the one attempt, from its own start
+        assert task.attempt_count == 1
+        assert task.starttimestamp == started
+        assert (self.resultsdir / f"job{task.id:05d}.txt").exists()
+        assert not TaskAttempt.objects.exists()
+
+    def test_recovery_keeps_the_jobs_that_are_there_and_stops_orphans(self) -> None:
+        running, gone, deleted = self.make_task(), self.make_task(), self.make_task()
+        with self.simulate():
+            self.launch(running, "sleep 30")
+            gonejob = self.launch(gone, "true")
+            orphan = self.launch(deleted, "sleep 30")
+            # a job whose files went with a reboot of the host
+            time.sleep(0.5)
+            for remotefile in self.attemptsdir.glob(f"attempt{gonejob.attempt.id:06d}.*"):
+                remotefile.unlink()
+            deleted.delete()
+
+            detached.recover_attempts(claims.runner_id(), logfunc=lambda _: None)
+
+            assert list(TaskAttempt.objects.values_list("task_id", flat=True)) == [running.id]
+            # the orphan's job was stopped, and its files are gone with it
+            time.sleep(0.5)
+            assert detached.job_status(orphan, 0) == detached.JOB_GONE
+            assert not list(self.attemptsdir.glob(f"attempt{orphan.attempt.id:06d}.*"))
+
+            job = detached.RemoteJob(TaskAttempt.objects.get())
+            detached.stop_job(job, 0, logfunc=lambda _: None)
+            assert detached.job_status(job, 0) == detached.JOB_GONE
+
+    def test_a_lost_session_leaves_the_job_for_the_retry(self) -> None:
+        task = self.make_task()
+        with self.simulate("fp=fixed:1"):
+            with (
+                mock.patch.object(taskrunner_main.time, "sleep"),
+                # ssh fails once the job has started, as a dropped connection does
+                mock.patch.object(taskrunner_main, "run_remote_command", return_value=None),
+            ):
+                taskrunner_main.do_task(task=task, slotid=0)
+
+            task.refresh_from_db()
+            assert task.finishtimestamp is None
+            attempt = TaskAttempt.objects.get()
+            assert attempt.task_id == task.id
+            assert attempt.remote_pid is not None
+            assert detached.job_status(detached.RemoteJob(attempt), 0) == detached.JOB_RUNNING
+
+            taskrunner_main.do_task(task=task, slotid=0)
+
+        task.refresh_from_db()
+        assert task.finishtimestamp is not None
+        assert task.attempt_count == 1
+        assert len((self.resultsdir / f"job{task.id:05d}.txt").read_text().splitlines()) == 1 + 5
+
+    def test_a_runner_stopping_before_the_results_are_back_attaches_again(self) -> None:
+        class RunnerStoppedError(Exception):
+            pass
+
+        task = self.make_task()
+        with self.simulate():
+            with (
+                mock.patch.object(taskrunner_main, "retrieve_results", side_effect=RunnerStoppedError),
+                contextlib.suppress(RunnerStoppedError),
+            ):
+                taskrunner_main.do_task(task=task, slotid=0)
+
+            # the job has exited, and it and its attempt are still there to attach to
+            attempt = TaskAttempt.objects.get()
+            assert detached.job_status(detached.RemoteJob(attempt), 0) == detached.JOB_EXITED
+            assert detached.attempt_host(task) == taskrunner_main.REMOTE_SERVER
+
+            with mock.patch.object(detached, "launch_job") as launch:
+                taskrunner_main.do_task(task=task, slotid=0)
+
+        launch.assert_not_called()
+        task.refresh_from_db()
+        assert task.finishtimestamp is not None
+        assert task.attempt_count == 1
+        assert len((self.resultsdir / f"job{task.id:05d}.txt").read_text().splitlines()) == 1 + 5
+        assert not TaskAttempt.objects.exists()
+        assert not list(self.attemptsdir.iterdir())
+        assert detached.attempt_host(task) is None
+
+
+class BackoffTests(TestCase):
+    """Circuit breakers for the remote hosts, and the backoff of failed tasks (TASKRUNNER_BACKOFF)."""
+
+    SIMULATION = "connect=fixed:0 fp=fixed:0 imgzip=fixed:0 ssostack=fixed:0 nodata_rate=0 rows=5"
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username="backoff", email="backoff@example.com", password=None)
+        homedir = tempfile.TemporaryDirectory()
+        resultsdir = tempfile.TemporaryDirectory()
+        self.addCleanup(homedir.cleanup)
+        self.addCleanup(resultsdir.cleanup)
+        for patcher in (
+            mock.patch.object(executors, "SIMULATED_HOME_DIR", Path(homedir.name)),
+            mock.patch.object(taskrunner_main.settings, "RESULTS_DIR", Path(resultsdir.name)),
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_EXECUTOR", "simulated"),
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_BACKOFF", True),
+            mock.patch.object(taskrunner_main, "log_general"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.messages: list[str] = []
+        self.now = 1000.0
+        patcher = mock.patch.object(breaker.time, "monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def simulate(self, simulation: str) -> t.Any:
+        return mock.patch.object(taskrunner_main.settings, "TASKRUNNER_SIMULATION", f"{self.SIMULATION} {simulation}")
+
+    def make_task(self) -> Task:
+        return Task.objects.select_related("user").get(id=Task.objects.create(user=self.user, ra=100.0, dec=-20.0).id)
+
+    def test_the_breaker_opens_after_failures_in_a_row_and_probes_with_one_task(self) -> None:
+        hostbreaker = breaker.CircuitBreaker("atlas", logfunc=self.messages.append)
+        for slotid in range(breaker.BREAKER_OPEN_AFTER_FAILURES - 1):
+            hostbreaker.record(slotid, breaker.HOST_UNREACHABLE)
+        # a success in between starts the count again
+        hostbreaker.record(0, breaker.HOST_ANSWERED)
+        for slotid in range(breaker.BREAKER_OPEN_AFTER_FAILURES):
+            assert hostbreaker.allows_dispatch()
+            hostbreaker.record(slotid, breaker.HOST_UNREACHABLE)
+        assert hostbreaker.state == breaker.BREAKER_OPEN
+        assert not hostbreaker.allows_dispatch()
+
+        self.now += breaker.BREAKER_OPEN_SECONDS
+        assert hostbreaker.allows_dispatch()
+        assert hostbreaker.state == breaker.BREAKER_HALF_OPEN
+        hostbreaker.dispatched(3)
+        assert not hostbreaker.allows_dispatch()
+
+        # the probe failing opens it again for longer
+        hostbreaker.record(3, breaker.HOST_UNREACHABLE)
+        assert hostbreaker.state == breaker.BREAKER_OPEN
+        self.now += breaker.BREAKER_OPEN_SECONDS
+        assert not hostbreaker.allows_dispatch()
+        self.now += breaker.BREAKER_OPEN_SECONDS
+        assert hostbreaker.allows_dispatch()
+
+        # and the probe reaching the host closes it
+        hostbreaker.dispatched(5)
+        hostbreaker.record(5, breaker.HOST_ANSWERED)
+        assert hostbreaker.state == breaker.BREAKER_CLOSED
+        assert hostbreaker.allows_dispatch()
+        assert hostbreaker.open_seconds == breaker.BREAKER_OPEN_SECONDS
+
+    def test_a_probe_that_found_nothing_is_replaced_by_the_next_task(self) -> None:
+        hostbreaker = breaker.CircuitBreaker("atlas", logfunc=self.messages.append)
+        for slotid in range(breaker.BREAKER_OPEN_AFTER_FAILURES):
+            hostbreaker.record(slotid, breaker.HOST_UNREACHABLE)
+        self.now += breaker.BREAKER_OPEN_SECONDS
+        assert hostbreaker.allows_dispatch()
+        hostbreaker.dispatched(0)
+
+        hostbreaker.record(0, None)
+
+        assert hostbreaker.state == breaker.BREAKER_HALF_OPEN
+        assert hostbreaker.allows_dispatch()
+
+    def test_an_attempt_is_unreachable_if_any_of_its_commands_could_not_connect(self) -> None:
+        breaker.start_attempt()
+        assert breaker.attempt_outcome() is None
+        breaker.record_exit_status(0)
+        assert breaker.attempt_outcome() == breaker.HOST_ANSWERED
+        breaker.record_exit_status(breaker.SSH_CONNECTION_FAILED)
+        breaker.record_exit_status(None)
+        assert breaker.attempt_outcome() == breaker.HOST_UNREACHABLE
+
+    def test_an_unreachable_host_holds_the_task_back_without_counting_the_attempt(self) -> None:
+        task = self.make_task()
+        with (
+            self.simulate("failure_rate=1"),
+            mock.patch.object(taskrunner_main.time, "sleep", wraps=time.sleep) as sleep,
+        ):
+            outcome = taskrunner_main.do_task(task=task, slotid=0)
+
+        assert outcome == breaker.HOST_UNREACHABLE
+        # held back in the queue, rather than by sleeping in the slot
+        assert mock.call(5) not in sleep.call_args_list
+        task.refresh_from_db()
+        assert task.finishtimestamp is None
+        assert task.attempt_count == 0
+        assert task.next_attempt_after is not None
+        assert task.next_attempt_after > timezone.now()
+        assert not Task.dispatchable().filter(id=task.id).exists()
+        assert claims.claim_next_task("runner", slotid=0) is None
+
+    def test_a_task_that_keeps_failing_is_finished_with_an_error(self) -> None:
+        task = self.make_task()
+        Task.objects.filter(id=task.id).update(attempt_count=1)
+        task.refresh_from_db()
+        with (
+            self.simulate("failure_rate=0"),
+            mock.patch.object(taskrunner_main.settings, "TASKRUNNER_MAX_ATTEMPTS", 3),
+            # the host answers, and the task fails all the same
+            mock.patch.object(taskrunner_main, "runtask", return_value=(None, None)),
+        ):
+            taskrunner_main.do_task(task=task, slotid=0)
+            task.refresh_from_db()
+            assert task.finishtimestamp is None
+            assert task.attempt_count == 2
+            assert task.next_attempt_after is not None
+            first_delay = (task.next_attempt_after - timezone.now()).total_seconds()
+            assert 0 < first_delay <= taskrunner_main.retry_delay_seconds(2)
+
+            taskrunner_main.do_task(task=task, slotid=0)
+
+        task.refresh_from_db()
+        assert task.finishtimestamp is not None
+        assert task.error_msg is not None
+        assert "3 attempts" in task.error_msg
+
+    def test_the_backoff_doubles_up_to_its_limit(self) -> None:
+        delays = [taskrunner_main.retry_delay_seconds(attempts) for attempts in range(1, 20)]
+
+        assert delays[:3] == [
+            taskrunner_main.RETRY_BASE_SECONDS,
+            2 * taskrunner_main.RETRY_BASE_SECONDS,
+            4 * taskrunner_main.RETRY_BASE_SECONDS,
+        ]
+        assert max(delays) == delays[-1] == taskrunner_main.RETRY_MAX_SECONDS
+
+
+class DrainTests(TestCase):
+    """Stopping the runner, or restarting it for a handover, once its running tasks finish."""
+
+    def setUp(self) -> None:
+        controldir = tempfile.TemporaryDirectory()
+        self.addCleanup(controldir.cleanup)
+        self.controlpath = Path(controldir.name, "taskrunner_control.json")
+        for patcher in (
+            mock.patch.object(runnerstatus, "CONTROL_PATH", self.controlpath),
+            mock.patch.object(taskrunner_main, "log_general"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_a_written_request_is_taken_once(self) -> None:
+        started = datetime.datetime.now(datetime.UTC)
+        runnerstatus.write_drain_request(runnerstatus.DrainRequest.after(600, handover=True))
+
+        request = taskrunner_main.pending_drain_request(started)
+        assert request is not None
+        assert request.handover is True
+        assert 590 < request.seconds_left() <= 600
+        assert not self.controlpath.exists()
+        assert taskrunner_main.pending_drain_request(started) is None
+
+    def test_a_request_left_from_before_the_runner_started_is_dropped(self) -> None:
+        runnerstatus.write_drain_request(runnerstatus.DrainRequest.after(600))
+        started = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=1)
+
+        assert taskrunner_main.pending_drain_request(started) is None
+        assert not self.controlpath.exists()
+
+    def test_sigterm_drains_with_the_default_deadline(self) -> None:
+        self.addCleanup(setattr, taskrunner_main, "_signalled_drain", None)
+        taskrunner_main.drain_handler(signal.SIGTERM, None)
+
+        request = taskrunner_main.pending_drain_request(datetime.datetime.now(datetime.UTC))
+        assert request is not None
+        assert request.handover is False
+        assert request.seconds_left() > runnerstatus.DRAIN_DEADLINE_SECONDS - 10
+        assert taskrunner_main.pending_drain_request(datetime.datetime.now(datetime.UTC)) is None
+
+    def test_the_status_file_says_it_is_draining(self) -> None:
+        request = runnerstatus.DrainRequest.after(600, handover=True)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            statuspath = Path(tmpdir, "taskrunner_status.json")
+            with mock.patch.object(runnerstatus, "STATUS_PATH", statuspath):
+                taskrunner_main.write_status(
+                    procs_taskids={}, numslots=runnerstatus.NUMSLOTS, draining=request.as_status()
+                )
+            status = json.loads(statuspath.read_text())
+
+        assert status["draining"] == {"handover": True, "deadline": request.deadline.isoformat()}
+
+    def test_a_handover_leaves_only_the_slots_following_a_detached_job(self) -> None:
+        user = User.objects.create_user(username="handover", email="handover@example.com", password=None)
+        following, launching, batched = (Task.objects.create(user=user, ra=1.0, dec=2.0) for _ in range(3))
+        for task, pid in ((following, 4242), (launching, None)):
+            TaskAttempt.objects.create(
+                task=task, number=1, runner="here:1", host="atlas", remote_prefix="~/attempt", remote_pid=pid
+            )
+
+        # the one starting its job and the batch, which runs attached, are waited for
+        assert detached.resumable_taskids([following.id, launching.id, batched.id]) == {following.id}
+
+    def test_a_stopped_slot_takes_its_sessions_with_it(self) -> None:
+        # a slot process and the ssh session it waits on, as far as the process tree goes
+        proc = subprocess.Popen(["sh", "-c", "sleep 60 & wait"])
+        self.addCleanup(proc.wait)
+        deadline = time.monotonic() + 10
+        while not (children := psutil.Process(proc.pid).children()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert children
+
+        taskrunner_main.stop_process_tree(proc.pid)
+
+        proc.wait(timeout=10)
+        for child in children:
+            # gone, or a zombie that nothing here reaps
+            with contextlib.suppress(psutil.NoSuchProcess):
+                assert child.status() == psutil.STATUS_ZOMBIE
+
+
 class ProcessTimeoutTests(TestCase):
     # time.sleep as the target rather than a helper defined here: the default start method on this
     # platform is spawn, and a child that re-imports this module dies on AppRegistryNotReady before
@@ -61,6 +61,8 @@ from rest_framework.serializers import BaseSerializer
 from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
+from atlasserver.forcephot import prediction
+from atlasserver.forcephot import sketches
 from atlasserver.forcephot.filters import TaskFilter
 from atlasserver.forcephot.forms import email_is_taken
 from atlasserver.forcephot.forms import EmailChangeForm
@@ -78,6 +80,7 @@ from atlasserver.forcephot.models import Task
 from atlasserver.forcephot.netaddr import address_is_public
 from atlasserver.forcephot.netaddr import client_address
 from atlasserver.forcephot.pagination import TaskPagination
+from atlasserver.forcephot.queue import first_position_after_user
 from atlasserver.forcephot.queue import next_queuepos_relative
 from atlasserver.forcephot.queue import request_recalc as request_queue_recalc
 from atlasserver.forcephot.queue import typical_runtime_seconds
@@ -179,6 +182,13 @@ def get_tasklist_etag(request, user_id: int) -> str:
     such as an IMGZIP child finishing when it is reported on its parent's row but paginated
     elsewhere.
     """
+    # With the runner's published order, what this user's page shows of the queue is where their own
+    # tasks are in it, and nothing else: a reordering that moved only other users' tasks leaves this
+    # tag alone. A task submitted since the order was published is counted at its back, which can
+    # drift without changing the tag, but only until the runner places it a few seconds later.
+    snapshot = Task.queue_snapshot()
+    queueposition = snapshot.user_positions.get(user_id) if snapshot is not None else Task.min_queuepos_relative()
+
     # one aggregate query for all of it. task_modified_datetime (auto_now) covers edits that change
     # none of the other timestamps, and the count covers deletions, which move no timestamp at all.
     # calculate_queue_positions() writes task_modified_datetime explicitly for the same reason: it
@@ -201,7 +211,7 @@ def get_tasklist_etag(request, user_id: int) -> str:
         usertasks["finishtimestamp__max"],
         usertasks["task_modified_datetime__max"],
         # the queue position rendered for a task is relative to the front of the global queue
-        Task.min_queuepos_relative(),
+        queueposition,
     )
 
 
@@ -439,6 +449,11 @@ class ForcePhotTaskViewSet(viewsets.ModelViewSet[Task]):
         extra_fields.update(client_location_fields(self.request))
         extra_fields["from_api"] = request_is_from_api(self.request)
 
+        # before the save, so that the new tasks are not counted among the ones already placed
+        recalc_from_position = (
+            first_position_after_user(self.request.user.pk) if self.request.user.pk is not None else 0
+        )
+
         serializer.save(**extra_fields)
 
         # take the ids from the saved objects rather than serializer.data: accessing .data here
@@ -467,7 +482,7 @@ class ForcePhotTaskViewSet(viewsets.ModelViewSet[Task]):
             ["userqueuedtasks_on_submit", "queuepos_relative"],
         )
 
-        request_queue_recalc()
+        request_queue_recalc(from_position=recalc_from_position)
 
         # the updates above went straight to the database, so reload the in-memory objects that
         # will be serialised into the response
@@ -485,9 +500,11 @@ class ForcePhotTaskViewSet(viewsets.ModelViewSet[Task]):
     def perform_destroy(self, instance: Task) -> None:
         """Delete a task, and if the task is queued (not finished), then update queue positions."""
         update_queue_positions = not instance.finishtimestamp
+        # nothing ahead of the deleted task moves up
+        recalc_from_position = instance.queuepos_relative or 0
         instance.delete()
         if update_queue_positions:
-            request_queue_recalc()
+            request_queue_recalc(from_position=recalc_from_position)
 
     @override
     # pyrefly: ignore [bad-override]
@@ -618,9 +635,10 @@ class RequestImages(APIView):
             newtask = parent_task.new_imagerequest(user=request.user)
             for field, value in client_location_fields(self.request).items():
                 setattr(newtask, field, value)
+            recalc_from_position = first_position_after_user(request.user.pk)
             newtask.queuepos_relative = next_queuepos_relative()
             newtask.save()
-            request_queue_recalc()
+            request_queue_recalc(from_position=recalc_from_position)
 
             redirurl = replace_query_param(reverse("task-list"), "newids", str(newtask.id))
 
@@ -875,7 +893,35 @@ def statsshortterm(request):
         mean = mean_seconds(values)
         return "-" if mean is None else f"{mean:.1f}s"
 
-    if sevendaytasks_finished.count() > 0:
+    if settings.TASKRUNNER_RUNTIME_SKETCHES:
+        # From the hourly sketches (see sketches.py), which count the tasks that finished in the
+        # week rather than those submitted in it, and cost one query of at most a week's rows per
+        # metric and request type instead of every finished task built into a model instance.
+        summaries = {
+            metric: sketches.combined_summary(sketches.window_summaries(metric, hours=7 * 24))
+            for metric in sketches.METRICS
+        }
+
+        def seconds_str(value: float | None) -> str:
+            return "-" if value is None else f"{value:.1f}s"
+
+        dictparams |= {
+            "sevendayavgwaittime": seconds_str(summaries["waittime"].mean()),
+            "sevendayavgwaittimeuserfirst": seconds_str(summaries["waittime_first"].mean()),
+            "sevendayavgruntime": seconds_str(summaries["runtime"].mean()),
+            "sevendaywaittimepercentiles": " / ".join(
+                seconds_str(summaries["waittime"].quantile(fraction)) for fraction in (0.5, 0.9, 0.99)
+            ),
+            "sevendayruntimepercentiles": " / ".join(
+                seconds_str(summaries["runtime"].quantile(fraction)) for fraction in (0.5, 0.9, 0.99)
+            ),
+        }
+        # the run time sketched, rather than every task times the mean: a task that reused another's
+        # result has no run time in the sketch, and occupied no slot for one (see Task.reused_result)
+        dictparams["sevendayloadpercent"] = (
+            f"{100.0 * summaries['runtime'].total_seconds / (7 * 24.0 * 60 * 60) / runnerstatus.NUMSLOTS:.1f}%"
+        )
+    elif sevendaytasks_finished.count() > 0:
         dictparams["sevendayavgwaittime"] = mean_seconds_str([tsk.waittime() for tsk in sevendaytasks_finished])
 
         sevendaytasks_finished_firstusertasks = sevendaytasks_finished.filter(userqueuedtasks_on_submit=0)
@@ -911,19 +957,43 @@ def queuepositions(request):
     answers that question with two indexed queries and a few hundred bytes, rather than a page of
     fully serialised tasks and the filesystem stats that go with them.
     """
-    queueoffset = Task.min_queuepos_relative()
-    positions = Task.objects.filter(
-        user_id=request.user.pk, finishtimestamp__isnull=True, is_archived=False, queuepos_relative__isnull=False
-    ).values_list("id", "queuepos_relative", "request_type")
+    snapshot = Task.queue_snapshot()
+    queueoffset = 0 if snapshot is not None else Task.min_queuepos_relative()
+    positions = list(
+        Task.objects.filter(
+            user_id=request.user.pk, finishtimestamp__isnull=True, is_archived=False, queuepos_relative__isnull=False
+        ).values_list("id", "queuepos_relative", *prediction.FEATURE_FIELDS)
+    )
+    startestimates = runnerstatus.read_start_estimates()
 
     return JsonResponse(
         {
-            "queuepositions": {str(taskid): queuepos - queueoffset for taskid, queuepos, _ in positions},
+            "queuepositions": {
+                str(taskid): snapshot.position(taskid) if snapshot is not None else queuepos - queueoffset
+                for taskid, queuepos, *_ in positions
+            },
             # What each of those tasks is. Dispatch runs one task per user at a time, so a user's
             # own tasks ahead of this one are waited through in series -- and an IMGZIP among them
             # is a quarter of an hour of that wait where an FP task is a minute. Another column on
             # a query already being made, and only ever this user's own tasks.
-            "queuedtypes": {str(taskid): requesttype for taskid, _, requesttype in positions},
+            "queuedtypes": {str(taskid): requesttype for taskid, _, requesttype, *_ in positions},
+            # And how long each is expected to take, from finished tasks like it rather than from
+            # its type alone (see prediction.py): a light curve over the whole survey is not a
+            # month's. From the cache, so no query; a task with no prediction is left out.
+            "expectedruntimes": {
+                str(taskid): seconds
+                for taskid, seconds in prediction.predict_runtimes(
+                    (taskid, t.cast("prediction.Features", tuple(features))) for taskid, _, *features in positions
+                ).items()
+            },
+            # When each is likely to start, as [median, 90th percentile] seconds from now, from the
+            # runner's simulation of the queue draining (see taskrunner/eta.py); empty when it
+            # publishes none. One parse of a file per change of it, shared by every poll.
+            "startestimates": {
+                str(taskid): remaining
+                for taskid, *_ in (positions if startestimates is not None else [])
+                if (remaining := startestimates.remaining(taskid)) is not None
+            },
             "queueoffset": queueoffset,
         }
     )
@@ -11,8 +11,11 @@ the request is sent.
 """
 
 import email.message
+import hashlib
+import hmac
 import json
 import socket
+import time
 import typing as t
 import urllib.error
 import urllib.request
@@ -112,24 +115,9 @@ class _NoRedirects(urllib.request.HTTPRedirectHandler):
         return None
 
 
-def send_task_callback(task: "Task", logfunc: t.Callable[[t.Any], None]) -> bool:
-    """POST a completion notification for a finished task. Return whether it was accepted.
-
-    Never raises: a callback that fails is logged and dropped. Retrying is deliberately not
-    attempted — the task is already finished and recorded, the client can still poll, and a retry
-    loop against an unresponsive endpoint would tie up the runner.
-    """
-    if not task.callback_url:
-        return False
-
-    try:
-        url = validate_callback_url(task.callback_url)
-    except CallbackUrlError as ex:
-        # the URL passed validation when the task was submitted, so this means DNS changed under it
-        logfunc(f"Not sending callback for task {task.id}: {ex}")
-        return False
-
-    payload = {
+def callback_payload(task: "Task") -> dict[str, t.Any]:
+    """Return the JSON body of a finished task's callback."""
+    return {
         "task_id": task.id,
         "task_url": f"https://fallingstar-data.com/forcedphot/queue/{task.id}/",
         "request_type": task.request_type,
@@ -138,22 +126,79 @@ def send_task_callback(task: "Task", logfunc: t.Callable[[t.Any], None]) -> bool
         "success": not task.error_msg,
     }
 
+
+def sign_callback(body: bytes, key: str, timestamp: int) -> str:
+    """Return the signature header value of a callback body sent at `timestamp` (Unix seconds).
+
+    An HMAC-SHA256 of the timestamp, a full stop and the body, keyed with the user's API token,
+    which is the one secret the server and the API client already share. The receiver computes the
+    same from the X-Atlas-Timestamp header and the raw body, and can refuse an old timestamp so
+    that a captured request cannot be replayed later.
+    """
+    digest = hmac.new(key.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def callback_headers(user_id: int, body: bytes) -> dict[str, str]:
+    """Return the headers of a callback to a user, signed if they have an API token to sign it with."""
+    # imported here for the reason given at the top of the module
+    from rest_framework.authtoken.models import Token
+
+    headers = {"Content-Type": "application/json", "User-Agent": "atlasserver-forcedphot-callback"}
+    key = Token.objects.filter(user_id=user_id).values_list("key", flat=True).first()
+    if key is not None:
+        timestamp = int(time.time())
+        headers["X-Atlas-Timestamp"] = str(timestamp)
+        headers["X-Atlas-Signature"] = sign_callback(body, key, timestamp)
+    return headers
+
+
+def post_callback(url: str, body: bytes, headers: dict[str, str]) -> int:
+    """POST a callback to a URL that has been validated, and return the HTTP status it answered with.
+
+    Raises OSError (urllib.error.URLError among them) when no answer came, and CallbackUrlError
+    for a URL that urllib cannot send to.
+    """
     request = urllib.request.Request(  # noqa: S310 (the scheme is checked in validate_callback_url)
-        url,
-        data=json.dumps(payload).encode(),
-        headers={"Content-Type": "application/json", "User-Agent": "atlasserver-forcedphot-callback"},
-        method="POST",
+        url, data=body, headers=headers, method="POST"
     )
 
     opener = urllib.request.build_opener(_NoRedirects)
     try:
         with opener.open(request, timeout=CALLBACK_TIMEOUT_SECONDS) as response:
-            logfunc(f"Callback for task {task.id} returned HTTP {response.status}")
-            return 200 <= response.status < 300
+            return int(response.status)
     except urllib.error.HTTPError as ex:
         # the endpoint answered, just not with a success status
-        logfunc(f"Callback for task {task.id} returned HTTP {ex.code}")
+        return ex.code
+    except ValueError as ex:
+        raise CallbackUrlError(str(ex)) from ex
+
+
+def send_task_callback(task: "Task", logfunc: t.Callable[[t.Any], None]) -> bool:
+    """POST a completion notification for a finished task. Return whether it was accepted.
+
+    Never raises: a callback that fails is logged and dropped. Retrying is deliberately not
+    attempted here — the task is already finished and recorded, the client can still poll, and a
+    retry loop against an unresponsive endpoint would tie up the runner. With
+    settings.TASKRUNNER_NOTIFY_OUTBOX, the runner's outbox sends callbacks instead, and retries
+    them away from the slots (see atlasserver.taskrunner.outbox).
+    """
+    if not task.callback_url:
         return False
-    except (urllib.error.URLError, TimeoutError, OSError, ValueError) as ex:
+
+    try:
+        url = validate_callback_url(task.callback_url)
+    except CallbackUrlError as ex:
+        # the URL passed validation when the task was submitted, so this means DNS changed under it
+        logfunc(f"Not sending callback for task {task.id}: {ex}")
+        return False
+
+    body = json.dumps(callback_payload(task)).encode()
+    try:
+        status = post_callback(url, body, callback_headers(task.user_id, body))
+    except (CallbackUrlError, OSError) as ex:
         logfunc(f"Callback for task {task.id} failed: {ex}")
         return False
+
+    logfunc(f"Callback for task {task.id} returned HTTP {status}")
+    return 200 <= status < 300
@@ -288,6 +288,165 @@ def _static_version() -> str:
 
 STATIC_VERSION = _static_version()
 
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    """Return the boolean an ATLASSERVER_* variable holds, refusing anything but the six spellings.
+
+    The same rule as ATLASSERVER_DEBUG above, for the same reason: a value like "on" silently
+    reading as off would leave an operator wondering why the setting had no effect.
+    """
+    value = os.environ.get(name, "").strip().lower()
+    if not value:
+        return default
+    if value not in {"1", "true", "yes", "0", "false", "no"}:
+        msg = f"{name} must be one of 1/true/yes or 0/false/no, not {value!r}"
+        raise ImproperlyConfigured(msg)
+    return value in {"1", "true", "yes"}
+
+
+def _env_count(name: str, default: int = 0) -> int:
+    """Return the non-negative integer an ATLASSERVER_* variable holds, validated as for the proxy count."""
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    if not value.isdecimal():
+        msg = f"{name} must be a non-negative integer, not {value!r}"
+        raise ImproperlyConfigured(msg)
+    return int(value)
+
+
+# Task runner modes. Each is off by default, so that a deployment behaves as it always has until an
+# operator opts in through .env; the runner reads them once at startup.
+
+# Keep one warm worker process per slot and hand it task ids, rather than spawning a process (with
+# its own interpreter start, django.setup() and database connection) for every task.
+TASKRUNNER_WORKER_POOL = _env_flag("ATLASSERVER_TASKRUNNER_WORKER_POOL")
+
+# Route every ssh and rsync to the remote host through a few long-lived ControlMaster connections,
+# so that a task does not pay a full handshake for each of its three or four connections.
+TASKRUNNER_SSH_MULTIPLEX = _env_flag("ATLASSERVER_TASKRUNNER_SSH_MULTIPLEX")
+
+# Bring each task's result files back as one tar stream over a single ssh call, rather than with an
+# rsync per file. Falls back to rsync for the task if the stream fails.
+TASKRUNNER_TAR_RETRIEVAL = _env_flag("ATLASSERVER_TASKRUNNER_TAR_RETRIEVAL")
+
+# Run a user's compatible queued forced photometry tasks together in one remote session, up to
+# taskrunner.main.FP_BATCH_MAX_TASKS at a time, instead of one session per task. While other users
+# have tasks waiting, a batch is held to the user's share of the slots (see batch_size_limit()).
+TASKRUNNER_FP_BATCH = _env_flag("ATLASSERVER_TASKRUNNER_FP_BATCH")
+
+# Do not run a forced photometry request while an identical one is running; when that one
+# finishes, give every waiting duplicate a copy (a hard link) of its result instead.
+TASKRUNNER_DEDUPLICATE = _env_flag("ATLASSERVER_TASKRUNNER_DEDUPLICATE")
+
+# Answer a forced photometry request from the result of an earlier task at the same position, when
+# that task covered the requested MJD window and finished no more than this many hours ago, by
+# slicing its file locally instead of running force.sh again. Zero turns the cache off. The window
+# is the trade: observations reduced since the earlier task ran are missing from the answer.
+TASKRUNNER_RESULT_CACHE_HOURS = _env_count("ATLASSERVER_TASKRUNNER_RESULT_CACHE_HOURS")
+
+# When an earlier result for the same light curve exists (a monitoring user's previous day's task),
+# ask sc01 only for the observations after its last row, and merge them into a copy of it.
+TASKRUNNER_INCREMENTAL = _env_flag("ATLASSERVER_TASKRUNNER_INCREMENTAL")
+
+# Have the web app nudge the runner over a unix socket whenever the queue changes, and have the
+# runner wait on that (and on its slots finishing) instead of polling the table every half second.
+# The polling stays, every IDLE_POLL_INTERVAL_SECONDS, as the backstop for a lost nudge.
+TASKRUNNER_WAKEUP = _env_flag("ATLASSERVER_TASKRUNNER_WAKEUP")
+
+# Have the dispatcher find cancelled running tasks, all slots in one query, and signal their slots,
+# instead of every running task asking the database about itself every fifteen seconds.
+TASKRUNNER_CANCEL_WATCH = _env_flag("ATLASSERVER_TASKRUNNER_CANCEL_WATCH")
+
+# Run the hourly sweep of old tasks and their files on a thread of its own, paced, rather than in
+# the dispatch loop, which it used to hold up for as long as it took.
+TASKRUNNER_BACKGROUND_MAINTENANCE = _env_flag("ATLASSERVER_TASKRUNNER_BACKGROUND_MAINTENANCE")
+
+# Keep the round-robin queue order in the runner's memory and publish it as a file that the web app
+# reads positions from, instead of writing every moved task's position (and modified time) into
+# the database on each reordering. Both the web server and the runner must have it set.
+TASKRUNNER_VIRTUAL_QUEUE = _env_flag("ATLASSERVER_TASKRUNNER_VIRTUAL_QUEUE")
+
+# Let several task runners, on one machine or more, share the queue: each claims a task with a row
+# in the database that also keeps a user to one running task across all of them, and the hourly
+# sweep and the queue renumbering are done by whichever runner holds the leader lease. Dispatch
+# follows the stored positions, so this does not combine with TASKRUNNER_VIRTUAL_QUEUE.
+TASKRUNNER_CLAIMS = _env_flag("ATLASSERVER_TASKRUNNER_CLAIMS")
+if TASKRUNNER_CLAIMS and TASKRUNNER_VIRTUAL_QUEUE:
+    _msg = "ATLASSERVER_TASKRUNNER_CLAIMS and ATLASSERVER_TASKRUNNER_VIRTUAL_QUEUE cannot both be set"
+    raise ImproperlyConfigured(_msg)
+
+# The remote hosts to run tasks on, each with how many tasks it may run at once and which request
+# types, as "name[:slots[:type,type...]]" separated by spaces; see taskrunner/hosts.py. Each host is
+# probed, and tasks go to the least loaded one that is answering. Empty runs every task on "atlas".
+# The limits are per runner: with TASKRUNNER_CLAIMS, each runner counts only its own tasks.
+TASKRUNNER_REMOTE_HOSTS = os.environ.get("ATLASSERVER_TASKRUNNER_REMOTE_HOSTS", "").strip()
+
+# What runs the remote commands: "ssh" to the ATLAS hosts, or "simulated", which runs stand-ins for
+# force.sh and the other tools on this machine, for load testing the runner without the cluster;
+# see taskrunner/executors.py. TASKRUNNER_SIMULATION tunes the stand-ins, as "key=value" settings
+# separated by spaces (latencies, failure rate, rows per light curve, a seed); empty keeps defaults.
+TASKRUNNER_EXECUTOR = os.environ.get("ATLASSERVER_TASKRUNNER_EXECUTOR", "").strip() or "ssh"
+if TASKRUNNER_EXECUTOR not in {"ssh", "simulated"}:
+    _msg = f"ATLASSERVER_TASKRUNNER_EXECUTOR must be ssh or simulated, not {TASKRUNNER_EXECUTOR!r}"
+    raise ImproperlyConfigured(_msg)
+TASKRUNNER_SIMULATION = os.environ.get("ATLASSERVER_TASKRUNNER_SIMULATION", "").strip()
+
+# Have the runner's leader fold newly finished tasks into binned run time predictions every minute
+# (see forcephot/prediction.py). The task API, the queue page, shortest_first and the start
+# estimates use a task's prediction where there is one, and the median of its request type where
+# not, so without this they all fall back to the medians. Only the runner reads it.
+TASKRUNNER_RUNTIME_PREDICTOR = _env_flag("ATLASSERVER_TASKRUNNER_RUNTIME_PREDICTOR")
+
+# How the queue is ordered, within the guarantee that each user has one task running at a time and
+# one task in each pass of the queue. "round_robin" takes a pass's users in id order, as always.
+# "short_lane" does too, but keeps TASKRUNNER_SHORT_LANE_SLOTS slots for the request types that
+# typically finish within taskrunner.main.SHORT_TASK_SECONDS, so that a run of long image requests
+# cannot take every slot. "shortest_first" takes a pass's tasks by their predicted run times (see
+# forcephot/prediction.py), shortest first. Only the runner reads it: the web app shows the
+# positions the runner gives. Without TASKRUNNER_RUNTIME_PREDICTOR, it orders by the type medians.
+TASKRUNNER_SCHEDULER = os.environ.get("ATLASSERVER_TASKRUNNER_SCHEDULER", "").strip() or "round_robin"
+if TASKRUNNER_SCHEDULER not in {"round_robin", "short_lane", "shortest_first"}:
+    _msg = (
+        "ATLASSERVER_TASKRUNNER_SCHEDULER must be round_robin, short_lane or shortest_first,"
+        f" not {TASKRUNNER_SCHEDULER!r}"
+    )
+    raise ImproperlyConfigured(_msg)
+TASKRUNNER_SHORT_LANE_SLOTS = _env_count("ATLASSERVER_TASKRUNNER_SHORT_LANE_SLOTS", default=4)
+
+# Keep hourly quantile sketches of the run and wait times of finished tasks (see
+# forcephot/sketches.py), which the runner adds each task to as it finishes. The wait estimates and
+# the stats page then read a few hundred rows of sketches instead of thousands of tasks. Both the
+# runner, which writes them, and the web app, which reads them, need it set.
+TASKRUNNER_RUNTIME_SKETCHES = _env_flag("ATLASSERVER_TASKRUNNER_RUNTIME_SKETCHES")
+
+# Simulate the runner working through the queue to estimate when each queued task will start (see
+# taskrunner/eta.py), and publish those for the queue page in place of its own estimate. Only the
+# runner reads it: the web app serves whatever recent estimates the runner has published.
+TASKRUNNER_START_ESTIMATES = _env_flag("ATLASSERVER_TASKRUNNER_START_ESTIMATES")
+
+# Read a forced photometry task's light curve from the remote command's output as it arrives, into
+# a partial result file, rather than as one block at the end and again by rsync; the task's rows
+# received so far are shown while it runs. See taskrunner/streaming.py.
+TASKRUNNER_STREAM_RESULTS = _env_flag("ATLASSERVER_TASKRUNNER_STREAM_RESULTS")
+
+# Start each task's remote command detached from the ssh session, with its output in files on the
+# remote host, and resume the jobs that were running when the runner or its connection went down
+# rather than running their tasks again. See taskrunner/detached.py.
+TASKRUNNER_DETACHED = _env_flag("ATLASSERVER_TASKRUNNER_DETACHED")
+
+# Stop sending tasks to a remote host that keeps failing to connect, and probe it with one task at a
+# time until it answers, and hold back a task whose attempt failed for a backoff that doubles with
+# each failure, rather than retrying it after five seconds. A task that fails TASKRUNNER_MAX_ATTEMPTS
+# times (0 for no limit) is finished with an error. See taskrunner/breaker.py.
+TASKRUNNER_BACKOFF = _env_flag("ATLASSERVER_TASKRUNNER_BACKOFF")
+TASKRUNNER_MAX_ATTEMPTS = _env_count("ATLASSERVER_TASKRUNNER_MAX_ATTEMPTS", default=8)
+
+# Write each finished task's callback and result email to an outbox table, and send them from the
+# runner's delivery threads, with retries and signing, rather than from the slot that ran the task.
+# See taskrunner/outbox.py.
+TASKRUNNER_NOTIFY_OUTBOX = _env_flag("ATLASSERVER_TASKRUNNER_NOTIFY_OUTBOX")
+
 USE_X_FORWARDED_HOST = False
 USE_X_FORWARDED_PORT = False
 
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Stand-ins for ssh and the ATLAS tools, for the simulated executor; see executors.py.
+
+Run as `atlas_simulated.py TOOL ARGS...`. As "ssh HOME HOST COMMAND...", it connects (waits for a
+draw from the connect latency, and fails at the failure rate, as ssh does, with exit code 255),
+then runs the command with sh in HOME. As one of the tools that sc01 has, it takes that tool's
+arguments, waits for a draw from its request type's latency and writes what the tool would: a
+light curve, a stack, a preview image or a zip of cutouts. Only the shape of each file is real.
+
+The settings are the simulation.json that the executor wrote in HOME. With a seed, a tool's draws
+depend only on the seed and its arguments, so a task takes as long and has data or not the same way
+every time it is run, and two runs of a load test see the same tasks. Connection failures are never
+seeded, since the same task failing on every retry is not what they stand for.
+
+Nothing from atlasserver is imported: this runs as the remote side would, from the shell.
+"""
+
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+RESULTFILE_HEADER = "###MJD m dm uJy duJy F err chi/N RA Dec x y maj min phi apfit mag5sig Sky Obs"
+
+# where the light curve's MJDs fall when the request leaves either end open
+DEFAULT_MJD_MIN = 57230.0
+DEFAULT_MJD_MAX = 61000.0
+
+
+def load_simulation(home: Path) -> dict:
+    return json.loads((home / "simulation.json").read_text())
+
+
+def make_rng(simulation: dict, tool: str, args: list[str]) -> random.Random:
+    if simulation["seed"] is None:
+        return random.Random()  # noqa: S311 (a simulation, not cryptography)
+    return random.Random(f"{simulation['seed']} {tool} {' '.join(args)}")  # noqa: S311 (as above)
+
+
+def draw(rng: random.Random, distribution: list) -> float:
+    """Return a number of seconds from a distribution given as [kind, params...]; see executors.py."""
+    kind, *params = distribution
+    if kind == "uniform":
+        return rng.uniform(params[0], params[1])
+    if kind == "lognormal":
+        return rng.lognormvariate(math.log(params[0]), params[1]) if params[0] > 0 else 0.0
+    if kind == "exponential":
+        return rng.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+    return params[0]
+
+
+def ssh(args: list[str]) -> int:
+    home, host, command = Path(args[0]), args[1], " ".join(args[2:])
+    simulation = load_simulation(home)
+    rng = random.Random()  # noqa: S311 (a simulation, not cryptography)
+
+    time.sleep(draw(rng, simulation["connect"]))
+    if rng.random() < simulation["failure_rate"]:
+        print(f"ssh: connect to host {host} port 22: Connection timed out", file=sys.stderr)
+        return 255
+
+    # its own process group, so that the runner cancelling or timing out the "ssh" stops the tools
+    # the command started too, as hanging up on a remote session does
+    proc = subprocess.Popen(
+        ["sh", "-c", command], cwd=home, env={**os.environ, "HOME": str(home)}, start_new_session=True
+    )
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: os.killpg(proc.pid, signal.SIGTERM))
+    return proc.wait()
+
+
+def keyword_args(args: list[str]) -> dict[str, str]:
+    return dict(arg.split("=", 1) for arg in args if "=" in arg)
+
+
+def force(args: list[str], tool: str) -> int:
+    """Print a light curve as force.sh or ssforce.sh does, or only its header when there is no data."""
+    home = Path(os.environ["HOME"])
+    simulation = load_simulation(home)
+    rng = make_rng(simulation, tool, args)
+    time.sleep(draw(rng, simulation["fp"]))
+
+    print(RESULTFILE_HEADER)
+    if rng.random() < simulation["nodata_rate"]:
+        return 0
+
+    options = keyword_args(args)
+    positional = [arg for arg in args if "=" not in arg]
+    ra, dec = (float(positional[0]), float(positional[1])) if tool == "force.sh" else (180.0, 0.0)
+    mjd_min = float(options.get("m0", DEFAULT_MJD_MIN))
+    mjd_max = float(options.get("m1", DEFAULT_MJD_MAX))
+    for _ in range(simulation["rows"]):
+        mjd = rng.uniform(mjd_min, mjd_max)
+        ujy = rng.gauss(100.0, 30.0)
+        mag = 23.9 - 2.5 * math.log10(ujy) if ujy > 0 else -99.0
+        obs = f"0{rng.choice('1234')}a{int(mjd):05d}{rng.choice('co')}{rng.randrange(10000):04d}{rng.choice('co')}"
+        print(
+            f"{mjd:.6f} {mag:.3f} 0.05 {ujy:.0f} 20 {rng.choice('co')} 0 1.05 {ra:.5f} {dec:.5f}"
+            f" 5000.00 5000.00 2.10 2.00 -40.0 -0.5 19.50 20.90 {obs}"
+        )
+    return 0
+
+
+def stack_rock(args: list[str]) -> int:
+    """Write a stack into outdir= as stack_rock.sh does, or only say there is none."""
+    home = Path(os.environ["HOME"])
+    simulation = load_simulation(home)
+    rng = make_rng(simulation, "stack_rock.sh", args)
+    time.sleep(draw(rng, simulation["ssostack"]))
+
+    name = args[0]
+    if rng.random() < simulation["nodata_rate"]:
+        print(f"No observations of {name} between MJD {args[1]} and {args[2]}")
+        return 0
+
+    outdir = Path(keyword_args(args)["outdir"].replace("~", str(home), 1))
+    outdir.mkdir(parents=True, exist_ok=True)
+    cards = [
+        "SIMPLE  =                    T",
+        "BITPIX  =                    8",
+        "NAXIS   =                    0",
+        "END",
+    ]
+    (outdir / f"{name.replace(' ', '_')}.fits").write_text("".join(card.ljust(80) for card in cards).ljust(2880))
+    print(f"Stacked {rng.randrange(1, 50)} images of {name}")
+    return 0
+
+
+def write_preview(resultfile: Path) -> None:
+    # a light curve with no rows has nothing to make a preview of, as on sc01
+    if resultfile.exists() and len(resultfile.read_text().splitlines()) > 1:
+        resultfile.with_suffix(".jpg").write_bytes(b"\xff\xd8\xff\xe0 simulated preview \xff\xd9")
+
+
+def gettaskimages(args: list[str]) -> int:
+    """Zip the data file with a cutout, as atlas_gettaskimages.py zips the images it lists."""
+    home = Path(os.environ["HOME"])
+    simulation = load_simulation(home)
+    time.sleep(draw(make_rng(simulation, "atlas_gettaskimages.py", args), simulation["imgzip"]))
+
+    datafile = Path(args[0])
+    with zipfile.ZipFile(datafile.with_suffix(".zip"), "w") as archive:
+        archive.write(datafile, datafile.name)
+        archive.writestr(f"{datafile.stem}_cutout.fits", "SIMPLE  =                    T".ljust(2880))
+    return 0
+
+
+def main() -> None:
+    tool, args = sys.argv[1], sys.argv[2:]
+    if tool == "ssh":
+        sys.exit(ssh(args))
+    elif tool in {"force.sh", "ssforce.sh"}:
+        sys.exit(force(args, tool))
+    elif tool == "stack_rock.sh":
+        sys.exit(stack_rock(args))
+    elif tool in {"atlas_gettaskimage.py", "atlas_gettaskimage_ssostack.py"}:
+        write_preview(Path(args[0]))
+    elif tool == "atlas_gettaskimages.py":
+        sys.exit(gettaskimages(args))
+    else:
+        print(f"ERROR: {tool} is not simulated")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
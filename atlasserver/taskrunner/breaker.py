@@ -0,0 +1,131 @@
+"""A circuit breaker for each remote host, from what the attempts sent to it found, with settings.TASKRUNNER_BACKOFF.
+
+While sc01 was unreachable, every slot's task failed to connect, do_task() slept five seconds, and the
+task was dispatched again at once, to fail again: sixteen new ssh connections every few seconds for
+as long as the outage lasted, a log full of them, and an attempt_count that grew without bound.
+
+The dispatcher now keeps a breaker for each host. Closed, tasks go to the host as they always did,
+and the connection failures in a row are counted. After BREAKER_OPEN_AFTER_FAILURES of them it
+opens, and nothing is sent to the host for a while; then it is half open, and one task is sent as a
+probe. The probe reaching the host closes the breaker, and its failing opens it again for twice as
+long, up to BREAKER_MAX_OPEN_SECONDS.
+
+A connection failure is ssh's exit status 255, which is what it exits with when it cannot connect
+or loses the connection. Each slot's process records the exit statuses of its attempt's commands
+(see record_exit_status()), and tells the dispatcher what they found when the slot frees.
+
+The tasks' own backoff, and the limit on their attempts, are in taskrunner.main.retry_later().
+
+No Django here, as in status.py: the slots' commands record into this module from anywhere.
+"""
+
+import math
+import time
+import typing as t
+
+# what ssh exits with when it could not connect to the host, or lost the connection; the simulated
+# executor's stand-in does the same (see atlas_simulated.py)
+SSH_CONNECTION_FAILED: t.Final = 255
+
+# what an attempt found of its host: it answered, or it could not be reached. None is neither, for
+# an attempt that never connected to it, such as one answered from the result cache.
+HOST_ANSWERED: t.Final = "answered"
+HOST_UNREACHABLE: t.Final = "unreachable"
+
+BREAKER_CLOSED: t.Final = "closed"
+BREAKER_OPEN: t.Final = "open"
+BREAKER_HALF_OPEN: t.Final = "half_open"
+
+# How many connection failures in a row open a host's breaker. More than one, so that a dropped
+# connection does not stop dispatch; fewer than the slots, so that an outage costs less than one
+# round of them.
+BREAKER_OPEN_AFTER_FAILURES: int = 4
+
+# how long a breaker stays open the first time, and at most, as it doubles with each failed probe
+BREAKER_OPEN_SECONDS: float = 30.0
+BREAKER_MAX_OPEN_SECONDS: float = 15 * 60.0
+
+# In a slot's process, what the commands of its current attempt have found of the host. Module
+# state, as pool.slot_cancel_event is: it belongs to the slot's process rather than to any one call.
+_attempt_found: set[str] = set()
+
+
+def start_attempt() -> None:
+    """Forget what the slot's last attempt found, at the start of the next."""
+    _attempt_found.clear()
+
+
+def record_exit_status(returncode: int | None) -> None:
+    """Record the exit status of one of the attempt's commands that connects to the host.
+
+    None, for a command that was killed before it exited, found nothing either way.
+    """
+    if returncode is not None:
+        _attempt_found.add(HOST_UNREACHABLE if returncode == SSH_CONNECTION_FAILED else HOST_ANSWERED)
+
+
+def attempt_outcome() -> str | None:
+    """Return what the attempt found of its host: HOST_UNREACHABLE if any command could not connect."""
+    if HOST_UNREACHABLE in _attempt_found:
+        return HOST_UNREACHABLE
+    return HOST_ANSWERED if HOST_ANSWERED in _attempt_found else None
+
+
+class CircuitBreaker:
+    """Whether tasks may be sent to one host, from what the attempts already sent there found."""
+
+    def __init__(self, host: str, logfunc: t.Callable[[str], None]) -> None:
+        """Start closed, for the host named `host`."""
+        self.host = host
+        self.logfunc = logfunc
+        self.state = BREAKER_CLOSED
+        self.failures = 0  # connection failures in a row
+        self.open_seconds = BREAKER_OPEN_SECONDS
+        self.opened = -math.inf
+        self.probe_slot: int | None = None  # the slot whose task is the half-open breaker's probe
+
+    def allows_dispatch(self) -> bool:
+        """Return whether a task may be sent to the host now: closed, or half open with no probe out."""
+        if self.state == BREAKER_OPEN and (time.monotonic() - self.opened) >= self.open_seconds:
+            self.state = BREAKER_HALF_OPEN
+            self.logfunc(f"host {self.host}: the circuit breaker is half open, and the next task is a probe")
+        return self.state == BREAKER_CLOSED or (self.state == BREAKER_HALF_OPEN and self.probe_slot is None)
+
+    def dispatched(self, slotid: int) -> None:
+        """Note that a task has been sent to the host in `slotid`, which while half open is the probe."""
+        if self.state == BREAKER_HALF_OPEN:
+            self.probe_slot = slotid
+
+    def record(self, slotid: int, outcome: str | None) -> None:
+        """Take what the attempt that was in `slotid` found of the host, as its slot frees."""
+        probe = slotid == self.probe_slot
+        if probe:
+            self.probe_slot = None
+
+        if outcome == HOST_ANSWERED:
+            if self.state != BREAKER_CLOSED:
+                self.logfunc(f"host {self.host}: answered again, and the circuit breaker is closed")
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+            self.open_seconds = BREAKER_OPEN_SECONDS
+        elif outcome == HOST_UNREACHABLE:
+            self.failures += 1
+            if probe and self.state == BREAKER_HALF_OPEN:
+                self.open(min(self.open_seconds * 2, BREAKER_MAX_OPEN_SECONDS))
+            elif self.state == BREAKER_CLOSED and self.failures >= BREAKER_OPEN_AFTER_FAILURES:
+                self.open(BREAKER_OPEN_SECONDS)
+        # an attempt that found nothing leaves the breaker as it was, and a probe that found nothing
+        # is replaced by the next task
+
+    def open(self, seconds: float) -> None:
+        self.state = BREAKER_OPEN
+        self.opened = time.monotonic()
+        self.open_seconds = seconds
+        self.logfunc(
+            f"host {self.host}: {self.failures} connection failures in a row, so the circuit breaker is open"
+            f" and no task is sent there for {seconds:.0f} seconds"
+        )
+
+    def snapshot(self) -> dict[str, t.Any]:
+        """Return the breaker's state, for the status file."""
+        return {"state": self.state, "failures": self.failures}
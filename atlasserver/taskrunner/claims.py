@@ -0,0 +1,147 @@
+"""Running the queue from more than one task runner instance, with settings.TASKRUNNER_CLAIMS.
+
+A single runner owns every slot: it remembers in its own dicts which users have a task running,
+and the rest of the system takes the task started most recently to be the running one. That puts a
+ceiling on capacity at the slots one process manages, and the whole service stops when that
+process or its machine does.
+
+With claims, dispatch goes through the database instead. A runner takes a task by inserting its
+TaskClaim row, which can exist once per task and once per user, so the insert itself is what stops
+two runners starting the same task or running two tasks of one user. The candidates are read with
+SELECT ... FOR UPDATE SKIP LOCKED, so runners claiming at the same moment pass over each other's
+rows rather than queueing behind them.
+
+A claim carries a lease that its runner renews while the task runs. A runner that dies stops
+renewing, and once the lease has passed, the next runner to claim removes the claim and the task is
+run again, as a task that failed without a definite error already is. Lease times are compared
+across machines, so their clocks are expected to be kept in step (NTP is ample at these scales).
+
+The work that must happen once rather than once per runner -- the hourly maintenance sweep, and
+renumbering the queue -- goes to whichever runner holds the leader lease, which another runner
+takes over once its holder stops renewing it.
+"""
+
+import datetime
+import os
+import socket
+import typing as t
+
+from django.db import IntegrityError
+from django.db import models
+from django.db import transaction
+
+from atlasserver.forcephot.models import RunnerLease
+from atlasserver.forcephot.models import Task
+from atlasserver.forcephot.models import TaskClaim
+
+# How long a claim or the leader lease stays valid without being renewed. Long enough that a slow
+# pass of the runner's loop does not lose its tasks to another runner; short enough that the tasks
+# of a runner that died are picked up again within a couple of minutes.
+LEASE_SECONDS: float = 120.0
+
+# how often a runner renews its claims and the leader lease, if it holds it
+RENEW_SECONDS: float = 30.0
+
+LEADER_LEASE_NAME: t.Final = "leader"
+
+# At most this many candidates are locked and tried per claim. A claim fails on a candidate only
+# when another runner has just taken that user or that task, so a few will do; the limit bounds the
+# rows held locked while they are tried.
+CLAIM_SCAN_LIMIT: int = 50
+
+
+def runner_id() -> str:
+    """Return a name for this runner instance that no other one running at the same time has."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_expiry() -> datetime.datetime:
+    return datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=LEASE_SECONDS)
+
+
+def claim_next_task(
+    runnerid: str,
+    slotid: int,
+    running_fingerprints: set[str] | None = None,
+    request_types: set[str] | None = None,
+) -> Task | None:
+    """Claim the first task in queue order that no runner holds and whose user has nothing running.
+
+    Returns None when there is none. A task identical to one running in this runner (see
+    TASKRUNNER_DEDUPLICATE) is passed over; the runners do not compare those between them.
+    `request_types`, if given, are the only types this runner can start now (see hosts.py).
+    """
+    # A claim that has outlived its lease belongs to a runner that has stopped, and until it goes,
+    # its task and every other task of its user are blocked. Cleared before the read so that
+    # they are candidates in this same claim.
+    TaskClaim.objects.filter(lease_expires__lt=datetime.datetime.now(datetime.UTC)).delete()
+
+    candidates = (
+        Task.dispatchable()
+        .exclude(id__in=TaskClaim.objects.values("task_id"))
+        .exclude(user_id__in=TaskClaim.objects.values("user_id"))
+        .order_by("queuepos_relative", "id")
+    )
+    if request_types is not None:
+        candidates = candidates.filter(request_type__in=request_types)
+
+    with transaction.atomic():
+        for task in candidates.select_for_update(skip_locked=True, of=("self",))[:CLAIM_SCAN_LIMIT]:
+            if running_fingerprints and task.request_fingerprint() in running_fingerprints:
+                continue
+
+            try:
+                # a savepoint, so that losing this one leaves the transaction usable for the next
+                with transaction.atomic():
+                    TaskClaim.objects.create(
+                        task=task, user_id=task.user_id, runner=runnerid, slotid=slotid, lease_expires=lease_expiry()
+                    )
+            except IntegrityError:
+                # another runner claimed a task of this user since the read; its rows were not
+                # locked, since it is another task
+                continue
+
+            return task
+
+    return None
+
+
+def renew_claims(runnerid: str) -> int:
+    """Extend the lease on every claim this runner holds, and return how many it still holds."""
+    return TaskClaim.objects.filter(runner=runnerid).update(lease_expires=lease_expiry())
+
+
+def release_claims(runnerid: str, taskids: t.Iterable[int]) -> None:
+    """Give up this runner's claims on the given tasks, whose slots have freed."""
+    TaskClaim.objects.filter(runner=runnerid, task_id__in=list(taskids)).delete()
+
+
+def acquire_lease(name: str, holder: str) -> bool:
+    """Take or renew the named lease for `holder`, and return whether it holds it now.
+
+    Renewed when `holder` already has it, and taken over when whoever had it let it lapse. The
+    update is conditional on exactly that in one statement, so of two runners trying at once only
+    one can succeed; when there is no row yet, the primary key decides the same way.
+    """
+    now = datetime.datetime.now(datetime.UTC)
+    expires = lease_expiry()
+
+    if (
+        RunnerLease.objects.filter(name=name)
+        .filter(models.Q(holder=holder) | models.Q(expires__lt=now))
+        .update(holder=holder, expires=expires)
+    ):
+        return True
+
+    try:
+        with transaction.atomic():
+            RunnerLease.objects.create(name=name, holder=holder, expires=expires)
+    except IntegrityError:
+        return False
+
+    return True
+
+
+def release_lease(name: str, holder: str) -> None:
+    """Give up the named lease, if `holder` has it, so that another runner need not wait for it to lapse."""
+    RunnerLease.objects.filter(name=name, holder=holder).delete()
@@ -0,0 +1,271 @@
+"""Remote jobs that outlive the ssh session that started them, with settings.TASKRUNNER_DETACHED.
+
+A task's remote command ran in the foreground of its ssh session, so whatever ended the session
+ended the job: a dropped connection, a restart of the runner, a reboot of its machine. The task was
+then run again from the start, throwing away up to TASK_MAXTIME_SECONDS of sc01's work per slot.
+
+Detached, the command is started with setsid and nohup in a session of its own, with its standard
+output, standard error and exit status going to files on the host, and one short ssh command
+returns its process id. The runner then attaches to it in a second session, which follows the
+output file until the job exits and passes on what it writes; ending that session leaves the job
+running. A TaskAttempt row, written before the job starts, records where its files are and then its
+process id. It and the job's files are kept until the runner has brought the task's result files
+back (see finish_job()), so that a runner stopping after the job exits and before that attaches to
+the exited job again, rather than running the task again.
+
+A task dispatched while it has an attempt is resumed rather than started again: the host is asked
+what became of the job, and the runner attaches to it if it is running or has finished, which for a
+finished one collects its output at once. Only a job that is gone -- stopped, collected, or lost
+with a reboot of the host -- is run again. At startup the runner asks about every attempt, before
+it dispatches anything (see recover_attempts()).
+"""
+
+import datetime
+import shlex
+import subprocess
+import typing as t
+
+from atlasserver.forcephot.models import Task
+from atlasserver.forcephot.models import TaskAttempt
+from atlasserver.forcephot.models import TaskClaim
+from atlasserver.taskrunner import breaker
+from atlasserver.taskrunner import claims
+from atlasserver.taskrunner import executors
+
+# where the jobs' files go on the remote host, one set per attempt
+ATTEMPTS_DIR: t.Final = "~/atlasserver/attempts"
+
+# How long the short commands that start a job and ask about one are given. Generous, because they
+# connect anew when the ssh connections are not multiplexed.
+COMMAND_TIMEOUT_SECONDS: float = 60.0
+
+# what the status command says of a job
+JOB_RUNNING: t.Final = "running"
+JOB_EXITED: t.Final = "exited"
+JOB_GONE: t.Final = "gone"
+
+
+class RemoteJob:
+    """An attempt's detached job, as the shell commands that start it, attach to it, ask about it and stop it."""
+
+    def __init__(self, attempt: TaskAttempt) -> None:
+        """Describe the job of `attempt`, whose files are at its remote_prefix."""
+        self.attempt = attempt
+        prefix = attempt.remote_prefix
+        self.pidfile = f"{prefix}.pid"
+        self.outfile = f"{prefix}.out"
+        self.errfile = f"{prefix}.err"
+        self.exitfile = f"{prefix}.exit"
+
+    def launch_command(self, command: str) -> str:
+        """Return the remote command that starts `command` detached and prints its process id.
+
+        The exit status is written by the shell that runs the command, which is the job's session
+        leader, once the command has exited; it is written to a temporary name and renamed, so
+        that an exit file is always whole.
+        """
+        wrapped = f"({command}); echo $? > {self.exitfile}.tmp && mv {self.exitfile}.tmp {self.exitfile}"
+        return (
+            f"mkdir -p {ATTEMPTS_DIR} || exit 1; "
+            f"setsid nohup sh -c {shlex.quote(wrapped)} > {self.outfile} 2> {self.errfile} < /dev/null & "
+            f"echo $! > {self.pidfile} && cat {self.pidfile}"
+        )
+
+    def attach_command(self) -> str:
+        """Return the remote command that passes on the job's output, from the start, until it exits.
+
+        Its standard output is the job's, passed on each second as it grows, and its standard error
+        the job's once it has exited. The job's files are left for finish_job(). It exits 0 for any
+        job that exited, since the runner judges a task by its result files, so that 255 is only
+        ever ssh's own failure: the session, and not the job, having ended.
+
+        The job is over once its exit file is there, rather than once its process is gone: a
+        process that nothing has reaped yet still answers kill -0, as it does to tail --pid. Its
+        process is only asked about for a job that has no exit file coming, killed or lost.
+        """
+        return (
+            "sent=0; while :; do "
+            f'if [ -e {self.exitfile} ] || ! kill -0 "$(cat {self.pidfile})" 2>/dev/null; '
+            "then over=1; else over=0; fi; "
+            f"size=$(wc -c < {self.outfile}); "
+            f'[ "$size" -gt "$sent" ] && tail -c +$((sent + 1)) {self.outfile} | head -c $((size - sent)); '
+            'sent=$size; [ "$over" = 1 ] && break; sleep 1; done; '
+            f"cat {self.errfile} >&2; "
+            f"[ -e {self.exitfile} ] && exit 0; "
+            "echo 'the detached job stopped without an exit status' >&2; exit 1"
+        )
+
+    def status_command(self) -> str:
+        return (
+            f"if [ -e {self.exitfile} ]; then echo {JOB_EXITED}; "
+            f'elif [ -e {self.pidfile} ] && kill -0 "$(cat {self.pidfile})" 2>/dev/null; then echo {JOB_RUNNING}; '
+            f"else echo {JOB_GONE}; fi"
+        )
+
+    def remove_command(self) -> str:
+        """Return the remote command that removes the files of a job that has exited."""
+        return f"rm -f {self.pidfile} {self.outfile} {self.errfile} {self.exitfile}"
+
+    def kill_command(self) -> str:
+        """Return the remote command that stops the job and everything it started, and removes its files."""
+        return (
+            f'[ -e {self.pidfile} ] && kill -s TERM -- "-$(cat {self.pidfile})" 2>/dev/null; '
+            f"rm -f {self.pidfile} {self.outfile} {self.errfile} {self.exitfile} {self.exitfile}.tmp"
+        )
+
+
+def run_short_command(host: str, slotid: int, command: str) -> subprocess.CompletedProcess[str]:
+    """Run one of the short remote commands and return how it went; raises subprocess.TimeoutExpired."""
+    executor = executors.executor_for(host)
+    result = subprocess.run(
+        [*executor.shell_argv(slotid), executor.prepare_command(command)],
+        capture_output=True,
+        text=True,
+        timeout=COMMAND_TIMEOUT_SECONDS,
+        check=False,
+    )
+    breaker.record_exit_status(result.returncode)
+    return result
+
+
+def launch_job(
+    task: Task, command: str, host: str, slotid: int, logfunc: t.Callable[[t.Any], None]
+) -> RemoteJob | None:
+    """Start `command` as a detached job for a new attempt at `task`, and return it, or None if it did not start.
+
+    The attempt is recorded before the job is started, so that a runner stopping between the two
+    leaves a record of a job that may exist rather than a job that nothing knows of.
+    """
+    attempt = TaskAttempt.objects.create(
+        task=task, number=task.attempt_count, runner=claims.runner_id(), host=host, remote_prefix="", remote_pid=None
+    )
+    attempt.remote_prefix = f"{ATTEMPTS_DIR}/attempt{attempt.id:06d}"
+    attempt.save(update_fields=["remote_prefix"])
+    job = RemoteJob(attempt)
+
+    logfunc(f"Starting detached on {host}: {command}")
+    try:
+        result = run_short_command(host, slotid, job.launch_command(command))
+    except subprocess.TimeoutExpired:
+        result = None
+    pid = result.stdout.strip() if result is not None and result.returncode == 0 else ""
+    if not pid.isdecimal():
+        # It may have started without saying so. It is stopped, if so, since this attempt is about
+        # to be retried from the start.
+        logfunc(f"ERROR: the detached job did not start on {host}: {result.stderr.strip() if result else 'timed out'}")
+        stop_job(job, slotid, logfunc)
+        return None
+
+    attempt.remote_pid = int(pid)
+    attempt.save(update_fields=["remote_pid"])
+    logfunc(f"Detached job started on {host} with process id {pid}")
+    return job
+
+
+def job_status(job: RemoteJob, slotid: int) -> str | None:
+    """Return JOB_RUNNING, JOB_EXITED or JOB_GONE for a job, or None when its host could not be asked."""
+    try:
+        result = run_short_command(job.attempt.host, slotid, job.status_command())
+    except subprocess.TimeoutExpired:
+        return None
+    status = result.stdout.strip()
+    return status if result.returncode == 0 and status in {JOB_RUNNING, JOB_EXITED, JOB_GONE} else None
+
+
+def stop_job(job: RemoteJob, slotid: int, logfunc: t.Callable[[t.Any], None]) -> None:
+    """Stop a job and remove its files and its attempt, which is then over."""
+    try:
+        run_short_command(job.attempt.host, slotid, job.kill_command())
+    except subprocess.TimeoutExpired:
+        # the attempt is dropped all the same: the job ends at its own time limit, and a kept
+        # attempt would be resumed into a job that is on its way out
+        logfunc(f"ERROR: timed out stopping the detached job on {job.attempt.host}")
+    job.attempt.delete()
+
+
+def finish_job(job: RemoteJob, slotid: int, logfunc: t.Callable[[t.Any], None]) -> None:
+    """Remove the files of a job that has exited, and its attempt, once the runner has what it needed of them."""
+    try:
+        run_short_command(job.attempt.host, slotid, job.remove_command())
+    except subprocess.TimeoutExpired:
+        # a few small files left in ATTEMPTS_DIR, which nothing reads again once the attempt is gone
+        logfunc(f"ERROR: timed out removing the files of the detached job on {job.attempt.host}")
+    job.attempt.delete()
+
+
+def attempt_host(task: Task) -> str | None:
+    """Return the host of `task`'s last attempt, which it is resumed on, or None if it has no attempt."""
+    return TaskAttempt.objects.filter(task=task).order_by("-id").values_list("host", flat=True).first()
+
+
+def resumable_taskids(taskids: t.Iterable[int]) -> set[int]:
+    """Return which of `taskids` have a detached job out, which a runner handing over may leave running.
+
+    A task is in that phase from when its job has a process id until its results are back (see
+    finish_job()). Before that, its slot may be starting the job, or running a batch, which runs
+    attached; after it, the slot is finishing the task. Stopping the slot in any of those loses work.
+    """
+    return set(
+        TaskAttempt.objects.filter(task_id__in=list(taskids), remote_pid__isnull=False).values_list(
+            "task_id", flat=True
+        )
+    )
+
+
+def resumable_job(task: Task, slotid: int, logfunc: t.Callable[[t.Any], None]) -> RemoteJob | t.Literal[False] | None:
+    """Return the job of `task`'s last attempt if it is running or has finished, to be attached to.
+
+    None when there is none, and the task starts a new attempt. False when the host could not be
+    asked, and the task must wait: starting it again while its job may still be running would have
+    two jobs writing one result file.
+    """
+    attempt = TaskAttempt.objects.filter(task=task).order_by("-id").first()
+    if attempt is None:
+        return None
+
+    job = RemoteJob(attempt)
+    status = job_status(job, slotid)
+    if status is None:
+        logfunc(f"ERROR: could not ask {attempt.host} about the detached job of attempt {attempt.number}")
+        return False
+    if status == JOB_GONE:
+        logfunc(f"The detached job of attempt {attempt.number} on {attempt.host} is gone, so the task starts again")
+        attempt.delete()
+        return None
+
+    logfunc(f"Resuming attempt {attempt.number}, whose detached job on {attempt.host} has {status}")
+    return job
+
+
+def recover_attempts(runnerid: str, logfunc: t.Callable[[t.Any], None]) -> None:
+    """Find out what became of the detached jobs that were out when a runner stopped, before dispatching.
+
+    A job that is running or has finished is left for its task's next dispatch to attach to, and
+    the task, having been dispatched before anything queued since, is one of the first. The record
+    of a job that is gone is deleted, so that its task starts again; so is the job of a task deleted
+    meanwhile, once it has been stopped. An attempt whose task another live runner has claimed is
+    that runner's, and is left alone.
+    """
+    heldelsewhere = TaskClaim.objects.filter(lease_expires__gte=datetime.datetime.now(datetime.UTC)).exclude(
+        runner=runnerid
+    )
+    attempts = list(TaskAttempt.objects.exclude(task_id__in=heldelsewhere.values("task_id")).order_by("id"))
+    if attempts:
+        logfunc(f"Recovering {len(attempts)} detached jobs from before the restart")
+
+    for attempt in attempts:
+        job = RemoteJob(attempt)
+        if attempt.task_id is None:
+            logfunc(f"Stopping the detached job on {attempt.host} of a task deleted since (pid {attempt.remote_pid})")
+            stop_job(job, slotid=0, logfunc=logfunc)
+            continue
+
+        status = job_status(job, slotid=0)
+        if status is None:
+            # asked again when the task is dispatched
+            logfunc(f"ERROR: could not ask {attempt.host} about the detached job of task {attempt.task_id}")
+        elif status == JOB_GONE:
+            logfunc(f"Task {attempt.task_id}: its detached job on {attempt.host} is gone, and it will run again")
+            attempt.delete()
+        else:
+            logfunc(f"Task {attempt.task_id}: its detached job on {attempt.host} has {status}, and will be resumed")
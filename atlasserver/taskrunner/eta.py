@@ -0,0 +1,232 @@
+"""When each queued task is likely to start, from simulating the runner working through the queue.
+
+The queue page's wait estimate (waitestimate.js) prices a task's wait from its position: the user's
+own tasks ahead of it one after another, and everyone else's in passes of min(slots, users) at a
+time, each at the mean of the medians of what is queued. It cannot see which tasks are ahead of
+which, how long the running tasks have left, or that a user's tasks queued behind a long one of
+theirs wait for it whatever slot comes free.
+
+This runs the dispatch loop itself, forward in time, over the queue as the runner has ordered it:
+each slot that frees takes the first queued task whose user has nothing running (and, with
+settings.TASKRUNNER_SCHEDULER = "short_lane", whose type the lanes allow), a running task frees its
+slot after the rest of its run time, and a queued task runs for a draw from the recent run times of
+the tasks like it (see forcephot/prediction.py). Done ETA_SIMULATIONS times over, each queued task
+gets as many start times, of which the median and the 90th percentile are its estimate.
+
+The runner's leader does this every ETA_REFRESH_SECONDS with settings.TASKRUNNER_START_ESTIMATES,
+on a thread of its own (see taskrunner.main.StartEstimator), and publishes the result for the web
+app (see taskrunner.status.write_start_estimates).
+
+Each simulation is O(n log n) in the queued tasks: the users with nothing running are kept in a
+heap by the position of their first queued task, so that finding the next task to start does not
+scan the queue. All of them together take under a second for 10,000 queued tasks.
+"""
+
+import datetime
+import heapq
+import math
+import random
+import statistics
+import typing as t
+from collections import deque
+
+from atlasserver.forcephot import prediction
+from atlasserver.forcephot import queue as taskqueue
+from atlasserver.forcephot.misc import datetime_to_mjd
+from atlasserver.forcephot.models import Task
+
+# How many times the queue is drained. Enough for a steady 90th percentile; each one costs about as
+# much as the rest of a refresh put together.
+ETA_SIMULATIONS: t.Final = 24
+
+# How often the leader recomputes the estimates. Between refreshes, a reader subtracts their age.
+ETA_REFRESH_SECONDS: t.Final = 30.0
+
+# The same queue and run times give the same estimates, so that they do not wander from one
+# refresh to the next with nothing having changed.
+ETA_SEED: t.Final = 0
+
+# (task id, user id, request type): a queued task as the simulation sees it, in queue order
+type QueuedTask = tuple[int, int, str]
+
+
+class StartEstimates:
+    """The start time of each queued task, as the median and the 90th percentile of the simulations."""
+
+    def __init__(self, starts: dict[int, tuple[float, float]], drain: tuple[float, float] | None) -> None:
+        """Hold each task's (median, 90th percentile) start in seconds from now, and the same for the last."""
+        self.starts = starts
+        self.drain = drain
+
+
+def percentile(ordered: t.Sequence[float], fraction: float) -> float:
+    """Return the value at `fraction` of the way through an ordered, non-empty sequence, rounding up."""
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def runtime_distributions(
+    features: dict[int, "prediction.Features"], mjdnow: float
+) -> dict[int, t.Sequence[float]] | None:
+    """Return the run times that each task's run time is drawn from, or None when nothing is known.
+
+    The samples of the finest bin of the predictor with enough of them. A task with none is given its
+    request type's median from typical_runtime_seconds(), and failing that the longest of those
+    medians, since a rare type is more often a slow one. None when there is not even that to go on.
+    """
+    samples = prediction.runtime_bin_samples()
+    medians = taskqueue.typical_runtime_seconds()
+    if not samples and not medians:
+        return None
+
+    fallback = max(medians.values()) if medians else statistics.median(v for s in samples.values() for v in s)
+    # one tuple per bin, shared by every task in it
+    binned: dict[str, tuple[float, ...]] = {
+        key: tuple(runtimes) for key, runtimes in samples.items() if len(runtimes) >= prediction.BIN_MIN_SAMPLES
+    }
+    distributions: dict[int, t.Sequence[float]] = {}
+    for taskid, taskfeatures in features.items():
+        key = next((key for key in prediction.bin_keys(taskfeatures, mjdnow) if key in binned), None)
+        distributions[taskid] = binned[key] if key is not None else (medians.get(taskfeatures[0], fallback),)
+
+    return distributions
+
+
+def simulate_starts(
+    queued: t.Sequence[QueuedTask],
+    runtimes: t.Sequence[float],
+    running: t.Iterable[tuple[int, float, str]],
+    numslots: int,
+    short_types: set[str] | None = None,
+    long_slots: int | None = None,
+) -> list[float]:
+    """Return the start time, in seconds from now, of each queued task in one drain of the queue.
+
+    `queued` is in queue order, without the running tasks, and `runtimes` is what each takes.
+    `running` is (user id, seconds left, request type) for each running task. With `short_types`
+    and `long_slots`, tasks of any other type may hold at most `long_slots` slots, as the short
+    lane allows (see taskrunner.main.lane_request_types). A task that never starts -- only when
+    there are no slots -- is given infinity.
+    """
+    lanes = short_types is not None and long_slots is not None
+    # each user's queued tasks, by index into `queued`, front first
+    usertasks: dict[int, deque[int]] = {}
+    for index, (_, userid, _) in enumerate(queued):
+        usertasks.setdefault(userid, deque()).append(index)
+
+    # (when it finishes, user id, whether it is long) for each running task
+    finishing: list[tuple[float, int, bool]] = []
+    for userid, remaining, request_type in running:
+        finishing.append((remaining, userid, lanes and request_type not in t.cast("set[str]", short_types)))
+    heapq.heapify(finishing)
+    busyusers = {userid for _, userid, _ in finishing}
+    freeslots = numslots - len(finishing)
+    runninglong = sum(1 for _, _, islong in finishing if islong)
+
+    # The users with nothing running, by the index of their first queued task: one heap for those
+    # whose first task is of a short type, and one for the rest. Without lanes, all are "short".
+    shortheads: list[tuple[int, int]] = []
+    longheads: list[tuple[int, int]] = []
+
+    def islong(index: int) -> bool:
+        return lanes and queued[index][2] not in t.cast("set[str]", short_types)
+
+    def queue_head(userid: int) -> None:
+        if tasks := usertasks.get(userid):
+            head = tasks[0]
+            heapq.heappush(longheads if islong(head) else shortheads, (head, userid))
+
+    for userid in usertasks:
+        if userid not in busyusers:
+            queue_head(userid)
+
+    starts = [math.inf] * len(queued)
+    now = 0.0
+    while True:
+        while freeslots > 0:
+            longallowed = longheads and (not lanes or runninglong < t.cast("int", long_slots))
+            if shortheads and (not longallowed or shortheads[0] < longheads[0]):
+                index, userid = heapq.heappop(shortheads)
+            elif longallowed:
+                index, userid = heapq.heappop(longheads)
+            else:
+                break
+            usertasks[userid].popleft()
+            starts[index] = now
+            taskislong = islong(index)
+            runninglong += taskislong
+            freeslots -= 1
+            heapq.heappush(finishing, (now + runtimes[index], userid, taskislong))
+
+        if not finishing:
+            break
+        now, userid, waslong = heapq.heappop(finishing)
+        runninglong -= waslong
+        freeslots += 1
+        queue_head(userid)
+
+    return starts
+
+
+def estimate_start_times(
+    running_taskids: t.Iterable[int],
+    numslots: int,
+    order: t.Sequence[tuple[int, int]] | None = None,
+    short_types: set[str] | None = None,
+    long_slots: int | None = None,
+) -> StartEstimates | None:
+    """Return when each queued task is likely to start, or None when no run time is known to simulate with.
+
+    `running_taskids` are the tasks running now, and `order` the runner's own queue order with
+    settings.TASKRUNNER_VIRTUAL_QUEUE (a task submitted since goes at the back, as in
+    QueueSnapshot.position); without it, the positions stored on the tasks give the order. One query
+    reads every queued task, and everything after it is in memory.
+    """
+    runningids = set(running_taskids)
+    rows = list(
+        Task.queued().values_list("id", "user_id", "queuepos_relative", "starttimestamp", *prediction.FEATURE_FIELDS)
+    )
+    now = datetime.datetime.now(datetime.UTC)
+    features: dict[int, prediction.Features] = {
+        taskid: t.cast("prediction.Features", tuple(taskfeatures)) for taskid, _, _, _, *taskfeatures in rows
+    }
+    distributions = runtime_distributions(features, mjdnow=datetime_to_mjd(now))
+    if distributions is None:
+        return None
+
+    positions = {taskid: position for position, (taskid, _) in enumerate(order)} if order is not None else None
+    waiting = sorted(
+        (row for row in rows if row[0] not in runningids),
+        key=lambda row: (
+            positions.get(row[0], len(positions)) if positions is not None else (row[2] is None, row[2] or 0),
+            row[0],
+        ),
+    )
+    queued: list[QueuedTask] = [(taskid, userid, request_type) for taskid, userid, _, _, request_type, *_ in waiting]
+    elapsed = {
+        taskid: (userid, (now - started).total_seconds() if started is not None else 0.0, request_type)
+        for taskid, userid, _, started, request_type, *_ in rows
+        if taskid in runningids
+    }
+
+    rng = random.Random(ETA_SEED)  # noqa: S311 (a simulation, not cryptography)
+    simulations: list[list[float]] = []
+    for _ in range(ETA_SIMULATIONS):
+        runtimes = [(samples := distributions[taskid])[int(rng.random() * len(samples))] for taskid, _, _ in queued]
+        running = []
+        for taskid, (userid, seconds, request_type) in elapsed.items():
+            # what is left of a run time drawn from those longer than it has already run, or none
+            # left when it has outrun all of them
+            longer = [runtime - seconds for runtime in distributions[taskid] if runtime > seconds]
+            running.append((userid, longer[int(rng.random() * len(longer))] if longer else 0.0, request_type))
+        simulations.append(simulate_starts(queued, runtimes, running, numslots, short_types, long_slots))
+
+    starts: dict[int, tuple[float, float]] = {}
+    for (taskid, _, _), taskstarts in zip(queued, zip(*simulations, strict=True), strict=True):
+        ordered = sorted(taskstarts)
+        if math.isfinite(ordered[-1]):
+            starts[taskid] = (round(percentile(ordered, 0.5), 1), round(percentile(ordered, 0.9), 1))
+
+    lasts = sorted(max(simulation, default=0.0) for simulation in simulations)
+    drain = (round(percentile(lasts, 0.5), 1), round(percentile(lasts, 0.9), 1)) if math.isfinite(lasts[-1]) else None
+
+    return StartEstimates(starts, drain)
@@ -0,0 +1,235 @@
+"""Where a slot's remote commands run, and how files get there and back.
+
+The runner talked to sc01 in one way only: ssh for the commands, rsync for the files. So the only
+way to see how it behaves under load -- how fast it dispatches, how fair the queue is, what it does
+when the remote side fails -- was to run it against the real cluster.
+
+An executor is the piece that knows the remote side. It builds the command lines for each thing
+the runner does there: run a shell command, copy a file over, move a result back, and check that
+the host is answering. Running those, timing them out and cancelling them stays the runner's, as
+does everything it decides from their output, since all of it happens through a local child process
+whichever executor built the command line.
+
+SshExecutor is what the runner always did. SimulatedExecutor, chosen with
+settings.TASKRUNNER_EXECUTOR = "simulated", runs the same commands on this machine, in a stand-in
+home directory where force.sh, ssforce.sh, stack_rock.sh and the image scripts are replaced by
+atlas_simulated.py. That sleeps for a draw from a configured distribution, fails at a configured
+rate, and writes result files of the right shape, so the runner can be load tested on any Linux box.
+"""
+
+import abc
+import functools
+import json
+import shlex
+import sys
+import typing as t
+from pathlib import Path
+
+from django.core.exceptions import ImproperlyConfigured
+
+from atlasserver import settings
+from atlasserver.taskrunner import sshmux
+
+# Where the simulated hosts' home directories go, one per host. Outside the checkout, as the ssh
+# control sockets are: it fills with the results of every simulated task until they are fetched.
+SIMULATED_HOME_DIR: Path = Path("/tmp/atlasforced/simulated")
+
+# the script that stands in for sc01's tools and for ssh itself
+SIMULATOR_SCRIPT: Path = Path(__file__).with_name("atlas_simulated.py")
+
+# The tools that the runner's commands call on sc01, by where they are in the stand-in home. The
+# paths under /atlas/bin are rewritten into the home; see SimulatedExecutor.prepare_command.
+SIMULATED_TOOLS: t.Final = [
+    "atlas/bin/force.sh",
+    "atlas/bin/ssforce.sh",
+    "atlas/bin/stack_rock.sh",
+    "atlas_gettaskimage.py",
+    "atlas_gettaskimage_ssostack.py",
+    "atlas_gettaskimages.py",
+]
+
+# the number of parameters that each kind of latency distribution takes
+DISTRIBUTIONS: t.Final = {"fixed": 1, "uniform": 2, "lognormal": 2, "exponential": 1}
+
+# What settings.TASKRUNNER_SIMULATION starts from. Latencies are in seconds: "connect" for every
+# ssh, and one for each request type's remote work (ssforce.sh counts as FP). A failure is a
+# connection that does not happen, which the runner retries; "no data" is a forced photometry or
+# stack request with no observations, which is a definite answer.
+SIMULATION_DEFAULTS: t.Final = {
+    "connect": ["lognormal", 0.3, 0.5],
+    "fp": ["lognormal", 30.0, 0.8],
+    "imgzip": ["lognormal", 60.0, 0.5],
+    "ssostack": ["lognormal", 120.0, 0.5],
+    "failure_rate": 0.02,
+    "nodata_rate": 0.05,
+    "rows": 100,
+    "seed": None,
+}
+
+
+class Executor(abc.ABC):
+    """The remote host that a slot's commands run on, as the command lines that reach it."""
+
+    def __init__(self, host: str) -> None:
+        """Describe the executor for `host`, the name the runner routed the task to."""
+        self.host = host
+
+    @abc.abstractmethod
+    def shell_argv(self, slotid: int) -> list[str]:
+        """Return the command line that a remote shell command is appended to, as one argument."""
+
+    def prepare_command(self, command: str) -> str:
+        """Return the remote shell command to run in place of one the runner built for sc01."""
+        return command
+
+    @abc.abstractmethod
+    def copy_to_argv(self, localfile: Path, remotefile: Path, slotid: int) -> list[str]:
+        """Return the command line that copies a local file to the remote host."""
+
+    @abc.abstractmethod
+    def move_from_argv(self, remotefile: Path, localdir: Path, slotid: int) -> list[str]:
+        """Return the command line that moves a remote file into a local directory."""
+
+    @abc.abstractmethod
+    def probe_argv(self, timeout_seconds: float) -> list[str]:
+        """Return the command that checks the host answers: a trivial remote command that must exit 0.
+
+        `timeout_seconds` is how long the probe is given, for whatever connecting it does itself.
+        """
+
+
+class SshExecutor(Executor):
+    """An ATLAS host reached over ssh, through the slot's multiplexed connection if there is one."""
+
+    def shell_argv(self, slotid: int) -> list[str]:
+        return sshmux.ssh_argv(self.host, slotid)
+
+    def copy_to_argv(self, localfile: Path, remotefile: Path, slotid: int) -> list[str]:
+        return [*sshmux.rsync_argv(self.host, slotid), str(localfile), f"{self.host}:{remotefile}"]
+
+    def move_from_argv(self, remotefile: Path, localdir: Path, slotid: int) -> list[str]:
+        return [
+            *sshmux.rsync_argv(self.host, slotid),
+            "--remove-source-files",
+            f"{self.host}:{remotefile}",
+            str(localdir),
+        ]
+
+    def probe_argv(self, timeout_seconds: float) -> list[str]:
+        # through the host's first master when multiplexing, which is quick while the master is up
+        # and an ordinary connection when it is not; see sshmux.ssh_options
+        return [
+            "ssh",
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            f"ConnectTimeout={timeout_seconds:.0f}",
+            *sshmux.ssh_options(self.host, 0),
+            self.host,
+            "true",
+        ]
+
+
+class SimulatedExecutor(Executor):
+    """A stand-in for an ATLAS host, in a local directory; see atlas_simulated.py."""
+
+    def __init__(self, host: str, simulation: dict[str, t.Any], homedir: Path | None = None) -> None:
+        """Set up the stand-in home for `host` with the tools and the parsed `simulation` settings."""
+        super().__init__(host)
+        self.home = (homedir if homedir is not None else SIMULATED_HOME_DIR) / host
+        (self.home / "atlasserver" / "results").mkdir(parents=True, exist_ok=True)
+        (self.home / "simulation.json").write_text(json.dumps(simulation))
+
+        for tool in SIMULATED_TOOLS:
+            toolpath = self.home / tool
+            toolpath.parent.mkdir(parents=True, exist_ok=True)
+            toolpath.write_text(
+                f'#!/bin/sh\nexec {shlex.join([sys.executable, str(SIMULATOR_SCRIPT), Path(tool).name])} "$@"\n'
+            )
+            toolpath.chmod(0o755)
+
+    def local_path(self, remotefile: Path) -> Path:
+        """Return where a path on the remote host is in the stand-in home."""
+        text = str(remotefile)
+        return self.home / text.removeprefix("~/") if text.startswith("~/") else Path(text)
+
+    def shell_argv(self, slotid: int) -> list[str]:  # noqa: ARG002 (every slot shares the one home)
+        return [sys.executable, str(SIMULATOR_SCRIPT), "ssh", str(self.home), self.host]
+
+    def prepare_command(self, command: str) -> str:
+        # the tools are called by absolute path on sc01; in the home, the remote shell finds them
+        # by expanding the tilde, as it does for the image scripts
+        return command.replace("/atlas/bin/", "~/atlas/bin/")
+
+    def copy_to_argv(self, localfile: Path, remotefile: Path, slotid: int) -> list[str]:  # noqa: ARG002 (as above)
+        return ["cp", "--", str(localfile), str(self.local_path(remotefile))]
+
+    def move_from_argv(self, remotefile: Path, localdir: Path, slotid: int) -> list[str]:  # noqa: ARG002 (as above)
+        return ["mv", "-f", "--", str(self.local_path(remotefile)), str(localdir)]
+
+    def probe_argv(self, timeout_seconds: float) -> list[str]:  # noqa: ARG002 (the stand-in connects or not at once)
+        return [*self.shell_argv(0), "true"]
+
+
+def parse_distribution(key: str, text: str) -> list[t.Any]:
+    """Return a latency distribution given as kind:param[:param], for example lognormal:30:0.8."""
+    kind, *params = text.split(":")
+    if DISTRIBUTIONS.get(kind) != len(params):
+        msg = f"ATLASSERVER_TASKRUNNER_SIMULATION: {key}={text!r} is not one of {', '.join(DISTRIBUTIONS)}"
+        raise ImproperlyConfigured(msg)
+    try:
+        values = [float(param) for param in params]
+    except ValueError:
+        values = [-1.0]
+    if min(values) < 0:
+        msg = f"ATLASSERVER_TASKRUNNER_SIMULATION: {key}={text!r} needs non-negative numbers"
+        raise ImproperlyConfigured(msg)
+    return [kind, *values]
+
+
+def parse_simulation(spec: str) -> dict[str, t.Any]:
+    """Return the simulation that a TASKRUNNER_SIMULATION value describes, over SIMULATION_DEFAULTS.
+
+    Settings are separated by whitespace, each as key=value, for example
+    "fp=lognormal:20:0.5 failure_rate=0.1 seed=1". Raises ImproperlyConfigured naming what is wrong.
+    """
+    simulation = dict(SIMULATION_DEFAULTS)
+    for entry in spec.split():
+        key, _, value = entry.partition("=")
+        if key not in simulation or not value:
+            msg = f"ATLASSERVER_TASKRUNNER_SIMULATION: {entry!r} is not one of {', '.join(simulation)} as key=value"
+            raise ImproperlyConfigured(msg)
+
+        if isinstance(SIMULATION_DEFAULTS[key], list):
+            simulation[key] = parse_distribution(key, value)
+        elif key in {"rows", "seed"}:
+            if not value.isdecimal():
+                msg = f"ATLASSERVER_TASKRUNNER_SIMULATION: {key} must be a non-negative integer, not {value!r}"
+                raise ImproperlyConfigured(msg)
+            simulation[key] = int(value)
+        else:
+            try:
+                rate = float(value)
+            except ValueError:
+                rate = -1.0
+            if not 0.0 <= rate <= 1.0:
+                msg = f"ATLASSERVER_TASKRUNNER_SIMULATION: {key} must be between 0 and 1, not {value!r}"
+                raise ImproperlyConfigured(msg)
+            simulation[key] = rate
+
+    return simulation
+
+
+@functools.cache
+def _executor(kind: str, spec: str, homedir: Path, host: str) -> Executor:
+    if kind == "simulated":
+        return SimulatedExecutor(host, parse_simulation(spec), homedir=homedir)
+    return SshExecutor(host)
+
+
+def executor_for(host: str) -> Executor:
+    """Return the executor for a remote host, as settings.TASKRUNNER_EXECUTOR chooses.
+
+    One per host for the life of the process, so that the simulated home is set up once.
+    """
+    return _executor(settings.TASKRUNNER_EXECUTOR, settings.TASKRUNNER_SIMULATION, SIMULATED_HOME_DIR, host)
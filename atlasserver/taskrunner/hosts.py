@@ -0,0 +1,189 @@
+"""The remote hosts that tasks run on, and which of them each task goes to.
+
+Every slot used to run its tasks on one host, the `atlas` alias for sc01, so the only way to more
+throughput was more slots on the same machine, and while that machine was slow or unreachable every
+task dispatched to it failed, was retried after a few seconds, and failed again.
+
+With settings.TASKRUNNER_REMOTE_HOSTS, the runner has a pool of hosts instead. Each has a limit on
+how many tasks it runs at once and a set of request types it can run, and each is probed on an
+interval. A task goes to the least loaded healthy host that can run it. A host that stops
+answering is routed around until it answers again: its share of the queue waits for the others
+rather than being dispatched to it to fail. Dispatch only considers tasks that some host could take
+right now, so a type that only a down host runs waits without holding up the rest.
+
+The probes run alongside the dispatch loop rather than in it: each is a child process that the loop
+starts and later collects, so a host that hangs costs the probe its timeout and the loop nothing.
+
+The pool, and so each host's limit, belongs to one runner, which counts only its own tasks against
+it. With settings.TASKRUNNER_CLAIMS and several runners sharing a host, the host can be running
+the sum of their limits at once, and each runner's limit for it is to be set to that runner's share.
+"""
+
+import contextlib
+import math
+import subprocess
+import time
+import typing as t
+
+from django.core.exceptions import ImproperlyConfigured
+
+from atlasserver.taskrunner import executors
+
+# how often each host is asked whether it is still answering
+HOST_PROBE_SECONDS: float = 30.0
+
+# how long a probe is given before it counts as a failure
+HOST_PROBE_TIMEOUT_SECONDS: float = 15.0
+
+# How many probes in a row must fail before a host is routed around. More than one, so that a
+# single dropped connection does not take a host out of service; one success brings it back.
+HOST_DOWN_AFTER_FAILURES: int = 2
+
+
+def probe_argv(host: str) -> list[str]:
+    """Return the command that checks a host answers, from the host's executor; see executors.py."""
+    return executors.executor_for(host).probe_argv(timeout_seconds=HOST_PROBE_TIMEOUT_SECONDS)
+
+
+class RemoteHost:
+    """One host in the pool: what it may run, how much of it is in use, and whether it is answering."""
+
+    def __init__(self, name: str, slots: int, request_types: t.Iterable[str]) -> None:
+        """Describe a host reached as `name` over ssh, running up to `slots` tasks of `request_types`."""
+        self.name = name
+        self.slots = slots
+        self.request_types = frozenset(request_types)
+        # this runner's tasks on the host, and not any other runner's; see the note at the top
+        self.busy = 0
+        # healthy until a probe says otherwise, so that dispatch starts at once after a restart
+        self.healthy = True
+        self.failures = 0
+        self.probe: subprocess.Popen[bytes] | None = None
+        self.probe_started = 0.0
+        self.last_probe = -math.inf
+
+    def can_run(self, request_type: str) -> bool:
+        return self.healthy and self.busy < self.slots and request_type in self.request_types
+
+
+def parse_remote_hosts(spec: str, request_types: t.Iterable[str], default_slots: int) -> list[RemoteHost]:
+    """Return the hosts that a TASKRUNNER_REMOTE_HOSTS value describes.
+
+    Hosts are separated by whitespace, each as `name[:slots[:type,type...]]`, for example
+    "atlas:12 sc02:4:FP". A host given no slot limit may use every slot, and one given no types
+    runs all of them. Raises ImproperlyConfigured naming what is wrong.
+    """
+    alltypes = list(request_types)
+    hosts = []
+    for entry in spec.split():
+        name, _, rest = entry.partition(":")
+        slotstext, _, typestext = rest.partition(":")
+        if not name or (slotstext and not slotstext.isdecimal()) or slotstext == "0":
+            msg = f"ATLASSERVER_TASKRUNNER_REMOTE_HOSTS: {entry!r} is not name[:slots[:type,type...]]"
+            raise ImproperlyConfigured(msg)
+
+        types = typestext.split(",") if typestext else alltypes
+        if unknown := set(types) - set(alltypes):
+            msg = f"ATLASSERVER_TASKRUNNER_REMOTE_HOSTS: unknown request type {sorted(unknown)} for {name}"
+            raise ImproperlyConfigured(msg)
+
+        hosts.append(RemoteHost(name, int(slotstext) if slotstext else default_slots, types))
+
+    if len({host.name for host in hosts}) != len(hosts):
+        msg = "ATLASSERVER_TASKRUNNER_REMOTE_HOSTS names a host more than once"
+        raise ImproperlyConfigured(msg)
+
+    return hosts
+
+
+class HostPool:
+    """The hosts the runner dispatches to, which slot is using which, and their health probes."""
+
+    def __init__(self, hosts: list[RemoteHost], logfunc: t.Callable[[str], None]) -> None:
+        """Route among `hosts`; nothing is probed until the first maintain()."""
+        self.hosts = hosts
+        self.logfunc = logfunc
+        self.slot_hosts: dict[int, RemoteHost] = {}
+
+    def route(self, request_type: str, exclude: t.Collection[str] = ()) -> RemoteHost | None:
+        """Return the healthy host with a free slot for the type that is least loaded, or None.
+
+        Load is the share of the host's slots in use, so that a small host is not filled before a
+        large one has started; a tie goes to the host configured first. The hosts named in
+        `exclude` are passed over, as those whose circuit breaker is open are (see breaker.py).
+        """
+        candidates = [host for host in self.hosts if host.can_run(request_type) and host.name not in exclude]
+        return min(candidates, key=lambda host: host.busy / host.slots, default=None)
+
+    def routable_types(self, exclude: t.Collection[str] = ()) -> set[str]:
+        """Return the request types that some host, other than those in `exclude`, could start a task of now."""
+        return {
+            request_type
+            for host in self.hosts
+            if host.healthy and host.busy < host.slots and host.name not in exclude
+            for request_type in host.request_types
+        }
+
+    def host_named(self, name: str) -> RemoteHost | None:
+        """Return the host called `name`, or None if the pool no longer has one."""
+        return next((host for host in self.hosts if host.name == name), None)
+
+    def assign(self, slotid: int, host: RemoteHost) -> None:
+        self.slot_hosts[slotid] = host
+        host.busy += 1
+
+    def release(self, slotid: int) -> None:
+        if (host := self.slot_hosts.pop(slotid, None)) is not None:
+            host.busy -= 1
+
+    def maintain(self) -> None:
+        """Collect the probes that have finished, and start those that are due. Never blocks."""
+        now = time.monotonic()
+        for host in self.hosts:
+            if host.probe is not None:
+                returncode = host.probe.poll()
+                if returncode is None and (now - host.probe_started) < HOST_PROBE_TIMEOUT_SECONDS:
+                    continue
+                if returncode is None:
+                    host.probe.kill()
+                    host.probe.wait()
+                host.probe = None
+                self.record_probe(host, answered=returncode == 0)
+
+            if host.probe is None and (now - host.last_probe) >= HOST_PROBE_SECONDS:
+                host.last_probe = now
+                host.probe_started = now
+                try:
+                    host.probe = subprocess.Popen(
+                        probe_argv(host.name),
+                        stdin=subprocess.DEVNULL,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                except OSError:
+                    self.record_probe(host, answered=False)
+
+    def record_probe(self, host: RemoteHost, answered: bool) -> None:
+        if answered:
+            if not host.healthy:
+                self.logfunc(f"host {host.name} is answering again, and tasks are being routed to it")
+            host.healthy = True
+            host.failures = 0
+            return
+
+        host.failures += 1
+        if host.healthy and host.failures >= HOST_DOWN_AFTER_FAILURES:
+            host.healthy = False
+            self.logfunc(f"host {host.name} failed {host.failures} probes in a row, and is being routed around")
+
+    def snapshot(self) -> dict[str, dict[str, t.Any]]:
+        """Return each host's state, for the status file."""
+        return {host.name: {"healthy": host.healthy, "busy": host.busy, "slots": host.slots} for host in self.hosts}
+
+    def shutdown(self) -> None:
+        for host in self.hosts:
+            if host.probe is not None:
+                with contextlib.suppress(OSError):
+                    host.probe.kill()
+                host.probe.wait()
+                host.probe = None
@@ -6,10 +6,16 @@ import datetime
 import json
 import multiprocessing as mp
 import os
+import shlex
+import shutil
 import smtplib
 import subprocess
+import tarfile
+import tempfile
+import threading
 import time
 import typing as t
+from itertools import islice
 from pathlib import Path
 from signal import SIGINT
 from signal import signal
@@ -17,15 +23,22 @@ from signal import SIGTERM
 
 import django
 import pandas as pd
+import psutil
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.mail import EmailMessage
+from django.db import close_old_connections
+from django.db import connection
 from django.db import models
+from django.db import transaction
 from django.forms.models import model_to_dict
 
 from atlasserver import settings
 from atlasserver.forcephot.misc import datetime_to_mjd
 from atlasserver.taskrunner import status as runnerstatus
 
+if t.TYPE_CHECKING:
+    import io
+    from multiprocessing.synchronize import Event
+
 REMOTE_SERVER = "atlas"
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "atlasserver.settings")
@@ -34,23 +47,84 @@ django.setup()
 
 import sys
 
+from atlasserver.forcephot import prediction
 from atlasserver.forcephot import queue as taskqueue
+from atlasserver.forcephot import sketches
 from atlasserver.forcephot.models import Task
+from atlasserver.forcephot.models import TaskClaim
 from atlasserver.forcephot.webhooks import send_task_callback
+from atlasserver.taskrunner import breaker
+from atlasserver.taskrunner import claims
+from atlasserver.taskrunner import detached
+from atlasserver.taskrunner import eta
+from atlasserver.taskrunner import executors
+from atlasserver.taskrunner import outbox
+from atlasserver.taskrunner import pool as workerpool
+from atlasserver.taskrunner import resultcache
+from atlasserver.taskrunner.hosts import HostPool
+from atlasserver.taskrunner.hosts import parse_remote_hosts
+from atlasserver.taskrunner.pool import WorkerPool
+from atlasserver.taskrunner.sshmux import SshMultiplexer
+from atlasserver.taskrunner.streaming import LineReader
+from atlasserver.taskrunner.streaming import OutputStream
+from atlasserver.taskrunner.streaming import PipeReader
+from atlasserver.taskrunner.wakeup import WakeupListener
 
 TASK_MAXTIME_SECONDS: int = 4 * 3600
 
+# With settings.TASKRUNNER_BACKOFF, how long a task whose attempt failed is held back the first
+# time, and at most, as it doubles with each failure; see retry_later()
+RETRY_BASE_SECONDS: float = 30.0
+RETRY_MAX_SECONDS: float = 3600.0
+
+# The exit status of a slot's own process for what its attempt found of the host, which the
+# dispatcher reads back as the slot frees (see run_slot_process()). Any other status, a crash among
+# them, found nothing.
+SLOT_EXIT_STATUSES: t.Final = {breaker.HOST_ANSWERED: 0, breaker.HOST_UNREACHABLE: 3}
+SLOT_EXIT_OUTCOMES: t.Final = {status: outcome for outcome, status in SLOT_EXIT_STATUSES.items()}
+
 # how often a running task asks the database whether it has been cancelled
 CANCEL_CHECK_SECONDS: float = 15.0
 
+# With settings.TASKRUNNER_CANCEL_WATCH, the running tasks do not ask: the dispatcher looks for all
+# of them in one query this often, and signals the slot of any that has gone. Sooner than the
+# per-task interval above, and still a fraction of the queries sixteen slots asking used to make.
+CANCEL_WATCH_SECONDS: float = 5.0
+
 # how long the main loop waits between polls of the queue. The longer interval applies once the
 # queue has been seen to be empty, so that an idle server is not querying twice a second all night.
 POLL_INTERVAL_SECONDS: float = 0.5
 IDLE_POLL_INTERVAL_SECONDS: float = 5.0
+# With settings.TASKRUNNER_WAKEUP the loop is woken by a submission or a slot coming free, and
+# IDLE_POLL_INTERVAL_SECONDS is only the backstop for a lost nudge; see wakeup.py.
+
+# Forced photometry requests tend to arrive in bursts from one user (a radeclist submission alone
+# can be a hundred targets), and each task used to pay for its own ssh session and remote start-up
+# to run a single force.sh. With settings.TASKRUNNER_FP_BATCH, a slot that picks up such a task
+# takes up to this many of the same user's compatible queued tasks along with it, and runs them
+# one after another in one session. Bounded, because the batch holds its slot for all of them.
+FP_BATCH_MAX_TASKS: int = 10
+
+# how the remote side of a batch marks where each task's command starts and ends in its output
+BATCH_MARKER: str = "ATLASSERVER_BATCH"
+
+# With settings.TASKRUNNER_DEDUPLICATE, how far down the queue dispatch looks for a task that is not
+# a duplicate of one already running, before giving up until the next pass
+DISPATCH_SCAN_LIMIT: int = 50
+
+# With settings.TASKRUNNER_SCHEDULER = "short_lane", a request type whose median run time is at most
+# this is short, and may use the slots kept for short tasks. A type with too few recent tasks for a
+# median is short if it is forced photometry, which it almost always is.
+SHORT_TASK_SECONDS: float = 120.0
 
 # how many tasks the maintenance sweep loads, cleans up and writes back at a time
 MAINTENANCE_BATCH_SIZE: int = 500
 
+# With settings.TASKRUNNER_BACKGROUND_MAINTENANCE, the sweep waits this long after each batch. It
+# no longer holds up dispatch, so there is no hurry, and the pause leaves the database and the
+# results mount to the tasks that are running alongside it.
+MAINTENANCE_BATCH_PAUSE_SECONDS: float = 1.0
+
 # LOG_DIR, STATUS_PATH and STATUS_WRITE_SECONDS live in atlasserver.taskrunner.status so that the
 # web server can read the status file without importing this module. All three are referenced
 # through that module at each use rather than bound by name here, so that one
@@ -83,8 +157,6 @@ def log_general(msg: str, suffix: str = "", *args, **kwargs) -> None:
     if logfile_latest.exists():
         lastwrite = datetime.datetime.fromtimestamp(logfile_latest.stat().st_mtime, tz=datetime.UTC)
         if lastwrite.date() < dtnow.date():
-            import shutil
-
             logfile_archive = Path(
                 runnerstatus.LOG_DIR,
                 f"fprunnerlog_{lastwrite.year:4d}-{lastwrite.month:02d}-{lastwrite.day:02d}{suffix}.txt",
@@ -97,7 +169,10 @@ def log_general(msg: str, suffix: str = "", *args, **kwargs) -> None:
 
 
 def run_rsync(copycommand: list[str], logfunc: t.Callable[[t.Any], None]) -> int | None:
-    """Run an rsync command, logging its output. Return the exit code, or None if it timed out."""
+    """Run an rsync command, logging its output. Return the exit code, or None if it timed out.
+
+    Or whatever copies files in its place: the command lines come from the host's executor.
+    """
     logfunc(" ".join(copycommand))
 
     proc = subprocess.Popen(
@@ -120,6 +195,7 @@ def run_rsync(copycommand: list[str], logfunc: t.Callable[[t.Any], None]) -> int
             proc.wait(timeout=10)  # reap the process to avoid leaving a zombie
         return None
 
+    breaker.record_exit_status(proc.returncode)
     if stdout:
         for line in stdout.split("\n"):
             logfunc(f"STDOUT: {line}")
@@ -144,6 +220,136 @@ def task_exists(taskid: int) -> bool:
     return True
 
 
+def remote_shell_path(path: Path) -> str:
+    """Quote a path for the remote shell, leaving a leading ~/ for it to expand."""
+    text = str(path)
+    if text.startswith("~/"):
+        return "~/" + shlex.quote(text.removeprefix("~/"))
+    return shlex.quote(text)
+
+
+def unpack_result_archive(stream: t.IO[bytes], names: set[str], destdir: Path) -> list[str]:
+    """Unpack a tar stream of result files into destdir, and return the names of the files in it.
+
+    Anything other than a regular file from `names` raises tarfile.TarError, as does an archive
+    that is cut short. An empty stream is an empty archive.
+    """
+    if not t.cast("io.BufferedReader", stream).peek(1):
+        return []
+
+    received = []
+    with tarfile.open(fileobj=stream, mode="r|") as archive:
+        for member in archive:
+            if not member.isfile() or member.name not in names:
+                msg = f"unexpected archive member {member.name!r}"
+                raise tarfile.TarError(msg)
+            archive.extract(member, destdir, filter="data")
+            received.append(member.name)
+    return received
+
+
+def retrieve_results_tar(
+    remotefiles: list[Path], logfunc: t.Callable[[t.Any], None], slotid: int = 0, host: str = REMOTE_SERVER
+) -> bool:
+    """Move a task's result files from the remote host as one tar stream, instead of an rsync per file.
+
+    All of the files must be in one remote directory. Any that do not exist are skipped, as rsync
+    skips them, since which ones a task leaves behind depends on how it went (an SSOSTACK with no
+    observations makes no fits file, for instance).
+
+    The archive is unpacked into a scratch directory beside settings.RESULTS_DIR's files, and only
+    once ssh has exited cleanly and the whole archive has been read is each file renamed into
+    place, so nothing ever sees a half-written result. Only then are the received files deleted on
+    the remote host. Return whether that all happened; on False the remote files are untouched,
+    and the caller can still fetch them another way.
+    """
+    remotedir = remotefiles[0].parent
+    assert all(remotefile.parent == remotedir for remotefile in remotefiles)
+    names = {remotefile.name for remotefile in remotefiles}
+    quotednames = " ".join(shlex.quote(name) for name in sorted(names))
+
+    # tar refuses to create an archive with nothing in it, and complains about missing files, so
+    # the list is narrowed to the files that exist. No output at all means none of them did.
+    remotecommand = (
+        f"cd {remote_shell_path(remotedir)} && set -- && "
+        f'for f in {quotednames}; do [ -f "$f" ] && set -- "$@" "$f"; done; '
+        f'[ $# -eq 0 ] || exec tar -cf - -- "$@"'
+    )
+    sshcommand = executors.executor_for(host).shell_argv(slotid)
+    logfunc(f"Retrieving {' '.join(sorted(names))} from {host}:{remotedir} as a tar stream")
+
+    incomingdir = Path(tempfile.mkdtemp(dir=settings.RESULTS_DIR, prefix=".incoming-"))
+    # Standard error goes to a file rather than a pipe: only standard output is read while tar
+    # runs, and a remote that filled a pipe with warnings would stall until the watchdog fired.
+    with tempfile.TemporaryFile() as stderrfile:
+        try:
+            proc = subprocess.Popen([*sshcommand, remotecommand], stdout=subprocess.PIPE, stderr=stderrfile)
+            assert proc.stdout is not None
+            # the stream is read as it arrives rather than with communicate(), so an image zip is never
+            # held in memory whole, and the timeout that communicate() would give is a timer instead
+            watchdog = threading.Timer(TASK_MAXTIME_SECONDS, proc.kill)
+            watchdog.start()
+            try:
+                received = unpack_result_archive(proc.stdout, names=names, destdir=incomingdir)
+                proc.stdout.read()  # the padding after the end-of-archive marker
+                proc.wait()
+            except (OSError, tarfile.TarError) as ex:
+                logfunc(f"ERROR: could not unpack the result archive: {ex}")
+                proc.kill()
+                proc.wait()
+                return False
+            finally:
+                watchdog.cancel()
+
+            stderrfile.seek(0)
+            stderr = stderrfile.read().decode(errors="replace")
+
+            breaker.record_exit_status(proc.returncode)
+            for line in stderr.splitlines():
+                logfunc(f"STDERR: {line}")
+
+            if proc.returncode != 0:
+                # a truncated stream can still end on a member boundary, so a clean read is not enough
+                logfunc(f"ERROR: tar retrieval exited with code {proc.returncode}")
+                return False
+
+            try:
+                for name in received:
+                    (incomingdir / name).replace(settings.RESULTS_DIR / name)
+            except OSError as ex:
+                # the remote files are still there, for the rsync fallback to collect
+                logfunc(f"ERROR: could not move the retrieved files into place: {ex}")
+                return False
+        finally:
+            shutil.rmtree(incomingdir, ignore_errors=True)
+
+    if received:
+        # if this fails the files are only left behind on the remote host, where the next attempt
+        # at the task overwrites them; the local copies are complete either way
+        removecommand = f"cd {remote_shell_path(remotedir)} && rm -f -- " + " ".join(
+            shlex.quote(name) for name in received
+        )
+        try:
+            subprocess.run([*sshcommand, removecommand], capture_output=True, timeout=60, check=False)
+        except subprocess.TimeoutExpired:
+            logfunc(f"ERROR: timed out removing the retrieved files from {host}")
+
+    return True
+
+
+def retrieve_results(
+    remotefiles: list[Path], logfunc: t.Callable[[t.Any], None], slotid: int = 0, host: str = REMOTE_SERVER
+) -> None:
+    """Move result files from the remote host into settings.RESULTS_DIR, deleting the remote copies."""
+    if settings.TASKRUNNER_TAR_RETRIEVAL and retrieve_results_tar(remotefiles, logfunc, slotid=slotid, host=host):
+        return
+
+    # a failed tar retrieval leaves the remote files in place, so rsync can still collect them
+    executor = executors.executor_for(host)
+    for remotefile in remotefiles:
+        run_rsync(executor.move_from_argv(remotefile, settings.RESULTS_DIR, slotid), logfunc)
+
+
 def remove_task_resultfiles(
     taskid: int,
     parent_task_id: int | None = None,
@@ -187,8 +393,17 @@ def remote_result_filename(task) -> str | None:
     return None
 
 
-def build_fp_command(task, remoteresultfile: Path) -> str:
-    """Return the remote shell command for a forced photometry task."""
+def build_fp_command(task, remoteresultfile: Path, m0: float | None = None, stream: bool = False) -> str:
+    """Return the remote shell command for a forced photometry task.
+
+    `m0` replaces the task's own mjd_min, for fetching only the part of a light curve that an
+    earlier result lacks; see resultcache.find_incremental_base.
+
+    With `stream`, the rows are written to the standard output as force.sh produces them, for the
+    runner to read as they arrive (see streaming.py), and sorted after. The remote file is then only
+    the input of the preview image, and is removed once that is made; the script's own output goes
+    to the standard error, so that nothing but the light curve is on the standard output.
+    """
     # falsy exactly when there is no MPC target: task_mpc_name_not_blank keeps whitespace out of
     # the column, so this needs no normalising of its own
     if task.mpc_name:
@@ -210,7 +425,9 @@ def build_fp_command(task, remoteresultfile: Path) -> str:
 
     # "is not None" rather than truthiness, so that an explicit bound of 0 is passed through
     # instead of being silently dropped
-    if task.mjd_min is not None:
+    if m0 is not None:
+        atlascommand += f" m0={float(m0)}"
+    elif task.mjd_min is not None:
         atlascommand += f" m0={float(task.mjd_min)}"
     if task.mjd_max is not None:
         atlascommand += f" m1={float(task.mjd_max)}"
@@ -221,6 +438,15 @@ def build_fp_command(task, remoteresultfile: Path) -> str:
     if task.user_id in settings.TEST_USERS:
         atlascommand += " tdo=1"
 
+    if stream:
+        # sort would hold every row back until the last one, so the runner sorts its copy instead
+        atlascommand += f" | tee {remoteresultfile}; "
+        atlascommand += f"sort -n -o {remoteresultfile} {remoteresultfile}; "
+        atlascommand += f"~/atlas_gettaskimage.py {remoteresultfile}"
+        atlascommand += " red" if task.use_reduced else " diff"
+        atlascommand += f" >&2; rm -f {remoteresultfile}"
+        return atlascommand
+
     atlascommand += " | sort -n"
     atlascommand += f" | tee {remoteresultfile}; "
     atlascommand += f"~/atlas_gettaskimage.py {remoteresultfile}"
@@ -250,65 +476,210 @@ def build_ssostack_command(task, remoteresultfile: Path, remotedatafile: Path, r
     return atlascommand
 
 
-def runtask(task, logfunc, **kwargs) -> tuple[Path | None, str | None]:
-    """Run the forced photometry on atlas sc01 and retrieve the result.
+def is_batchable(task) -> bool:
+    """Whether a task can share a remote session with others; see FP_BATCH_MAX_TASKS."""
+    # ssforce.sh works on an orbit rather than a position and can run far longer, so minor planet
+    # tasks always go alone
+    return task.request_type == "FP" and not task.mpc_name
 
-    returns (resultfilename, error_msg)
-     - resultfilename will be None if it could not be created due to an error
-     - error_msg is None unless there was an error that would make retries pointless (e.g. invalid object name)
+
+def batch_size_limit(task, freeslots: int, numslots: int) -> int:
+    """Return how many tasks the batch that `task` leads may hold, itself included; see find_batch_companions().
+
+    A batch's companions are the user's later tasks, run now instead of in their turn, so they are
+    run ahead of any other user's task queued between them. That costs no one anything only while
+    the dispatch leaves `freeslots` going spare and no other user has a task waiting, and only then
+    may the batch be FP_BATCH_MAX_TASKS long. Otherwise it is held to the user's turn share: their
+    even share of the `numslots` slots among the users with tasks waiting, which round-robin
+    dispatch would give them anyway, and so no companions at all once more users have tasks
+    waiting than there are slots.
     """
-    filename = remote_result_filename(task)
-    if filename is None:
-        return None, None
+    if not settings.TASKRUNNER_FP_BATCH or not is_batchable(task):
+        return 1
 
-    remoteresultdir = Path("~/atlasserver/results/")
-    remotetaskdir = remoteresultdir / f"task{task.id:05d}"
-    remoteresultfile = Path(remoteresultdir, filename)
+    otherusers = Task.dispatchable().exclude(user_id=task.user_id).values("user_id").distinct().count()
+    if freeslots > 0 and otherusers == 0:
+        return FP_BATCH_MAX_TASKS
 
-    localresultfile = Path(settings.RESULTS_DIR, filename)
-    settings.RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    return max(1, min(FP_BATCH_MAX_TASKS, numslots // (otherusers + 1)))
 
-    atlascommand = f"nice -n 19 timeout {TASK_MAXTIME_SECONDS:.1f}s "
-    if task.request_type == "FP":
-        atlascommand += build_fp_command(task, remoteresultfile=remoteresultfile)
 
-    elif task.request_type == "IMGZIP":
-        localdatafile = Path(settings.RESULTS_DIR, f"job{task.parent_task_id:05d}.txt")
-        remotedatafile = Path(remoteresultdir, f"job{task.parent_task_id:05d}.txt")
+def find_batch_companions(task, limit: int = FP_BATCH_MAX_TASKS) -> list[Task]:
+    """Return the queued tasks that should run in the same remote session as `task`, next in queue order.
 
-        if not localdatafile.exists():
-            # the parent forced photometry data file lists the images to fetch. Without it the task
-            # can never succeed, so finish with an error instead of retrying it forever.
-            return None, "The forced photometry data file for the parent task is no longer available."
+    Only the same user's tasks: dispatch keeps a user to one slot at a time, so their other queued
+    tasks cannot be running elsewhere or be picked up while this slot holds them. Running them now
+    does put them ahead of other users' tasks, which is what `limit` bounds; the dispatcher sets it
+    with batch_size_limit(). Only tasks that agree on the image type and MJD window, so that a
+    batch is tasks of one kind -- the shape a multi-target force.sh run would need, were the remote
+    side to offer one.
+    """
+    if not settings.TASKRUNNER_FP_BATCH or not is_batchable(task) or limit <= 1:
+        return []
+
+    return list(
+        Task.queued()
+        .filter(
+            user_id=task.user_id,
+            request_type="FP",
+            use_reduced=task.use_reduced,
+            mjd_min=task.mjd_min,
+            mjd_max=task.mjd_max,
+        )
+        .filter(models.Q(mpc_name__isnull=True) | models.Q(mpc_name=""))
+        .exclude(id=task.id)
+        .select_related("user")
+        .order_by("queuepos_relative", "id")[: min(limit, FP_BATCH_MAX_TASKS) - 1]
+    )
 
-        # copy out the FP data file first, so that it's available on sc01 for the image gathering script
-        if run_rsync(["rsync", str(localdatafile), f"{REMOTE_SERVER}:{remotedatafile}"], logfunc) != 0:
-            # without the data file the remote script cannot select any images, so retry later
-            # instead of burning a remote run that is certain to fail
-            return None, None
 
-        atlascommand += f"~/atlas_gettaskimages.py {remotedatafile}"
-        atlascommand += " red" if task.use_reduced else " diff"
+def build_fp_batch_command(tasks: list[Task], remoteresultdir: Path, m0s: dict[int, float] | None = None) -> str:
+    """Return one remote shell command that runs each task's forced photometry in turn.
 
-    elif task.request_type == "SSOSTACK":
-        remotedatafile = Path(remoteresultdir, f"job{task.id:05d}.txt")
-        atlascommand += build_ssostack_command(
-            task,
-            remoteresultfile=remoteresultfile,
-            remotedatafile=remotedatafile,
-            remotetaskdir=remotetaskdir,
+    Every task keeps its own time limit and writes its own result file, exactly as it would alone.
+    The markers around each one let parse_batch_runtimes() say how long each took. `m0s` holds a
+    start MJD by task id for the tasks that are extending an earlier result.
+    """
+    commands = []
+    for task in tasks:
+        fpcommand = build_fp_command(
+            task, remoteresultfile=Path(remoteresultdir, f"job{task.id:05d}.txt"), m0=(m0s or {}).get(task.id)
         )
+        commands.append(
+            f"echo {BATCH_MARKER} start {task.id} $(date +%s); "
+            f"nice -n 19 timeout {TASK_MAXTIME_SECONDS:.1f}s {fpcommand}; "
+            f"echo {BATCH_MARKER} end {task.id} $(date +%s)"
+        )
+    return "; ".join(commands)
+
 
-    logfunc(f"Executing on {REMOTE_SERVER}: {atlascommand}")
+def parse_batch_runtimes(stdout: str) -> dict[int, float]:
+    """Return the seconds each task of a batch ran for, by task id, from the markers in its output."""
+    starts: dict[int, float] = {}
+    runtimes: dict[int, float] = {}
+    for line in stdout.splitlines():
+        fields = line.split()
+        if len(fields) != 4 or fields[0] != BATCH_MARKER:
+            continue
+        with contextlib.suppress(ValueError):
+            taskid, timestamp = int(fields[2]), float(fields[3])
+            if fields[1] == "start":
+                starts[taskid] = timestamp
+            elif fields[1] == "end" and taskid in starts:
+                runtimes[taskid] = timestamp - starts[taskid]
+    return runtimes
+
+
+def runtask_batch(
+    tasks: list[Task],
+    logfunc: t.Callable[[t.Any], None],
+    slotid: int = 0,
+    cancel_event: "Event | None" = None,
+    host: str = REMOTE_SERVER,
+    on_task_start: t.Callable[[Task], None] | None = None,
+) -> dict[int, tuple[Path | None, str | None, float | None]]:
+    """Run several forced photometry tasks in one remote session and retrieve their results.
+
+    Returns (resultfilename, error_msg, runtime_seconds) by task id, with the first two meaning
+    what they do for runtask(). A task missing from the result is to be retried, as is every task
+    if the session was killed. The session is cancelled only once every task in it has been.
+
+    `on_task_start` is called with each task as its own run begins on the remote host, which for
+    all but the first is some time after the session starts, and for some never.
+    """
+    remoteresultdir = Path("~/atlasserver/results/")
+    taskids = [task.id for task in tasks]
+    tasksbyid = {task.id: task for task in tasks}
 
+    def watch_markers(line: str) -> None:
+        fields = line.split()
+        if on_task_start is None or len(fields) != 4 or fields[:2] != [BATCH_MARKER, "start"]:
+            return
+        with contextlib.suppress(ValueError):
+            if (starting := tasksbyid.pop(int(fields[2]), None)) is not None:
+                on_task_start(starting)
+
+    settings.RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+
+    incrementals = {
+        task.id: incremental for task in tasks if (incremental := resultcache.find_incremental_base(task)) is not None
+    }
+
+    stdout = run_remote_command(
+        build_fp_batch_command(tasks, remoteresultdir, m0s={taskid: base[1] for taskid, base in incrementals.items()}),
+        logfunc,
+        is_cancelled=lambda: not Task.objects.filter(id__in=taskids).exists(),
+        slotid=slotid,
+        maxtime_seconds=TASK_MAXTIME_SECONDS * len(tasks),
+        cancel_event=cancel_event,
+        host=host,
+        on_line=watch_markers,
+    )
+    if stdout is None:
+        return {}
+
+    runtimes = parse_batch_runtimes(stdout)
+
+    # every task's files in one retrieval, which with TASKRUNNER_TAR_RETRIEVAL is a single stream.
+    # A task cancelled during the batch is fetched too, and its files deleted by the caller, so
+    # that nothing is left behind on the remote host.
+    remotefiles = []
+    for taskid in taskids:
+        remoteresultfile = Path(remoteresultdir, f"job{taskid:05d}.txt")
+        remotefiles.extend([remoteresultfile, remoteresultfile.with_suffix(".jpg")])
+    retrieve_results(remotefiles, logfunc, slotid=slotid, host=host)
+
+    results: dict[int, tuple[Path | None, str | None, float | None]] = {}
+    for task in tasks:
+        taskid = task.id
+        fetchedfile = Path(settings.RESULTS_DIR, f"job{taskid:05d}.txt")
+        if taskid in incrementals and fetchedfile.exists():
+            resultcache.merge_incremental_result(
+                incrementals[taskid][0], fetchedfile, mjd_min=task.mjd_min, mjd_max=task.mjd_max, logfunc=logfunc
+            )
+        localresultfile, error_msg = check_fp_resultfile(fetchedfile, logfunc)
+        results[taskid] = (localresultfile, error_msg, runtimes.get(taskid))
+    return results
+
+
+def run_remote_command(
+    atlascommand: str,
+    logfunc: t.Callable[[t.Any], None],
+    is_cancelled: t.Callable[[], bool],
+    slotid: int = 0,
+    maxtime_seconds: float = TASK_MAXTIME_SECONDS,
+    cancel_event: "Event | None" = None,
+    host: str = REMOTE_SERVER,
+    stream: OutputStream | None = None,
+    attached: bool = False,
+    on_line: t.Callable[[str], None] | None = None,
+) -> str | None:
+    """Run a shell command on the remote host and return its standard output.
+
+    Returns None if the command was killed, either because `is_cancelled` said so or because it ran
+    past `maxtime_seconds`. `is_cancelled` is asked every CANCEL_CHECK_SECONDS, or, given the slot's
+    `cancel_event`, only once the dispatcher has set it; see watch_cancellations().
+
+    With `stream`, the standard output goes into its file as it arrives instead, and the empty
+    string is returned for it; see streaming.py.
+
+    With `on_line`, each line of the standard output is also passed to it as it arrives.
+
+    With `attached`, the command is following a detached job (see detached.py), and None is also
+    returned when ssh itself fails, since the job then goes on without it.
+    """
+    logfunc(f"Executing on {host}: {atlascommand}")
+
+    executor = executors.executor_for(host)
+    reader: PipeReader | None = stream if stream is not None else LineReader(on_line) if on_line is not None else None
+    # a reader takes bytes as they come, where communicate() wants lines of text
+    textmode: dict[str, t.Any] = {} if reader is not None else {"encoding": "utf-8", "bufsize": 1, "text": True}
     proc = subprocess.Popen(
-        ["ssh", f"{REMOTE_SERVER}", atlascommand],
+        [*executor.shell_argv(slotid), executor.prepare_command(atlascommand)],
         shell=False,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        encoding="utf-8",
-        bufsize=1,
-        universal_newlines=True,
+        **textmode,
     )
 
     starttime = time.perf_counter()
@@ -318,7 +689,10 @@ def runtask(task, logfunc, **kwargs) -> tuple[Path | None, str | None]:
     timed_out = False
     while not cancelled and not timed_out:
         try:
-            proc.communicate(timeout=1)
+            if reader is not None:
+                reader.pump(proc, timeout=1)
+            else:
+                proc.communicate(timeout=1)
 
         except subprocess.TimeoutExpired:
             now = time.perf_counter()
@@ -326,11 +700,17 @@ def runtask(task, logfunc, **kwargs) -> tuple[Path | None, str | None]:
             # run one per second per slot. Across 16 slots that was ~16 queries/sec forever, and a
             # single job at the 4 hour limit issued over ten thousand of them. Cancelling a job
             # that has already been running for minutes is not more urgent than this.
-            if (now - lastcancelcheck) >= CANCEL_CHECK_SECONDS:
+            if cancel_event is not None:
+                # the dispatcher's signal is confirmed rather than trusted: a batch's lead task can
+                # be cancelled while the rest of the batch is still wanted
+                if cancel_event.is_set():
+                    cancel_event.clear()
+                    cancelled = is_cancelled()
+            elif (now - lastcancelcheck) >= CANCEL_CHECK_SECONDS:
                 lastcancelcheck = now
-                cancelled = not task_exists(taskid=task.id)
+                cancelled = is_cancelled()
             timed_out = (now - starttime) >= (
-                TASK_MAXTIME_SECONDS + 30
+                maxtime_seconds + 30
             )  # give a little extra time for cleanup after timeout
             if (now - lastlogtime) >= 10:
                 logfunc(f"ssh has been running for {now - starttime:.0f} seconds        ")
@@ -340,67 +720,194 @@ def runtask(task, logfunc, **kwargs) -> tuple[Path | None, str | None]:
 
     if cancelled or timed_out:
         if timed_out:
-            logfunc(f"ERROR: ssh was killed after exceeding TASKMAXTIME limit of {TASK_MAXTIME_SECONDS:.0f} seconds")
+            logfunc(f"ERROR: ssh was killed after exceeding TASKMAXTIME limit of {maxtime_seconds:.0f} seconds")
         os.kill(proc.pid, SIGTERM)
         with contextlib.suppress(subprocess.TimeoutExpired):
             proc.wait(timeout=10)  # reap the process to avoid leaving a zombie
-        return None, None  # don't finish with an error message, because we'll retry it later
+        if reader is not None:
+            reader.close()
+        return None
 
-    stdout, stderr = proc.communicate()
+    if stream is not None:
+        stdout, stderr = "", stream.close()
+    elif isinstance(reader, LineReader):
+        stderr = reader.close()
+        stdout = reader.stdout
+    else:
+        stdout, stderr = proc.communicate()
     logfunc(f"ssh finished after running for {time.perf_counter() - starttime:.1f} seconds")
+    breaker.record_exit_status(proc.returncode)
 
-    if stdout:
+    if stream is not None:
+        logfunc(f"{host} STDOUT: ({stream.rows} rows streamed into {stream.path.name})")
+    elif stdout:
         stdoutlines = stdout.split("\n")
-        logfunc(f"{REMOTE_SERVER} STDOUT: ({len(stdoutlines)} lines of output)")
+        logfunc(f"{host} STDOUT: ({len(stdoutlines)} lines of output)")
 
     if stderr:
         for line in stderr.split("\n"):
-            logfunc(f"{REMOTE_SERVER} STDERR: {line}")
+            logfunc(f"{host} STDERR: {line}")
 
-    if not task_exists(taskid=task.id):  # check if job was cancelled
+    if attached and proc.returncode == 255:
+        logfunc(f"ERROR: lost the session to {host}, but not the detached job, which is attached to again")
+        return None
+
+    return stdout or ""
+
+
+def runtask(
+    task,
+    logfunc,
+    slotid: int = 0,
+    cancel_event: "Event | None" = None,
+    host: str = REMOTE_SERVER,
+    job: detached.RemoteJob | None = None,
+    **kwargs,
+) -> tuple[Path | None, str | None]:
+    """Run the forced photometry on atlas sc01 and retrieve the result.
+
+    `slotid` decides which multiplexed ssh connection the slot's commands go through; see sshmux.
+    `cancel_event` is the slot's, when the dispatcher is watching for cancellations. `host` is the
+    remote host the dispatcher routed the task to; see hosts.py. `job` is the detached job of an
+    earlier attempt, to attach to instead of starting the command; see detached.py.
+
+    returns (resultfilename, error_msg)
+     - resultfilename will be None if it could not be created due to an error
+     - error_msg is None unless there was an error that would make retries pointless (e.g. invalid object name)
+    """
+    filename = remote_result_filename(task)
+    if filename is None:
         return None, None
 
-    # copy files from sc01 to local machine, deleting the remote files after successful copy
+    remoteresultdir = Path("~/atlasserver/results/")
+    remotetaskdir = remoteresultdir / f"task{task.id:05d}"
+    remoteresultfile = Path(remoteresultdir, filename)
+
+    localresultfile = Path(settings.RESULTS_DIR, filename)
+    settings.RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+
+    executor = executors.executor_for(host)
+
+    incremental = resultcache.find_incremental_base(task)
+    if incremental is not None:
+        logfunc(f"Fetching only observations from MJD {incremental[1]} on, to extend {incremental[0].name}")
+
+    # the light curve as it arrives, with TASKRUNNER_STREAM_RESULTS
+    stream = (
+        OutputStream(
+            localresultfile.with_name(f"{localresultfile.name}.part"),
+            on_progress=lambda rows, last_mjd: record_progress(task, rows, last_mjd),
+        )
+        if settings.TASKRUNNER_STREAM_RESULTS and task.request_type == "FP"
+        else None
+    )
+
+    atlascommand = f"nice -n 19 timeout {TASK_MAXTIME_SECONDS:.1f}s "
     if task.request_type == "FP":
-        copycommands = [
-            # move the jpg task image from sc01 (deleting the remote file)
-            ["rsync", "--remove-source-files", f"{REMOTE_SERVER}:{remoteresultfile}", str(localresultfile)],
-            [
-                "rsync",
-                "--remove-source-files",
-                f"{REMOTE_SERVER}:{Path(remoteresultdir / filename).with_suffix('.jpg')}",
-                str(settings.RESULTS_DIR),
-            ],
-        ]
+        atlascommand += build_fp_command(
+            task,
+            remoteresultfile=remoteresultfile,
+            m0=incremental[1] if incremental is not None else None,
+            stream=stream is not None,
+        )
+
+    elif task.request_type == "IMGZIP":
+        localdatafile = Path(settings.RESULTS_DIR, f"job{task.parent_task_id:05d}.txt")
+        remotedatafile = Path(remoteresultdir, f"job{task.parent_task_id:05d}.txt")
+
+        if not localdatafile.exists():
+            # the parent forced photometry data file lists the images to fetch. Without it the task
+            # can never succeed, so finish with an error instead of retrying it forever.
+            return None, "The forced photometry data file for the parent task is no longer available."
+
+        # copy out the FP data file first, so that it's available on sc01 for the image gathering script
+        if run_rsync(executor.copy_to_argv(localdatafile, remotedatafile, slotid), logfunc) != 0:
+            # without the data file the remote script cannot select any images, so retry later
+            # instead of burning a remote run that is certain to fail
+            return None, None
+
+        atlascommand += f"~/atlas_gettaskimages.py {remotedatafile}"
+        atlascommand += " red" if task.use_reduced else " diff"
+
     elif task.request_type == "SSOSTACK":
-        # move the stack *.fits, *.jpg and *.txt data from sc01 (deleting the remote files)
-        copycommands = [
-            ["rsync", "--remove-source-files", f"{REMOTE_SERVER}:{remoteresultfile}", str(settings.RESULTS_DIR)],
-            [
-                "rsync",
-                "--remove-source-files",
-                f"{REMOTE_SERVER}:{Path(remoteresultfile).with_suffix('.jpg')}",
-                str(settings.RESULTS_DIR),
-            ],
-            ["rsync", "--remove-source-files", f"{REMOTE_SERVER}:{remotedatafile}", str(settings.RESULTS_DIR)],
-        ]
-    else:  # IMGZIP
-        # move the image zip from sc01 (deleting the remote file)
-        copycommands = [
-            ["rsync", "--remove-source-files", f"{REMOTE_SERVER}:{remoteresultfile}", str(settings.RESULTS_DIR)]
-        ]
-        # the data file should already be copied, but just in case, copy it again (deleting the remote file)
-        copycommands.append(
-            [
-                "rsync",
-                "--remove-source-files",
-                f"{REMOTE_SERVER}:{remotedatafile}",
-                str(settings.RESULTS_DIR),
-            ]
+        remotedatafile = Path(remoteresultdir, f"job{task.id:05d}.txt")
+        atlascommand += build_ssostack_command(
+            task,
+            remoteresultfile=remoteresultfile,
+            remotedatafile=remotedatafile,
+            remotetaskdir=remotetaskdir,
         )
 
-    for copycommand in copycommands:
-        run_rsync(copycommand, logfunc)
+    remotecommand = atlascommand
+    maxtime_seconds: float = TASK_MAXTIME_SECONDS
+    if job is not None:
+        # the job's time limit started with it, in the attempt being resumed
+        remotecommand = job.attach_command()
+        elapsed = datetime.datetime.now(datetime.UTC) - job.attempt.started
+        maxtime_seconds = max(0.0, TASK_MAXTIME_SECONDS - elapsed.total_seconds())
+    elif settings.TASKRUNNER_DETACHED:
+        job = detached.launch_job(task, atlascommand, host=host, slotid=slotid, logfunc=logfunc)
+        if job is None:
+            return None, None
+        remotecommand = job.attach_command()
+
+    if (
+        run_remote_command(
+            remotecommand,
+            logfunc,
+            is_cancelled=lambda: not task_exists(taskid=task.id),
+            slotid=slotid,
+            maxtime_seconds=maxtime_seconds,
+            cancel_event=cancel_event,
+            host=host,
+            stream=stream,
+            attached=job is not None,
+        )
+        is None
+    ):
+        if stream is not None:
+            stream.path.unlink(missing_ok=True)
+        # A detached job is stopped here only for a cancelled task. One that timed out was stopped
+        # by its own time limit, and one whose session was lost goes on, for the retry to attach to.
+        if job is not None and not task_exists(taskid=task.id):
+            detached.stop_job(job, slotid, logfunc)
+        return None, None  # don't finish with an error message, because we'll retry it later
+
+    # The job has exited. Its attempt is kept until its result files are here: a runner stopping
+    # before then attaches to the exited job again, where deleting it now would run the task again.
+
+    # check if job was cancelled. A watched slot has been told if it was, in all but the last few
+    # seconds; a cancellation in those is still caught when the attempt is finished.
+    if cancel_event.is_set() if cancel_event is not None else not task_exists(taskid=task.id):
+        if stream is not None:
+            stream.path.unlink(missing_ok=True)
+        if job is not None:
+            detached.finish_job(job, slotid, logfunc)
+        return None, None
+
+    # the files to move from sc01 to the local machine, deleting the remote files after a successful copy
+    if stream is not None:
+        # the result table is here already, as it came, and only needs the sort that sc01 skipped
+        if not finish_streamed_result(stream.path, localresultfile, logfunc):
+            if job is not None:
+                detached.finish_job(job, slotid, logfunc)
+            return None, None
+        remotefiles = [remoteresultfile.with_suffix(".jpg")]
+    elif task.request_type == "FP":
+        # the result table and its jpg task image
+        remotefiles = [remoteresultfile, remoteresultfile.with_suffix(".jpg")]
+    elif task.request_type == "SSOSTACK":
+        # the stack *.fits, *.jpg and *.txt data
+        remotefiles = [remoteresultfile, remoteresultfile.with_suffix(".jpg"), remotedatafile]
+    else:  # IMGZIP
+        # the image zip, and the data file, which should already be copied, but just in case, copy it again
+        remotefiles = [remoteresultfile, remotedatafile]
+
+    retrieve_results(remotefiles, logfunc, slotid=slotid, host=host)
+
+    if job is not None:
+        # whatever came back is all there is, so the attempt is over whatever its result
+        detached.finish_job(job, slotid, logfunc)
 
     # got an error message (probably no observations in time range) and no fits file, but task is completed
     if task.request_type == "SSOSTACK" and (
@@ -415,24 +922,72 @@ def runtask(task, logfunc, **kwargs) -> tuple[Path | None, str | None]:
         # task failed somehow
         return None, None
 
+    if incremental is not None:
+        resultcache.merge_incremental_result(
+            incremental[0], localresultfile, mjd_min=task.mjd_min, mjd_max=task.mjd_max, logfunc=logfunc
+        )
+
     if task.request_type == "FP":
-        try:
-            dfforcedphot = pd.read_csv(localresultfile, sep=r"\s+", escapechar="#", skipinitialspace=True)
+        return check_fp_resultfile(localresultfile, logfunc)
 
-            if dfforcedphot.empty:
-                # file is just a header row without data
-                return localresultfile, "No data returned"
-        except pd.errors.EmptyDataError:
-            return localresultfile, "No data returned"
-        except pd.errors.ParserError:
-            # a ragged file (e.g. a diagnostic line mixed into the output) must not raise out of
-            # here, because the task would then never be marked finished and would be retried forever
-            logfunc("ERROR: could not parse the result file")
-            return localresultfile, "Could not parse the result file"
+    return localresultfile, None
 
-        # if not task.from_api:
-        #     make_pdf_plot(taskid=task.id, taskcomment=task.comment, localresultfile=localresultfile,
-        #                   logprefix=logprefix, logfunc=log, separate_process=True)
+
+def finish_streamed_result(partfile: Path, localresultfile: Path, logfunc: t.Callable[[t.Any], None]) -> bool:
+    """Sort a streamed light curve into the result file, as sc01 would have, and return whether it was.
+
+    With sort(1) rather than in memory, which keeps a long light curve out of the worker, and under
+    the C locale, so that the MJDs sort the same way here as there. The "###MJD" header sorts
+    first, as a number that is not there.
+    """
+    result = subprocess.run(
+        ["sort", "-n", "-o", str(localresultfile), str(partfile)],
+        capture_output=True,
+        text=True,
+        check=False,
+        env={**os.environ, "LC_ALL": "C"},
+    )
+    partfile.unlink(missing_ok=True)
+    if result.returncode != 0:
+        logfunc(f"ERROR: could not sort the streamed result into {localresultfile.name}: {result.stderr.strip()}")
+        return False
+    return True
+
+
+def record_progress(task, rows: int, last_mjd: float | None) -> None:
+    """Record how many rows of the light curve have arrived, for the API; see streaming.py.
+
+    task_modified_datetime is written with them, because the update does not trigger auto_now, and
+    it is what tells a polling queue page that the task has changed.
+    """
+    Task.objects.filter(pk=task.id).update(
+        rows_received=rows, last_mjd_received=last_mjd, task_modified_datetime=datetime.datetime.now(datetime.UTC)
+    )
+
+
+def check_fp_resultfile(localresultfile: Path, logfunc: t.Callable[[t.Any], None]) -> tuple[Path | None, str | None]:
+    """Return (resultfile, error_msg) for a retrieved forced photometry result, as runtask() does."""
+    if not localresultfile.exists():
+        # task failed somehow
+        return None, None
+
+    try:
+        dfforcedphot = pd.read_csv(localresultfile, sep=r"\s+", escapechar="#", skipinitialspace=True)
+
+        if dfforcedphot.empty:
+            # file is just a header row without data
+            return localresultfile, "No data returned"
+    except pd.errors.EmptyDataError:
+        return localresultfile, "No data returned"
+    except pd.errors.ParserError:
+        # a ragged file (e.g. a diagnostic line mixed into the output) must not raise out of
+        # here, because the task would then never be marked finished and would be retried forever
+        logfunc("ERROR: could not parse the result file")
+        return localresultfile, "Could not parse the result file"
+
+    # if not task.from_api:
+    #     make_pdf_plot(taskid=task.id, taskcomment=task.comment, localresultfile=localresultfile,
+    #                   logprefix=logprefix, logfunc=log, separate_process=True)
 
     return localresultfile, None
 
@@ -454,13 +1009,21 @@ def mark_started(task) -> None:
     """
     starttimestamp = datetime.datetime.now(datetime.UTC).replace(microsecond=0)
 
-    Task.objects.filter(pk=task.id).update(starttimestamp=starttimestamp, attempt_count=models.F("attempt_count") + 1)
+    # the progress is of an attempt, so an earlier one's is cleared
+    Task.objects.filter(pk=task.id).update(
+        starttimestamp=starttimestamp,
+        attempt_count=models.F("attempt_count") + 1,
+        rows_received=None,
+        last_mjd_received=None,
+    )
 
     task.starttimestamp = starttimestamp
     task.attempt_count += 1
 
 
-def mark_finished(task, error_msg: str | None) -> None:
+def mark_finished(
+    task, error_msg: str | None, runtime_seconds: float | None = None, reused_result: bool = False
+) -> None:
     """Record that a task has finished, in the database and on the in-memory instance.
 
     The database write has to be a queryset update rather than a save(): `task` is a copy read when
@@ -469,14 +1032,49 @@ def mark_finished(task, error_msg: str | None) -> None:
     The same values are then applied to the instance, because notify_finished() reports on it. Until
     this was done, every callback said `finishtimestamp: null` and `success: true` no matter what
     had actually happened, because the instance still held the values it was loaded with.
+
+    `runtime_seconds` is for a task that ran in a batch. All of a batch is started together and
+    finished together, so finish minus start would be the whole batch's time for every task in it;
+    given its own run time, the start is moved to that long before the finish, so that the wait
+    estimates built on those two columns see what the task itself took.
+
+    `reused_result` is for a task finished with a result computed for another (see
+    Task.reused_result), whose two columns are left out of the run time statistics instead.
+
+    With TASKRUNNER_RUNTIME_SKETCHES, the task is then added to the hour's sketches of run and wait
+    times (see forcephot/sketches.py), from the instance, which by then has both timestamps.
+
+    With TASKRUNNER_NOTIFY_OUTBOX, the task's callback and its submission's email are written to
+    the outbox here, in the transaction that finishes the task, for the runner to send, and
+    notify_finished() sends nothing (see outbox.py). A task is then never finished without them, as
+    it was when the runner stopped between the two, nor are they sent for a task left unfinished.
     """
     finishtimestamp = datetime.datetime.now(datetime.UTC).replace(microsecond=0)
+    updates: dict[str, t.Any] = {"finishtimestamp": finishtimestamp, "queuepos_relative": None, "error_msg": error_msg}
+    if runtime_seconds is not None:
+        updates["starttimestamp"] = finishtimestamp - datetime.timedelta(seconds=round(runtime_seconds))
+    if reused_result:
+        updates["reused_result"] = True
+
+    with transaction.atomic():
+        if settings.TASKRUNNER_NOTIFY_OUTBOX:
+            outbox.lock_submission(task)
+
+        Task.objects.filter(pk=task.id).update(**updates)
 
-    Task.objects.filter(pk=task.id).update(finishtimestamp=finishtimestamp, queuepos_relative=None, error_msg=error_msg)
+        # before the notifications, which are written from the instance
+        for field, value in updates.items():
+            setattr(task, field, value)
 
-    task.finishtimestamp = finishtimestamp
-    task.queuepos_relative = None
-    task.error_msg = error_msg
+        if settings.TASKRUNNER_NOTIFY_OUTBOX:
+            outbox.enqueue_notifications(task)
+
+    if settings.TASKRUNNER_RUNTIME_SKETCHES:
+        try:
+            sketches.record_finished_task(task)
+        except Exception as ex:  # noqa: BLE001 (the task is already finished; a statistic missing
+            # one task must not stop its submitter being told)
+            log_general(f"ERROR: could not add task {task.id} to the run time sketches: {ex}")
 
 
 def notify_finished(task, logfunc) -> None:
@@ -485,6 +1083,10 @@ def notify_finished(task, logfunc) -> None:
     Both are best-effort and neither may raise: the task is already marked finished by the time
     this runs, and an exception here would kill the worker before it could move on.
     """
+    if settings.TASKRUNNER_NOTIFY_OUTBOX:
+        # mark_finished() has written them to the outbox, and the runner sends them from there
+        return
+
     if task.callback_url:
         try:
             send_task_callback(task=task, logfunc=logfunc)
@@ -511,61 +1113,17 @@ def send_email_if_needed(task, logfunc) -> None:
 
     # if we find an unfinished task in the same batch, hold off sending the email.
     # same batch here is defined as being queued by the same user with identical timestamps
-    batchtasks_unfinished = 0
-    batchtaskcount = 0
-
-    taskdesclist = []
-    localresultfilelist = []
-    batchtasks = Task.objects.all().filter(user_id=task.user_id, send_email=True, timestamp=task.timestamp)
-
-    for batchtask in batchtasks:
-        batchtaskcount += 1
-        if not batchtask.finishtimestamp and batchtask.id != task.id:
-            batchtasks_unfinished += 1
-        else:
-            localresultfile = localresultfileprefix(batchtask.id) + ".txt"
-            taskurl = f"https://fallingstar-data.com/forcedphot/queue/{batchtask.id}/"
-            strtask = (
-                f"Task {batchtask.id}: RA {batchtask.ra} Dec {batchtask.dec} "
-                f"{'img_reduced' if batchtask.use_reduced else 'img_difference'} "
-                f"\n{taskurl}\n"
-            )
-
-            if batchtask.comment:
-                strtask += " comment: '" + batchtask.comment + "'"
-
-            taskdesclist.append(strtask)
-            localresultfilelist.append(localresultfile)
+    batchtasks = list(Task.objects.all().filter(user_id=task.user_id, send_email=True, timestamp=task.timestamp))
+    batchtasks_unfinished = sum(
+        1 for batchtask in batchtasks if not batchtask.finishtimestamp and batchtask.id != task.id
+    )
+    batchtaskcount = len(batchtasks)
 
     if batchtasks_unfinished == 0:
         logfunc(f"Sending email to {task.user.email} containing {batchtaskcount} tasks")
 
-        message = EmailMessage(
-            subject="ATLAS forced photometry results",
-            body=("Your forced photometry results are available for:\n\n" + "\n".join(taskdesclist) + "\n\n"),
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[task.user.email],
-        )
-
-        attach_size_mb = 0.0
-
-        for localresultfile in localresultfilelist:
-            if Path(localresultfile).exists():
-                filesize_mb = Path(localresultfile).stat().st_size / 1024.0 / 1024.0
-                if (attach_size_mb + filesize_mb) < 22:
-                    attach_size_mb += filesize_mb
-                    message.attach_file(localresultfile)
-
-        for localresultfile in localresultfilelist:
-            pdfpath = Path(localresultfile).with_suffix(".pdf")
-            if pdfpath.exists():
-                filesize_mb = Path(pdfpath).stat().st_size / 1024.0 / 1024.0
-                if (attach_size_mb + filesize_mb) < 22:
-                    attach_size_mb += filesize_mb
-                    message.attach_file(str(pdfpath))
-
         try:
-            message.send()
+            outbox.result_email(task.user.email, batchtasks).send()
         except (OSError, smtplib.SMTPException) as ex:
             # a refused recipient or an unreachable mail server must not propagate: it would kill
             # the worker before the task is marked finished, and the task would be re-run forever
@@ -577,7 +1135,17 @@ def send_email_if_needed(task, logfunc) -> None:
         )
 
 
-def write_status(procs_taskids: dict[int, int], numslots: int, maintenance: bool = False) -> None:
+def write_status(
+    procs_taskids: dict[int, int],
+    numslots: int,
+    maintenance: bool = False,
+    maintenance_progress: dict[str, t.Any] | None = None,
+    remote_hosts: dict[str, dict[str, t.Any]] | None = None,
+    queue_drain_seconds: tuple[float, float] | None = None,
+    draining: dict[str, t.Any] | None = None,
+    circuit_breakers: dict[str, dict[str, t.Any]] | None = None,
+    statuspath: Path | None = None,
+) -> None:
     """Write a snapshot of the runner's state for the status endpoint to read.
 
     Nothing outside the runner could previously tell whether it was alive, how many slots were
@@ -587,6 +1155,23 @@ def write_status(procs_taskids: dict[int, int], numslots: int, maintenance: bool
     `maintenance` marks a snapshot written while the hourly sweep is blocking the main loop. The
     slot fields are frozen for that whole window (nothing is reaped or dispatched), so without the
     flag the file would confidently describe workers that may have already exited.
+
+    `maintenance_progress` is how far a sweep running alongside dispatch has got (see
+    MaintenanceSweep); the slot fields are live then, so `maintenance` stays False.
+
+    `remote_hosts` is the health and load of each host, with a pool of them (see hosts.py).
+
+    `queue_drain_seconds` is when the last queued task is expected to start, as the median and the
+    90th percentile, with settings.TASKRUNNER_START_ESTIMATES (see eta.py).
+
+    `draining` is the drain under way, if any (see DrainRequest.as_status()): no task is started
+    while it lasts, and the slot fields count down to none.
+
+    `circuit_breakers` is the state of each host's breaker, with settings.TASKRUNNER_BACKOFF (see
+    breaker.py).
+
+    `statuspath` is where to write it in place of runnerstatus.STATUS_PATH: with
+    settings.TASKRUNNER_CLAIMS, the runner's own file, which the reader merges with the others'.
     """
     # One pass over the queued set for all three figures, rather than a first(), a count() and a
     # distinct count() each rebuilding the queryset and scanning again -- this runs every
@@ -615,13 +1200,35 @@ def write_status(procs_taskids: dict[int, int], numslots: int, maintenance: bool
         for row in Task.queued().values("request_type").annotate(count=models.Count("id"))
     }
 
+    # What each running task is expected to take (see forcephot/prediction.py), for a reader to
+    # say how long it has left; a task with no prediction is left out.
+    running_expected_runtime_seconds = (
+        {
+            str(taskid): seconds
+            for taskid, seconds in prediction.predict_runtimes(
+                (taskid, t.cast("prediction.Features", tuple(features)))
+                for taskid, *features in Task.objects.filter(id__in=procs_taskids.values()).values_list(
+                    "id", *prediction.FEATURE_FIELDS
+                )
+            ).items()
+        }
+        if procs_taskids
+        else {}
+    )
+
     status = {
         "written": datetime.datetime.now(datetime.UTC).isoformat(),
         "pid": os.getpid(),
         "numslots": numslots,
         "slots_busy": len(procs_taskids),
         "running_taskids": sorted(procs_taskids.values()),
+        "running_expected_runtime_seconds": running_expected_runtime_seconds,
         "maintenance": maintenance,
+        "maintenance_progress": maintenance_progress,
+        "remote_hosts": remote_hosts,
+        "queue_drain_seconds": queue_drain_seconds,
+        "draining": draining,
+        "circuit_breakers": circuit_breakers,
         "queued_task_count": queuestats["queued_task_count"],
         "distinct_queued_users": queuestats["distinct_queued_users"],
         "queued_by_request_type": queued_by_request_type,
@@ -629,7 +1236,7 @@ def write_status(procs_taskids: dict[int, int], numslots: int, maintenance: bool
     }
 
     try:
-        statuspath = runnerstatus.STATUS_PATH
+        statuspath = statuspath if statuspath is not None else runnerstatus.STATUS_PATH
         statuspath.parent.mkdir(parents=True, exist_ok=True)
         tmppath = statuspath.with_suffix(".tmp")
         tmppath.write_text(json.dumps(status))
@@ -645,8 +1252,231 @@ def handler(signal_received, frame):
     sys.exit(0)
 
 
-def do_task(task, slotid: int) -> None:
-    """Run a task in a particular slot and send a result email if requested."""
+# a drain asked for by SIGTERM, until the main loop takes it; see pending_drain_request()
+_signalled_drain: runnerstatus.DrainRequest | None = None
+
+
+def drain_handler(signal_received, frame):
+    """Start a drain on SIGTERM, rather than stopping the running tasks where they are.
+
+    Only recorded here: the main loop takes it on its next pass, as it takes the requests that
+    `atlastaskrunner drain` writes. SIGINT still stops the runner at once.
+    """
+    global _signalled_drain  # noqa: PLW0603
+    _signalled_drain = runnerstatus.DrainRequest.after(runnerstatus.DRAIN_DEADLINE_SECONDS)
+
+
+def pending_drain_request(started: datetime.datetime) -> runnerstatus.DrainRequest | None:
+    """Return the drain asked for since the last call, by SIGTERM or by atlastaskrunner, or None."""
+    global _signalled_drain
+    signalled, _signalled_drain = _signalled_drain, None
+    try:
+        written = runnerstatus.take_drain_request(started)
+    except OSError as ex:
+        log_general(f"ERROR: could not read the drain request: {ex}")
+        written = None
+    return written if written is not None else signalled
+
+
+def stop_process_tree(pid: int | None) -> None:
+    """Kill a slot's process and the processes it started, its ssh and rsync sessions among them.
+
+    Killing the slot's process alone would leave those running, orphaned. A detached job is in a
+    session of its own on the remote host, and is not among them.
+    """
+    if pid is None:
+        return
+    try:
+        process = psutil.Process(pid)
+        family = [*process.children(recursive=True), process]
+    except psutil.NoSuchProcess:
+        return
+    for member in family:
+        with contextlib.suppress(psutil.NoSuchProcess):
+            member.kill()
+    psutil.wait_procs(family, timeout=5)
+
+
+def do_task(
+    task,
+    slotid: int,
+    cancel_event: "Event | None" = None,
+    host: str = REMOTE_SERVER,
+    batch_limit: int = FP_BATCH_MAX_TASKS,
+) -> str | None:
+    """Run a task in a particular slot, on the given remote host, and send a result email if requested.
+
+    With settings.TASKRUNNER_FP_BATCH, up to `batch_limit` of the user's queued tasks, this one
+    included, may run together; see find_batch_companions(). Each is then started, logged and
+    finished just as it would be alone, and is marked started only when its own run begins.
+
+    `cancel_event` is the slot's, set by the dispatcher when the task is deleted while it runs (with
+    settings.TASKRUNNER_CANCEL_WATCH); without it, the running task asks the database itself.
+
+    Returns what the attempt found of the host, for its circuit breaker; see breaker.py.
+    """
+    breaker.start_attempt()
+
+    # With TASKRUNNER_DETACHED, a task whose last attempt left a job on a remote host is resumed on
+    # that host, and alone: a batch is always started afresh, and runs attached.
+    job = None
+    if settings.TASKRUNNER_DETACHED:
+        _, logfunc = task_logfuncs(task, slotid)
+        resumable = detached.resumable_job(task, slotid, logfunc)
+        if resumable is False:
+            if settings.TASKRUNNER_BACKOFF:
+                logfunc("ERROR: Task was not started")
+                retry_later(task, logfunc, unreachable=True)
+            else:
+                waittime = 5
+                logfunc(f"ERROR: Task was not started. Waiting {waittime} seconds to slow down retries...")
+                time.sleep(waittime)
+            return breaker.HOST_UNREACHABLE
+        if resumable is not None:
+            job = resumable
+            host = job.attempt.host
+
+    batch = [task]
+    for companion in find_batch_companions(task, limit=batch_limit) if job is None else []:
+        # a duplicate of a task already in the batch is left queued, to share that task's result
+        if not settings.TASKRUNNER_DEDUPLICATE or companion.request_fingerprint() not in {
+            batchtask.request_fingerprint() for batchtask in batch
+        }:
+            batch.append(companion)
+
+    logfuncs = {batchtask.id: task_logfuncs(batchtask, slotid) for batchtask in batch}
+    started: set[int] = set()
+
+    def begin(batchtask) -> None:
+        # A companion's attempt starts when its own run does rather than with the batch, so that it
+        # counts no attempt, and shows no start, while it only waits its turn in the session. One
+        # whose turn never comes is left queued as it was.
+        if batchtask.id in started:
+            return
+        logfunc_slotonly, logfunc = logfuncs[batchtask.id]
+        started.add(batchtask.id)
+
+        # a resumed attempt keeps the start, and the count, of the attempt it resumes
+        if job is None:
+            mark_started(batchtask)
+
+        logfunc(
+            f"{'Starting' if job is None else 'Resuming'} {'API' if batchtask.from_api else 'web'} task"
+            f" for {batchtask.user.username}"
+            f" ({batchtask.user.email}):"
+        )
+        for key, value in model_to_dict(batchtask).items():
+            logfunc_slotonly(f"{key:>17}: {value}")
+
+    begin(task)
+
+    runtask_starttime = time.perf_counter()
+
+    results: dict[int, tuple[Path | None, str | None, float | None]] = {}
+    remotebatch = []
+    for batchtask in batch:
+        cachedresultfile = (
+            resultcache.answer_from_cache(batchtask, logfunc=logfuncs[batchtask.id][1]) if job is None else None
+        )
+        if cachedresultfile is not None:
+            begin(batchtask)
+            results[batchtask.id] = (*check_fp_resultfile(cachedresultfile, logfuncs[batchtask.id][0]), None)
+        else:
+            remotebatch.append(batchtask)
+
+    if len(remotebatch) > 1:
+        logfunc_slotonly, logfunc = logfuncs[remotebatch[0].id]
+        logfunc(f"Running in one remote session with tasks {[batchtask.id for batchtask in remotebatch[1:]]}")
+        results |= runtask_batch(
+            remotebatch,
+            logfunc=logfunc_slotonly,
+            slotid=slotid,
+            cancel_event=cancel_event,
+            host=host,
+            on_task_start=begin,
+        )
+    elif remotebatch:
+        logfunc_slotonly, _ = logfuncs[remotebatch[0].id]
+        localresultfile, error_msg = runtask(
+            task=remotebatch[0], logfunc=logfunc_slotonly, slotid=slotid, cancel_event=cancel_event, host=host, job=job
+        )
+        results[remotebatch[0].id] = (localresultfile, error_msg, None)
+
+    runtask_duration = time.perf_counter() - runtask_starttime
+
+    # a companion that never began was never attempted, and has nothing to finish or back off
+    batch = [batchtask for batchtask in batch if batchtask.id in started]
+    completed = [
+        finish_attempt(
+            batchtask,
+            *results.get(batchtask.id, (None, None, None)),
+            runtask_duration,
+            slotid,
+            *logfuncs[batchtask.id],
+            record_in_cache=batchtask in remotebatch,
+        )
+        for batchtask in batch
+    ]
+
+    outcome = breaker.attempt_outcome()
+    if settings.TASKRUNNER_BACKOFF:
+        for batchtask, done in zip(batch, completed, strict=True):
+            if done:
+                continue
+            if outcome == breaker.HOST_UNREACHABLE and job is None:
+                # the attempt that mark_started() counted never reached the host; see retry_later()
+                Task.objects.filter(pk=batchtask.id).update(attempt_count=models.F("attempt_count") - 1)
+                batchtask.attempt_count -= 1
+            retry_later(batchtask, logfuncs[batchtask.id][1], unreachable=outcome == breaker.HOST_UNREACHABLE)
+
+    elif not all(completed):
+        waittime = 5
+        logfunc = logfuncs[task.id][1]
+        logfunc(f"ERROR: Task was not completed successfully. Waiting {waittime} seconds to slow down retries...")
+        time.sleep(waittime)  # in case we're stuck in an error loop, wait a bit before trying again
+
+    return outcome
+
+
+def run_slot_process(**kwargs: t.Any) -> None:
+    """Run do_task() as a slot's own process, exiting with what it found of the host; see SLOT_EXIT_STATUSES."""
+    outcome = do_task(**kwargs)
+    sys.exit(SLOT_EXIT_STATUSES[outcome] if outcome is not None else 2)
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    """Return how long a task is held back after its `attempts`th attempt failed."""
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def retry_later(task, logfunc: t.Callable[[t.Any], None], unreachable: bool) -> None:
+    """Hold back a task whose attempt failed until a backoff has passed, or finish it if it has failed too often.
+
+    With settings.TASKRUNNER_BACKOFF, in place of the five seconds that do_task() otherwise sleeps:
+    the slot is free for another task at once, and this one is passed over by the dispatch queries
+    (see Task.dispatchable) for RETRY_BASE_SECONDS, doubling with each attempt up to
+    RETRY_MAX_SECONDS. One that has failed settings.TASKRUNNER_MAX_ATTEMPTS times is finished with
+    an error, and its submitter told, as for any other error.
+
+    `unreachable` is for an attempt that could not reach the host, which is not held against the
+    task: an outage of sc01 is not its fault, and would otherwise fail every task at the front of the
+    queue. The host's circuit breaker deals with those.
+    """
+    if not unreachable and settings.TASKRUNNER_MAX_ATTEMPTS and task.attempt_count >= settings.TASKRUNNER_MAX_ATTEMPTS:
+        error_msg = f"The task failed on each of its {task.attempt_count} attempts, and will not be tried again."
+        logfunc(f"Error_msg: {error_msg}")
+        mark_finished(task=task, error_msg=error_msg)
+        notify_finished(task=task, logfunc=logfunc)
+        return
+
+    delay = retry_delay_seconds(task.attempt_count)
+    task.next_attempt_after = datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds=delay)
+    Task.objects.filter(pk=task.id).update(next_attempt_after=task.next_attempt_after)
+    logfunc(f"Task will be tried again in {delay:.0f} seconds at the earliest")
+
+
+def task_logfuncs(task, slotid: int) -> tuple[t.Callable[[t.Any], None], t.Callable[[t.Any], None]]:
+    """Return the task's log functions: one for the slot log only, and one for the main log as well."""
 
     def logfunc_slotonly(x) -> None:
         log_general(f"slot {slotid:2d} task {task.id:05d}: {x}", suffix=f"_slot{slotid:02d}")
@@ -657,16 +1487,27 @@ def do_task(task, slotid: int) -> None:
         # also log to the main process
         log_general(f"slot {slotid:2d} task {task.id:05d}: {x}")
 
-    mark_started(task)
-
-    logfunc(f"Starting {'API' if task.from_api else 'web'} task for {task.user.username} ({task.user.email}):")
-    for key, value in model_to_dict(task).items():
-        logfunc_slotonly(f"{key:>17}: {value}")
-
-    runtask_starttime = time.perf_counter()
-
-    localresultfile, error_msg = runtask(task=task, logfunc=logfunc_slotonly)
-
+    return logfunc_slotonly, logfunc
+
+
+def finish_attempt(
+    task,
+    localresultfile: Path | None,
+    error_msg: str | None,
+    runtime_seconds: float | None,
+    runtask_duration: float,
+    slotid: int,
+    logfunc_slotonly: t.Callable[[t.Any], None],
+    logfunc: t.Callable[[t.Any], None],
+    record_in_cache: bool = True,
+) -> bool:
+    """Record the outcome of an attempt at a task, and return False if it is to be retried.
+
+    `runtime_seconds` is the task's own run time when it ran in a batch, and None otherwise.
+    `record_in_cache` is False for a result that was itself answered from the result cache: it is
+    only as fresh as the one it was sliced from, and caching it would restart the clock on that. Nor
+    did the task run, so it is marked as having reused a result (see Task.reused_result).
+    """
     if not task_exists(taskid=task.id):  # task was cancelled
         logfunc("Task was cancelled during execution (no longer in database)")
 
@@ -674,32 +1515,319 @@ def do_task(task, slotid: int) -> None:
         remove_task_resultfiles(
             taskid=task.id, parent_task_id=task.parent_task_id, request_type=task.request_type, logfunc=logfunc
         )
+        return True
+
+    logfunc(f"Task ran for {runtime_seconds if runtime_seconds is not None else runtask_duration:.1f} seconds")
+
+    # the task is marked finished before the email is sent, so that a mail failure can never
+    # leave the task looking unfinished and get it re-run
+    if error_msg:
+        # an error occurred and the task should not be retried (e.g. invalid
+        # minor planet center object name or no data returned)
+        logfunc(f"Error_msg: {error_msg}")
+
+        mark_finished(
+            task=task, error_msg=error_msg, runtime_seconds=runtime_seconds, reused_result=not record_in_cache
+        )
+
+        notify_finished(task=task, logfunc=logfunc)
+
+    elif localresultfile and localresultfile.exists():
+        # the result file is served from disk; nothing parses it into the database
+        mark_finished(task=task, error_msg=None, runtime_seconds=runtime_seconds, reused_result=not record_in_cache)
+
+        if record_in_cache:
+            resultcache.record_result(task)
+
+        notify_finished(task=task, logfunc=logfunc)
+
     else:
-        runtask_duration = time.perf_counter() - runtask_starttime
+        logfunc_slotonly("Task was not completed successfully")
+        return False
 
-        logfunc(f"Task ran for {runtask_duration:.1f} seconds")
+    attach_duplicates(task, localresultfile=localresultfile, error_msg=error_msg, slotid=slotid)
 
-        # the task is marked finished before the email is sent, so that a mail failure can never
-        # leave the task looking unfinished and get it re-run
-        if error_msg:
-            # an error occurred and the task should not be retried (e.g. invalid
-            # minor planet center object name or no data returned)
-            logfunc(f"Error_msg: {error_msg}")
+    return True
 
-            mark_finished(task=task, error_msg=error_msg)
 
-            notify_finished(task=task, logfunc=logfunc)
+def find_duplicates(task) -> list[Task]:
+    """Return the other unfinished tasks that ask for exactly what `task` does; see Task.request_fingerprint."""
+    fingerprint = task.request_fingerprint()
+    if not settings.TASKRUNNER_DEDUPLICATE or fingerprint is None:
+        return []
 
-        elif localresultfile and localresultfile.exists():
-            # the result file is served from disk; nothing parses it into the database
-            mark_finished(task=task, error_msg=None)
+    # Narrowed in the database by the fields that cannot differ, and then compared exactly; the
+    # coordinate window is wider than the fingerprint's rounding, so it cannot exclude a match.
+    #
+    # Never started, because a started one may be running right now as a companion in another
+    # user's batch, which would finish (and notify) it a second time. The cost is that a duplicate
+    # whose own earlier attempt failed is run again rather than shared.
+    candidates = (
+        Task.queued()
+        .filter(request_type="FP", use_reduced=task.use_reduced, starttimestamp__isnull=True)
+        .exclude(id=task.id)
+    )
+    if settings.TASKRUNNER_CLAIMS:
+        # nor claimed, by this runner or another, which may be about to start it
+        candidates = candidates.exclude(id__in=TaskClaim.objects.values("task_id"))
+    if task.mpc_name:
+        candidates = candidates.filter(mpc_name=task.mpc_name)
+    else:
+        candidates = candidates.filter(
+            ra__range=(task.ra - 1e-6, task.ra + 1e-6), dec__range=(task.dec - 1e-6, task.dec + 1e-6)
+        )
+
+    return [
+        candidate
+        for candidate in candidates.select_related("user").order_by("id")
+        if candidate.request_fingerprint() == fingerprint
+    ]
 
-            notify_finished(task=task, logfunc=logfunc)
 
-        else:
-            waittime = 5
-            logfunc(f"ERROR: Task was not completed successfully. Waiting {waittime} seconds to slow down retries...")
-            time.sleep(waittime)  # in case we're stuck in an error loop, wait a bit before trying again
+def link_result_file(source: Path, destination: Path) -> None:
+    """Give `destination` the contents of `source`, as a hard link where the filesystem allows one."""
+    # a link rather than a copy costs no space, and the two stay independent where it matters:
+    # deleting either task's file (the retention sweep, a user deleting their task) removes only
+    # that name, and nothing ever rewrites a result file in place
+    destination.unlink(missing_ok=True)
+    try:
+        destination.hardlink_to(source)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def attach_duplicates(task, localresultfile: Path | None, error_msg: str | None, slotid: int) -> None:
+    """Finish every queued duplicate of a task that has just finished, with a copy of its outcome.
+
+    Each duplicate keeps its own row, result file, email and callback; only the remote run is
+    shared. Dispatch does not start a task while a duplicate of it is running (see
+    next_dispatchable_task), so the duplicates found here are still waiting, however long the
+    original took.
+    """
+    for duplicate in find_duplicates(task):
+        logfunc_slotonly, logfunc = task_logfuncs(duplicate, slotid)
+
+        if localresultfile is not None:
+            for suffix in (".txt", ".jpg"):
+                source = localresultfile.with_suffix(suffix)
+                if source.exists():
+                    link_result_file(source, Path(settings.RESULTS_DIR, f"job{duplicate.id:05d}{suffix}"))
+
+        mark_started(duplicate)
+        mark_finished(task=duplicate, error_msg=error_msg, reused_result=True)
+        logfunc(f"Finished with the result of task {task.id}, which asked for the same thing")
+        for key, value in model_to_dict(duplicate).items():
+            logfunc_slotonly(f"{key:>17}: {value}")
+
+        notify_finished(task=duplicate, logfunc=logfunc)
+
+
+def watch_cancellations(procs_taskids: dict[int, int]) -> list[int]:
+    """Return the slots whose task is no longer in the database, in one query for every running slot.
+
+    This is what settings.TASKRUNNER_CANCEL_WATCH replaces the per-slot polling with: sixteen slots
+    each asking about their own task every CANCEL_CHECK_SECONDS made that many queries to learn,
+    almost always, that nothing had changed.
+
+    Only a slot's lead task is known here, so a batch is signalled when its lead is cancelled and
+    the slot decides whether the rest of the batch still wants running; see run_remote_command.
+    """
+    if not procs_taskids:
+        return []
+
+    remaining = set(Task.objects.filter(id__in=procs_taskids.values()).values_list("id", flat=True))
+    return [slotid for slotid, taskid in procs_taskids.items() if taskid not in remaining]
+
+
+def next_dispatchable_task(candidates: "models.QuerySet[Task]", running_fingerprints: set[str]) -> Task | None:
+    """Return the first of the candidates, in order, that is not a duplicate of a running task.
+
+    A duplicate is left queued for the running task to finish when it does (see attach_duplicates)
+    rather than sent to sc01 a second time.
+    """
+    if not running_fingerprints:
+        return candidates.first()
+
+    for task in candidates[:DISPATCH_SCAN_LIMIT]:
+        if task.request_fingerprint() not in running_fingerprints:
+            return task
+
+    return None
+
+
+def next_task_in_order(
+    order: list[tuple[int, int]],
+    busy_userids: set[int],
+    running_fingerprints: set[str],
+    request_types: set[str] | None = None,
+) -> Task | None:
+    """Return the first task in the runner's own queue order that next_dispatchable_task() would accept.
+
+    For settings.TASKRUNNER_VIRTUAL_QUEUE, where `order` is what the runner published and the
+    positions stored on the tasks are not kept up to date. The first DISPATCH_SCAN_LIMIT tasks of
+    users with nothing running are looked up in one query, and one deleted since the order was
+    taken is simply not found. None means none of those will do, and the caller falls back to the
+    stored order, which also holds any task submitted since. `request_types`, if given, are the
+    only types that will do.
+    """
+    candidateids = list(islice((taskid for taskid, userid in order if userid not in busy_userids), DISPATCH_SCAN_LIMIT))
+    if not candidateids:
+        return None
+
+    found = Task.dispatchable().in_bulk(candidateids)
+    if request_types is not None:
+        found = {taskid: task for taskid, task in found.items() if task.request_type in request_types}
+    for taskid in candidateids:
+        task = found.get(taskid)
+        if task is not None and (not running_fingerprints or task.request_fingerprint() not in running_fingerprints):
+            return task
+
+    return None
+
+
+def short_request_types() -> set[str]:
+    """Return the request types that typically finish within SHORT_TASK_SECONDS."""
+    medians = taskqueue.typical_runtime_seconds()
+    return {
+        request_type
+        for request_type in Task.RequestType.values  # noqa: PD011 (Django choices, not pandas)
+        if (medians[request_type] <= SHORT_TASK_SECONDS if request_type in medians else request_type == "FP")
+    }
+
+
+def lane_request_types(
+    running_types: "t.Iterable[str]", numslots: int, request_types: set[str] | None
+) -> set[str] | None:
+    """Return the request types that a free slot may take, with settings.TASKRUNNER_SCHEDULER = "short_lane".
+
+    Long tasks may hold all but settings.TASKRUNNER_SHORT_LANE_SLOTS of the slots (and always at
+    least one), and once they do, only the short types are dispatched. `running_types` are the
+    request types of the running tasks, and `request_types` the types that would be dispatched
+    otherwise, None for every type. Any other scheduler leaves them as they are.
+    """
+    if settings.TASKRUNNER_SCHEDULER != "short_lane":
+        return request_types
+
+    shorttypes = short_request_types()
+    longslots = max(numslots - settings.TASKRUNNER_SHORT_LANE_SLOTS, 1)
+    if sum(1 for request_type in running_types if request_type not in shorttypes) < longslots:
+        return request_types
+
+    return shorttypes if request_types is None else shorttypes & request_types
+
+
+def publish_start_estimates(
+    running_taskids: "t.Iterable[int]", numslots: int, order: list[tuple[int, int]] | None, runnerid: str = ""
+) -> tuple[float, float] | None:
+    """Estimate when each queued task will start and publish that, returning when the last one will.
+
+    With settings.TASKRUNNER_START_ESTIMATES. The simulation follows the short lane when the
+    scheduler has one. With settings.TASKRUNNER_CLAIMS, it runs every runner's running tasks on
+    every runner's slots: `numslots` (the runners share their settings) for this one, `runnerid`,
+    and for each other runner holding a claim. A runner with nothing running is left out, which
+    only happens when it has found nothing in the queue to start. None, and nothing published, when
+    there are no run times yet to simulate with.
+    """
+    shortlane = settings.TASKRUNNER_SCHEDULER == "short_lane"
+    runnercount = 1
+    if settings.TASKRUNNER_CLAIMS:
+        claimed = list(Task.queued().filter(claim__isnull=False).values_list("id", "claim__runner"))
+        running_taskids = [taskid for taskid, _ in claimed]
+        runnercount += len({runner for _, runner in claimed if runner != runnerid})
+
+    computed = datetime.datetime.now(datetime.UTC)
+    estimates = eta.estimate_start_times(
+        running_taskids=running_taskids,
+        numslots=numslots * runnercount,
+        order=order,
+        short_types=short_request_types() if shortlane else None,
+        long_slots=max(numslots - settings.TASKRUNNER_SHORT_LANE_SLOTS, 1) * runnercount if shortlane else None,
+    )
+    if estimates is None:
+        return None
+
+    runnerstatus.write_start_estimates(computed, estimates.starts)
+    return estimates.drain
+
+
+class StartEstimator:
+    """The start estimates, simulated on a thread of its own so that dispatch goes on while they are.
+
+    With settings.TASKRUNNER_START_ESTIMATES. Tens of drains of a long queue take a good part of a
+    second, for a loop that otherwise turns every half second. The thread is given copies of what
+    it reads from the main loop, has its own database connection as the maintenance sweep's does,
+    and hands back only when the last queued task is expected to start, through the lock.
+    """
+
+    def __init__(self) -> None:
+        """Nothing runs until start()."""
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.drain: tuple[float, float] | None = None
+
+    def start(
+        self, running_taskids: "t.Iterable[int]", numslots: int, order: list[tuple[int, int]] | None, runnerid: str
+    ) -> bool:
+        """Start estimating, unless the last estimate is still going; return whether one was started."""
+        if self.is_running():
+            return False
+
+        self.thread = threading.Thread(
+            target=self.run,
+            args=(list(running_taskids), numslots, list(order) if order is not None else None, runnerid),
+            name="startestimates",
+            daemon=True,
+        )
+        self.thread.start()
+        return True
+
+    def run(
+        self, running_taskids: list[int], numslots: int, order: list[tuple[int, int]] | None, runnerid: str
+    ) -> None:
+        try:
+            drain = publish_start_estimates(running_taskids, numslots, order, runnerid)
+        except Exception as ex:  # noqa: BLE001 (an estimate going stale is a display problem, and
+            # an unhandled exception here would only print to stderr, where nobody reads it)
+            log_general(f"ERROR: could not estimate the queued tasks' start times: {ex}")
+            return
+        finally:
+            connection.close()
+
+        with self.lock:
+            self.drain = drain
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def drain_seconds(self) -> tuple[float, float] | None:
+        """Return when the last queued task is expected to start, from the last estimate that finished."""
+        with self.lock:
+            return self.drain
+
+
+def do_pooled_task(
+    taskid: int, slotid: int, host: str = REMOTE_SERVER, batch_limit: int = FP_BATCH_MAX_TASKS
+) -> str | None:
+    """Run a task by id inside a pooled worker; see atlasserver.taskrunner.pool.
+
+    The task is read here rather than handed over by the dispatcher, because it may have been
+    cancelled in the moment between the two. A warm worker also keeps its database connection
+    between tasks, and one the server has since closed would fail the first query of the next.
+    """
+    close_old_connections()
+
+    task = Task.objects.select_related("user").filter(id=taskid).first()
+    if task is None:
+        log_general(f"slot {slotid:2d} task {taskid:05d}: cancelled before it started", suffix=f"_slot{slotid:02d}")
+        return None
+
+    return do_task(
+        task=task,
+        slotid=slotid,
+        cancel_event=workerpool.slot_cancel_event if settings.TASKRUNNER_CANCEL_WATCH else None,
+        host=host,
+        batch_limit=batch_limit,
+    )
 
 
 def remove_old_tasks(
@@ -710,11 +1838,14 @@ def remove_old_tasks(
     from_api: bool | None = None,
     logfunc=log_general,
     heartbeat: t.Callable[[], None] | None = None,
+    progress: t.Callable[[int, int], None] | None = None,
+    pause_seconds: float = 0.0,
 ) -> None:
     """Remove old tasks matching given criteria, optionally deleting their result files.
 
     `heartbeat` is called after every batch so that a long sweep does not look like a dead runner
-    to whatever is watching the status file.
+    to whatever is watching the status file. `progress` is given the number of tasks and of files
+    each batch removed, and `pause_seconds` is waited after each batch.
     """
     now = datetime.datetime.now(datetime.UTC)
     filteropts: dict[str, t.Any] = {
@@ -783,8 +1914,9 @@ def remove_old_tasks(
 
             taskids = [task.id for task in tasks]
 
+            filecount = 0
             for taskindex, task in enumerate(tasks):
-                task.delete_result_files()
+                filecount += task.delete_result_files()
                 # inside the batch as well as after it: 500 tasks times several filesystem operations
                 # each can alone outlast the staleness window on a slow results mount. The
                 # heartbeat rate-limits itself, so calling it often costs almost nothing.
@@ -800,21 +1932,31 @@ def remove_old_tasks(
             for task in tasks:
                 task.forget_derived_cache()
 
+            if progress is not None:
+                progress(len(tasks), filecount)
             if heartbeat is not None:
                 heartbeat()
+            if pause_seconds > 0:
+                time.sleep(pause_seconds)
         else:
             logfunc(f"  WARNING: stopped after {maxpasses} batches with tasks still matching")
 
         logfunc("  Done.")
 
 
-def do_maintenance(heartbeat: t.Callable[[], None] | None = None):
+def do_maintenance(
+    heartbeat: t.Callable[[], None] | None = None,
+    sweep: "MaintenanceSweep | None" = None,
+    pause_seconds: float = 0.0,
+):
     """Remove old tasks and associated files according to their type and age.
 
     `heartbeat` is called between sweeps and periodically within them. This runs in the main loop
     and blocks it, and a long sweep would otherwise leave the status file untouched for minutes,
     which from outside is indistinguishable from a dead runner: the queue page would tell every
     user that their tasks are not being processed while all sixteen slots were in fact busy.
+
+    Run in the background instead, `sweep` is given its progress for the status file to report.
     """
     # no maxtime parameter: one used to be accepted and silently ignored (its only reference was a
     # commented-out call), which read as a five-minute bound on the sweep that did not exist
@@ -834,15 +1976,91 @@ def do_maintenance(heartbeat: t.Callable[[], None] | None = None):
         {"days_ago": 183, "harddeleterecord": True},
     ]
 
-    for sweep in sweeps:
+    for sweepindex, sweepopts in enumerate(sweeps):
         if heartbeat is not None:
             heartbeat()
-        remove_old_tasks(**sweep, logfunc=logfunc, heartbeat=heartbeat)
+        if sweep is not None:
+            sweep.report(current_sweep=sweepindex + 1, sweep_count=len(sweeps), sweep_days_ago=sweepopts["days_ago"])
+        remove_old_tasks(
+            **sweepopts,
+            logfunc=logfunc,
+            heartbeat=heartbeat,
+            progress=sweep.count if sweep is not None else None,
+            pause_seconds=pause_seconds,
+        )
+
+    # with or without the mode on: rows left from a time it was on would stop a backfill later
+    prunedsketches = sketches.prune_runtime_sketches()
+    if prunedsketches:
+        logfunc(f"Deleted {prunedsketches} run time sketch rows older than {sketches.KEEP_HOURS} hours")
+
 
+class MaintenanceSweep:
+    """The hourly sweep on a thread of its own, so that dispatch goes on filling slots while it runs.
 
-def main() -> None:
-    """Run queued tasks and clean up on old tasks."""
+    With settings.TASKRUNNER_BACKGROUND_MAINTENANCE. The thread has its own database connection,
+    which Django gives each thread, and closes it when the sweep ends. Everything the main loop
+    reads from here goes through the lock: the progress is written by one thread and read by another.
+    """
+
+    def __init__(self) -> None:
+        """Nothing runs until start()."""
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.progress: dict[str, t.Any] = {}
+
+    def start(self) -> bool:
+        """Start a sweep, unless the last one is still going; return whether one was started."""
+        if self.is_running():
+            return False
+
+        with self.lock:
+            self.progress = {
+                "started": datetime.datetime.now(datetime.UTC).isoformat(),
+                "current_sweep": 0,
+                "sweep_count": 0,
+                "sweep_days_ago": None,
+                "tasks_processed": 0,
+                "files_deleted": 0,
+            }
+        self.thread = threading.Thread(target=self.run, name="maintenance", daemon=True)
+        self.thread.start()
+        return True
+
+    def run(self) -> None:
+        try:
+            do_maintenance(sweep=self, pause_seconds=MAINTENANCE_BATCH_PAUSE_SECONDS)
+        except Exception as ex:  # noqa: BLE001 (a failed sweep is retried next hour; an unhandled
+            # exception here would only print to stderr, where nobody reads it)
+            log_general(f"Maintenance: ERROR: the sweep failed: {ex}")
+        finally:
+            connection.close()
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def report(self, **fields: t.Any) -> None:
+        with self.lock:
+            self.progress.update(fields)
+
+    def count(self, tasks: int, files: int) -> None:
+        with self.lock:
+            self.progress["tasks_processed"] += tasks
+            self.progress["files_deleted"] += files
+
+    def snapshot(self) -> dict[str, t.Any] | None:
+        """Return a copy of the running sweep's progress, or None when none is running."""
+        if not self.is_running():
+            return None
+        with self.lock:
+            return dict(self.progress)
+
+
+def main() -> int:
+    """Run queued tasks and clean up on old tasks, until a drain; return the exit status it calls for."""
     signal(SIGINT, handler)
+    signal(SIGTERM, drain_handler)
+    startedat = datetime.datetime.now(datetime.UTC)
 
     runnerstatus.LOG_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -853,42 +2071,221 @@ def main() -> None:
     mp.set_start_method("spawn")
     numslots: int = runnerstatus.NUMSLOTS
     procs: list[mp.Process | None] = [None for _ in range(numslots)]
+    # with the pool, each slot's worker outlives its tasks and procs stays empty
+    pool = (
+        WorkerPool(numslots=numslots, run_task=do_pooled_task, logfunc=logfunc)
+        if settings.TASKRUNNER_WORKER_POOL
+        else None
+    )
+    if pool is not None:
+        pool.start()
+
+    # with TASKRUNNER_REMOTE_HOSTS, which host each task goes to; without it, all go to REMOTE_SERVER
+    hostpool = (
+        HostPool(
+            parse_remote_hosts(
+                settings.TASKRUNNER_REMOTE_HOSTS, request_types=Task.RequestType.values, default_slots=numslots
+            ),
+            logfunc=logfunc,
+        )
+        if settings.TASKRUNNER_REMOTE_HOSTS
+        else None
+    )
+    remotehosts = [host.name for host in hostpool.hosts] if hostpool is not None else [REMOTE_SERVER]
+
+    # Set up now, so that a simulation that is misconfigured stops the runner here rather than
+    # failing every task; with the ssh executor this is only the host names.
+    for host in remotehosts:
+        executors.executor_for(host)
+
+    # owned here rather than by the slots, so that the connections outlive any one task. A
+    # simulated host has nothing to connect to.
+    sshmultiplexers = (
+        [SshMultiplexer(host, logfunc=logfunc) for host in remotehosts]
+        if settings.TASKRUNNER_SSH_MULTIPLEX and settings.TASKRUNNER_EXECUTOR == "ssh"
+        else []
+    )
+    for sshmultiplexer in sshmultiplexers:
+        sshmultiplexer.start()
+
+    # with TASKRUNNER_BACKOFF, whether each host is being sent tasks; see breaker.py
+    breakers = (
+        {host: breaker.CircuitBreaker(host, logfunc=logfunc) for host in remotehosts}
+        if settings.TASKRUNNER_BACKOFF
+        else {}
+    )
+
+    # the first start with the sketches turned on fills them from the last week of finished tasks
+    if settings.TASKRUNNER_RUNTIME_SKETCHES:
+        backfilled = sketches.backfill_runtime_sketches()
+        if backfilled:
+            logfunc(f"Filled the run time sketches from {backfilled} recently finished tasks")
+
+    maintenancesweep = MaintenanceSweep() if settings.TASKRUNNER_BACKGROUND_MAINTENANCE else None
+
+    # with TASKRUNNER_NOTIFY_OUTBOX, the threads that send the callbacks and emails of finished tasks
+    notificationdelivery = outbox.OutboxDelivery(logfunc=logfunc) if settings.TASKRUNNER_NOTIFY_OUTBOX else None
+    if notificationdelivery is not None:
+        notificationdelivery.start()
+
+    # one per slot, set to tell its task that it has been cancelled; see watch_cancellations()
+    slot_cancel_events = [mp.Event() for _ in range(numslots)] if settings.TASKRUNNER_CANCEL_WATCH else []
+    procs_cancelled: set[int] = set()  # slots already signalled, so the log says it once
+
+    # (task id, user id) of each queued task, front first, with TASKRUNNER_VIRTUAL_QUEUE: the order
+    # is kept here and published for the web app rather than written into every moved row
+    virtualorder: list[tuple[int, int]] = []
+
+    # With TASKRUNNER_CLAIMS, what this runner's claims carry as its name, and whether it holds the
+    # leader lease: only the leader sweeps and renumbers. A lone runner is always its own leader.
+    runnerid = claims.runner_id()
+    is_leader = not settings.TASKRUNNER_CLAIMS
+    last_leaserenewtime: float = float("-inf")
+
+    # with claims, several runners can share LOG_DIR, and each has a status file and wakeup socket
+    # of its own; see status.runner_path()
+    statuspath = runnerstatus.runner_path(runnerstatus.STATUS_PATH, runnerid) if settings.TASKRUNNER_CLAIMS else None
+    wakeuppath = (
+        runnerstatus.runner_path(runnerstatus.WAKEUP_SOCKET_PATH, runnerid)
+        if settings.TASKRUNNER_CLAIMS
+        else runnerstatus.WAKEUP_SOCKET_PATH
+    )
+
+    wakeup: WakeupListener | None = None
+    if settings.TASKRUNNER_WAKEUP:
+        try:
+            wakeup = WakeupListener(wakeuppath)
+        except OSError as ex:
+            logfunc(f"ERROR: could not listen on {wakeuppath}, polling instead: {ex}")
+
+    # what became of the detached jobs that were out when the runner last stopped, before any task
+    # is dispatched into a slot; see detached.py
+    if settings.TASKRUNNER_DETACHED:
+        detached.recover_attempts(runnerid, logfunc)
+
     procs_userids: dict[int, int] = {}  # user_id of currently running job, or None
     procs_taskids: dict[int, int] = {}  # tasks_id of currently running job, or None
+    # request fingerprint of each running job, kept only with TASKRUNNER_DEDUPLICATE
+    procs_fingerprints: dict[int, str] = {}
+    procs_requesttypes: dict[int, str] = {}  # request_type of each running job
+    procs_hosts: dict[int, str] = {}  # the remote host of each running job
 
     last_maintenancetime: float = float("-inf")
     last_statustime: float = float("-inf")
     last_queuerecalctime: float = float("-inf")
     last_queueflagchecktime: float = float("-inf")
+    last_cancelchecktime: float = float("-inf")
+    last_predictorrefreshtime: float = float("-inf")
+    last_startestimatetime: float = float("-inf")
+    # also says when the last queued task is expected to start, for the status; see eta.py
+    startestimator = StartEstimator()
     # what the queue-recalc counter read the last time positions were renumbered; see
     # forcephot.queue.recalc_generation. Starts below any real value so the first pass renumbers.
     last_recalc_generation: int = -1
     seen_generation: int = -1
     printedwaiting = False
+    dispatched = False  # whether the last pass started a task, so another slot may be fillable now
+    # the drain under way, once one has been asked for: nothing more is dispatched, and the loop
+    # ends once the slots are empty or its deadline has passed
+    draining: runnerstatus.DrainRequest | None = None
 
     def refresh_status(maintenance: bool = False) -> None:
         """Write the status snapshot now, and reset the interval that would have written it."""
         nonlocal last_statustime
-        write_status(procs_taskids=procs_taskids, numslots=numslots, maintenance=maintenance)
+        write_status(
+            procs_taskids=procs_taskids,
+            numslots=numslots,
+            maintenance=maintenance,
+            maintenance_progress=maintenancesweep.snapshot() if maintenancesweep is not None else None,
+            remote_hosts=hostpool.snapshot() if hostpool is not None else None,
+            queue_drain_seconds=startestimator.drain_seconds(),
+            draining=draining.as_status() if draining is not None else None,
+            circuit_breakers={name: hostbreaker.snapshot() for name, hostbreaker in breakers.items()} or None,
+            statuspath=statuspath,
+        )
         last_statustime = time.perf_counter()
 
+        # the order is rewritten only when it changes, and a reader takes one that is not kept
+        # current as a runner that has gone; see QUEUE_SNAPSHOT_STALE_SECONDS
+        if settings.TASKRUNNER_VIRTUAL_QUEUE and is_leader:
+            try:
+                runnerstatus.touch_queue_snapshot()
+            except FileNotFoundError:
+                pass  # not published yet: the next queue pass writes it
+            except OSError as ex:
+                logfunc(f"ERROR: could not mark the queue order current: {ex}")
+
+    def renew_leases() -> None:
+        """Renew this runner's claims and the leader lease, at most once per claims.RENEW_SECONDS."""
+        nonlocal is_leader, last_leaserenewtime
+        if not settings.TASKRUNNER_CLAIMS or (time.perf_counter() - last_leaserenewtime) < claims.RENEW_SECONDS:
+            return
+        last_leaserenewtime = time.perf_counter()
+
+        claims.renew_claims(runnerid)
+        was_leader = is_leader
+        is_leader = claims.acquire_lease(claims.LEADER_LEASE_NAME, runnerid)
+        if is_leader != was_leader:
+            logfunc(f"Runner {runnerid} {'now leads' if is_leader else 'no longer leads'} the other runners")
+
     def maintenance_heartbeat() -> None:
         """Keep the status file fresh during the sweep, at the normal cadence.
 
         Rate-limited so that callers can invoke it as often as they like; marked as maintenance
         because the slot fields are frozen while the sweep blocks the loop, and an unqualified
         snapshot would describe workers that may have already exited.
+
+        The claims are renewed here too, as the loop would have: a sweep outlasting their lease
+        would otherwise hand this runner's running tasks to another runner to start again.
         """
         if (time.perf_counter() - last_statustime) >= runnerstatus.STATUS_WRITE_SECONDS:
             refresh_status(maintenance=True)
+        renew_leases()
 
     while True:
-        # an idle server polled twice a second all night for nothing. Once the queue has been seen
-        # to be empty, wait longer between polls; the interval drops back as soon as work appears,
-        # so the latency to pick up a new task is unchanged whenever the server is actually busy.
-        time.sleep(IDLE_POLL_INTERVAL_SECONDS if printedwaiting else POLL_INTERVAL_SECONDS)
+        if wakeup is None:
+            # an idle server polled twice a second all night for nothing. Once the queue has been seen
+            # to be empty, wait longer between polls; the interval drops back as soon as work appears,
+            # so the latency to pick up a new task is unchanged whenever the server is actually busy.
+            time.sleep(IDLE_POLL_INTERVAL_SECONDS if printedwaiting else POLL_INTERVAL_SECONDS)
+        else:
+            slotwaitables = (
+                pool.waitables() if pool is not None else [proc.sentinel for proc in procs if proc is not None]
+            )
+            if wakeup.wait(slotwaitables, timeout=0.0 if dispatched else IDLE_POLL_INTERVAL_SECONDS):
+                # the queue changed, so the renumbering request is read now rather than on its
+                # interval, and a deletion reaches a running task now rather than on the next watch
+                last_queueflagchecktime = float("-inf")
+                last_cancelchecktime = float("-inf")
+        dispatched = False
+
+        if (request := pending_drain_request(startedat)) is not None:
+            # a later request replaces an earlier one, to hand over after all or to move the deadline
+            draining = request
+            if draining.handover and settings.TASKRUNNER_DETACHED:
+                logfunc(
+                    "Handing over: the running tasks' remote jobs will be left for the next runner to resume,"
+                    f" once each slot is following its job, or at {draining.deadline:%F %T} UTC"
+                )
+            else:
+                logfunc(
+                    f"Draining{' for a handover' if draining.handover else ''}: no more tasks will be started,"
+                    f" and the {len(procs_taskids)} running have until {draining.deadline:%F %T} UTC to finish"
+                )
+            refresh_status()
+
+        renew_leases()
+
+        # not started while draining, since a sweep that blocks the loop would hold up the exit
+        maintenance_due = draining is None and is_leader and (time.perf_counter() - last_maintenancetime) > 60 * 60
+        if maintenance_due and maintenancesweep is not None:
+            last_maintenancetime = time.perf_counter()
+            if maintenancesweep.start():
+                refresh_status()  # so that the sweep shows from its start rather than a write later
+            else:
+                logfunc("Maintenance: the previous sweep is still running, so this hour's is skipped")
 
-        if (time.perf_counter() - last_maintenancetime) > 60 * 60:  # once per hour
+        elif maintenance_due:  # once per hour
             last_maintenancetime = time.perf_counter()
             # the sweep blocks this loop, so it refreshes the status file itself; without that a
             # sweep lasting longer than STATUS_WRITE_SECONDS * 4 makes the queue page tell every
@@ -907,13 +2304,26 @@ def main() -> None:
             seen_generation = taskqueue.recalc_generation()
             recalc_requested = seen_generation != last_recalc_generation
 
-        if recalc_requested or ((time.perf_counter() - last_queuerecalctime) > taskqueue.RECALC_MAX_INTERVAL_SECONDS):
+        full_recalc_due = (time.perf_counter() - last_queuerecalctime) > taskqueue.RECALC_MAX_INTERVAL_SECONDS
+        if is_leader and (recalc_requested or full_recalc_due):
+            # the web app says how much of the queue its changes can have moved; the backstop pass
+            # renumbers all of it, which also repairs a tail left stale by a lost position
+            from_position = taskqueue.take_recalc_from_position()
+            if full_recalc_due:
+                from_position = 0
+
             # caught, because this loop is what dispatches every job: unguarded, a lock timeout or
             # a bad queue state would take the exception out of main() and stop the runner, and the
             # supervisor would restart it straight back into the same state. Queue positions going
             # stale is a display problem; not dispatching anything is not.
             try:
-                taskqueue.calculate_queue_positions()
+                if settings.TASKRUNNER_VIRTUAL_QUEUE:
+                    # the whole order every time: reading the queue is cheap, and what made the
+                    # tail-only pass worth having was writing it
+                    virtualorder = taskqueue.virtual_queue_order()
+                    runnerstatus.write_queue_snapshot(virtualorder)
+                else:
+                    taskqueue.calculate_queue_positions(from_position=from_position)
             except Exception as ex:  # noqa: BLE001 (this loop dispatches every job; stale
                 # queue positions are a display problem, not dispatching is not)
                 logfunc(f"ERROR: could not update queue positions: {ex}")
@@ -925,26 +2335,123 @@ def main() -> None:
                 last_recalc_generation = seen_generation
 
             # stamped even on failure, so a persistent one is retried on an interval rather than on
-            # every pass of the loop
-            last_queuerecalctime = time.perf_counter()
+            # every pass of the loop. Only for a pass over the whole queue: a stream of submissions
+            # renumbering the tail must not keep postponing the backstop.
+            if from_position == 0:
+                last_queuerecalctime = time.perf_counter()
+
+        # the leader's job, as the renumbering is: the bins are shared, through the cache
+        if (
+            settings.TASKRUNNER_RUNTIME_PREDICTOR
+            and is_leader
+            and (time.perf_counter() - last_predictorrefreshtime) >= prediction.PREDICTOR_REFRESH_SECONDS
+        ):
+            last_predictorrefreshtime = time.perf_counter()
+            try:
+                prediction.refresh_runtime_predictor()
+            except Exception as ex:  # noqa: BLE001 (as for the queue positions: a prediction going
+                # stale is a display problem, and not dispatching is not)
+                logfunc(f"ERROR: could not refresh the run time predictions: {ex}")
+
+        # the leader's too, since it sees the queue order the others dispatch by
+        if (
+            settings.TASKRUNNER_START_ESTIMATES
+            and is_leader
+            and (time.perf_counter() - last_startestimatetime) >= eta.ETA_REFRESH_SECONDS
+        ):
+            last_startestimatetime = time.perf_counter()
+            startestimator.start(
+                running_taskids=procs_taskids.values(),
+                numslots=numslots,
+                order=virtualorder if settings.TASKRUNNER_VIRTUAL_QUEUE else None,
+                runnerid=runnerid,
+            )
 
-        for slotid, proc in enumerate(procs):
-            if proc is not None and proc.exitcode is not None:
-                proc.join()
-                proc.close()
-                procs[slotid] = None
-                procs_userids.pop(slotid)
-                procs_taskids.pop(slotid)
+        for sshmultiplexer in sshmultiplexers:
+            sshmultiplexer.maintain()
 
-                numslotsfree = sum(1 if p is None else 0 for p in procs)
-                logfunc(f"slot {slotid} is now free. {numslotsfree} of {numslots} slots are available")
+        if hostpool is not None:
+            hostpool.maintain()
+
+        # what each freed slot's attempt found of its host, for the circuit breakers; read before
+        # the pool's maintenance, which may replace the worker that holds it
+        freedoutcomes: dict[int, str | None] = {}
+        if pool is not None:
+            freedoutcomes = {slotid: t.cast("str | None", pool.workers[slotid].result) for slotid in pool.reap()}
+            pool.maintain()
+        else:
+            for slotid, proc in enumerate(procs):
+                if proc is not None and proc.exitcode is not None:
+                    freedoutcomes[slotid] = SLOT_EXIT_OUTCOMES.get(proc.exitcode)
+                    proc.join()
+                    proc.close()
+                    procs[slotid] = None
+        freedslots = list(freedoutcomes)
+
+        freedtaskids: set[int] = set()
+        for slotid in freedslots:
+            procs_userids.pop(slotid, None)
+            if (freedtaskid := procs_taskids.pop(slotid, None)) is not None:
+                freedtaskids.add(freedtaskid)
+            procs_fingerprints.pop(slotid, None)
+            procs_requesttypes.pop(slotid, None)
+            if (freedhost := procs_hosts.pop(slotid, None)) in breakers:
+                breakers[freedhost].record(slotid, freedoutcomes[slotid])
+            procs_cancelled.discard(slotid)
+            if hostpool is not None:
+                hostpool.release(slotid)
+
+            numslotsfree = numslots - len(procs_taskids)
+            logfunc(f"slot {slotid} is now free. {numslotsfree} of {numslots} slots are available")
+
+        # a task that finished has written its notifications, which are sent now rather than at the
+        # delivery's next poll
+        if freedslots and notificationdelivery is not None:
+            notificationdelivery.wake()
+
+        if settings.TASKRUNNER_CLAIMS and freedtaskids:
+            claims.release_claims(runnerid, freedtaskids)
+
+        if settings.TASKRUNNER_VIRTUAL_QUEUE and freedtaskids:
+            # everything behind a finished task moves up one, which the runner knows without asking
+            # the database; the tasks a batch or a duplicate finished with it go at the next order
+            virtualorder = [(taskid, userid) for taskid, userid in virtualorder if taskid not in freedtaskids]
+            try:
+                runnerstatus.write_queue_snapshot(virtualorder)
+            except OSError as ex:
+                logfunc(f"ERROR: could not publish queue order: {ex}")
+
+        if settings.TASKRUNNER_CANCEL_WATCH and (time.perf_counter() - last_cancelchecktime) >= CANCEL_WATCH_SECONDS:
+            last_cancelchecktime = time.perf_counter()
+            for slotid in watch_cancellations(procs_taskids):
+                # signalled on every watch until the slot frees, because a batch whose lead task
+                # was cancelled keeps running for the others and must be told again if they go too
+                if pool is not None:
+                    pool.cancel(slotid)
+                else:
+                    slot_cancel_events[slotid].set()
+                if slotid not in procs_cancelled:
+                    procs_cancelled.add(slotid)
+                    logfunc(f"slot {slotid} task {procs_taskids[slotid]} was cancelled")
 
         queuedtasks = Task.queued().order_by("queuepos_relative")
 
         if (time.perf_counter() - last_statustime) >= runnerstatus.STATUS_WRITE_SECONDS:
             refresh_status()
 
-        slotid = procs.index(None) if None in procs else -1
+        if draining is not None:
+            # With detached jobs, a handover waits only for the slots that are not following one: the
+            # next runner resumes a job that is out, and a slot starting its job, running a batch or
+            # finishing its task would lose that work if stopped.
+            unfinished = set(procs_taskids.values())
+            if draining.handover and settings.TASKRUNNER_DETACHED:
+                unfinished -= detached.resumable_taskids(unfinished)
+            if unfinished and draining.seconds_left() > 0:
+                continue
+            break
+
+        # procs_taskids rather than procs, because it is what both modes keep
+        slotid = next((slotid for slotid in range(numslots) if slotid not in procs_taskids), -1)
 
         if slotid < 0:
             # every slot is busy, so there is nothing to dispatch and no reason to look at the queue
@@ -952,7 +2459,40 @@ def main() -> None:
 
         # one query rather than a count() followed by a first(): the count was only used for a log
         # line, and is fetched below only when a task is actually dispatched
-        task = queuedtasks.exclude(user_id__in=list(procs_userids.values())).first()
+        # With a pool of hosts, only the request types that one of them can start now: a task that
+        # no healthy host with a free slot runs waits in the queue, rather than being dispatched to
+        # fail. None is every type. The short lane narrows that further once long tasks fill their
+        # share of the slots.
+        # a host whose circuit breaker is open, or half open with its probe out, takes no task
+        blockedhosts = {host for host, hostbreaker in breakers.items() if not hostbreaker.allows_dispatch()}
+        if hostpool is None and REMOTE_SERVER in blockedhosts:
+            continue
+        request_types = hostpool.routable_types(exclude=blockedhosts) if hostpool is not None else None
+        request_types = lane_request_types(procs_requesttypes.values(), numslots, request_types)
+        if request_types is not None and not request_types:
+            continue
+
+        task = None
+        if settings.TASKRUNNER_CLAIMS:
+            # the database knows which users have a task running on any runner, so procs_userids,
+            # which knows only this one's, has no say
+            task = claims.claim_next_task(
+                runnerid, slotid, running_fingerprints=set(procs_fingerprints.values()), request_types=request_types
+            )
+        elif settings.TASKRUNNER_VIRTUAL_QUEUE:
+            task = next_task_in_order(
+                virtualorder,
+                busy_userids=set(procs_userids.values()),
+                running_fingerprints=set(procs_fingerprints.values()),
+                request_types=request_types,
+            )
+        if task is None and not settings.TASKRUNNER_CLAIMS:
+            candidates = (
+                Task.dispatchable().order_by("queuepos_relative").exclude(user_id__in=list(procs_userids.values()))
+            )
+            if request_types is not None:
+                candidates = candidates.filter(request_type__in=request_types)
+            task = next_dispatchable_task(candidates, running_fingerprints=set(procs_fingerprints.values()))
 
         if task is None:
             # nothing runnable. That is either an empty queue or a queue holding only tasks from
@@ -963,15 +2503,87 @@ def main() -> None:
             continue
 
         printedwaiting = False
+        dispatched = True
         logfunc(f"Unfinished tasks in queue: {queuedtasks.count()}")
-        logfunc(f"Running task {task.id} in slot {slotid}")
+        # A task with a detached job out is resumed on the job's host, whichever would be chosen
+        # for it now (see detached.resumable_job()), so that host is the one whose slot it holds
+        # and whose breaker it counts for, even over the host's own limit.
+        attempthost = detached.attempt_host(task) if settings.TASKRUNNER_DETACHED else None
+        remotehost = attempthost or REMOTE_SERVER
+        if hostpool is not None:
+            if attempthost is not None:
+                routedhost = hostpool.host_named(attempthost)
+            else:
+                routedhost = hostpool.route(task.request_type, exclude=blockedhosts)
+                # the candidates were narrowed to the types that a host can take
+                assert routedhost is not None
+            if routedhost is not None:
+                hostpool.assign(slotid, routedhost)
+                remotehost = routedhost.name
+        logfunc(f"Running task {task.id} in slot {slotid} on {remotehost}")
         procs_userids[slotid] = task.user_id
         procs_taskids[slotid] = task.id
-
-        proc = mp.Process(target=do_task, kwargs={"task": task, "slotid": slotid})
-        proc.start()
-        procs[slotid] = proc
+        procs_requesttypes[slotid] = task.request_type
+        procs_hosts[slotid] = remotehost
+        if remotehost in breakers:
+            breakers[remotehost].dispatched(slotid)
+        if settings.TASKRUNNER_DEDUPLICATE and (fingerprint := task.request_fingerprint()) is not None:
+            procs_fingerprints[slotid] = fingerprint
+
+        # the slots left free once this one is taken say whether a batch may run at its longest
+        batchlimit = batch_size_limit(task, freeslots=numslots - len(procs_taskids), numslots=numslots)
+        if pool is not None:
+            pool.submit(slotid, task.id, host=remotehost, batch_limit=batchlimit)
+        else:
+            kwargs: dict[str, t.Any] = {"task": task, "slotid": slotid, "host": remotehost, "batch_limit": batchlimit}
+            if slot_cancel_events:
+                slot_cancel_events[slotid].clear()
+                kwargs["cancel_event"] = slot_cancel_events[slotid]
+            proc = mp.Process(target=run_slot_process, kwargs=kwargs)
+            proc.start()
+            procs[slotid] = proc
+
+    # Drained, or out of time. A task still running is stopped here, and is dispatched again as one
+    # whose runner crashed would be, except that a detached job of one is left running for the next
+    # runner to attach to (see detached.resumable_job()). Its claim is given up, so that the next
+    # runner need not wait for it to lapse.
+    assert draining is not None  # for the type checker: the loop ends only in a drain
+    if procs_taskids:
+        resumable = detached.resumable_taskids(procs_taskids.values()) if settings.TASKRUNNER_DETACHED else set()
+        if resumable:
+            logfunc(f"Leaving the detached jobs of tasks {sorted(resumable)} for the next runner")
+        if stopped := sorted(set(procs_taskids.values()) - resumable):
+            logfunc(f"Drain deadline passed. Stopping tasks {stopped}, which will run again")
+        for slotid in procs_taskids:
+            stop_process_tree(pool.workers[slotid].pid if pool is not None else t.cast("mp.Process", procs[slotid]).pid)
+        if settings.TASKRUNNER_CLAIMS:
+            claims.release_claims(runnerid, procs_taskids.values())
+    else:
+        logfunc("Drained: no task is running")
+
+    if pool is not None:
+        pool.shutdown()
+    for proc in procs:
+        if proc is not None:
+            proc.join()
+    for sshmultiplexer in sshmultiplexers:
+        sshmultiplexer.shutdown()
+    if wakeup is not None:
+        wakeup.close()
+    if notificationdelivery is not None:
+        notificationdelivery.stop()
+    if settings.TASKRUNNER_CLAIMS:
+        claims.release_lease(claims.LEADER_LEASE_NAME, runnerid)
+    if statuspath is not None:
+        # its slots stop counting in the merged status now, rather than once its file is stale
+        statuspath.unlink(missing_ok=True)
+
+    if draining.handover:
+        logfunc("Exiting for the supervisor to start the runner again")
+        return runnerstatus.HANDOVER_EXIT_CODE
+    logfunc("Exiting")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
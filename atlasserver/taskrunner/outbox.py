@@ -0,0 +1,339 @@
+"""Sending finished tasks' callbacks and result emails away from the slots, with settings.TASKRUNNER_NOTIFY_OUTBOX.
+
+notify_finished() sent a task's callback (a POST with a ten second timeout) and its result email (a
+query for the rest of the submission, then an SMTP send with the result files attached) from the
+slot that ran the task, which was not free for the next task until both were done. A slow webhook
+receiver or mail server held one of the slots that the remote tasks are run in, and a failed
+delivery was logged and dropped.
+
+With the outbox, mark_finished() writes a Notification row for each, in the same pass as the task's
+own finish, and the slot moves on. The runner's OutboxDelivery sends them from a pool of threads
+in its own process, DELIVERY_THREADS at a time. A delivery that fails for a reason that may pass
+(no answer, a 5xx, a 429, a mail server that is down) is retried after a backoff that doubles from
+RETRY_BASE_SECONDS; one that fails for good (a URL that no longer validates, a 4xx, a refused
+recipient), or MAX_DELIVERY_ATTEMPTS times, is dead-lettered: left in the table as dead, with its
+last error, for an administrator to look at or send again.
+
+The result email of a submission is written once, when its last task finishes, and built when it
+is sent, so that it lists every task in the submission as send_email_if_needed() did.
+
+Each runner delivers. A notification is taken by moving its next_attempt_after on by
+DELIVERY_LEASE_SECONDS, conditional on it not having moved, so that two runners do not both send it,
+and a runner that stops mid-delivery leaves it due again once the lease has passed.
+"""
+
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import math
+import smtplib
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage
+from django.db import connection
+from django.db import IntegrityError
+from django.db import transaction
+from django.utils import timezone
+
+from atlasserver import settings
+from atlasserver.forcephot import webhooks
+from atlasserver.forcephot.models import Notification
+from atlasserver.forcephot.models import Task
+
+# How many notifications are sent at once. Each waits on a remote server, and none on the CPU.
+DELIVERY_THREADS: int = 8
+
+# How often the due notifications are looked for when nothing has woken the delivery sooner. A task
+# that finishes wakes it, so this only bounds the wait for a retry that has come due.
+POLL_SECONDS: float = 5.0
+
+# how long a notification taken for delivery is kept from the others; well over what one takes
+DELIVERY_LEASE_SECONDS: float = 5 * 60.0
+
+# the backoff between the attempts at a delivery, doubling from the first to at most the second
+RETRY_BASE_SECONDS: float = 60.0
+RETRY_MAX_SECONDS: float = 3600.0
+
+# how many times a delivery is attempted before it is dead-lettered: about two hours of retries
+MAX_DELIVERY_ATTEMPTS: int = 8
+
+# how long a delivered notification is kept, and how often the older ones are deleted
+DELIVERED_KEEP_DAYS: int = 7
+PRUNE_SECONDS: float = 3600.0
+
+# the largest the attachments of a result email may add up to, in MB
+EMAIL_ATTACH_LIMIT_MB: float = 22.0
+
+
+class DeliveryError(Exception):
+    """A delivery that failed, and whether it failed for good rather than for now."""
+
+    def __init__(self, message: str, permanent: bool) -> None:
+        """Describe the failure in `message`; `permanent` means that retrying would fail the same way."""
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def lock_submission(task: Task) -> None:
+    """Lock the tasks of the submission that `task` is one of, in the transaction that finishes it.
+
+    For a submission that is to be emailed: two of its tasks finishing together then take turns,
+    and the second sees the first finished once that has been committed. Without the lock, each
+    could see the other unfinished in its own transaction, and neither would write the email.
+    """
+    if task.send_email and not task.from_api:
+        list(
+            Task.objects.select_for_update()
+            .filter(user_id=task.user_id, send_email=True, timestamp=task.timestamp)
+            .values_list("id", flat=True)
+        )
+
+
+def enqueue_notifications(task: Task) -> None:
+    """Write the notifications that a task's finish calls for: its callback, and its submission's email.
+
+    Called once the task's finish has been written, in the same transaction and with its submission
+    locked (see lock_submission()), so that for the email, the last task of a submission to finish
+    sees every other one finished. Should two both see it, the unique key leaves one email.
+    """
+    if task.callback_url:
+        write_notification(
+            kind=Notification.Kind.CALLBACK,
+            key=f"callback:{task.id}",
+            user_id=task.user_id,
+            url=task.callback_url,
+            payload=webhooks.callback_payload(task),
+        )
+
+    if task.send_email and not task.from_api and task.user.email:
+        unfinished = Task.objects.filter(
+            user_id=task.user_id, send_email=True, timestamp=task.timestamp, finishtimestamp__isnull=True
+        ).exclude(id=task.id)
+        if not unfinished.exists():
+            write_notification(
+                kind=Notification.Kind.EMAIL,
+                key=f"email:{task.user_id}:{task.timestamp.isoformat()}",
+                user_id=task.user_id,
+                payload={"timestamp": task.timestamp.isoformat()},
+            )
+
+
+def write_notification(kind: str, key: str, user_id: int, payload: dict[str, t.Any], url: str = "") -> None:
+    # a key that is already there is the same notification, written by the other of two tasks
+    # finishing together
+    with contextlib.suppress(IntegrityError), transaction.atomic():
+        Notification.objects.create(kind=kind, key=key, user_id=user_id, url=url, payload=payload)
+
+
+def take_due_notifications(limit: int) -> list[Notification]:
+    """Take up to `limit` of the notifications that are due, oldest first, for this runner to send."""
+    now = timezone.now()
+    lease = now + datetime.timedelta(seconds=DELIVERY_LEASE_SECONDS)
+    due = Notification.objects.filter(state=Notification.State.PENDING, next_attempt_after__lte=now)
+    # another runner that took one first has moved its next_attempt_after already
+    return [
+        notification
+        for notification in due.order_by("next_attempt_after", "id")[:limit]
+        if Notification.objects.filter(
+            id=notification.id, state=Notification.State.PENDING, next_attempt_after=notification.next_attempt_after
+        ).update(next_attempt_after=lease)
+    ]
+
+
+def prune_delivered() -> None:
+    """Delete the notifications delivered more than DELIVERED_KEEP_DAYS ago; the dead ones are kept."""
+    cutoff = timezone.now() - datetime.timedelta(days=DELIVERED_KEEP_DAYS)
+    Notification.objects.filter(state=Notification.State.DELIVERED, delivered__lt=cutoff).delete()
+
+
+def retry_delay_seconds(attempts: int) -> float:
+    """Return how long a delivery waits after its `attempts`th attempt failed."""
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def deliver(notification: Notification, logfunc: t.Callable[[t.Any], None]) -> None:
+    """Send one notification that has been taken, and record how it went: delivered, to retry, or dead."""
+    notification.attempts += 1
+    try:
+        if notification.kind == Notification.Kind.CALLBACK:
+            deliver_callback(notification)
+        else:
+            deliver_email(notification)
+    except DeliveryError as ex:
+        notification.last_error = str(ex)
+        if ex.permanent or notification.attempts >= MAX_DELIVERY_ATTEMPTS:
+            notification.state = Notification.State.DEAD
+            logfunc(f"Outbox: ERROR: gave up on {notification.key} after {notification.attempts} attempts: {ex}")
+        else:
+            delay = retry_delay_seconds(notification.attempts)
+            notification.next_attempt_after = timezone.now() + datetime.timedelta(seconds=delay)
+            logfunc(f"Outbox: {notification.key} failed ({ex}), and will be tried again in {delay:.0f} seconds")
+    else:
+        notification.state = Notification.State.DELIVERED
+        notification.delivered = timezone.now()
+        notification.last_error = ""
+        logfunc(f"Outbox: delivered {notification.key} on attempt {notification.attempts}")
+
+    notification.save(update_fields=["attempts", "state", "next_attempt_after", "last_error", "delivered"])
+
+
+def deliver_callback(notification: Notification) -> None:
+    """POST a callback, signed for its user; raises DeliveryError unless the endpoint accepted it."""
+    try:
+        url = webhooks.validate_callback_url(notification.url)
+    except webhooks.CallbackUrlError as ex:
+        # the URL passed validation when the task was submitted, so this means DNS changed under it
+        raise DeliveryError(str(ex), permanent=True) from ex
+
+    body = json.dumps(notification.payload).encode()
+    headers = webhooks.callback_headers(notification.user_id, body)
+    # the same for each attempt, so that a receiver can tell a retry from a second notification
+    headers["X-Atlas-Delivery"] = str(notification.id)
+    try:
+        status = webhooks.post_callback(url, body, headers)
+    except webhooks.CallbackUrlError as ex:
+        raise DeliveryError(str(ex), permanent=True) from ex
+    except OSError as ex:
+        msg = f"no answer: {ex}"
+        raise DeliveryError(msg, permanent=False) from ex
+
+    if not 200 <= status < 300:
+        # a client error other than a timeout or a rate limit is the same on every attempt
+        msg = f"HTTP {status}"
+        raise DeliveryError(msg, permanent=400 <= status < 500 and status not in {408, 429})
+
+
+def result_email(to: str, batchtasks: t.Iterable[Task]) -> EmailMessage:
+    """Return the result email for a submission's tasks, with as many of their result files as fit attached."""
+    taskdesclist = []
+    localresultfilelist = []
+    for batchtask in batchtasks:
+        taskurl = f"https://fallingstar-data.com/forcedphot/queue/{batchtask.id}/"
+        strtask = (
+            f"Task {batchtask.id}: RA {batchtask.ra} Dec {batchtask.dec} "
+            f"{'img_reduced' if batchtask.use_reduced else 'img_difference'} "
+            f"\n{taskurl}\n"
+        )
+
+        if batchtask.comment:
+            strtask += " comment: '" + batchtask.comment + "'"
+
+        taskdesclist.append(strtask)
+        localresultfilelist.append(Path(settings.RESULTS_DIR, f"job{batchtask.id:05d}.txt"))
+
+    message = EmailMessage(
+        subject="ATLAS forced photometry results",
+        body=("Your forced photometry results are available for:\n\n" + "\n".join(taskdesclist) + "\n\n"),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[to],
+    )
+
+    # the light curves first, then their plots, while they fit
+    attach_size_mb = 0.0
+    for path in [*localresultfilelist, *(resultfile.with_suffix(".pdf") for resultfile in localresultfilelist)]:
+        if path.exists():
+            filesize_mb = path.stat().st_size / 1024.0 / 1024.0
+            if (attach_size_mb + filesize_mb) < EMAIL_ATTACH_LIMIT_MB:
+                attach_size_mb += filesize_mb
+                message.attach_file(str(path))
+
+    return message
+
+
+def deliver_email(notification: Notification) -> None:
+    """Send a submission's result email; raises DeliveryError if the mail server did not take it."""
+    user = User.objects.get(id=notification.user_id)
+    timestamp = datetime.datetime.fromisoformat(notification.payload["timestamp"])
+    batchtasks = Task.objects.filter(user_id=notification.user_id, send_email=True, timestamp=timestamp).order_by("id")
+    if not user.email or not batchtasks:
+        # deleted since, or the address removed: there is nothing to send, and nothing to retry
+        return
+
+    try:
+        result_email(user.email, batchtasks).send()
+    except smtplib.SMTPRecipientsRefused as ex:
+        msg = f"recipient refused: {ex}"
+        raise DeliveryError(msg, permanent=True) from ex
+    except (OSError, smtplib.SMTPException) as ex:
+        msg = f"could not send email to {user.email}: {ex}"
+        raise DeliveryError(msg, permanent=False) from ex
+
+
+class OutboxDelivery:
+    """The threads that send the due notifications: one that takes them, and a pool that sends them.
+
+    The taking thread keeps the pool busy with up to DELIVERY_THREADS notifications, and looks for
+    more each time one is done, each time wake() is called, and every POLL_SECONDS. Each thread has
+    its own database connection, which Django gives each thread, and closes it after each use, as
+    the maintenance sweep does.
+    """
+
+    def __init__(self, logfunc: t.Callable[[t.Any], None], threads: int = DELIVERY_THREADS) -> None:
+        """Nothing runs until start()."""
+        self.logfunc = logfunc
+        self.threads = threads
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self.thread: threading.Thread | None = None
+        self.inflight: set[concurrent.futures.Future[None]] = set()
+        self.last_prunetime = -math.inf
+
+    def start(self) -> None:
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="outbox")
+        self.thread = threading.Thread(target=self.run, name="outbox", daemon=True)
+        self.thread.start()
+
+    def wake(self) -> None:
+        """Look for due notifications now, as after a task has finished."""
+        self.wakeup.set()
+
+    def run(self) -> None:
+        assert self.executor is not None  # for the type checker: set by start()
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            self.inflight = {future for future in self.inflight if not future.done()}
+            if len(self.inflight) < self.threads:
+                try:
+                    if time.monotonic() - self.last_prunetime >= PRUNE_SECONDS:
+                        self.last_prunetime = time.monotonic()
+                        prune_delivered()
+                    taken = take_due_notifications(limit=self.threads - len(self.inflight))
+                except Exception as ex:  # noqa: BLE001 (the next pass tries again; an unhandled
+                    # exception would stop delivery until the runner restarts)
+                    self.logfunc(f"Outbox: ERROR: could not read the due notifications: {ex}")
+                    taken = []
+                finally:
+                    connection.close()
+                for notification in taken:
+                    future = self.executor.submit(self.deliver_one, notification)
+                    future.add_done_callback(lambda _: self.wakeup.set())
+                    self.inflight.add(future)
+            self.wakeup.wait(POLL_SECONDS)
+
+    def deliver_one(self, notification: Notification) -> None:
+        try:
+            deliver(notification, self.logfunc)
+        except Exception as ex:  # noqa: BLE001 (left to come due again when its lease passes)
+            self.logfunc(f"Outbox: ERROR: unexpected failure delivering {notification.key}: {ex}")
+        finally:
+            connection.close()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Stop taking notifications, and wait up to `timeout` seconds for those being sent.
+
+        One still being sent after that is abandoned, and sent again by the next runner once its
+        lease has passed.
+        """
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+        concurrent.futures.wait(self.inflight, timeout=timeout)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
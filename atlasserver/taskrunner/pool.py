@@ -0,0 +1,335 @@
+"""Long-lived worker processes for the task runner's slots.
+
+Without the pool, every dispatched task gets a freshly spawned process, and pays for an interpreter
+start, django.setup(), the pandas import and a new database connection before its ssh command even
+begins. Most forced photometry tasks are short, so at a few thousand of them a day that start-up is
+a real share of each slot's busy time.
+
+With the pool (settings.TASKRUNNER_WORKER_POOL), each slot keeps one warm worker that receives task
+ids over a pipe and runs them one after another. What a worker does with a task id is up to the
+function it is given, which is the runner's own do_task; cancellation and the per-slot log are
+therefore exactly what they are without the pool.
+
+No Django here, and nothing imported from the runner: a spawned child unpickles its target by
+importing the module that defines it, and this one has to be importable before django.setup().
+"""
+
+import contextlib
+import multiprocessing as mp
+import time
+import typing as t
+from multiprocessing.connection import Connection
+from multiprocessing.context import SpawnContext
+
+import psutil
+
+if t.TYPE_CHECKING:
+    from multiprocessing.process import BaseProcess
+    from multiprocessing.synchronize import Event
+
+# Replace a worker after it has run this many tasks. A warm process is the point of the pool, but
+# one that lives for weeks accumulates whatever pandas, Django and the C libraries under them fail
+# to give back, and a fresh start every couple of hundred tasks costs almost nothing.
+WORKER_MAX_TASKS: int = 200
+
+# ...or sooner, once its resident memory passes this. A single huge light curve can leave a worker
+# holding a few hundred megabytes that would otherwise stay allocated for the rest of its life.
+WORKER_MAX_RSS_MB: float = 1024.0
+
+# How often an idle worker is asked to prove that it is still answering, and how long it has to do
+# so. A busy worker is running a task on its only thread and cannot answer, so only idle ones are
+# asked; a wedged busy worker is bounded by the runner's own task time limit instead. The answer is
+# collected on a later pass of the dispatch loop, which does not wait for it.
+WORKER_HEALTHCHECK_SECONDS: float = 60.0
+WORKER_HEALTHCHECK_TIMEOUT_SECONDS: float = 10.0
+
+# how long a worker asked to stop is given before it is killed
+WORKER_STOP_TIMEOUT_SECONDS: float = 10.0
+
+# Inside a worker process, the event its slot's task is cancelled through; None in the runner
+# itself. Module state rather than an argument: it belongs to the slot rather than to any one task.
+slot_cancel_event: "Event | None" = None
+
+
+def worker_loop(
+    conn: Connection, slotid: int, run_task: t.Callable[..., object], cancel_event: "Event | None" = None
+) -> None:
+    """Run task ids received over `conn` until told to stop, answering each with a done message.
+
+    The messages in are ("task", taskid, options), ("ping",) and None to stop; the replies are
+    ("done", taskid, result), with what run_task returned or None if it raised, and ("pong",). A
+    closed pipe means the runner has gone, and is treated as a stop.
+    `options` are keyword arguments for run_task that the dispatcher chose for this task, such as
+    the remote host it is to run on.
+
+    The pipe cannot carry a cancellation, because the worker's only thread is busy running the task
+    it would cancel; `cancel_event` does that instead, and is left for the task in slot_cancel_event.
+    """
+    global slot_cancel_event  # noqa: PLW0603
+    slot_cancel_event = cancel_event
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        if message is None:
+            return
+
+        if message[0] == "ping":
+            conn.send(("pong",))
+        elif message[0] == "task":
+            taskid, options = message[1], message[2]
+            if cancel_event is not None:
+                # a cancellation meant for the previous task, signalled just as it finished
+                cancel_event.clear()
+            result = None
+            try:
+                result = run_task(taskid, slotid, **options)
+            finally:
+                # even when the task raised: the runner is waiting on this reply to free the slot,
+                # and a worker that went quiet would hold it until the next health check
+                with contextlib.suppress(OSError):
+                    conn.send(("done", taskid, result))
+
+
+class PooledWorker:
+    """One slot's warm worker process, and what the runner knows about it."""
+
+    def __init__(self, slotid: int, run_task: t.Callable[..., object], context: SpawnContext) -> None:
+        """Describe the worker for a slot; nothing is started until start()."""
+        self.slotid = slotid
+        self.run_task = run_task
+        self.context = context
+        self.process: BaseProcess | None = None
+        self.conn: Connection | None = None
+        self.taskid: int | None = None  # the task it is running, or None when idle
+        self.result: object = None  # what run_task returned for its last task, or None
+        self.tasks_run = 0
+        # whether the recycle limits have been checked since the last task ended. Reading the
+        # resident size is a system call, and the dispatch loop asks twice a second.
+        self.recycle_checked = True
+        self.last_healthcheck = 0.0
+        self.ping_sent: float | None = None  # when the health check in progress was sent
+        # created once and handed to each process started for the slot, so a restart keeps it
+        self.cancel_event = context.Event()
+
+    def start(self) -> None:
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=worker_loop,
+            kwargs={
+                "conn": child_conn,
+                "slotid": self.slotid,
+                "run_task": self.run_task,
+                "cancel_event": self.cancel_event,
+            },
+            name=f"slot{self.slotid:02d}",
+        )
+        self.process.start()
+        # the child holds its own copy; closing ours means the child sees EOF if the parent dies
+        child_conn.close()
+        self.conn = parent_conn
+        self.taskid = None
+        self.tasks_run = 0
+        self.recycle_checked = True
+        self.last_healthcheck = time.monotonic()
+        self.ping_sent = None
+
+    @property
+    def pid(self) -> int | None:
+        return self.process.pid if self.process is not None else None
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def submit(self, taskid: int, **options: t.Any) -> None:
+        assert self.conn is not None
+        self.conn.send(("task", taskid, options))
+        self.taskid = taskid
+        self.result = None
+        # the worker is answering whatever became of a ping sent before, and its pong, if it
+        # comes, is passed over with the replies before the done message
+        self.ping_sent = None
+
+    def cancel(self) -> None:
+        """Tell the running task that it has been cancelled; see slot_cancel_event."""
+        self.cancel_event.set()
+
+    def poll_done(self) -> bool:
+        """Consume any replies waiting on the pipe, and return whether the current task is done."""
+        if self.conn is None:
+            return False
+        try:
+            while self.conn.poll():
+                reply = self.conn.recv()
+                if reply[0] == "done" and reply[1] == self.taskid:
+                    self.taskid = None
+                    self.result = reply[2]
+                    self.tasks_run += 1
+                    self.recycle_checked = False
+                    return True
+        except (EOFError, OSError):
+            return False
+        return False
+
+    def rss_mb(self) -> float:
+        try:
+            return psutil.Process(self.pid).memory_info().rss / 1024.0 / 1024.0
+        except (psutil.Error, TypeError, ValueError):
+            return 0.0
+
+    def needs_recycle(self) -> bool:
+        return self.tasks_run >= WORKER_MAX_TASKS or self.rss_mb() > WORKER_MAX_RSS_MB
+
+    def send_ping(self) -> bool:
+        """Ask an idle worker to reply, for ping_answer() to collect; return whether it could be asked."""
+        self.last_healthcheck = time.monotonic()
+        if self.conn is None:
+            return False
+        try:
+            self.conn.send(("ping",))
+        except OSError:
+            return False
+        self.ping_sent = self.last_healthcheck
+        return True
+
+    def ping_answer(self) -> bool | None:
+        """Return whether the worker answered its ping, or None while it still has time to. Never blocks."""
+        if self.ping_sent is None or self.conn is None:
+            return None
+        try:
+            while self.conn.poll():
+                if self.conn.recv() == ("pong",):
+                    self.ping_sent = None
+                    return True
+        except (EOFError, OSError):
+            self.ping_sent = None
+            return False
+        if (time.monotonic() - self.ping_sent) < WORKER_HEALTHCHECK_TIMEOUT_SECONDS:
+            return None
+        self.ping_sent = None
+        return False
+
+    def stop(self, kill: bool = False) -> None:
+        """Ask the worker to exit, kill it if it does not, and release its handles.
+
+        With `kill`, for a worker that has stopped answering, it is killed without being asked:
+        it would not read the request, and waiting for it would hold up the dispatch loop.
+        """
+        if self.conn is not None and not kill:
+            with contextlib.suppress(OSError):
+                self.conn.send(None)
+        if self.process is not None:
+            if not kill:
+                self.process.join(timeout=WORKER_STOP_TIMEOUT_SECONDS)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join(timeout=WORKER_STOP_TIMEOUT_SECONDS)
+            with contextlib.suppress(ValueError):  # still running after a kill is not worth raising over
+                self.process.close()
+        if self.conn is not None:
+            self.conn.close()
+        self.process = None
+        self.conn = None
+        self.taskid = None
+        self.result = None
+        self.ping_sent = None
+
+
+class WorkerPool:
+    """A warm worker for each slot, restarted when it dies, wedges or has served long enough."""
+
+    def __init__(
+        self,
+        numslots: int,
+        run_task: t.Callable[..., object],
+        logfunc: t.Callable[[str], None],
+        context: SpawnContext | None = None,
+    ) -> None:
+        """Describe one worker per slot, each running `run_task(taskid, slotid, **options)` for its tasks."""
+        # spawn for the same reason as the per-task processes: the runner's parent holds database
+        # connections and threads that a forked child must not inherit
+        self.context = context if context is not None else mp.get_context("spawn")
+        self.workers = [PooledWorker(slotid, run_task, self.context) for slotid in range(numslots)]
+        self.logfunc = logfunc
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+            self.logfunc(f"slot {worker.slotid} worker started (pid {worker.pid})")
+
+    def submit(self, slotid: int, taskid: int, **options: t.Any) -> None:
+        self.workers[slotid].submit(taskid, **options)
+
+    def cancel(self, slotid: int) -> None:
+        self.workers[slotid].cancel()
+
+    def reap(self) -> list[int]:
+        """Return the slots whose task has ended since the last call, replacing any dead worker.
+
+        A worker that died with a task in hand frees its slot like one that finished: the task is
+        still unfinished in the database, so it is dispatched again, which is exactly what happens
+        to a per-task process that dies.
+        """
+        freed = []
+        for worker in self.workers:
+            if worker.taskid is not None and worker.poll_done():
+                freed.append(worker.slotid)
+            elif not worker.is_alive():
+                if worker.taskid is not None:
+                    self.logfunc(f"slot {worker.slotid} worker died while running task {worker.taskid}")
+                    freed.append(worker.slotid)
+                else:
+                    self.logfunc(f"slot {worker.slotid} worker is not running")
+                self.restart(worker)
+        return freed
+
+    def maintain(self) -> None:
+        """Recycle idle workers that have served long enough, and health-check the rest. Never blocks.
+
+        A health check is a ping sent on one pass and its answer collected on a later one, so that a
+        wedged worker costs its slot the timeout and the dispatch loop nothing.
+        """
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.taskid is not None:
+                continue
+            if not worker.recycle_checked and worker.needs_recycle():
+                self.logfunc(
+                    f"slot {worker.slotid} worker recycled after {worker.tasks_run} tasks ({worker.rss_mb():.0f} MB)"
+                )
+                self.restart(worker)
+            elif worker.ping_sent is not None:
+                if worker.ping_answer() is False:
+                    self.logfunc(f"slot {worker.slotid} worker failed its health check")
+                    self.restart(worker, kill=True)
+            elif (now - worker.last_healthcheck) >= WORKER_HEALTHCHECK_SECONDS and not worker.send_ping():
+                self.logfunc(f"slot {worker.slotid} worker failed its health check")
+                self.restart(worker, kill=True)
+            worker.recycle_checked = True
+
+    def waitables(self) -> list[t.Any]:
+        """Return what becomes ready when a slot may have come free, for multiprocessing's wait().
+
+        The pipe of each busy worker, which its done message arrives on, and every worker's process
+        sentinel, so that one dying is noticed as soon as one finishing would be. Idle workers'
+        pipes are left out: nothing is expected on them outside a health check.
+        """
+        ready: list[t.Any] = []
+        for worker in self.workers:
+            if worker.taskid is not None and worker.conn is not None:
+                ready.append(worker.conn)
+            if worker.process is not None:
+                ready.append(worker.process.sentinel)
+        return ready
+
+    def restart(self, worker: PooledWorker, kill: bool = False) -> None:
+        worker.stop(kill=kill)
+        worker.start()
+        self.logfunc(f"slot {worker.slotid} worker started (pid {worker.pid})")
+
+    def shutdown(self) -> None:
+        for worker in self.workers:
+            worker.stop()
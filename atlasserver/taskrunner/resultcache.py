@@ -0,0 +1,308 @@
+"""Answering forced photometry requests from the results of earlier tasks at the same position.
+
+Popular transients are requested over and over, by many users, often within hours of each other,
+and with the default 30-day window or a fixed start date. Each request is a full force.sh run on
+one of the sixteen slots, even though when an earlier task at the same position covered a window
+at least as wide, the answer is just some of the rows of that task's file.
+
+With settings.TASKRUNNER_RESULT_CACHE_HOURS, every finished position-based task that is eligible is
+recorded in ResultCacheEntry, and a later request that such an entry covers is answered by copying
+the rows of the cached file that fall inside its window, without going to sc01. The freshness
+window bounds what the answer can be missing: observations that reached the database after the
+cached task ran.
+
+Positions are matched by an exact separation test, narrowed in the database by a grid of sky cells
+rather than by HEALPix, which would be a new dependency for what is here a simple lookup key. The
+grid is plain RA/Dec bins, so a match can only ever lie in a neighbouring cell while the bins are
+wider than the match radius, which they are everywhere but within a hundredth of a degree or so of
+the poles. Requests beyond MAX_ABS_DEC are not cached, which leaves a wide margin.
+
+The same files serve settings.TASKRUNNER_INCREMENTAL, for the other common pattern: a monitoring
+user resubmitting one target every day with mjd_min far in the past. There the earlier result is
+too old to answer from, but all that is missing from it is what came after its last row, so sc01
+is asked only for that, and the new rows are merged into a copy of the earlier file.
+"""
+
+import datetime
+import math
+import shutil
+import typing as t
+from pathlib import Path
+
+from django.db import models
+
+from atlasserver import settings
+from atlasserver.forcephot.misc import datetime_to_mjd
+from atlasserver.forcephot.models import ResultCacheEntry
+from atlasserver.forcephot.models import Task
+
+# Side of a sky grid cell, in degrees. Any size well above the match radius works; this one keeps
+# a cell to a handful of entries even for the most requested fields.
+SKY_CELL_DEGREES: float = 0.1
+
+# How close two positions must be for one's result to answer for the other. Small enough that the
+# photometry at the two positions is the same measurement: force.sh places its aperture to far
+# coarser precision than this.
+MATCH_RADIUS_ARCSEC: float = 0.05
+
+# no caching at or beyond this declination, where the RA bins become narrower than the match radius
+MAX_ABS_DEC: float = 89.0
+
+RA_CELLS: t.Final = round(360.0 / SKY_CELL_DEGREES)
+
+# How old an earlier result may be and still be extended by TASKRUNNER_INCREMENTAL. What an extended
+# result can lack is an observation older than the earlier file's last row that was only reduced
+# after that file was made, and the longer the chain of extensions the more of those there can be.
+INCREMENTAL_MAX_AGE_DAYS: int = 7
+
+
+def sky_cell(ra: float, dec: float) -> int:
+    decband = math.floor((dec + 90.0) / SKY_CELL_DEGREES)
+    rabin = math.floor((ra % 360.0) / SKY_CELL_DEGREES) % RA_CELLS
+    return decband * RA_CELLS + rabin
+
+
+def neighbouring_cells(ra: float, dec: float) -> list[int]:
+    """Return the cell of the position and the eight around it."""
+    cell = sky_cell(ra, dec)
+    decband, rabin = divmod(cell, RA_CELLS)
+    return [
+        (decband + ddec) * RA_CELLS + (rabin + dra) % RA_CELLS
+        for ddec in (-1, 0, 1)
+        for dra in (-1, 0, 1)
+        if decband + ddec >= 0
+    ]
+
+
+def separation_arcsec(ra1: float, dec1: float, ra2: float, dec2: float) -> float:
+    """Return the angular separation of two positions, by the haversine formula."""
+    ra1r, dec1r, ra2r, dec2r = (math.radians(x) for x in (ra1, dec1, ra2, dec2))
+    hav = math.sin((dec2r - dec1r) / 2) ** 2 + math.cos(dec1r) * math.cos(dec2r) * math.sin((ra2r - ra1r) / 2) ** 2
+    return math.degrees(2 * math.asin(min(1.0, math.sqrt(hav)))) * 3600.0
+
+
+def is_cacheable(task: Task) -> bool:
+    """Whether a task's result can be cached or answered from the cache.
+
+    Only plain position requests: ssforce.sh follows an orbit, and an epoch or proper motion moves
+    the position with time, so neither is a fixed point in the sky. Users who get TDO data are
+    asked a different question of force.sh than everyone else, so they are left out both ways.
+    """
+    return (
+        settings.TASKRUNNER_RESULT_CACHE_HOURS > 0
+        and task.request_type == Task.RequestType.FP
+        and not task.mpc_name
+        and task.ra is not None
+        and task.dec is not None
+        and abs(task.dec) < MAX_ABS_DEC
+        and not task.radec_epoch_year
+        and not task.propermotion_ra
+        and not task.propermotion_dec
+        and task.user_id not in settings.TEST_USERS
+    )
+
+
+def record_result(task: Task) -> None:
+    """Make a task that has just finished with a result available to answer later requests."""
+    if not is_cacheable(task) or task.starttimestamp is None:
+        return
+
+    assert task.ra is not None
+    assert task.dec is not None
+    # With no upper bound, the file holds what there was when force.sh ran, which began after the
+    # task started; the start is the safe side of that. With one, the task's own bound, unless it
+    # lies in the future.
+    startmjd = datetime_to_mjd(task.starttimestamp)
+    covered_mjd_max = min(task.mjd_max, startmjd) if task.mjd_max is not None else startmjd
+
+    ResultCacheEntry.objects.update_or_create(
+        task=task,
+        defaults={
+            "sky_cell": sky_cell(task.ra, task.dec),
+            "ra": task.ra,
+            "dec": task.dec,
+            "use_reduced": task.use_reduced,
+            "mjd_min": task.mjd_min,
+            "covered_mjd_max": covered_mjd_max,
+        },
+    )
+
+
+def find_entry(task: Task) -> ResultCacheEntry | None:
+    """Return the freshest cache entry whose result covers everything the task asks for, if any."""
+    if not is_cacheable(task):
+        return None
+
+    assert task.ra is not None
+    assert task.dec is not None
+    oldest = datetime.datetime.now(datetime.UTC) - datetime.timedelta(hours=settings.TASKRUNNER_RESULT_CACHE_HOURS)
+    # with no upper bound the request is for everything up to now, which no entry covers exactly;
+    # the freshness window is what decides how close is close enough
+    wanted_mjd_max = task.mjd_max if task.mjd_max is not None else datetime_to_mjd(oldest)
+
+    candidates = ResultCacheEntry.objects.filter(
+        sky_cell__in=neighbouring_cells(task.ra, task.dec),
+        use_reduced=task.use_reduced,
+        created__gte=oldest,
+        covered_mjd_max__gte=wanted_mjd_max,
+        task__is_archived=False,
+    )
+    if task.mjd_min is None:
+        candidates = candidates.filter(mjd_min__isnull=True)
+    else:
+        candidates = candidates.filter(models.Q(mjd_min__isnull=True) | models.Q(mjd_min__lte=task.mjd_min))
+
+    for entry in candidates.order_by("-created"):
+        if (
+            separation_arcsec(task.ra, task.dec, entry.ra, entry.dec) <= MATCH_RADIUS_ARCSEC
+            and Path(settings.RESULTS_DIR, f"job{entry.task_id:05d}.txt").exists()
+        ):
+            return entry
+
+    return None
+
+
+def slice_result_file(source: Path, destination: Path, mjd_min: float | None, mjd_max: float | None) -> int:
+    """Write the rows of a result file that fall in an MJD window, with its header, and return how many.
+
+    Line by line rather than through pandas, so that the rows are exactly as force.sh wrote them:
+    a parse and rewrite would reformat every number in the file.
+    """
+    rowcount = 0
+    partfile = destination.with_name(f".{destination.name}.part")
+    with source.open() as fin, partfile.open("w") as fout:
+        for line in fin:
+            fields = line.split(maxsplit=1)
+            if not fields or line.startswith("#"):
+                fout.write(line)
+                continue
+            try:
+                mjd = float(fields[0])
+            except ValueError:
+                fout.write(line)  # not a data row, so it is not for the window to drop
+                continue
+            if (mjd_min is None or mjd >= mjd_min) and (mjd_max is None or mjd <= mjd_max):
+                fout.write(line)
+                rowcount += 1
+    partfile.replace(destination)
+    return rowcount
+
+
+def answer_from_cache(task: Task, logfunc: t.Callable[[t.Any], None]) -> Path | None:
+    """Write the task's result file from a cached one, and return its path, or None if there is none to use."""
+    entry = find_entry(task)
+    if entry is None:
+        return None
+
+    source = Path(settings.RESULTS_DIR, f"job{entry.task_id:05d}.txt")
+    destination = Path(settings.RESULTS_DIR, f"job{task.id:05d}.txt")
+    rowcount = slice_result_file(source, destination, mjd_min=task.mjd_min, mjd_max=task.mjd_max)
+
+    # the preview is a cutout at the position, and the same position gives the same picture
+    preview = source.with_suffix(".jpg")
+    if preview.exists():
+        shutil.copyfile(preview, destination.with_suffix(".jpg"))
+
+    logfunc(f"Answered from the cached result of task {entry.task_id} ({rowcount} rows in the requested window)")
+    return destination
+
+
+def data_rows(path: Path) -> t.Iterator[tuple[float, str, str]]:
+    """Yield (mjd, obs, line) for each data row of a result file; Obs is the last column."""
+    with path.open() as fin:
+        for line in fin:
+            fields = line.split()
+            if not fields or line.startswith("#"):
+                continue
+            try:
+                mjd = float(fields[0])
+            except ValueError:
+                continue
+            yield mjd, fields[-1], line if line.endswith("\n") else line + "\n"
+
+
+def find_incremental_base(task: Task) -> tuple[Path, float] | None:
+    """Return an earlier result file that the task's result can extend, and the MJD of its last row.
+
+    The earlier task must have asked for the same light curve (everything in the request but its
+    MJD window), from no later a start and with no upper bound, and have finished without error in
+    the last INCREMENTAL_MAX_AGE_DAYS. None if there is no such result, or if the task's own window
+    ends before there is anything new to fetch.
+    """
+    if not settings.TASKRUNNER_INCREMENTAL or task.request_type != Task.RequestType.FP:
+        return None
+
+    fingerprint = task.request_fingerprint(include_window=False)
+    candidates = Task.objects.filter(
+        request_type=Task.RequestType.FP,
+        use_reduced=task.use_reduced,
+        is_archived=False,
+        error_msg__isnull=True,
+        mjd_max__isnull=True,
+        finishtimestamp__gte=datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=INCREMENTAL_MAX_AGE_DAYS),
+    ).exclude(id=task.id)
+    if task.mpc_name:
+        candidates = candidates.filter(mpc_name=task.mpc_name)
+    else:
+        assert task.ra is not None
+        assert task.dec is not None
+        # wider than the fingerprint's rounding, so the exact comparison below decides
+        candidates = candidates.filter(
+            ra__range=(task.ra - 1e-6, task.ra + 1e-6), dec__range=(task.dec - 1e-6, task.dec + 1e-6)
+        )
+    if task.mjd_min is None:
+        candidates = candidates.filter(mjd_min__isnull=True)
+    else:
+        candidates = candidates.filter(models.Q(mjd_min__isnull=True) | models.Q(mjd_min__lte=task.mjd_min))
+
+    for prior in candidates.order_by("-finishtimestamp")[:10]:
+        priorfile = Path(settings.RESULTS_DIR, f"job{prior.id:05d}.txt")
+        if prior.request_fingerprint(include_window=False) != fingerprint or not priorfile.exists():
+            continue
+        last_mjd = max((mjd for mjd, _, _ in data_rows(priorfile)), default=None)
+        if last_mjd is None:
+            continue
+        if task.mjd_max is not None and task.mjd_max <= last_mjd:
+            return None
+        if task.mjd_min is not None and task.mjd_min >= last_mjd:
+            # none of the earlier rows are wanted, so there is nothing to save
+            return None
+        return priorfile, last_mjd
+
+    return None
+
+
+def merge_incremental_result(
+    base: Path, localresultfile: Path, mjd_min: float | None, mjd_max: float | None, logfunc: t.Callable[[t.Any], None]
+) -> int:
+    """Merge the earlier result's rows into a freshly fetched partial result, in place, and return the row count.
+
+    The rows of both that fall in the window, sorted by MJD, one per Obs: where both files have an
+    observation, the new measurement wins. The header is the new file's, or the earlier file's if
+    the new one has none.
+    """
+    rows: dict[str, tuple[float, str]] = {}
+    newrowcount = 0
+    for path in (base, localresultfile):
+        for mjd, obs, line in data_rows(path):
+            if (mjd_min is None or mjd >= mjd_min) and (mjd_max is None or mjd <= mjd_max):
+                rows[obs] = (mjd, line)
+                newrowcount += path == localresultfile
+
+    header = [line for line in localresultfile.read_text().splitlines(keepends=True) if line.startswith("#")]
+    if not header:
+        header = [line for line in base.read_text().splitlines(keepends=True) if line.startswith("#")]
+
+    partfile = localresultfile.with_name(f".{localresultfile.name}.part")
+    with partfile.open("w") as fout:
+        fout.writelines(header)
+        fout.writelines(line for _, line in sorted(rows.values(), key=lambda row: row[0]))
+    partfile.replace(localresultfile)
+
+    # the preview is made from the rows sc01 returned, and with no new ones there is none
+    preview = localresultfile.with_suffix(".jpg")
+    if not preview.exists() and base.with_suffix(".jpg").exists():
+        shutil.copyfile(base.with_suffix(".jpg"), preview)
+
+    logfunc(f"Merged {newrowcount} new rows into the earlier result {base.name}, for {len(rows)} in all")
+    return len(rows)
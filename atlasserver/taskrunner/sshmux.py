@@ -0,0 +1,219 @@
+"""Multiplexed ssh connections to the remote host, shared by every slot.
+
+Each task used to open its own ssh connection for the remote command and then one more for every
+rsync: three or four full handshakes to sc01 per task, which on a short forced photometry task is a
+large fixed share of its run time. With settings.TASKRUNNER_SSH_MULTIPLEX, the runner keeps a few
+master connections open (OpenSSH's ControlMaster) and every ssh and rsync a slot makes is routed
+through one of them, so the handshake is paid once per master rather than once per call.
+
+The runner's main process owns the masters; the slots only need to know which socket to use, and
+that is derived from the slot number, so nothing has to be passed between the processes. A slot
+whose master is down is not stuck: with ControlMaster=no, ssh that cannot reach the socket makes an
+ordinary connection of its own, so a dead master costs a handshake rather than a task.
+"""
+
+import contextlib
+import shlex
+import subprocess
+import time
+import typing as t
+from pathlib import Path
+
+from atlasserver import settings
+
+# How many master connections to keep open. Slots share them round-robin; OpenSSH multiplexes
+# sessions over one connection well, but a few spread the load of sixteen slots' transfers and
+# mean that a master being restarted affects only the slots routed through it.
+SSH_MASTER_COUNT: int = 4
+
+# Where the control sockets live. Short and outside the checkout on purpose: a unix socket path is
+# limited to about a hundred bytes, and ssh refuses a ControlPath in a directory others can write.
+CONTROL_DIR: Path = Path("/tmp/atlasforced/sshmux")
+
+# How often each master is asked whether it is still up. The check is a child process that the
+# dispatch loop starts and later collects, as the host probes are (see hosts.py).
+SSH_MASTER_CHECK_SECONDS: float = 30.0
+
+# how long the check and the exit request are given before they count as failed
+SSH_MASTER_COMMAND_TIMEOUT_SECONDS: float = 10.0
+
+# Options for the masters themselves: fail rather than prompt (nobody is there to answer), and
+# notice a dead network path within a minute or so instead of waiting for TCP to give up.
+MASTER_OPTIONS: t.Final = [
+    "-o",
+    "BatchMode=yes",
+    "-o",
+    "ServerAliveInterval=15",
+    "-o",
+    "ServerAliveCountMax=3",
+]
+
+
+def control_path(host: str, index: int) -> Path:
+    return CONTROL_DIR / f"{host}-{index}.sock"
+
+
+def ssh_options(host: str, slotid: int) -> list[str]:
+    """Return the ssh options that route a slot's connections through its master, if enabled."""
+    if not settings.TASKRUNNER_SSH_MULTIPLEX:
+        return []
+
+    # ControlMaster=no: use the master if it is there, never become one. A slot that became a
+    # master would hold its socket open past the end of its task, and the next slot on that socket
+    # would be sharing a connection owned by a process that is about to exit.
+    return ["-o", "ControlMaster=no", "-o", f"ControlPath={control_path(host, slotid % SSH_MASTER_COUNT)}"]
+
+
+def ssh_argv(host: str, slotid: int) -> list[str]:
+    """Return the ssh command line, up to and including the host, for a slot's remote commands."""
+    return ["ssh", *ssh_options(host, slotid), host]
+
+
+def rsync_argv(host: str, slotid: int) -> list[str]:
+    """Return the start of an rsync command line whose transport goes through the slot's master."""
+    options = ssh_options(host, slotid)
+    if not options:
+        return ["rsync"]
+
+    # rsync runs the -e value through its own word splitting, which honours shell-style quoting
+    return ["rsync", "-e", shlex.join(["ssh", *options])]
+
+
+class MasterConnection:
+    """One ControlMaster ssh process, kept as a child of the runner so that its death is visible."""
+
+    def __init__(self, host: str, index: int) -> None:
+        """Describe the master; nothing is connected until start()."""
+        self.host = host
+        self.index = index
+        self.path = control_path(host, index)
+        self.proc: subprocess.Popen[bytes] | None = None
+        # the `ssh -O check` in progress, and when it started; and whether the last could not start
+        self.check: subprocess.Popen[bytes] | None = None
+        self.check_started = 0.0
+        self.check_failed = False
+
+    def start(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True, mode=0o700)
+        # a socket left behind by a master that was killed would make the new one refuse to start
+        self.path.unlink(missing_ok=True)
+        self.proc = subprocess.Popen(
+            ["ssh", "-M", "-N", *MASTER_OPTIONS, "-o", f"ControlPath={self.path}", self.host],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def start_check(self) -> None:
+        """Start asking the master whether it is answering on its socket, for check_result() to collect."""
+        self.check_started = time.monotonic()
+        try:
+            self.check = subprocess.Popen(
+                ["ssh", "-O", "check", "-o", f"ControlPath={self.path}", self.host],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            self.check = None
+            self.check_failed = True
+
+    def check_result(self) -> bool | None:
+        """Return whether the master is healthy, or None while its check is still running. Never blocks.
+
+        A master whose process has exited is not healthy, whatever its check says.
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            self.cancel_check()
+            return False
+        if self.check_failed:
+            self.check_failed = False
+            return False
+        if self.check is None:
+            return True
+
+        returncode = self.check.poll()
+        if returncode is None:
+            if (time.monotonic() - self.check_started) < SSH_MASTER_COMMAND_TIMEOUT_SECONDS:
+                return None
+            self.cancel_check()
+            return False
+        self.check = None
+        return returncode == 0
+
+    def cancel_check(self) -> None:
+        if self.check is not None:
+            with contextlib.suppress(OSError):
+                self.check.kill()
+            self.check.wait()
+            self.check = None
+
+    def restart(self) -> None:
+        """Replace a master that is down, without asking it to exit: it would not answer in time."""
+        self.cancel_check()
+        if self.proc is not None:
+            with contextlib.suppress(OSError):
+                self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+        self.start()
+
+    def stop(self) -> None:
+        self.cancel_check()
+        if self.proc is None:
+            return
+
+        with contextlib.suppress(OSError, subprocess.TimeoutExpired):
+            subprocess.run(
+                ["ssh", "-O", "exit", "-o", f"ControlPath={self.path}", self.host],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                timeout=SSH_MASTER_COMMAND_TIMEOUT_SECONDS,
+                check=False,
+            )
+
+        if self.proc.poll() is None:
+            self.proc.terminate()
+        with contextlib.suppress(subprocess.TimeoutExpired):
+            self.proc.wait(timeout=SSH_MASTER_COMMAND_TIMEOUT_SECONDS)
+        self.proc = None
+        self.path.unlink(missing_ok=True)
+
+
+class SshMultiplexer:
+    """The master connections to one host: started together, checked on an interval, restarted singly."""
+
+    def __init__(self, host: str, logfunc: t.Callable[[str], None], count: int = SSH_MASTER_COUNT) -> None:
+        """Describe `count` masters to `host`; nothing is connected until start()."""
+        self.masters = [MasterConnection(host, index) for index in range(count)]
+        self.logfunc = logfunc
+        self.last_check = float("-inf")
+
+    def start(self) -> None:
+        for master in self.masters:
+            master.start()
+        self.last_check = time.monotonic()
+
+    def maintain(self) -> None:
+        """Collect the masters' checks, restart any that is down, and start the checks that are due. Never blocks.
+
+        A master whose process has died is restarted at once, and one that is running is checked
+        at most once per interval.
+        """
+        due = (time.monotonic() - self.last_check) >= SSH_MASTER_CHECK_SECONDS
+        if due:
+            self.last_check = time.monotonic()
+
+        for master in self.masters:
+            if master.check is None and not due and master.proc is not None and master.proc.poll() is None:
+                continue
+            healthy = master.check_result()
+            if healthy is False:
+                self.logfunc(f"ssh master {master.index} to {master.host} is down, restarting it")
+                master.restart()
+            elif healthy and due:
+                master.start_check()
+
+    def shutdown(self) -> None:
+        for master in self.masters:
+            master.stop()
@@ -10,10 +10,20 @@ keep it there, to read these few values.
 Anything the two processes must agree on belongs here rather than in `main`, which the web app
 cannot reach: a value defined in both places can drift, and NUMSLOTS below is one the queue page
 and the runner's own pool size have to derive from the same number.
+
+With settings.TASKRUNNER_CLAIMS there can be several runners, and each writes a status file and
+listens on a wakeup socket of its own (see runner_path()), which a reader finds beside the single
+runner's and takes together: read_status() merges the status files, and the web app's nudge goes to
+every socket. The files that only the leading runner writes, such as the start estimates, keep the
+one name. All of them reach the web app as long as the runners share LOG_DIR with it: on its
+machine, or on a filesystem they all mount.
 """
 
 import datetime
 import json
+import os
+import re
+import time
 import typing as t
 from pathlib import Path
 
@@ -23,6 +33,37 @@ LOG_DIR: Path = Path(__file__).resolve().parent / "logs"
 
 STATUS_PATH: Path = LOG_DIR / "taskrunner_status.json"
 
+# The unix datagram socket the runner listens on for a nudge from the web app (see wakeup.py). In
+# the log directory for the same reason as the status file: both processes can reach it, and a
+# private /tmp under systemd would give each of them its own.
+WAKEUP_SOCKET_PATH: Path = LOG_DIR / "taskrunner_wakeup.sock"
+
+# The queue order the runner publishes with settings.TASKRUNNER_VIRTUAL_QUEUE, in place of the
+# positions it would otherwise write into every queued row; see read_queue_snapshot().
+QUEUE_SNAPSHOT_PATH: Path = LOG_DIR / "taskrunner_queue.json"
+
+# When each queued task is likely to start, which the runner publishes with
+# settings.TASKRUNNER_START_ESTIMATES; see taskrunner/eta.py and read_start_estimates().
+START_ESTIMATES_PATH: Path = LOG_DIR / "taskrunner_start_estimates.json"
+
+# How old the start estimates may be before they are not served. Several of the runner's refreshes,
+# so that one slow one is not noticed, and few enough that estimates left behind by a runner that
+# has stopped making them are not read as current.
+START_ESTIMATES_STALE_SECONDS: float = 180.0
+
+# Where `atlastaskrunner drain` and `atlastaskrunner handover` leave their request for the runner,
+# which takes it on its next pass; see DrainRequest.
+CONTROL_PATH: Path = LOG_DIR / "taskrunner_control.json"
+
+# What the runner exits with after a handover, for supervise_atlastaskrunner.sh to start it again at
+# once. Any other nonzero status is a crash, and 0 is a stop.
+HANDOVER_EXIT_CODE: int = 75
+
+# How long a drain gives the running tasks to finish when it is not told: for SIGTERM, and for
+# `atlastaskrunner drain` without a number of seconds. Most tasks take minutes, and the few that
+# take hours are run again rather than holding up a deployment for TASK_MAXTIME_SECONDS.
+DRAIN_DEADLINE_SECONDS: float = 30 * 60
+
 # how often the runner refreshes the status file read by the /taskrunnerstatus.json endpoint
 STATUS_WRITE_SECONDS: float = 15.0
 
@@ -30,11 +71,97 @@ STATUS_WRITE_SECONDS: float = 15.0
 # one, so that a single slow write does not raise a false alarm.
 STALE_AFTER_SECONDS: float = STATUS_WRITE_SECONDS * 4
 
+# How old the queue snapshot may be before it is not read, and the positions stored on the tasks are
+# used instead. The runner rewrites it only when the order changes, but marks it current on every
+# status write (see touch_queue_snapshot()), so this is the same allowance as the status file's:
+# past it, the runner that published the order has stopped, and the order is not being kept up.
+QUEUE_SNAPSHOT_STALE_SECONDS: float = STALE_AFTER_SECONDS
+
+# what runner_path() replaces with "_" in a runner's name, to make a file name of it
+_UNSAFE_IN_FILENAME: t.Final = re.compile(r"[^A-Za-z0-9_.-]")
+
+# The fields of one runner's status that are its own rather than its share of a total or a fact
+# about the queue; merge_statuses() lists them for each runner.
+RUNNER_STATUS_FIELDS: t.Final = (
+    "written",
+    "pid",
+    "numslots",
+    "slots_busy",
+    "maintenance",
+    "draining",
+    "remote_hosts",
+    "circuit_breakers",
+)
+
 # How many tasks the runner executes at once. The runner sizes its process pool from this and
 # reports it in the status file; the web app needs the same number to say how fast the queue drains
 # (the load factor on the stats page, and the wait estimate on the queue page).
 NUMSLOTS: int = 16
 
+# The last start estimates this process parsed, as for the queue snapshot below.
+_start_estimates_memo: tuple[tuple[int, int], "PublishedStartEstimates"] | None = None
+
+# The last queue snapshot this process parsed, and the (inode, mtime) of the file it came from.
+# Every serialised task and every ETag reads it, and the runner replaces the file only when the
+# order changes, so it is parsed once per change rather than once per read.
+_queue_snapshot_memo: tuple[tuple[int, int], "QueueSnapshot"] | None = None
+
+
+def runner_path(path: Path, runnerid: str) -> Path:
+    """Return one runner's own counterpart of `path`, for when several share LOG_DIR (settings.TASKRUNNER_CLAIMS).
+
+    "taskrunner_status.json" for the runner "sc02:4242" is "taskrunner_status.sc02_4242.json".
+    """
+    return path.with_name(f"{path.stem}.{_UNSAFE_IN_FILENAME.sub('_', runnerid)}{path.suffix}")
+
+
+def runner_paths(path: Path) -> list[Path]:
+    """Return those of `path` and every runner's own counterpart of it (see runner_path()) that exist."""
+    return sorted(path.parent.glob(f"{path.stem}.*{path.suffix}")) + ([path] if path.exists() else [])
+
+
+def read_status_file(path: Path) -> tuple[dict[str, t.Any], float]:
+    """Return the snapshot in one runner's status file, and how many seconds ago it was written."""
+    status = json.loads(path.read_text())
+    # this doubles as the check that the payload is an object at all: subscripting a JSON list,
+    # string or number raises TypeError, which every caller catches with the rest
+    written = datetime.datetime.fromisoformat(status["written"])
+    return status, (datetime.datetime.now(datetime.UTC) - written).total_seconds()
+
+
+def merge_statuses(statuses: list[dict[str, t.Any]]) -> dict[str, t.Any]:
+    """Return the snapshots of several runners as one, given the most recently written first.
+
+    Their slots and running tasks are added up, and one runner draining or sweeping shows as the
+    whole being so. The queue figures are about the one queue they share, and are the most recent
+    runner's. Each runner's own hosts and breakers, whose limits are that runner's alone (see
+    hosts.py), are listed under "runners" with the rest of its RUNNER_STATUS_FIELDS.
+    """
+    merged = dict(statuses[0])
+    merged |= {
+        "numslots": sum(status["numslots"] for status in statuses),
+        "slots_busy": sum(status["slots_busy"] for status in statuses),
+        "running_taskids": sorted(taskid for status in statuses for taskid in status["running_taskids"]),
+        "running_expected_runtime_seconds": {
+            taskid: seconds
+            for status in statuses
+            for taskid, seconds in (status.get("running_expected_runtime_seconds") or {}).items()
+        },
+        "maintenance": any(status.get("maintenance") for status in statuses),
+        "maintenance_progress": next(
+            (status["maintenance_progress"] for status in statuses if status.get("maintenance_progress")), None
+        ),
+        "draining": next((status["draining"] for status in statuses if status.get("draining")), None),
+        # published by the leading runner only
+        "queue_drain_seconds": next(
+            (status["queue_drain_seconds"] for status in statuses if status.get("queue_drain_seconds")), None
+        ),
+        "remote_hosts": None,
+        "circuit_breakers": None,
+        "runners": [{field: status.get(field) for field in RUNNER_STATUS_FIELDS} for status in statuses],
+    }
+    return merged
+
 
 def read_status() -> tuple[dict[str, t.Any], float]:
     """Return the snapshot the runner last wrote, and how many seconds ago it wrote it.
@@ -48,12 +175,27 @@ def read_status() -> tuple[dict[str, t.Any], float]:
     disagree about it: one saying the runner is down while the other draws the box as though it
     were up is the visible fault. Thus the read and the threshold below live here, next to the
     interval they are derived from, rather than once in each caller.
+
+    With several runners, each with a file of its own, those written within STALE_AFTER_SECONDS
+    are merged (see merge_statuses()), and the age is that of the most recent. When none is, the
+    most recent file is returned alone, for the caller to report as stale; a file that cannot be
+    read is passed over, and raises only when no file can be.
     """
-    status = json.loads(STATUS_PATH.read_text())
-    # this doubles as the check that the payload is an object at all: subscripting a JSON list,
-    # string or number raises TypeError, which every caller catches with the rest
-    written = datetime.datetime.fromisoformat(status["written"])
-    return status, (datetime.datetime.now(datetime.UTC) - written).total_seconds()
+    readings = []
+    error: Exception = FileNotFoundError(f"no status file at {STATUS_PATH}")
+    for path in runner_paths(STATUS_PATH):
+        try:
+            readings.append(read_status_file(path))
+        except (OSError, KeyError, TypeError, ValueError) as ex:
+            error = ex
+    if not readings:
+        raise error
+
+    readings.sort(key=lambda reading: reading[1])
+    fresh = [status for status, age_seconds in readings if age_seconds <= STALE_AFTER_SECONDS]
+    if len(fresh) <= 1:
+        return readings[0]
+    return merge_statuses(fresh), readings[0][1]
 
 
 def runner_is_stale() -> bool:
@@ -70,3 +212,206 @@ def runner_is_stale() -> bool:
         return True
 
     return age_seconds > STALE_AFTER_SECONDS
+
+
+class QueueSnapshot:
+    """The execution order the runner last published: where each queued task is, and each user's tasks."""
+
+    def __init__(self, order: t.Iterable[t.Sequence[int]]) -> None:
+        """Index (task id, user id) pairs given front of the queue first."""
+        self.positions: dict[int, int] = {}
+        self.user_positions: dict[int, list[int]] = {}
+        for position, (taskid, userid) in enumerate(order):
+            self.positions[taskid] = position
+            self.user_positions.setdefault(userid, []).append(position)
+
+    def position(self, taskid: int) -> int:
+        """Return a task's position, counting one submitted since the snapshot as at the back.
+
+        Which is where a new task goes until the runner next orders the queue, within seconds of
+        the submission that asked it to; the stored positions give it the same provisional place.
+        """
+        return self.positions.get(taskid, len(self.positions))
+
+
+def write_queue_snapshot(order: t.Iterable[tuple[int, int]]) -> None:
+    """Publish the queue order as (task id, user id) pairs, replacing the file atomically.
+
+    Raises OSError if it cannot be written; the caller decides what a stale order costs it.
+    """
+    QUEUE_SNAPSHOT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = QUEUE_SNAPSHOT_PATH.with_suffix(".tmp")
+    # no whitespace: a deep queue is tens of thousands of pairs, and every reader parses all of them
+    tmppath.write_text(json.dumps({"order": list(order)}, separators=(",", ":")))
+    tmppath.replace(QUEUE_SNAPSHOT_PATH)
+
+
+def touch_queue_snapshot() -> None:
+    """Mark the published queue order as still current, without rewriting it.
+
+    Raises OSError if it cannot be, as write_queue_snapshot() does.
+    """
+    os.utime(QUEUE_SNAPSHOT_PATH)
+
+
+def read_queue_snapshot() -> QueueSnapshot | None:
+    """Return the queue order the runner last published, or None if it is older than QUEUE_SNAPSHOT_STALE_SECONDS.
+
+    Raises as read_status() does when there is no usable snapshot, and for the same reasons: OSError
+    when the file is missing or unreadable, and KeyError, TypeError or ValueError when it does not
+    hold an order. A caller falls back to the positions stored on the tasks, as it does for None.
+
+    Keyed on the inode as well as the mtime, because the writer replaces the file rather than
+    rewriting it, and two orders published within the filesystem's timestamp resolution would
+    otherwise look like one.
+    """
+    global _queue_snapshot_memo  # noqa: PLW0603
+
+    stat = QUEUE_SNAPSHOT_PATH.stat()
+    if time.time() - stat.st_mtime > QUEUE_SNAPSHOT_STALE_SECONDS:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns)
+    if _queue_snapshot_memo is not None and _queue_snapshot_memo[0] == key:
+        return _queue_snapshot_memo[1]
+
+    snapshot = QueueSnapshot(json.loads(QUEUE_SNAPSHOT_PATH.read_text())["order"])
+    _queue_snapshot_memo = (key, snapshot)
+    return snapshot
+
+
+class PublishedStartEstimates:
+    """The start estimates the runner last published: when, and each queued task's median and 90th percentile."""
+
+    def __init__(self, computed: str, starts: dict[str, t.Sequence[float]]) -> None:
+        """Read the time they were computed at and the (median, 90th percentile) seconds of each task, by id."""
+        self.computed = datetime.datetime.fromisoformat(computed)
+        self.starts = starts
+
+    def age_seconds(self) -> float:
+        return (datetime.datetime.now(datetime.UTC) - self.computed).total_seconds()
+
+    def remaining(self, taskid: int) -> list[float] | None:
+        """Return a task's median and 90th percentile start in seconds from now, or None if it has none.
+
+        Counted down by the time since they were computed, and floored at zero: a task that has not
+        started when it was expected to is still expected at any moment.
+        """
+        start = self.starts.get(str(taskid))
+        if start is None:
+            return None
+        age = self.age_seconds()
+        return [max(0.0, round(seconds - age, 1)) for seconds in start]
+
+
+def write_start_estimates(computed: datetime.datetime, starts: dict[int, tuple[float, float]]) -> None:
+    """Publish each queued task's median and 90th percentile start, replacing the file atomically.
+
+    Raises OSError if it cannot be written, as write_queue_snapshot() does.
+    """
+    START_ESTIMATES_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = START_ESTIMATES_PATH.with_suffix(".tmp")
+    # no whitespace, as for the queue snapshot: one entry per queued task
+    tmppath.write_text(
+        json.dumps(
+            {"computed": computed.isoformat(), "starts": {str(taskid): start for taskid, start in starts.items()}},
+            separators=(",", ":"),
+        )
+    )
+    tmppath.replace(START_ESTIMATES_PATH)
+
+
+def read_start_estimates() -> PublishedStartEstimates | None:
+    """Return the start estimates the runner last published, or None if there are none recent enough.
+
+    None for a missing or unreadable file as well as one older than START_ESTIMATES_STALE_SECONDS:
+    either way there is nothing to serve, and the queue page falls back to its own estimate. Parsed
+    once per file, keyed as read_queue_snapshot() keys its memo.
+    """
+    global _start_estimates_memo  # noqa: PLW0603
+
+    try:
+        stat = START_ESTIMATES_PATH.stat()
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if _start_estimates_memo is None or _start_estimates_memo[0] != key:
+            data = json.loads(START_ESTIMATES_PATH.read_text())
+            _start_estimates_memo = (key, PublishedStartEstimates(data["computed"], data["starts"]))
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+
+    estimates = _start_estimates_memo[1]
+    return estimates if estimates.age_seconds() <= START_ESTIMATES_STALE_SECONDS else None
+
+
+class DrainRequest:
+    """A request that the runner stop dispatching, let its running tasks finish, and exit.
+
+    With `handover`, it then exits with HANDOVER_EXIT_CODE for the supervisor to start it again,
+    which is how a new version is deployed. The tasks still running at `deadline` are stopped, and
+    run again once a runner is back. With settings.TASKRUNNER_DETACHED, a handover waits only for the
+    slots that are not following a remote job (see detached.resumable_taskids()), and leaves the
+    jobs running for the new runner to resume.
+    """
+
+    def __init__(self, handover: bool, deadline: datetime.datetime, requested: datetime.datetime | None = None) -> None:
+        """Describe a drain that ends by `deadline`, asked for at `requested`, which defaults to now."""
+        self.handover = handover
+        self.deadline = deadline
+        self.requested = requested if requested is not None else datetime.datetime.now(datetime.UTC)
+
+    @classmethod
+    def after(cls, seconds: float, handover: bool = False) -> "DrainRequest":
+        """Return a request whose deadline is `seconds` from now."""
+        now = datetime.datetime.now(datetime.UTC)
+        return cls(handover=handover, deadline=now + datetime.timedelta(seconds=seconds), requested=now)
+
+    def seconds_left(self) -> float:
+        return (self.deadline - datetime.datetime.now(datetime.UTC)).total_seconds()
+
+    def as_status(self) -> dict[str, t.Any]:
+        """Return the request as the status file gives it, under "draining"."""
+        return {"handover": self.handover, "deadline": self.deadline.isoformat()}
+
+
+def write_drain_request(request: DrainRequest) -> None:
+    """Leave a drain request for the runner, replacing any it has not yet taken, atomically.
+
+    Raises OSError if it cannot be written.
+    """
+    CONTROL_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = CONTROL_PATH.with_suffix(".tmp")
+    tmppath.write_text(
+        json.dumps(
+            {
+                "handover": request.handover,
+                "deadline": request.deadline.isoformat(),
+                "requested": request.requested.isoformat(),
+            }
+        )
+    )
+    tmppath.replace(CONTROL_PATH)
+
+
+def take_drain_request(started: datetime.datetime) -> DrainRequest | None:
+    """Return the drain request left for the runner, if any, and remove it so that it is taken once.
+
+    A request written before `started`, when this runner started, was for a runner that had
+    already gone, and one that cannot be read is of no use to anyone: both are removed and None
+    returned, so that a request left behind does not drain the next runner as soon as it starts.
+    """
+    try:
+        data = json.loads(CONTROL_PATH.read_text())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        data = None
+    CONTROL_PATH.unlink(missing_ok=True)
+
+    try:
+        request = DrainRequest(
+            handover=bool(data["handover"]),
+            deadline=datetime.datetime.fromisoformat(data["deadline"]),
+            requested=datetime.datetime.fromisoformat(data["requested"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+    return request if request.requested >= started else None
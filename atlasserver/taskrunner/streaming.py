@@ -0,0 +1,164 @@
+"""Reading a remote command's standard output into a file as it arrives, with its progress.
+
+A forced photometry task's light curve is the standard output of force.sh. The runner used to
+collect all of it in memory with communicate(), only to log how many lines it had, while the same
+rows were written on sc01 with tee and moved back with rsync once the command exited. A four-hour
+task showed nothing of itself until then.
+
+With settings.TASKRUNNER_STREAM_RESULTS, run_remote_command() hands the pipes to an OutputStream
+instead. The rows go into a partial result file as they arrive, a chunk at a time, so nothing
+grows with the length of the light curve. The caller is told, at most every PROGRESS_SECONDS, how
+many rows have come and the MJD of the last, and writes them where the API reads them (see
+Task.rows_received).
+
+A LineReader reads the pipes the same way, for a command whose output is wanted whole but also
+watched as it comes, such as the markers that say when each task of a batch starts.
+"""
+
+import abc
+import contextlib
+import os
+import selectors
+import subprocess
+import time
+import typing as t
+from pathlib import Path
+
+# How often the progress is reported while rows arrive. Each report is a write to the task's row,
+# which also moves its modification time, so that the queue pages polling it see the change.
+PROGRESS_SECONDS: t.Final = 15.0
+
+# how much is read from a pipe at once
+READ_BYTES: t.Final = 65536
+
+
+class PipeReader(abc.ABC):
+    """A running command's standard output, taken a line at a time as it arrives, and its standard error, kept."""
+
+    def __init__(self) -> None:
+        """Read nothing until pump() is first called."""
+        self.stderr: list[bytes] = []
+        self._partial = b""  # the end of the output that is not yet a whole line
+        self._selector: selectors.BaseSelector | None = None
+
+    def pump(self, proc: "subprocess.Popen[bytes]", timeout: float) -> None:
+        """Take what the command writes for up to `timeout` seconds, returning once it has exited.
+
+        Raises subprocess.TimeoutExpired while it is still running, as communicate() does, so that
+        the caller's loop checks for cancellation and the time limit between calls.
+        """
+        if self._selector is None:
+            assert proc.stdout is not None  # for the type checker: opened with PIPE
+            assert proc.stderr is not None
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(proc.stdout, selectors.EVENT_READ, self.feed)
+            self._selector.register(proc.stderr, selectors.EVENT_READ, self.stderr.append)
+
+        deadline = time.monotonic() + timeout
+        while self._selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(proc.args, timeout)
+            for key, _ in self._selector.select(timeout=remaining):
+                chunk = os.read(key.fd, READ_BYTES)
+                if chunk:
+                    key.data(chunk)
+                else:
+                    self._selector.unregister(key.fileobj)
+
+        # both pipes are closed, which the command does as it exits
+        proc.wait(timeout=max(0.0, deadline - time.monotonic()))
+
+    def feed(self, chunk: bytes) -> None:
+        """Take a chunk of the standard output, passing on each line that it completes."""
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.take_line(line)
+
+    @abc.abstractmethod
+    def take_line(self, line: bytes) -> None:
+        """Take one whole line of the standard output, without its newline."""
+
+    def close(self) -> str:
+        """Take the last line, if the output did not end with a newline, and return the standard error."""
+        if self._partial:
+            self.take_line(self._partial)
+            self._partial = b""
+        if self._selector is not None:
+            self._selector.close()
+        return b"".join(self.stderr).decode("utf-8", errors="replace")
+
+
+class OutputStream(PipeReader):
+    """A running command's standard output, written to a file line by line, and its standard error, kept."""
+
+    def __init__(self, path: Path, on_progress: t.Callable[[int, float | None], None]) -> None:
+        """Stream into `path`, and report (rows received, last MJD) to `on_progress` as they change."""
+        super().__init__()
+        self.path = path
+        self.on_progress = on_progress
+        self.rows = 0
+        self.last_mjd: float | None = None
+        self._file: t.BinaryIO | None = None
+        self._lastprogress = time.monotonic()
+        self._reported: tuple[int, float | None] = (0, None)
+
+    def pump(self, proc: "subprocess.Popen[bytes]", timeout: float) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("wb")
+        super().pump(proc, timeout)
+
+    def feed(self, chunk: bytes) -> None:
+        """Write a chunk of the standard output, counting the rows it completes."""
+        assert self._file is not None  # for the type checker: opened before anything is read
+        self._file.write(chunk)
+
+        super().feed(chunk)
+
+        if time.monotonic() - self._lastprogress >= PROGRESS_SECONDS:
+            self.report()
+
+    def take_line(self, line: bytes) -> None:
+        # the header starts with "#", and a row with its MJD
+        fields = line.split(maxsplit=1)
+        if not fields or fields[0].startswith(b"#"):
+            return
+        self.rows += 1
+        with contextlib.suppress(ValueError):
+            self.last_mjd = float(fields[0])
+
+    def report(self) -> None:
+        self._lastprogress = time.monotonic()
+        if (self.rows, self.last_mjd) != self._reported:
+            self._reported = (self.rows, self.last_mjd)
+            self.on_progress(self.rows, self.last_mjd)
+
+    def close(self) -> str:
+        """Finish the file and report the final progress, and return the standard error."""
+        stderr = super().close()
+        if self._file is not None:
+            self._file.close()
+            self.report()
+        return stderr
+
+
+class LineReader(PipeReader):
+    """A running command's standard output, kept as text and shown to a callback a line at a time as it arrives."""
+
+    def __init__(self, on_line: t.Callable[[str], None]) -> None:
+        """Keep the output, and pass each line of it to `on_line` as it completes."""
+        super().__init__()
+        self.on_line = on_line
+        self.lines: list[str] = []
+
+    def take_line(self, line: bytes) -> None:
+        text = line.decode("utf-8", errors="replace")
+        self.lines.append(text)
+        self.on_line(text)
+
+    @property
+    def stdout(self) -> str:
+        """The standard output so far, as communicate() would have returned it."""
+        return "".join(f"{line}\n" for line in self.lines)
@@ -43,6 +43,11 @@ while (true) do
    python3 -u "$taskrunnerpath/main.py" 2> >(tee -a "$taskrunnerpath/logs/fprunnerlog_latest.txt" >&2) && break;
    # show result
    exitcode=$?
+   # HANDOVER_EXIT_CODE in status.py: the runner drained for a handover, and is started again at once
+   if [ "$exitcode" -eq 75 ]; then
+     echo "$(date "+%F %H:%M:%S")" "Supervisor: task runner exited for a handover. Restarting..." | tee -a "$taskrunnerpath/logs/fprunnerlog_latest.txt"
+     continue
+   fi
    echo "$(date "+%F %H:%M:%S")" "Supervisor: task runner crashed? Exit code was $exitcode. Restarting in two seconds..." | tee -a "$taskrunnerpath/logs/fprunnerlog_latest.txt"
    sleep 2
 done
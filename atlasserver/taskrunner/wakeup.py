@@ -0,0 +1,99 @@
+"""A nudge from the web app to the task runner that the queue has changed.
+
+The runner used to find new work only by polling: sleep half a second (five when the queue was
+empty), query the queue, repeat. A submission to an idle runner therefore waited up to five seconds
+before anything looked at it, and a busy runner queried the table twice a second whether or not
+anything had changed.
+
+With settings.TASKRUNNER_WAKEUP, the runner binds a unix datagram socket and blocks on it, and the
+web app sends one empty datagram to it whenever it asks for the queue to be renumbered. The content
+of a datagram means nothing; only its arrival does, so any number of nudges that arrive before the
+runner next looks are read as one. Polling stays as the backstop: a nudge sent while the runner is
+restarting, or dropped because the socket's buffer is full, costs at most one poll interval.
+
+With settings.TASKRUNNER_CLAIMS, each runner binds a socket of its own beside that one (see
+status.runner_path()), and the nudge goes to all of them. A unix socket reaches only its own
+machine, so a runner elsewhere is not nudged, and finds the change by polling.
+
+Nothing from the runner is imported here: the web app imports this module to send the nudge, and
+the runner's main module runs django.setup() and pulls in pandas on import.
+"""
+
+import contextlib
+import socket
+import typing as t
+from multiprocessing.connection import wait
+from pathlib import Path
+
+from atlasserver import settings
+from atlasserver.taskrunner import status as runnerstatus
+
+# Read and write for the runner and its group, which is what the web server runs as in production;
+# nobody else has any business waking the runner.
+SOCKET_MODE: int = 0o660
+
+
+def notify_runner(path: Path | None = None) -> None:
+    """Nudge the task runner, if it is listening. Never blocks, and never raises.
+
+    A runner that is not running, or that has not caught up on the nudges it already has, is not
+    the submitter's problem: the task is in the database either way, and the runner's polling will
+    find it. With settings.TASKRUNNER_CLAIMS, every runner listening here is nudged, and one that
+    is not does not stop the others being.
+    """
+    if not settings.TASKRUNNER_WAKEUP:
+        return
+
+    if path is not None:
+        paths = [path]
+    elif settings.TASKRUNNER_CLAIMS:
+        paths = runnerstatus.runner_paths(runnerstatus.WAKEUP_SOCKET_PATH)
+    else:
+        paths = [runnerstatus.WAKEUP_SOCKET_PATH]
+
+    with contextlib.suppress(OSError), socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for runnerpath in paths:
+            with contextlib.suppress(OSError):
+                sock.sendto(b"", str(runnerpath))
+
+
+class WakeupListener:
+    """The runner's end of the socket: bound once at startup, waited on by the dispatch loop."""
+
+    def __init__(self, path: Path | None = None) -> None:
+        """Bind the socket, replacing any left behind by a runner that did not exit cleanly.
+
+        Raises OSError if it cannot be bound, for instance because the path is longer than a unix
+        socket address allows; the runner then polls as it would with the setting off.
+        """
+        self.path = path if path is not None else runnerstatus.WAKEUP_SOCKET_PATH
+        self.path.unlink(missing_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind(str(self.path))
+            self.path.chmod(SOCKET_MODE)
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.setblocking(False)
+
+    def wait(self, others: t.Sequence[t.Any], timeout: float) -> bool:
+        """Block until a nudge arrives, one of `others` is ready, or `timeout` seconds pass.
+
+        `others` are whatever multiprocessing.connection.wait() accepts: the pipes of busy pooled
+        workers and the sentinels of per-task processes, so that a slot coming free wakes the loop
+        as well. Returns whether a nudge was received, after reading every one that is waiting.
+        """
+        ready = wait([self.sock, *others], timeout=timeout)
+        if self.sock not in ready:
+            return False
+
+        with contextlib.suppress(BlockingIOError):
+            while True:
+                self.sock.recv(1)
+        return True
+
+    def close(self) -> None:
+        self.sock.close()
+        self.path.unlink(missing_ok=True)
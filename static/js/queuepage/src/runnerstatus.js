@@ -55,7 +55,9 @@ export function describeAge(seconds) {
  * unnecessary render, which is a small cost. In a list of the fields to compare, a new field would
  * be invisible to every reader, and nothing would fail to show the mistake.
  */
-const RUNNERSTATUS_VOLATILE_FIELDS = ['written', 'pid', 'running_taskids', 'status_age_seconds'];
+const RUNNERSTATUS_VOLATILE_FIELDS = [
+    'written', 'pid', 'running_taskids', 'running_expected_runtime_seconds', 'status_age_seconds',
+];
 
 /**
  * Whether two status responses tell every reader the same thing.
@@ -128,10 +130,16 @@ export function runnerMessage(status, { showQueue = true } = {}) {
 
     // During the hourly maintenance operation, the slot counts hold their values. The task runner
     // starts no task and completes no task while that operation runs. Thus the sentence names the
-    // operation, and does not give numbers that have no meaning at that time.
-    const activity = status.maintenance
-        ? 'maintenance sweep in progress;'
-        : status.slots_busy + ' of ' + status.numslots + ' slots busy,';
+    // operation, and does not give numbers that have no meaning at that time. A drain starts no
+    // task either, until the runner is back, so it is named in the same place.
+    let activity = status.slots_busy + ' of ' + status.numslots + ' slots busy,';
+    if (status.draining) {
+        activity = status.draining.handover
+            ? 'restarting for an update, and starting no new tasks until then;'
+            : 'stopping, and starting no new tasks;';
+    } else if (status.maintenance) {
+        activity = 'maintenance sweep in progress;';
+    }
 
     return 'Task runner: ' + activity + ' ' + status.queued_task_count + ' unfinished '
         + (status.queued_task_count == 1 ? 'task' : 'tasks') + ' from all users in the queue.';
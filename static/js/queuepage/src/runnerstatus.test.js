@@ -184,6 +184,12 @@ describe('runnerMessage', () => {
         assert.doesNotMatch(message, /slots busy/);
     });
 
+    test('a drain is named instead of the slot counts', () => {
+        const message = runnerMessage(healthy({ draining: { handover: true, deadline: '2026-01-01T00:30:00Z' } }));
+        assert.match(message, /^Task runner: restarting for an update, and starting no new tasks until then; /);
+        assert.match(runnerMessage(healthy({ draining: { handover: false } })), /^Task runner: stopping,/);
+    });
+
     test('a working runner with an empty queue says nothing', () => {
         // the normal case, and the one the box must stay quiet in
         assert.equal(runnerMessage(healthy({ queued_task_count: 0 })), null);
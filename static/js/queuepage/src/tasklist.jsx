@@ -660,10 +660,14 @@ export const Task = React.memo(function Task(props) {
         // An indeterminate bar, striped and moving: the server reports that a task has started and
         // how long ago, and nothing about how far through it is, so there is no fraction to draw.
         // Bootstrap reads a role="progressbar" with no aria-valuenow as exactly that, and the label
-        // carries what is actually known to anyone who cannot see it moving.
+        // carries what is actually known to anyone who cannot see it moving. A runner that streams
+        // the light curve reports how much of it has arrived, which is still not a fraction of it.
+        const received = task.rows_received != null
+            ? ', ' + task.rows_received + ' rows so far' + (task.last_mjd_received != null ? ' up to MJD ' + task.last_mjd_received.toFixed(1) : '')
+            : '';
         taskbox.push(
             <div key="status" className="taskstatus running">
-                Running (started {timeelapsed} seconds ago)
+                Running (started {timeelapsed} seconds ago{received})
                 <div className="progress taskprogress" role="progressbar"
                     aria-label={'Task ' + task.id + ' is running'}>
                     <div className="progress-bar progress-bar-striped progress-bar-animated"></div>
@@ -788,9 +792,10 @@ export function TaskPage() {
         // countFinishedWhileAway and pageTitle
         finishedwhileaway: 0,
         /*
-         * All the user's queued tasks as {position, requesttype}, ascending by position, or null
-         * until the queue positions endpoint has answered. The type is there because these are
-         * waited through one at a time, so what each of them is decides how long it takes.
+         * All the user's queued tasks as {position, requesttype, expectedruntime, startestimate}, ascending by
+         * position, or null until the queue positions endpoint has answered. The type and the
+         * predicted run time are there because these are waited through one at a time, so what
+         * each of them is decides how long it takes.
          *
          * Null rather than an empty array, which would mean "this user has nothing else queued" --
          * a different answer, and the one that makes a bulk submitter's estimate wrong by up to the
@@ -1040,7 +1045,12 @@ export function TaskPage() {
                 // sorted so that the elementwise comparison below is meaningful; the estimate
                 // itself filters on position and does not care about the order
                 const ownqueued = Object.entries(data.queuepositions)
-                    .map(([taskid, position]) => ({ position, requesttype: data.queuedtypes?.[taskid] }))
+                    .map(([taskid, position]) => ({
+                        position,
+                        requesttype: data.queuedtypes?.[taskid],
+                        expectedruntime: data.expectedruntimes?.[taskid],
+                        startestimate: data.startestimates?.[taskid],
+                    }))
                     .sort((a, b) => a.position - b.position);
 
                 setState(prevstate => {
@@ -1062,12 +1072,18 @@ export function TaskPage() {
                     // every two seconds, and handing back a fresh array each time would re-render
                     // the page on every tick of a queue that has not moved. A null previous is the
                     // first answer, which is always a change.
+                    //
+                    // A start estimate counts down on every answer, so it is compared by the minute
+                    // it falls in, which is as fine as it is shown.
+                    const startMinute = (task) => (task.startestimate == null ? null : Math.ceil(task.startestimate[0] / 60));
                     const previousqueued = prevstate.ownqueued;
                     const positionschanged = (
                         previousqueued == null
                         || previousqueued.length != ownqueued.length
                         || ownqueued.some((task, index) => task.position !== previousqueued[index].position
-                            || task.requesttype !== previousqueued[index].requesttype));
+                            || task.requesttype !== previousqueued[index].requesttype
+                            || task.expectedruntime !== previousqueued[index].expectedruntime
+                            || startMinute(task) !== startMinute(previousqueued[index])));
 
                     if (!changed && !positionschanged) {
                         return null;
@@ -26,15 +26,16 @@
 /**
  * Seconds a task at this queue position is likely to wait, or null if that cannot be said.
  *
- * `ownqueued` is the caller's other queued tasks as {position, requesttype} pairs, or null while
- * that is not yet known — the two are different answers and an empty array only means the first.
+ * `ownqueued` is the caller's queued tasks as {position, requesttype, expectedruntime, startestimate},
+ * the last two only when the server has them, or null while that is not yet known — the two are different answers and an empty array only means the first.
  */
 export function estimateWaitSeconds({ queuepos, ownqueued, runnerstatus }) {
     // A queue that is not being dispatched from has no wait to report. `maintenance` means the
     // hourly sweep is blocking the runner's loop, so nothing starts for its duration and the slot
     // figures are frozen -- the banner already says so, and a countdown beside it would be against
-    // a queue that is not moving.
-    if (queuepos == null || runnerstatus == null || runnerstatus.stale || runnerstatus.maintenance) {
+    // a queue that is not moving. Nor is it moving while the runner drains.
+    if (queuepos == null || runnerstatus == null || runnerstatus.stale || runnerstatus.maintenance
+        || runnerstatus.draining) {
         return null;
     }
 
@@ -45,6 +46,15 @@ export function estimateWaitSeconds({ queuepos, ownqueued, runnerstatus }) {
         return null;
     }
 
+    // The runner's own simulation of the queue draining, when it publishes one (see
+    // taskrunner/eta.py). That follows the dispatch policy described above task by task, with what
+    // the running tasks have left, where everything below approximates it from counts. The median,
+    // because the 90th percentile would make nearly every row start early.
+    const own = ownqueued.find((task) => task.position === queuepos);
+    if (own?.startestimate?.[0] >= 0) {
+        return own.startestimate[0];
+    }
+
     // Nothing here reads the run time of the task being estimated. What it is waiting for is the
     // work ahead of it, so its own type says nothing about when it starts -- only about when it
     // then finishes, which is not what is being reported.
@@ -76,15 +86,17 @@ export function estimateWaitSeconds({ queuepos, ownqueued, runnerstatus }) {
     // The user's own tasks ahead run one at a time, so their run times add up -- each priced by
     // what it actually is. A radeclist submission is one type throughout, but a user who asked for
     // images and then submitted a light curve waits through the image request, and a quarter of an
-    // hour of that is not a minute of it.
+    // hour of that is not a minute of it. Its own predicted run time first (from finished tasks
+    // like it: a light curve over the whole survey is not a month's), and its type's median when it
+    // has none.
     let ownseconds = 0;
     for (const task of ownahead) {
-        const median = runtimes?.[task.requesttype];
-        if (!(median > 0)) {
+        const expected = task.expectedruntime > 0 ? task.expectedruntime : runtimes?.[task.requesttype];
+        if (!(expected > 0)) {
             // one of this user's own tasks ahead cannot be priced, and it is directly in the way
             return null;
         }
-        ownseconds += median;
+        ownseconds += expected;
     }
 
     // Everybody else's drain in whole passes, not fractions of one. With fifteen other users'
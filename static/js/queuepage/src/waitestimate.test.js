@@ -162,6 +162,10 @@ describe('estimateWaitSeconds', () => {
         assert.equal(soleTaskAt(5, { maintenance: true }), null);
     });
 
+    test('nothing is estimated while the runner drains', () => {
+        assert.equal(soleTaskAt(5, { draining: { handover: true } }), null);
+    });
+
     test('nothing is estimated before the first status response', () => {
         assert.equal(estimateWaitSeconds({
             queuepos: 5, ownqueued: [{ position: 5, requesttype: 'FP' }], runnerstatus: null,
@@ -198,6 +202,36 @@ describe('estimateWaitSeconds', () => {
         assert.equal(seconds, 900 + 60);
     });
 
+    test('an own task ahead with a prediction is priced by it rather than by its type', () => {
+        // a light curve over the whole survey, predicted at five minutes where its type's median is one
+        const seconds = estimateWaitSeconds({
+            queuepos: 2,
+            ownqueued: [
+                { position: 0, requesttype: 'FP', expectedruntime: 300 },
+                { position: 1, requesttype: 'SSOSTACK', expectedruntime: 1200 },
+                { position: 2, requesttype: 'FP' },
+            ],
+            runnerstatus: status({ distinct_queued_users: 1 }),
+        });
+
+        assert.equal(seconds, 300 + 1200);
+    });
+
+    test("the runner's simulated start is used in place of the counted one", () => {
+        const ownqueued = [
+            { position: 0, requesttype: 'IMGZIP' },
+            { position: 1, requesttype: 'FP', startestimate: [420, 900] },
+        ];
+
+        assert.equal(estimateWaitSeconds({
+            queuepos: 1, ownqueued, runnerstatus: status({ distinct_queued_users: 1 }),
+        }), 420);
+        // still nothing while the runner is not dispatching
+        assert.equal(estimateWaitSeconds({
+            queuepos: 1, ownqueued, runnerstatus: status({ stale: true }),
+        }), null);
+    });
+
     test('an own task ahead that cannot be priced withholds the estimate', () => {
         // unlike a rare type elsewhere in the queue, this one is directly in the way
         const seconds = estimateWaitSeconds({
@@ -1 +1 @@
-"use strict";export const POLL_MS=60000;const URL_META="meta[name=\"atlas-runnerstatus-url\"]";const READER_META="meta[name=\"atlas-reader\"]";export function describeAge(seconds){const units=[["day",86400],["hour",3600],["minute",60]];for(const[name,size]of units){if(seconds>=size){const count=Math.floor(seconds/size);return count+" "+name+(count==1?"":"s")+" ago"}}return"less than a minute ago"}const RUNNERSTATUS_VOLATILE_FIELDS=["written","pid","running_taskids","status_age_seconds"];export function runnerStatusEqual(previous,next){if(previous==null||next==null){return previous===next}if((previous.stale||next.stale)&&previous.status_age_seconds!==next.status_age_seconds){return false}const fields=new Set([...Object.keys(previous),...Object.keys(next)].filter(field=>!RUNNERSTATUS_VOLATILE_FIELDS.includes(field)));for(const field of fields){const before=previous[field];const after=next[field];if(before===after){continue}if(JSON.stringify(before)!==JSON.stringify(after)){return false}}return true}export function runnerMessage(status,{showQueue=true}={}){if(status==null){return null}if(status.stale){const age=status.status_age_seconds!=null?" It last reported "+describeAge(status.status_age_seconds)+".":"";return"The task runner is not currently processing jobs."+age+" Queued tasks will start once it is back; there is no need to submit them again."}if(!status.queued_task_count||!showQueue){return null}const activity=status.maintenance?"maintenance sweep in progress;":status.slots_busy+" of "+status.numslots+" slots busy,";return"Task runner: "+activity+" "+status.queued_task_count+" unfinished "+(status.queued_task_count==1?"task":"tasks")+" from all users in the queue."}function pollingPaused(){if(typeof document==="undefined"){return false}return document.hidden||typeof window!=="undefined"&&window.user_is_active===false}const CACHE_KEY="atlas-runnerstatus";function browserStorage(){try{return typeof sessionStorage!=="undefined"?sessionStorage:null}catch(error){return null}}function advanceAge(status,seconds){if(!status.stale||typeof status.status_age_seconds!=="number"){return status}return{...status,status_age_seconds:Math.round((status.status_age_seconds+seconds)*10)/10}}export function createCache({storage=browserStorage(),url,reader}){function clear(){try{storage?.removeItem(CACHE_KEY)}catch(error){console.debug("Could not discard the kept task runner status",error)}}function read(maxage){let record=null;try{const text=storage?.getItem(CACHE_KEY);record=text==null?null:JSON.parse(text)}catch(error){record=null}if(record==null||record.url!==url||record.reader!==reader||record.status==null||typeof record.status!=="object"){return null}const elapsed=Date.now()-record.saved;if(!(elapsed>=0&&elapsed<=maxage)){return null}return{saved:record.saved,status:advanceAge(record.status,elapsed/1000)}}function write(status,at){try{storage?.setItem(CACHE_KEY,JSON.stringify({url,reader,saved:at,status}))}catch(error){console.debug("Could not keep the task runner status for the next page",error)}}return{read,write,clear}}export function createStore({url,poll=POLL_MS,reader="",storage=browserStorage()}){const cache=createCache({storage,url,reader});const kept=cache.read(poll);let status=kept==null?null:kept.status;let lastgoodfetch=kept==null?null:kept.saved;let interval=null;let generation=0;let answered=0;const listeners=new Set;function publish(next){if(runnerStatusEqual(status,next)){return}status=next;const published=status;for(const listener of[...listeners]){tell(listener,published)}}function tell(listener,published){try{listener(published)}catch(error){console.error("A task runner status reader failed",error)}}function refresh({fresh=false}={}){const asked=generation+=1;return fetch(url,{credentials:"same-origin",headers:{"Accept":"application/json"},cache:fresh?"no-cache":"default"}).then(response=>response.json()).then(body=>{if(asked<=answered){return}answered=asked;lastgoodfetch=Date.now();publish(body);cache.write(body,lastgoodfetch)}).catch(error=>{if(asked<=answered){return}console.debug("Could not read the task runner status",error);if(lastgoodfetch!=null&&Date.now()-lastgoodfetch>poll*5){cache.clear();publish(null)}})}function refreshIfVisible(){if(typeof document!=="undefined"&&!document.hidden){refresh({fresh:true})}}function stop(){clearInterval(interval);interval=null;if(typeof document!=="undefined"){document.removeEventListener("visibilitychange",refreshIfVisible)}answered=generation;status=null;lastgoodfetch=null}function subscribe(listener){listeners.add(listener);if(interval==null){refresh();interval=setInterval(()=>{if(!pollingPaused()){refresh()}},poll);if(typeof document!=="undefined"){document.addEventListener("visibilitychange",refreshIfVisible)}}tell(listener,status);let subscribed=true;return()=>{if(!subscribed){return}subscribed=false;listeners.delete(listener);if(listeners.size===0){stop()}}}return{subscribe,refresh,stop,current:()=>status}}let pagestore=null;function pageStore(){if(pagestore==null){const meta=document.querySelector(URL_META);const reader=document.querySelector(READER_META);pagestore=meta!=null?createStore({url:meta.content,reader:reader==null?"":reader.content}):{subscribe:listener=>{listener(null);return()=>{}},refresh:()=>{},stop:()=>{},current:()=>null}}return pagestore}export function subscribe(listener){return pageStore().subscribe(listener)}export function renderInto(box,status){const line=box.querySelector(".sitenotice-runner");const text=line==null?null:line.querySelector(".sitenotice-runnertext");if(line==null||text==null){return}const showQueue=box.hasAttribute("data-showqueue")||status!=null&&status.user_queued_task_count>0;const message=runnerMessage(status,{showQueue});const stale=status!=null&&Boolean(status.stale);const drawn=message==null?"":message;box.classList.toggle("stale",stale);box.classList.toggle("sitenotice-noline",message==null);const mark=line.querySelector(".sitenotice-warnmark");if(mark!=null){mark.toggleAttribute("hidden",!(stale&&message!=null))}if(text.textContent===drawn){return}line.setAttribute("aria-live",stale?"polite":"off");text.textContent=drawn}export function start(box){let known=false;return subscribe(status=>{if(status==null&&!known){return}known=known||status!=null;renderInto(box,status)})}const sitenotice=typeof document!=="undefined"?document.getElementById("sitenotice"):null;const stopbootstrap=sitenotice!=null?start(sitenotice):()=>{};export function stopPageStore(){stopbootstrap()}
+"use strict";export const POLL_MS=60000;const URL_META="meta[name=\"atlas-runnerstatus-url\"]";const READER_META="meta[name=\"atlas-reader\"]";export function describeAge(seconds){const units=[["day",86400],["hour",3600],["minute",60]];for(const[name,size]of units){if(seconds>=size){const count=Math.floor(seconds/size);return count+" "+name+(count==1?"":"s")+" ago"}}return"less than a minute ago"}const RUNNERSTATUS_VOLATILE_FIELDS=["written","pid","running_taskids","running_expected_runtime_seconds","status_age_seconds"];export function runnerStatusEqual(previous,next){if(previous==null||next==null){return previous===next}if((previous.stale||next.stale)&&previous.status_age_seconds!==next.status_age_seconds){return false}const fields=new Set([...Object.keys(previous),...Object.keys(next)].filter(field=>!RUNNERSTATUS_VOLATILE_FIELDS.includes(field)));for(const field of fields){const before=previous[field];const after=next[field];if(before===after){continue}if(JSON.stringify(before)!==JSON.stringify(after)){return false}}return true}export function runnerMessage(status,{showQueue=true}={}){if(status==null){return null}if(status.stale){const age=status.status_age_seconds!=null?" It last reported "+describeAge(status.status_age_seconds)+".":"";return"The task runner is not currently processing jobs."+age+" Queued tasks will start once it is back; there is no need to submit them again."}if(!status.queued_task_count||!showQueue){return null}let activity=status.slots_busy+" of "+status.numslots+" slots busy,";if(status.draining){activity=status.draining.handover?"restarting for an update, and starting no new tasks until then;":"stopping, and starting no new tasks;"}else if(status.maintenance){activity="maintenance sweep in progress;"}return"Task runner: "+activity+" "+status.queued_task_count+" unfinished "+(status.queued_task_count==1?"task":"tasks")+" from all users in the queue."}function pollingPaused(){if(typeof document==="undefined"){return false}return document.hidden||typeof window!=="undefined"&&window.user_is_active===false}const CACHE_KEY="atlas-runnerstatus";function browserStorage(){try{return typeof sessionStorage!=="undefined"?sessionStorage:null}catch(error){return null}}function advanceAge(status,seconds){if(!status.stale||typeof status.status_age_seconds!=="number"){return status}return{...status,status_age_seconds:Math.round((status.status_age_seconds+seconds)*10)/10}}export function createCache({storage=browserStorage(),url,reader}){function clear(){try{storage?.removeItem(CACHE_KEY)}catch(error){console.debug("Could not discard the kept task runner status",error)}}function read(maxage){let record=null;try{const text=storage?.getItem(CACHE_KEY);record=text==null?null:JSON.parse(text)}catch(error){record=null}if(record==null||record.url!==url||record.reader!==reader||record.status==null||typeof record.status!=="object"){return null}const elapsed=Date.now()-record.saved;if(!(elapsed>=0&&elapsed<=maxage)){return null}return{saved:record.saved,status:advanceAge(record.status,elapsed/1000)}}function write(status,at){try{storage?.setItem(CACHE_KEY,JSON.stringify({url,reader,saved:at,status}))}catch(error){console.debug("Could not keep the task runner status for the next page",error)}}return{read,write,clear}}export function createStore({url,poll=POLL_MS,reader="",storage=browserStorage()}){const cache=createCache({storage,url,reader});const kept=cache.read(poll);let status=kept==null?null:kept.status;let lastgoodfetch=kept==null?null:kept.saved;let interval=null;let generation=0;let answered=0;const listeners=new Set;function publish(next){if(runnerStatusEqual(status,next)){return}status=next;const published=status;for(const listener of[...listeners]){tell(listener,published)}}function tell(listener,published){try{listener(published)}catch(error){console.error("A task runner status reader failed",error)}}function refresh({fresh=false}={}){const asked=generation+=1;return fetch(url,{credentials:"same-origin",headers:{"Accept":"application/json"},cache:fresh?"no-cache":"default"}).then(response=>response.json()).then(body=>{if(asked<=answered){return}answered=asked;lastgoodfetch=Date.now();publish(body);cache.write(body,lastgoodfetch)}).catch(error=>{if(asked<=answered){return}console.debug("Could not read the task runner status",error);if(lastgoodfetch!=null&&Date.now()-lastgoodfetch>poll*5){cache.clear();publish(null)}})}function refreshIfVisible(){if(typeof document!=="undefined"&&!document.hidden){refresh({fresh:true})}}function stop(){clearInterval(interval);interval=null;if(typeof document!=="undefined"){document.removeEventListener("visibilitychange",refreshIfVisible)}answered=generation;status=null;lastgoodfetch=null}function subscribe(listener){listeners.add(listener);if(interval==null){refresh();interval=setInterval(()=>{if(!pollingPaused()){refresh()}},poll);if(typeof document!=="undefined"){document.addEventListener("visibilitychange",refreshIfVisible)}}tell(listener,status);let subscribed=true;return()=>{if(!subscribed){return}subscribed=false;listeners.delete(listener);if(listeners.size===0){stop()}}}return{subscribe,refresh,stop,current:()=>status}}let pagestore=null;function pageStore(){if(pagestore==null){const meta=document.querySelector(URL_META);const reader=document.querySelector(READER_META);pagestore=meta!=null?createStore({url:meta.content,reader:reader==null?"":reader.content}):{subscribe:listener=>{listener(null);return()=>{}},refresh:()=>{},stop:()=>{},current:()=>null}}return pagestore}export function subscribe(listener){return pageStore().subscribe(listener)}export function renderInto(box,status){const line=box.querySelector(".sitenotice-runner");const text=line==null?null:line.querySelector(".sitenotice-runnertext");if(line==null||text==null){return}const showQueue=box.hasAttribute("data-showqueue")||status!=null&&status.user_queued_task_count>0;const message=runnerMessage(status,{showQueue});const stale=status!=null&&Boolean(status.stale);const drawn=message==null?"":message;box.classList.toggle("stale",stale);box.classList.toggle("sitenotice-noline",message==null);const mark=line.querySelector(".sitenotice-warnmark");if(mark!=null){mark.toggleAttribute("hidden",!(stale&&message!=null))}if(text.textContent===drawn){return}line.setAttribute("aria-live",stale?"polite":"off");text.textContent=drawn}export function start(box){let known=false;return subscribe(status=>{if(status==null&&!known){return}known=known||status!=null;renderInto(box,status)})}const sitenotice=typeof document!=="undefined"?document.getElementById("sitenotice"):null;const stopbootstrap=sitenotice!=null?start(sitenotice):()=>{};export function stopPageStore(){stopbootstrap()}
@@ -1 +1 @@
-"use strict";import React from"react";import ReactDOM from"react-dom";import{subscribe}from"runnerstatus";import{csrfHeader}from"csrftoken";import{NewRequest}from"newrequest";import{NOT_MODIFIED,PollCache}from"pollcache";import{estimateWaitSeconds,formatDuration,formatWaitEstimate}from"waitestimate";function debug_log(...args){}const TASKLIST_POLL_MS=6000;const QUEUEPOS_POLL_MS=2000;const SITE_TITLE="ATLAS Forced Photometry";const AWAY_POLL_MS=60000;const EMPTY_QUEUE_TICKS=5;function pageTitle(taskid,finishedwhileaway){const title=(taskid!=null?"Task "+taskid:"Task Queue")+" – "+SITE_TITLE;return finishedwhileaway>0?"("+finishedwhileaway+") "+title:title}function pollingPaused(){return document[hidden]||!user_is_active}function tracksQueuePosition(task){return task.user_id==user_id&&task.finishtimestamp==null&&task.queuepos!=null}function updateQueueBadge(count){const badge=document.querySelector(".queuecount");if(!badge){return}const number=badge.querySelector(".queuecount-number");if(number){number.textContent=count}badge.hidden=count==0}function pollInterval(fn,ms){return setInterval(()=>{if(!pollingPaused()){fn()}},ms)}const ROW_TRANSITION_MS=200;function taskRow(taskid){return document.getElementById("task-"+taskid)}function collapseRow(taskid){taskRow(taskid)?.classList.add("task-collapsed")}function expandRow(taskid){taskRow(taskid)?.classList.remove("task-collapsed")}const ROW_FLASH_MS=1600;function revealRow(taskid){const row=taskRow(taskid);if(!row){return}row.classList.add("task-collapsed");requestAnimationFrame(()=>requestAnimationFrame(()=>row.classList.remove("task-collapsed")));row.classList.add("task-flash");setTimeout(()=>row.classList.remove("task-flash"),ROW_FLASH_MS)}const COPY_LABEL_RESET_MS=2000;function CopyableValue({text,label,children}){const[state,setState]=React.useState("idle");const timer=React.useRef(null);const value=React.useRef(null);React.useEffect(()=>()=>clearTimeout(timer.current),[]);if(!navigator.clipboard){return children}const announce=next=>{setState(next);clearTimeout(timer.current);timer.current=setTimeout(()=>setState("idle"),COPY_LABEL_RESET_MS)};const selectValue=()=>{const selection=window.getSelection();if(!selection||!value.current){return}const range=document.createRange();range.selectNodeContents(value.current);selection.removeAllRanges();selection.addRange(range)};const copy=()=>{navigator.clipboard.writeText(text).then(()=>announce("copied"),()=>{selectValue();announce("failed")})};return React.createElement("span",{className:"copyable"},React.createElement("span",{className:"copyvalue",ref:value},children),React.createElement("button",{type:"button",className:"copybutton",onClick:copy,title:"Copy "+label,"aria-label":"Copy "+label},state==="idle"?React.createElement(CopyIcon,null):null,React.createElement("span",{className:"copyfeedback","aria-live":"polite"},state==="copied"?"Copied":null,state==="failed"?"Press Ctrl-C":null)))}function CopyIcon(){return React.createElement("svg",{width:"13",height:"13",viewBox:"0 0 16 16",fill:"none",stroke:"currentColor",strokeWidth:"1.5","aria-hidden":"true"},React.createElement("rect",{x:"5.5",y:"5.5",width:"8.5",height:"9",rx:"1.5"}),React.createElement("path",{d:"M10.5 3.2A1.7 1.7 0 0 0 8.8 2H3.7A1.7 1.7 0 0 0 2 3.7v5.1a1.7 1.7 0 0 0 1.2 1.6"}))}const TaskPlot=React.memo(function TaskPlot({taskid,taskurl}){React.useEffect(()=>{debug_log("activating plot",taskid);const plot_url=new URL(taskurl);plot_url.pathname+="resultplotdata.js";plot_url.search="";const script=document.createElement("script");script.src=plot_url;document.head.appendChild(script);return()=>{debug_log("Unmounting plot for task ",taskid);script.remove();const key="#plotforcedflux-task-"+taskid;delete jslimitsglobal[key];delete jslcdataglobal[key];delete jslabelsglobal[key]}},[taskid,taskurl]);return React.createElement("div",{key:"plot",id:"plotforcedflux-task-"+taskid,className:"plot",style:{width:"100%",height:"300px"}})});function useTimeElapsed(taskdata){const running=taskdata.starttimestamp!=null&&taskdata.finishtimestamp==null;const secondsSinceStart=()=>((new Date().getTime()-new Date(taskdata.starttimestamp).getTime())/1000).toFixed(0);const[timeelapsed,setTimeelapsed]=React.useState(()=>running?secondsSinceStart():-1);React.useEffect(()=>{if(!running){return undefined}setTimeelapsed(secondsSinceStart());const interval=setInterval(()=>setTimeelapsed(secondsSinceStart()),1000);return()=>clearInterval(interval)},[running,taskdata.starttimestamp]);return running?timeelapsed:-1}function taskPropsEqual(prev,next){return prev.hidePlot===next.hidePlot&&prev.waitestimate===next.waitestimate&&(prev.taskdata===next.taskdata||JSON.stringify(prev.taskdata)===JSON.stringify(next.taskdata))}export const Task=React.memo(function Task(props){const[httperror,setHttperror]=React.useState("");const timeelapsed=useTimeElapsed(props.taskdata);React.useEffect(()=>{if(newtaskids.includes(props.taskdata.id)){debug_log("showing new task",props.taskdata.id);revealRow(props.taskdata.id);newtaskids=newtaskids.filter(item=>item!==props.taskdata.id)}},[]);function deleteTask(){const task=props.taskdata;collapseRow(task.id);setTimeout(()=>{fetch(task.url,{credentials:"same-origin",method:"DELETE",headers:csrfHeader()}).then(response=>{if(response.ok){console.log("Deleted task ",task.id);setHttperror("");props.fetchData();return}console.log("Failed to delete task ",task.id,response.status);if(response.status===401){window.location.reload();return}expandRow(task.id);let message="ERROR: could not delete this task (HTTP "+response.status+").";if(response.status===403){message="ERROR: you are not allowed to delete this task."}setHttperror(message);props.fetchData()}).catch(err=>{console.log("Failed to reach the server to delete task ",task.id,err);expandRow(task.id);setHttperror("ERROR: could not reach the server to delete this task.");props.fetchData()})},ROW_TRANSITION_MS)}function requestImages(){const request_image_url=new URL(props.taskdata.url);request_image_url.pathname+="requestimages/";request_image_url.search="";fetch(request_image_url,{credentials:"same-origin",method:"POST",headers:{...csrfHeader(),"Accept":"application/json","Content-Type":"application/json"}}).then(response=>{if(response.status==200&&response.redirected){setHttperror("");const newimgtask_id=parseInt(new URL(response.url).searchParams.get("newids"));newtaskids.push(newimgtask_id);debug_log("requestimages created task",newimgtask_id);const new_page_url=new URL(response.url);new_page_url.searchParams.delete("newids");window.history.pushState({},document.title,new_page_url);props.fetchData(true)}else{return response.text().then(text=>{let message=response.statusText||"HTTP "+response.status;try{const data=JSON.parse(text);message=data["non_field_errors"]||data["detail"]||message}catch(err){console.log("requestImages: non-JSON error body",text)}console.log("requestImages: error returned",response.status,message);setHttperror("ERROR: "+message)})}return null}).catch(error=>{console.log("requestImages HTTP request failed",error);setHttperror("HTTP request failed.")})}const task=props.taskdata;const hasresultfile=task.result_url!=null;let statusclass="none";let buttontext="none";let statuslabel="";let statusbadge="";if(task.finishtimestamp!=null){statusclass=task.error_msg!=null?"finished errored":"finished";buttontext="Delete";statuslabel=task.error_msg!=null?"Error":"Finished";statusbadge=task.error_msg!=null?"taskbadge-error":"taskbadge-finished"}else if(task.starttimestamp!=null){statusclass="queued started";buttontext="Cancel";statuslabel="Running";statusbadge="taskbadge-running"}else{statusclass="queued notstarted";buttontext="Cancel";statuslabel="Queued";statusbadge="taskbadge-queued"}debug_log("Task "+task.id+" rendered");let delbutton=null;if(task.user_id==user_id){delbutton=React.createElement("button",{className:"btn btn-sm btn-danger",onClick:()=>deleteTask()},buttontext)}const previewimage=task.previewimage_url?React.createElement("img",{className:"previewimage",src:task.previewimage_url,height:"100",loading:"lazy",alt:"Preview image for task "+task.id}):null;let taskbox=[React.createElement("div",{key:"rightside",className:"rightside"},delbutton,previewimage)];taskbox.push(React.createElement("div",{key:"tasknum",className:"taskheading"},React.createElement("a",{key:"tasklink",href:task.url,onClick:e=>{props.setSingleTaskView(e,task.id,task.url)}},"Task ",task.id),React.createElement("span",{key:"taskbadge",className:"badge taskbadge "+statusbadge},statuslabel)));if(task.parent_task_url){taskbox.push(React.createElement("p",{key:"imgrequest"},"Image request for ",React.createElement("a",{key:"parent_task_link",href:task.parent_task_url,onClick:e=>{props.setSingleTaskView(e,task.parent_task_id,task.parent_task_url)}},"Task ",task.parent_task_id)))}else if(task.parent_task_id){taskbox.push(React.createElement("p",{key:"imgrequest"},"Image request for Task ",task.parent_task_id," (deleted)"))}else if(task.request_type=="IMGZIP"){taskbox.push(React.createElement("p",{key:"imgrequest"},"Image request"))}if(task.request_type=="IMGZIP"){const imagetype=task.use_reduced?"reduced":"difference";taskbox.push(React.createElement("p",{key:"imgrequestnote"},"Up to the first 1000 ",imagetype," images will be retrieved. The image request and download link may expire after one week."))}const meta=[];if(task.user_id!=user_id){meta.push(["user","User:",task.username])}if(task.comment!=null&&task.comment!=""){meta.push(["comment","Comment:",React.createElement("b",null,task.comment)])}if(task.mpc_name!=null&&task.mpc_name!=""){meta.push(["target","MPC Object:",React.createElement(CopyableValue,{text:task.mpc_name,label:"object name"},task.mpc_name)])}else{let radecepoch="";if(task.radec_epoch_year!=null){radecepoch=React.createElement("span",null,"(epoch ",task.radec_epoch_year,") ")}meta.push(["target","RA Dec:",React.createElement("span",null,radecepoch,React.createElement(CopyableValue,{text:task.ra+" "+task.dec,label:"coordinates"},task.ra," ",task.dec))]);if(task.propermotion_ra!=null&&task.propermotion_ra!=0||task.propermotion_dec!=null&&task.propermotion_dec!=0){meta.push(["propermotion","Proper motion:",React.createElement("span",null,task.propermotion_ra," ",task.propermotion_dec," mas/yr")])}}if(task.request_type=="SSOSTACK"){meta.push(["imgtype","Image:","Stacked"])}else{meta.push(["imgtype","Images:",task.use_reduced?"Reduced":"Difference"])}if(task.mjd_min!=null||task.mjd_max!=null){const mjdmin=task.mjd_min!=null?task.mjd_min:"0";const mjdmax=task.mjd_max!=null?task.mjd_max:"∞";meta.push(["mjdrange","MJD request:",React.createElement("span",null,"[",mjdmin,", ",mjdmax,"]")])}if(task.attempt_count>1){meta.push(["attempts","Attempts:",task.attempt_count])}meta.push(["queuetime","Queued at:",new Date(task.timestamp).toLocaleString()]);if(task.finishtimestamp!=null){meta.push(["finishtime","Finished at:",new Date(task.finishtimestamp).toLocaleString()]);const timing=(label,seconds)=>{const text=formatDuration(seconds);return text!=null?label+" "+text:null};const timings=[task.attempt_count>1?null:timing("waited",task.waittime),timing("ran",task.runtime)].filter(part=>part!=null);if(timings.length>0){meta.push(["timings","Took:",timings.join(" · ")])}}taskbox.push(React.createElement("dl",{key:"taskmeta",className:"taskmeta"},meta.map(([key,label,value])=>[React.createElement("dt",{key:key+"-label"},label),React.createElement("dd",{key:key+"-value"},value)])));if(task.finishtimestamp!=null){if(task.error_msg!=null){taskbox.push(React.createElement("p",{key:"error_msg",className:"taskerror"},"Error: ",task.error_msg))}else{const resultsexpired=React.createElement("p",{key:"expired"},"The download link has expired. Delete this task and request again if necessary.");if(task.request_type=="FP"){if(hasresultfile){taskbox.push(React.createElement("a",{key:"datalink",className:"results btn btn-info getdata",href:task.result_url,target:"_blank",rel:"noopener"},"Data"));taskbox.push(React.createElement("a",{key:"pdflink",className:"results btn btn-info getpdf",href:task.pdfplot_url,target:"_blank",rel:"noopener"},"PDF"))}else{taskbox.push(resultsexpired)}}else if(task.request_type=="SSOSTACK"){if(hasresultfile){taskbox.push(React.createElement("a",{key:"datalink",className:"results btn btn-info getdata",href:task.result_url,target:"_blank",rel:"noopener"},"Data"))}if(task.result_imagestack_url!=null){taskbox.push(React.createElement("a",{key:"imgdownload",className:"results btn btn-info",href:task.result_imagestack_url,target:"_blank",rel:"noopener"},"Stacked image (FITS)"))}else{taskbox.push(resultsexpired)}}if(task.request_type=="IMGZIP"){if(task.result_imagezip_url!=null){taskbox.push(React.createElement("a",{key:"imgdownload",className:"results btn btn-info",href:task.result_imagezip_url},"Download images (ZIP)"))}else{taskbox.push(resultsexpired)}}else if(task.imagerequest_task_id!=null){if(task.imagerequest_finished){taskbox.push(React.createElement("a",{key:"imgrequest",className:"btn btn-primary",href:task.imagerequest_url,onClick:e=>{props.setSingleTaskView(e,task.imagerequest_task_id,task.imagerequest_url)}},"Images retrieved"))}else{taskbox.push(React.createElement("a",{key:"imgrequest",className:"btn btn-warning",href:task.imagerequest_url,onClick:e=>{props.setSingleTaskView(e,task.imagerequest_task_id,task.imagerequest_url)}},"Images requested"))}}else if(task.request_type=="FP"&&user_id==task.user_id&&hasresultfile){taskbox.push(React.createElement("button",{key:"imgrequest",className:"btn btn-info",onClick:()=>requestImages(),title:"Download FITS and JPEG images for up to the first 1000 observations."},"Request ",task.use_reduced?"reduced":"diff"," images"))}}}else if(task.starttimestamp!=null){taskbox.push(React.createElement("div",{key:"status",className:"taskstatus running"},"Running (started ",timeelapsed," seconds ago)",React.createElement("div",{className:"progress taskprogress",role:"progressbar","aria-label":"Task "+task.id+" is running"},React.createElement("div",{className:"progress-bar progress-bar-striped progress-bar-animated"}))))}else if(task.queuepos!=null){const ahead=task.queuepos==0?"next":task.queuepos+" ahead";const estimate=props.waitestimate!=null?React.createElement(React.Fragment,null," ",React.createElement("span",{className:"taskestimate"},props.waitestimate,React.createElement("span",{className:"visually-hidden"}," estimated wait"))):null;taskbox.push(React.createElement("div",{key:"status",className:"taskstatus waiting"},"Waiting ",React.createElement("span",{className:"badge taskposition"},ahead,React.createElement("span",{className:"visually-hidden"}," in the queue")),estimate))}else{taskbox.push(React.createElement("div",{key:"status",className:"taskstatus waiting"},"Waiting in queue"))}if(httperror!=""){taskbox.push(React.createElement("p",{key:"httperror",className:"errors",role:"alert"},httperror))}if(task.finishtimestamp!=null&&task.error_msg==null&&task.request_type=="FP"&&hasresultfile&&!props.hidePlot){taskbox.push(React.createElement(TaskPlot,{key:"plot",taskid:task.id,taskurl:task.url}))}return(React.createElement("li",{key:"task-"+task.id,className:"task "+statusclass,id:"task-"+task.id},React.createElement("div",{className:"taskinner"},taskbox)))},taskPropsEqual);let tasklist_api_request_active=false;let tasklist_refresh_queued=false;const tasklist_fetchcache={};const tasklist_pollcache=new PollCache;let historynavigations=0;function useRunnerStatus(){const[status,setStatus]=React.useState(null);React.useEffect(()=>subscribe(setStatus),[]);return status}const Pager=React.memo(function Pager({previous,next,taskcount,pagefirsttaskposition,pagetaskcount,updateCursor}){debug_log("Pager rendered");if(taskcount==null){return null}const cursorFrom=url=>url!=null?new URL(url).searchParams.get("cursor"):null;return React.createElement("div",{id:"paginator",key:"paginator"},React.createElement("p",{key:"pagedescription"},"Showing tasks ",pagefirsttaskposition+1,"-",pagefirsttaskposition+pagetaskcount," of ",taskcount),React.createElement("ul",{key:"prevnext",className:"pagination"},previous!=null?React.createElement("li",{key:"previous",className:"page-item pageprev"},React.createElement("button",{type:"button",className:"page-link",onClick:()=>updateCursor(cursorFrom(previous))},"« Newer")):null,next!=null?React.createElement("li",{key:"next",className:"page-item pagenext"},React.createElement("button",{type:"button",className:"page-link",onClick:()=>updateCursor(cursorFrom(next))},"Older »")):null))});export function TaskPage(){const[state,setStateRaw]=React.useState({taskcount:null,results:null,next:null,previous:null,pagefirsttaskposition:null,scrollToTopAfterUpdate:false,dataurl:window.location.href,tasklist_last_fetch_time:null,tasklist_api_error:"",finishedwhileaway:0,ownqueued:null});const runnerstatus=useRunnerStatus();const stateRef=React.useRef(state);const queuedIdsRef=React.useRef(null);const askedQueuedIdsRef=React.useRef(new Set);const queueposRequestRef=React.useRef(0);const awayRequestRef=React.useRef(0);const emptyticksRef=React.useRef(0);const setState=React.useCallback(changes=>{const previous=stateRef.current;const resolved=typeof changes==="function"?changes(previous):changes;if(resolved==null){return}stateRef.current={...previous,...resolved};setStateRaw(stateRef.current)},[]);function singleTaskViewTaskId(strurl){const pathext=strurl.toString().replace(api_url_base.toString(),"").split("/").filter(el=>{return el.length!=0});if(pathext.length==1&&!isNaN(pathext[0])){return parseInt(pathext[0])}else{return null}}function filterIsActive(filtername,strurl){const started=new URL(strurl).searchParams.get("started");if(filtername==null){return started==null&&singleTaskViewTaskId(strurl)==null}return filtername=="started"&&started=="true"}function filterclass(filtername,strurl){return filterIsActive(filtername,strurl)?"btn-primary":"btn-link"}const fetchQueuePositions=React.useCallback(()=>{if(stateRef.current.results==null){return}const queued=queuedIdsRef.current;const knownempty=queued!=null&&queued.length==0;if(knownempty&&!stateRef.current.results.some(tracksQueuePosition)){emptyticksRef.current+=1;if(emptyticksRef.current%EMPTY_QUEUE_TICKS!=0){return}}else{emptyticksRef.current=0}const requestnumber=++queueposRequestRef.current;fetch(queuepositions_url,{credentials:"same-origin",headers:{"Accept":"application/json"},cache:"no-store"}).then(response=>response.status==200?response.json():null).then(data=>{if(requestnumber!=queueposRequestRef.current){debug_log("discarding a queue positions response overtaken by a later request");return}if(data==null||data.queuepositions==null||stateRef.current.results==null){return}const queuedids=Object.keys(data.queuepositions);if(!document[hidden]||queuedIdsRef.current==null){queuedIdsRef.current=queuedids}else{const alreadyknown=new Set(queuedIdsRef.current);const added=queuedids.filter(taskid=>!alreadyknown.has(taskid));if(added.length>0){queuedIdsRef.current=queuedIdsRef.current.concat(added)}}updateQueueBadge(queuedids.length);if(stateRef.current.results.some(task=>tracksQueuePosition(task)&&!(String(task.id)in data.queuepositions))){debug_log("a task left the queue: fetching the full task list");if(!pollingPaused()){fetchData(false)}return}const geturl=window.location.href;const ownqueued=Object.entries(data.queuepositions).map(([taskid,position])=>({position,requesttype:data.queuedtypes?.[taskid]})).sort((a,b)=>a.position-b.position);setState(prevstate=>{if(prevstate.results==null){return null}let changed=false;const newresults=prevstate.results.map(task=>{const queuepos=data.queuepositions[String(task.id)];if(queuepos===undefined||queuepos===task.queuepos||task.finishtimestamp!=null){return task}changed=true;return{...task,queuepos:queuepos}});const previousqueued=prevstate.ownqueued;const positionschanged=previousqueued==null||previousqueued.length!=ownqueued.length||ownqueued.some((task,index)=>task.position!==previousqueued[index].position||task.requesttype!==previousqueued[index].requesttype);if(!changed&&!positionschanged){return null}return{results:changed?newresults:prevstate.results,ownqueued:positionschanged?ownqueued:prevstate.ownqueued}});const cached=tasklist_fetchcache[geturl];if(cached!=null&&cached.results!=null&&geturl==window.location.href){const patched={...cached,results:stateRef.current.results};tasklist_fetchcache[geturl]=patched;tasklist_pollcache.storeBody(geturl,patched)}}).catch(error=>{debug_log("Queue positions request failed",error)})},[setState]);const countFinishedWhileAway=React.useCallback(()=>{const waiting=queuedIdsRef.current;if(!document[hidden]||waiting==null||waiting.length==0){return}const requestnumber=++awayRequestRef.current;fetch(queuepositions_url,{credentials:"same-origin",headers:{"Accept":"application/json"},cache:"no-store"}).then(response=>response.status==200?response.json():null).then(data=>{if(requestnumber!=awayRequestRef.current){debug_log("discarding an away count response overtaken by a later request");return}if(!document[hidden]||data==null||data.queuepositions==null){return}const finished=waiting.filter(taskid=>!(taskid in data.queuepositions)).length;if(finished!=stateRef.current.finishedwhileaway){setState({finishedwhileaway:finished})}}).catch(error=>debug_log("Away queue positions request failed",error))},[setState]);const handleVisibilityChange=React.useCallback(()=>{if(document[hidden]){return}if(stateRef.current.finishedwhileaway!=0){setState({finishedwhileaway:0})}queuedIdsRef.current=null;fetchQueuePositions()},[setState,fetchQueuePositions]);const fetchData=React.useCallback((usertriggered,scrolltotop=usertriggered)=>{const navigationsatstart=historynavigations;setState({dataurl:window.location.href});if(usertriggered){const tasklist_fetchcachematch=window.location.href in tasklist_fetchcache;if(tasklist_fetchcachematch){debug_log("using tasklist_fetchcache before GET response",window.location.href);setState(tasklist_fetchcache[window.location.href])}else{debug_log("no tasklist_fetchcache for",window.location.href)}}if(tasklist_api_request_active&&!usertriggered){debug_log("queueing refresh behind the in-flight GET request");tasklist_refresh_queued=true;return}tasklist_api_request_active=true;const get_url=window.location.href;debug_log("Fetching task list from",get_url);const request_headers=tasklist_pollcache.requestHeaders(get_url,{...csrfHeader(),"Accept":"application/json","Content-Type":"application/json"});fetch(get_url,{credentials:"same-origin",method:"GET",headers:request_headers,cache:"no-store",redirect:"manual"}).then(response=>{tasklist_api_request_active=false;if(tasklist_pollcache.noteResponse(get_url,response.status,response.headers.get("ETag"))===NOT_MODIFIED){debug_log("Task list unchanged (304)",get_url);setState({tasklist_api_error:""});return NOT_MODIFIED}if(response.type==="opaqueredirect"){window.location.href=response.url;console.log("Fetch got a redirection to ",response.url)}else{if(response.status!=200){console.log("Fetch received HTTP status ",response.status)}if(response.status==401||response.status==403){setState({tasklist_api_error:"Your session has ended. Reloading to sign in again…"});window.location.reload();return null}if(response.status==404){window.history.pushState({},document.title,api_url_base);setState({scrollToTopAfterUpdate:true});fetchData(true);return null}if(response.status==200){setState({tasklist_api_error:""});return response.json()}setState({tasklist_api_error:"Server error (HTTP "+response.status+")"})}return null}).catch(error=>{tasklist_api_request_active=false;console.log("Get task list HTTP request failed",error);setState({tasklist_api_error:"Connection error"})}).then(data=>{if(tasklist_refresh_queued&&!tasklist_api_request_active){tasklist_refresh_queued=false;setTimeout(()=>{if(!pollingPaused()){fetchData(false)}},0)}let statechanges=null;if(data===NOT_MODIFIED){const held=tasklist_pollcache.getBody(get_url);const restore=held!=null&&get_url==window.location.href&&stateRef.current.results!==held.results?held:null;setState({...restore,tasklist_last_fetch_time:new Date});return}if(data!=null&&data.hasOwnProperty("results")){if(data.results.length==0&&new URL(window.location.href).searchParams.get("cursor")!=null){updateCursorRef.current(null)}else{statechanges=data}}else if(data!=null&&data.hasOwnProperty("id")){statechanges={results:[data],next:null,previous:null,pagefirsttaskposition:null,taskcount:null}}if(statechanges!=null){statechanges["tasklist_last_fetch_time"]=new Date;tasklist_fetchcache[get_url]=statechanges;tasklist_pollcache.storeBody(get_url,statechanges);if(get_url==window.location.href){debug_log("Applying results from",get_url);setState(scrolltotop&&navigationsatstart==historynavigations?{...statechanges,scrollToTopAfterUpdate:true}:statechanges);const askedabout=askedQueuedIdsRef.current;const unasked=statechanges.results.filter(task=>tracksQueuePosition(task)&&!askedabout.has(String(task.id)));if(queuedIdsRef.current==null||unasked.length>0){unasked.forEach(task=>askedabout.add(String(task.id)));fetchQueuePositions()}}else{debug_log("Not applying results from",get_url,"location.href",window.location.href);return}}})},[setState]);const updateCursor=React.useCallback(new_cursor=>{if(new_cursor==new URL(window.location.href).searchParams.get("cursor")){return}debug_log("Task list cursor changed to ",new_cursor);const new_page_url=new URL(window.location.href);if(new_cursor!=null){new_page_url.searchParams.set("cursor",new_cursor)}else{new_page_url.searchParams.delete("cursor")}new_page_url.searchParams.delete("format");window.history.pushState({},document.title,new_page_url);setState({scrollToTopAfterUpdate:true});fetchData(true)},[setState]);const updateCursorRef=React.useRef(updateCursor);updateCursorRef.current=updateCursor;function setFilter(filtername){debug_log("changed filter to",filtername);const new_page_url=new URL(api_url_base);new_page_url.search="";if(filtername!=null){new_page_url.searchParams.set(filtername,true)}if(new_page_url!=window.location.href){window.history.pushState({},document.title,new_page_url);const statechanges={"scrollToTopAfterUpdate":true,dataurl:new_page_url};if(filtername=="started"&&stateRef.current.results!=null){statechanges["results"]=stateRef.current.results.filter(task=>{return task.starttimestamp!=null});if(statechanges["results"].length==0){statechanges["results"]=null}}setState(statechanges);fetchData(true)}}const setSingleTaskView=React.useCallback((event,task_id,task_url)=>{if(event.ctrlKey||event.metaKey||event.shiftKey){return}event.preventDefault();const new_page_url=api_url_base+task_id+"/";window.history.pushState({},document.title,new_page_url);debug_log("Task list changed to single task view for ",new_page_url.toString());let newresults=stateRef.current.results.filter(task=>{return task.id==task_id});if(newresults.length==0){newresults=null}setState({results:newresults,scrollToTopAfterUpdate:true,next:null,previous:null,pagefirsttaskposition:null,taskcount:null});fetchData(true)},[setState]);React.useEffect(()=>{function handlePopState(){debug_log("History navigation to",window.location.href);historynavigations+=1;setState({next:null,previous:null,pagefirsttaskposition:null,taskcount:null,scrollToTopAfterUpdate:false});fetchData(true,false)}const fetchinterval=pollInterval(()=>fetchData(false),TASKLIST_POLL_MS);const queueposinterval=pollInterval(fetchQueuePositions,QUEUEPOS_POLL_MS);const awayinterval=setInterval(countFinishedWhileAway,AWAY_POLL_MS);document.addEventListener("visibilitychange",handleVisibilityChange);window.addEventListener("popstate",handlePopState);fetchData(true);return()=>{clearInterval(fetchinterval);clearInterval(queueposinterval);clearInterval(awayinterval);document.removeEventListener("visibilitychange",handleVisibilityChange);window.removeEventListener("popstate",handlePopState)}},[]);React.useEffect(()=>{const title=pageTitle(singleTaskViewTaskId(state.dataurl),state.finishedwhileaway);if(document.title!=title){document.title=title}if(state.scrollToTopAfterUpdate){setState({scrollToTopAfterUpdate:false});window.scrollTo(0,0);window.dispatchEvent(new Event("resize"))}});const singletaskmode=singleTaskViewTaskId(state.dataurl)!=null;let pagehtml=[];if(!singletaskmode){pagehtml.push(React.createElement("div",{key:"header",className:"page-header"},React.createElement("h1",null,"Task Queue")))}else{pagehtml.push(React.createElement("div",{key:"header",className:"page-header"},React.createElement("h1",null,"Task ",singleTaskViewTaskId(state.dataurl))))}if(!singletaskmode||state.results!=null&&state.results.length>0&&state.results[0].user_id==user_id){pagehtml.push(React.createElement("ul",{key:"filters",id:"taskfilters"},React.createElement("li",{key:"all"},React.createElement("button",{type:"button",onClick:()=>setFilter(null),"aria-pressed":filterIsActive(null,state.dataurl),className:"btn "+filterclass(null,state.dataurl)},"All tasks")),React.createElement("li",{key:"started"},React.createElement("button",{type:"button",onClick:()=>setFilter("started"),"aria-pressed":filterIsActive("started",state.dataurl),className:"btn "+filterclass("started",state.dataurl)},"Running/Finished"))))}if(state.tasklist_last_fetch_time!=null){pagehtml.push(React.createElement("p",{key:"tasklistfetchstatus",id:"tasklistfetchstatus"},"Last updated: ",state.tasklist_last_fetch_time.toLocaleString()," ",React.createElement("span",{className:"errors"},state.tasklist_api_error)))}if(!singletaskmode){const allow_stack_rock=new URL(state.dataurl).searchParams.get("allow_stack_rock")=="true";pagehtml.push(React.createElement(NewRequest,{key:"newrequest",fetchData:fetchData,allow_stack_rock:allow_stack_rock}))}let tasklist;if(state.results==null){tasklist=React.createElement("ul",{key:"ultasklist",className:"tasks","aria-busy":"true"},React.createElement("li",{key:"message",className:"visually-hidden",role:"status"},"Loading tasks..."),[0,1,2].map(row=>React.createElement("li",{key:"skeleton"+row,className:"task taskskeleton","aria-hidden":"true"},React.createElement("div",{className:"taskinner"},React.createElement("p",{className:"placeholder-glow"},React.createElement("span",{className:"placeholder col-4"})),React.createElement("p",{className:"placeholder-glow"},React.createElement("span",{className:"placeholder col-7"})),React.createElement("p",{className:"placeholder-glow"},React.createElement("span",{className:"placeholder col-6"}))))))}else if(state.results.length==0){tasklist=filterIsActive("started",state.dataurl)?React.createElement("p",{key:"message",className:"tasksempty"},"Nothing running or finished yet. Queued tasks appear here once they start."):React.createElement("p",{key:"message",className:"tasksempty"},"No tasks yet. Request a position on the sky and its light curve will appear here.")}else{const pagetaskcount=state.results!=null?state.results.length:null;const waitEstimateFor=task=>!tracksQueuePosition(task)?null:formatWaitEstimate(estimateWaitSeconds({queuepos:task.queuepos,ownqueued:state.ownqueued,runnerstatus}));tasklist=[React.createElement("ul",{key:"ultasklist",className:"tasks"},state.results.map(task=>React.createElement(Task,{key:task.id,taskdata:task,fetchData:fetchData,setSingleTaskView:setSingleTaskView,hidePlot:pagetaskcount>10,waitestimate:waitEstimateFor(task)}))),React.createElement(Pager,{key:"pager",previous:state.previous,next:state.next,pagefirsttaskposition:state.pagefirsttaskposition,pagetaskcount:pagetaskcount,taskcount:state.taskcount,updateCursor:updateCursor})]}pagehtml.push(React.createElement("div",{key:"tasklist",id:"tasklist",className:singletaskmode?"singletaskdetail":null},tasklist));return pagehtml}const container=document.getElementById("taskpage");if(container){ReactDOM.createRoot(container).render(React.createElement(TaskPage,null))}
+"use strict";import React from"react";import ReactDOM from"react-dom";import{subscribe}from"runnerstatus";import{csrfHeader}from"csrftoken";import{NewRequest}from"newrequest";import{NOT_MODIFIED,PollCache}from"pollcache";import{estimateWaitSeconds,formatDuration,formatWaitEstimate}from"waitestimate";function debug_log(...args){}const TASKLIST_POLL_MS=6000;const QUEUEPOS_POLL_MS=2000;const SITE_TITLE="ATLAS Forced Photometry";const AWAY_POLL_MS=60000;const EMPTY_QUEUE_TICKS=5;function pageTitle(taskid,finishedwhileaway){const title=(taskid!=null?"Task "+taskid:"Task Queue")+" – "+SITE_TITLE;return finishedwhileaway>0?"("+finishedwhileaway+") "+title:title}function pollingPaused(){return document[hidden]||!user_is_active}function tracksQueuePosition(task){return task.user_id==user_id&&task.finishtimestamp==null&&task.queuepos!=null}function updateQueueBadge(count){const badge=document.querySelector(".queuecount");if(!badge){return}const number=badge.querySelector(".queuecount-number");if(number){number.textContent=count}badge.hidden=count==0}function pollInterval(fn,ms){return setInterval(()=>{if(!pollingPaused()){fn()}},ms)}const ROW_TRANSITION_MS=200;function taskRow(taskid){return document.getElementById("task-"+taskid)}function collapseRow(taskid){taskRow(taskid)?.classList.add("task-collapsed")}function expandRow(taskid){taskRow(taskid)?.classList.remove("task-collapsed")}const ROW_FLASH_MS=1600;function revealRow(taskid){const row=taskRow(taskid);if(!row){return}row.classList.add("task-collapsed");requestAnimationFrame(()=>requestAnimationFrame(()=>row.classList.remove("task-collapsed")));row.classList.add("task-flash");setTimeout(()=>row.classList.remove("task-flash"),ROW_FLASH_MS)}const COPY_LABEL_RESET_MS=2000;function CopyableValue({text,label,children}){const[state,setState]=React.useState("idle");const timer=React.useRef(null);const value=React.useRef(null);React.useEffect(()=>()=>clearTimeout(timer.current),[]);if(!navigator.clipboard){return children}const announce=next=>{setState(next);clearTimeout(timer.current);timer.current=setTimeout(()=>setState("idle"),COPY_LABEL_RESET_MS)};const selectValue=()=>{const selection=window.getSelection();if(!selection||!value.current){return}const range=document.createRange();range.selectNodeContents(value.current);selection.removeAllRanges();selection.addRange(range)};const copy=()=>{navigator.clipboard.writeText(text).then(()=>announce("copied"),()=>{selectValue();announce("failed")})};return React.createElement("span",{className:"copyable"},React.createElement("span",{className:"copyvalue",ref:value},children),React.createElement("button",{type:"button",className:"copybutton",onClick:copy,title:"Copy "+label,"aria-label":"Copy "+label},state==="idle"?React.createElement(CopyIcon,null):null,React.createElement("span",{className:"copyfeedback","aria-live":"polite"},state==="copied"?"Copied":null,state==="failed"?"Press Ctrl-C":null)))}function CopyIcon(){return React.createElement("svg",{width:"13",height:"13",viewBox:"0 0 16 16",fill:"none",stroke:"currentColor",strokeWidth:"1.5","aria-hidden":"true"},React.createElement("rect",{x:"5.5",y:"5.5",width:"8.5",height:"9",rx:"1.5"}),React.createElement("path",{d:"M10.5 3.2A1.7 1.7 0 0 0 8.8 2H3.7A1.7 1.7 0 0 0 2 3.7v5.1a1.7 1.7 0 0 0 1.2 1.6"}))}const TaskPlot=React.memo(function TaskPlot({taskid,taskurl}){React.useEffect(()=>{debug_log("activating plot",taskid);const plot_url=new URL(taskurl);plot_url.pathname+="resultplotdata.js";plot_url.search="";const script=document.createElement("script");script.src=plot_url;document.head.appendChild(script);return()=>{debug_log("Unmounting plot for task ",taskid);script.remove();const key="#plotforcedflux-task-"+taskid;delete jslimitsglobal[key];delete jslcdataglobal[key];delete jslabelsglobal[key]}},[taskid,taskurl]);return React.createElement("div",{key:"plot",id:"plotforcedflux-task-"+taskid,className:"plot",style:{width:"100%",height:"300px"}})});function useTimeElapsed(taskdata){const running=taskdata.starttimestamp!=null&&taskdata.finishtimestamp==null;const secondsSinceStart=()=>((new Date().getTime()-new Date(taskdata.starttimestamp).getTime())/1000).toFixed(0);const[timeelapsed,setTimeelapsed]=React.useState(()=>running?secondsSinceStart():-1);React.useEffect(()=>{if(!running){return undefined}setTimeelapsed(secondsSinceStart());const interval=setInterval(()=>setTimeelapsed(secondsSinceStart()),1000);return()=>clearInterval(interval)},[running,taskdata.starttimestamp]);return running?timeelapsed:-1}function taskPropsEqual(prev,next){return prev.hidePlot===next.hidePlot&&prev.waitestimate===next.waitestimate&&(prev.taskdata===next.taskdata||JSON.stringify(prev.taskdata)===JSON.stringify(next.taskdata))}export const Task=React.memo(function Task(props){const[httperror,setHttperror]=React.useState("");const timeelapsed=useTimeElapsed(props.taskdata);React.useEffect(()=>{if(newtaskids.includes(props.taskdata.id)){debug_log("showing new task",props.taskdata.id);revealRow(props.taskdata.id);newtaskids=newtaskids.filter(item=>item!==props.taskdata.id)}},[]);function deleteTask(){const task=props.taskdata;collapseRow(task.id);setTimeout(()=>{fetch(task.url,{credentials:"same-origin",method:"DELETE",headers:csrfHeader()}).then(response=>{if(response.ok){console.log("Deleted task ",task.id);setHttperror("");props.fetchData();return}console.log("Failed to delete task ",task.id,response.status);if(response.status===401){window.location.reload();return}expandRow(task.id);let message="ERROR: could not delete this task (HTTP "+response.status+").";if(response.status===403){message="ERROR: you are not allowed to delete this task."}setHttperror(message);props.fetchData()}).catch(err=>{console.log("Failed to reach the server to delete task ",task.id,err);expandRow(task.id);setHttperror("ERROR: could not reach the server to delete this task.");props.fetchData()})},ROW_TRANSITION_MS)}function requestImages(){const request_image_url=new URL(props.taskdata.url);request_image_url.pathname+="requestimages/";request_image_url.search="";fetch(request_image_url,{credentials:"same-origin",method:"POST",headers:{...csrfHeader(),"Accept":"application/json","Content-Type":"application/json"}}).then(response=>{if(response.status==200&&response.redirected){setHttperror("");const newimgtask_id=parseInt(new URL(response.url).searchParams.get("newids"));newtaskids.push(newimgtask_id);debug_log("requestimages created task",newimgtask_id);const new_page_url=new URL(response.url);new_page_url.searchParams.delete("newids");window.history.pushState({},document.title,new_page_url);props.fetchData(true)}else{return response.text().then(text=>{let message=response.statusText||"HTTP "+response.status;try{const data=JSON.parse(text);message=data["non_field_errors"]||data["detail"]||message}catch(err){console.log("requestImages: non-JSON error body",text)}console.log("requestImages: error returned",response.status,message);setHttperror("ERROR: "+message)})}return null}).catch(error=>{console.log("requestImages HTTP request failed",error);setHttperror("HTTP request failed.")})}const task=props.taskdata;const hasresultfile=task.result_url!=null;let statusclass="none";let buttontext="none";let statuslabel="";let statusbadge="";if(task.finishtimestamp!=null){statusclass=task.error_msg!=null?"finished errored":"finished";buttontext="Delete";statuslabel=task.error_msg!=null?"Error":"Finished";statusbadge=task.error_msg!=null?"taskbadge-error":"taskbadge-finished"}else if(task.starttimestamp!=null){statusclass="queued started";buttontext="Cancel";statuslabel="Running";statusbadge="taskbadge-running"}else{statusclass="queued notstarted";buttontext="Cancel";statuslabel="Queued";statusbadge="taskbadge-queued"}debug_log("Task "+task.id+" rendered");let delbutton=null;if(task.user_id==user_id){delbutton=React.createElement("button",{className:"btn btn-sm btn-danger",onClick:()=>deleteTask()},buttontext)}const previewimage=task.previewimage_url?React.createElement("img",{className:"previewimage",src:task.previewimage_url,height:"100",loading:"lazy",alt:"Preview image for task "+task.id}):null;let taskbox=[React.createElement("div",{key:"rightside",className:"rightside"},delbutton,previewimage)];taskbox.push(React.createElement("div",{key:"tasknum",className:"taskheading"},React.createElement("a",{key:"tasklink",href:task.url,onClick:e=>{props.setSingleTaskView(e,task.id,task.url)}},"Task ",task.id),React.createElement("span",{key:"taskbadge",className:"badge taskbadge "+statusbadge},statuslabel)));if(task.parent_task_url){taskbox.push(React.createElement("p",{key:"imgrequest"},"Image request for ",React.createElement("a",{key:"parent_task_link",href:task.parent_task_url,onClick:e=>{props.setSingleTaskView(e,task.parent_task_id,task.parent_task_url)}},"Task ",task.parent_task_id)))}else if(task.parent_task_id){taskbox.push(React.createElement("p",{key:"imgrequest"},"Image request for Task ",task.parent_task_id," (deleted)"))}else if(task.request_type=="IMGZIP"){taskbox.push(React.createElement("p",{key:"imgrequest"},"Image request"))}if(task.request_type=="IMGZIP"){const imagetype=task.use_reduced?"reduced":"difference";taskbox.push(React.createElement("p",{key:"imgrequestnote"},"Up to the first 1000 ",imagetype," images will be retrieved. The image request and download link may expire after one week."))}const meta=[];if(task.user_id!=user_id){meta.push(["user","User:",task.username])}if(task.comment!=null&&task.comment!=""){meta.push(["comment","Comment:",React.createElement("b",null,task.comment)])}if(task.mpc_name!=null&&task.mpc_name!=""){meta.push(["target","MPC Object:",React.createElement(CopyableValue,{text:task.mpc_name,label:"object name"},task.mpc_name)])}else{let radecepoch="";if(task.radec_epoch_year!=null){radecepoch=React.createElement("span",null,"(epoch ",task.radec_epoch_year,") ")}meta.push(["target","RA Dec:",React.createElement("span",null,radecepoch,React.createElement(CopyableValue,{text:task.ra+" "+task.dec,label:"coordinates"},task.ra," ",task.dec))]);if(task.propermotion_ra!=null&&task.propermotion_ra!=0||task.propermotion_dec!=null&&task.propermotion_dec!=0){meta.push(["propermotion","Proper motion:",React.createElement("span",null,task.propermotion_ra," ",task.propermotion_dec," mas/yr")])}}if(task.request_type=="SSOSTACK"){meta.push(["imgtype","Image:","Stacked"])}else{meta.push(["imgtype","Images:",task.use_reduced?"Reduced":"Difference"])}if(task.mjd_min!=null||task.mjd_max!=null){const mjdmin=task.mjd_min!=null?task.mjd_min:"0";const mjdmax=task.mjd_max!=null?task.mjd_max:"∞";meta.push(["mjdrange","MJD request:",React.createElement("span",null,"[",mjdmin,", ",mjdmax,"]")])}if(task.attempt_count>1){meta.push(["attempts","Attempts:",task.attempt_count])}meta.push(["queuetime","Queued at:",new Date(task.timestamp).toLocaleString()]);if(task.finishtimestamp!=null){meta.push(["finishtime","Finished at:",new Date(task.finishtimestamp).toLocaleString()]);const timing=(label,seconds)=>{const text=formatDuration(seconds);return text!=null?label+" "+text:null};const timings=[task.attempt_count>1?null:timing("waited",task.waittime),timing("ran",task.runtime)].filter(part=>part!=null);if(timings.length>0){meta.push(["timings","Took:",timings.join(" · ")])}}taskbox.push(React.createElement("dl",{key:"taskmeta",className:"taskmeta"},meta.map(([key,label,value])=>[React.createElement("dt",{key:key+"-label"},label),React.createElement("dd",{key:key+"-value"},value)])));if(task.finishtimestamp!=null){if(task.error_msg!=null){taskbox.push(React.createElement("p",{key:"error_msg",className:"taskerror"},"Error: ",task.error_msg))}else{const resultsexpired=React.createElement("p",{key:"expired"},"The download link has expired. Delete this task and request again if necessary.");if(task.request_type=="FP"){if(hasresultfile){taskbox.push(React.createElement("a",{key:"datalink",className:"results btn btn-info getdata",href:task.result_url,target:"_blank",rel:"noopener"},"Data"));taskbox.push(React.createElement("a",{key:"pdflink",className:"results btn btn-info getpdf",href:task.pdfplot_url,target:"_blank",rel:"noopener"},"PDF"))}else{taskbox.push(resultsexpired)}}else if(task.request_type=="SSOSTACK"){if(hasresultfile){taskbox.push(React.createElement("a",{key:"datalink",className:"results btn btn-info getdata",href:task.result_url,target:"_blank",rel:"noopener"},"Data"))}if(task.result_imagestack_url!=null){taskbox.push(React.createElement("a",{key:"imgdownload",className:"results btn btn-info",href:task.result_imagestack_url,target:"_blank",rel:"noopener"},"Stacked image (FITS)"))}else{taskbox.push(resultsexpired)}}if(task.request_type=="IMGZIP"){if(task.result_imagezip_url!=null){taskbox.push(React.createElement("a",{key:"imgdownload",className:"results btn btn-info",href:task.result_imagezip_url},"Download images (ZIP)"))}else{taskbox.push(resultsexpired)}}else if(task.imagerequest_task_id!=null){if(task.imagerequest_finished){taskbox.push(React.createElement("a",{key:"imgrequest",className:"btn btn-primary",href:task.imagerequest_url,onClick:e=>{props.setSingleTaskView(e,task.imagerequest_task_id,task.imagerequest_url)}},"Images retrieved"))}else{taskbox.push(React.createElement("a",{key:"imgrequest",className:"btn btn-warning",href:task.imagerequest_url,onClick:e=>{props.setSingleTaskView(e,task.imagerequest_task_id,task.imagerequest_url)}},"Images requested"))}}else if(task.request_type=="FP"&&user_id==task.user_id&&hasresultfile){taskbox.push(React.createElement("button",{key:"imgrequest",className:"btn btn-info",onClick:()=>requestImages(),title:"Download FITS and JPEG images for up to the first 1000 observations."},"Request ",task.use_reduced?"reduced":"diff"," images"))}}}else if(task.starttimestamp!=null){const received=task.rows_received!=null?", "+task.rows_received+" rows so far"+(task.last_mjd_received!=null?" up to MJD "+task.last_mjd_received.toFixed(1):""):"";taskbox.push(React.createElement("div",{key:"status",className:"taskstatus running"},"Running (started ",timeelapsed," seconds ago",received,")",React.createElement("div",{className:"progress taskprogress",role:"progressbar","aria-label":"Task "+task.id+" is running"},React.createElement("div",{className:"progress-bar progress-bar-striped progress-bar-animated"}))))}else if(task.queuepos!=null){const ahead=task.queuepos==0?"next":task.queuepos+" ahead";const estimate=props.waitestimate!=null?React.createElement(React.Fragment,null," ",React.createElement("span",{className:"taskestimate"},props.waitestimate,React.createElement("span",{className:"visually-hidden"}," estimated wait"))):null;taskbox.push(React.createElement("div",{key:"status",className:"taskstatus waiting"},"Waiting ",React.createElement("span",{className:"badge taskposition"},ahead,React.createElement("span",{className:"visually-hidden"}," in the queue")),estimate))}else{taskbox.push(React.createElement("div",{key:"status",className:"taskstatus waiting"},"Waiting in queue"))}if(httperror!=""){taskbox.push(React.createElement("p",{key:"httperror",className:"errors",role:"alert"},httperror))}if(task.finishtimestamp!=null&&task.error_msg==null&&task.request_type=="FP"&&hasresultfile&&!props.hidePlot){taskbox.push(React.createElement(TaskPlot,{key:"plot",taskid:task.id,taskurl:task.url}))}return(React.createElement("li",{key:"task-"+task.id,className:"task "+statusclass,id:"task-"+task.id},React.createElement("div",{className:"taskinner"},taskbox)))},taskPropsEqual);let tasklist_api_request_active=false;let tasklist_refresh_queued=false;const tasklist_fetchcache={};const tasklist_pollcache=new PollCache;let historynavigations=0;function useRunnerStatus(){const[status,setStatus]=React.useState(null);React.useEffect(()=>subscribe(setStatus),[]);return status}const Pager=React.memo(function Pager({previous,next,taskcount,pagefirsttaskposition,pagetaskcount,updateCursor}){debug_log("Pager rendered");if(taskcount==null){return null}const cursorFrom=url=>url!=null?new URL(url).searchParams.get("cursor"):null;return React.createElement("div",{id:"paginator",key:"paginator"},React.createElement("p",{key:"pagedescription"},"Showing tasks ",pagefirsttaskposition+1,"-",pagefirsttaskposition+pagetaskcount," of ",taskcount),React.createElement("ul",{key:"prevnext",className:"pagination"},previous!=null?React.createElement("li",{key:"previous",className:"page-item pageprev"},React.createElement("button",{type:"button",className:"page-link",onClick:()=>updateCursor(cursorFrom(previous))},"« Newer")):null,next!=null?React.createElement("li",{key:"next",className:"page-item pagenext"},React.createElement("button",{type:"button",className:"page-link",onClick:()=>updateCursor(cursorFrom(next))},"Older »")):null))});export function TaskPage(){const[state,setStateRaw]=React.useState({taskcount:null,results:null,next:null,previous:null,pagefirsttaskposition:null,scrollToTopAfterUpdate:false,dataurl:window.location.href,tasklist_last_fetch_time:null,tasklist_api_error:"",finishedwhileaway:0,ownqueued:null});const runnerstatus=useRunnerStatus();const stateRef=React.useRef(state);const queuedIdsRef=React.useRef(null);const askedQueuedIdsRef=React.useRef(new Set);const queueposRequestRef=React.useRef(0);const awayRequestRef=React.useRef(0);const emptyticksRef=React.useRef(0);const setState=React.useCallback(changes=>{const previous=stateRef.current;const resolved=typeof changes==="function"?changes(previous):changes;if(resolved==null){return}stateRef.current={...previous,...resolved};setStateRaw(stateRef.current)},[]);function singleTaskViewTaskId(strurl){const pathext=strurl.toString().replace(api_url_base.toString(),"").split("/").filter(el=>{return el.length!=0});if(pathext.length==1&&!isNaN(pathext[0])){return parseInt(pathext[0])}else{return null}}function filterIsActive(filtername,strurl){const started=new URL(strurl).searchParams.get("started");if(filtername==null){return started==null&&singleTaskViewTaskId(strurl)==null}return filtername=="started"&&started=="true"}function filterclass(filtername,strurl){return filterIsActive(filtername,strurl)?"btn-primary":"btn-link"}const fetchQueuePositions=React.useCallback(()=>{if(stateRef.current.results==null){return}const queued=queuedIdsRef.current;const knownempty=queued!=null&&queued.length==0;if(knownempty&&!stateRef.current.results.some(tracksQueuePosition)){emptyticksRef.current+=1;if(emptyticksRef.current%EMPTY_QUEUE_TICKS!=0){return}}else{emptyticksRef.current=0}const requestnumber=++queueposRequestRef.current;fetch(queuepositions_url,{credentials:"same-origin",headers:{"Accept":"application/json"},cache:"no-store"}).then(response=>response.status==200?response.json():null).then(data=>{if(requestnumber!=queueposRequestRef.current){debug_log("discarding a queue positions response overtaken by a later request");return}if(data==null||data.queuepositions==null||stateRef.current.results==null){return}const queuedids=Object.keys(data.queuepositions);if(!document[hidden]||queuedIdsRef.current==null){queuedIdsRef.current=queuedids}else{const alreadyknown=new Set(queuedIdsRef.current);const added=queuedids.filter(taskid=>!alreadyknown.has(taskid));if(added.length>0){queuedIdsRef.current=queuedIdsRef.current.concat(added)}}updateQueueBadge(queuedids.length);if(stateRef.current.results.some(task=>tracksQueuePosition(task)&&!(String(task.id)in data.queuepositions))){debug_log("a task left the queue: fetching the full task list");if(!pollingPaused()){fetchData(false)}return}const geturl=window.location.href;const ownqueued=Object.entries(data.queuepositions).map(([taskid,position])=>({position,requesttype:data.queuedtypes?.[taskid],expectedruntime:data.expectedruntimes?.[taskid],startestimate:data.startestimates?.[taskid]})).sort((a,b)=>a.position-b.position);setState(prevstate=>{if(prevstate.results==null){return null}let changed=false;const newresults=prevstate.results.map(task=>{const queuepos=data.queuepositions[String(task.id)];if(queuepos===undefined||queuepos===task.queuepos||task.finishtimestamp!=null){return task}changed=true;return{...task,queuepos:queuepos}});const startMinute=task=>task.startestimate==null?null:Math.ceil(task.startestimate[0]/60);const previousqueued=prevstate.ownqueued;const positionschanged=previousqueued==null||previousqueued.length!=ownqueued.length||ownqueued.some((task,index)=>task.position!==previousqueued[index].position||task.requesttype!==previousqueued[index].requesttype||task.expectedruntime!==previousqueued[index].expectedruntime||startMinute(task)!==startMinute(previousqueued[index]));if(!changed&&!positionschanged){return null}return{results:changed?newresults:prevstate.results,ownqueued:positionschanged?ownqueued:prevstate.ownqueued}});const cached=tasklist_fetchcache[geturl];if(cached!=null&&cached.results!=null&&geturl==window.location.href){const patched={...cached,results:stateRef.current.results};tasklist_fetchcache[geturl]=patched;tasklist_pollcache.storeBody(geturl,patched)}}).catch(error=>{debug_log("Queue positions request failed",error)})},[setState]);const countFinishedWhileAway=React.useCallback(()=>{const waiting=queuedIdsRef.current;if(!document[hidden]||waiting==null||waiting.length==0){return}const requestnumber=++awayRequestRef.current;fetch(queuepositions_url,{credentials:"same-origin",headers:{"Accept":"application/json"},cache:"no-store"}).then(response=>response.status==200?response.json():null).then(data=>{if(requestnumber!=awayRequestRef.current){debug_log("discarding an away count response overtaken by a later request");return}if(!document[hidden]||data==null||data.queuepositions==null){return}const finished=waiting.filter(taskid=>!(taskid in data.queuepositions)).length;if(finished!=stateRef.current.finishedwhileaway){setState({finishedwhileaway:finished})}}).catch(error=>debug_log("Away queue positions request failed",error))},[setState]);const handleVisibilityChange=React.useCallback(()=>{if(document[hidden]){return}if(stateRef.current.finishedwhileaway!=0){setState({finishedwhileaway:0})}queuedIdsRef.current=null;fetchQueuePositions()},[setState,fetchQueuePositions]);const fetchData=React.useCallback((usertriggered,scrolltotop=usertriggered)=>{const navigationsatstart=historynavigations;setState({dataurl:window.location.href});if(usertriggered){const tasklist_fetchcachematch=window.location.href in tasklist_fetchcache;if(tasklist_fetchcachematch){debug_log("using tasklist_fetchcache before GET response",window.location.href);setState(tasklist_fetchcache[window.location.href])}else{debug_log("no tasklist_fetchcache for",window.location.href)}}if(tasklist_api_request_active&&!usertriggered){debug_log("queueing refresh behind the in-flight GET request");tasklist_refresh_queued=true;return}tasklist_api_request_active=true;const get_url=window.location.href;debug_log("Fetching task list from",get_url);const request_headers=tasklist_pollcache.requestHeaders(get_url,{...csrfHeader(),"Accept":"application/json","Content-Type":"application/json"});fetch(get_url,{credentials:"same-origin",method:"GET",headers:request_headers,cache:"no-store",redirect:"manual"}).then(response=>{tasklist_api_request_active=false;if(tasklist_pollcache.noteResponse(get_url,response.status,response.headers.get("ETag"))===NOT_MODIFIED){debug_log("Task list unchanged (304)",get_url);setState({tasklist_api_error:""});return NOT_MODIFIED}if(response.type==="opaqueredirect"){window.location.href=response.url;console.log("Fetch got a redirection to ",response.url)}else{if(response.status!=200){console.log("Fetch received HTTP status ",response.status)}if(response.status==401||response.status==403){setState({tasklist_api_error:"Your session has ended. Reloading to sign in again…"});window.location.reload();return null}if(response.status==404){window.history.pushState({},document.title,api_url_base);setState({scrollToTopAfterUpdate:true});fetchData(true);return null}if(response.status==200){setState({tasklist_api_error:""});return response.json()}setState({tasklist_api_error:"Server error (HTTP "+response.status+")"})}return null}).catch(error=>{tasklist_api_request_active=false;console.log("Get task list HTTP request failed",error);setState({tasklist_api_error:"Connection error"})}).then(data=>{if(tasklist_refresh_queued&&!tasklist_api_request_active){tasklist_refresh_queued=false;setTimeout(()=>{if(!pollingPaused()){fetchData(false)}},0)}let statechanges=null;if(data===NOT_MODIFIED){const held=tasklist_pollcache.getBody(get_url);const restore=held!=null&&get_url==window.location.href&&stateRef.current.results!==held.results?held:null;setState({...restore,tasklist_last_fetch_time:new Date});return}if(data!=null&&data.hasOwnProperty("results")){if(data.results.length==0&&new URL(window.location.href).searchParams.get("cursor")!=null){updateCursorRef.current(null)}else{statechanges=data}}else if(data!=null&&data.hasOwnProperty("id")){statechanges={results:[data],next:null,previous:null,pagefirsttaskposition:null,taskcount:null}}if(statechanges!=null){statechanges["tasklist_last_fetch_time"]=new Date;tasklist_fetchcache[get_url]=statechanges;tasklist_pollcache.storeBody(get_url,statechanges);if(get_url==window.location.href){debug_log("Applying results from",get_url);setState(scrolltotop&&navigationsatstart==historynavigations?{...statechanges,scrollToTopAfterUpdate:true}:statechanges);const askedabout=askedQueuedIdsRef.current;const unasked=statechanges.results.filter(task=>tracksQueuePosition(task)&&!askedabout.has(String(task.id)));if(queuedIdsRef.current==null||unasked.length>0){unasked.forEach(task=>askedabout.add(String(task.id)));fetchQueuePositions()}}else{debug_log("Not applying results from",get_url,"location.href",window.location.href);return}}})},[setState]);const updateCursor=React.useCallback(new_cursor=>{if(new_cursor==new URL(window.location.href).searchParams.get("cursor")){return}debug_log("Task list cursor changed to ",new_cursor);const new_page_url=new URL(window.location.href);if(new_cursor!=null){new_page_url.searchParams.set("cursor",new_cursor)}else{new_page_url.searchParams.delete("cursor")}new_page_url.searchParams.delete("format");window.history.pushState({},document.title,new_page_url);setState({scrollToTopAfterUpdate:true});fetchData(true)},[setState]);const updateCursorRef=React.useRef(updateCursor);updateCursorRef.current=updateCursor;function setFilter(filtername){debug_log("changed filter to",filtername);const new_page_url=new URL(api_url_base);new_page_url.search="";if(filtername!=null){new_page_url.searchParams.set(filtername,true)}if(new_page_url!=window.location.href){window.history.pushState({},document.title,new_page_url);const statechanges={"scrollToTopAfterUpdate":true,dataurl:new_page_url};if(filtername=="started"&&stateRef.current.results!=null){statechanges["results"]=stateRef.current.results.filter(task=>{return task.starttimestamp!=null});if(statechanges["results"].length==0){statechanges["results"]=null}}setState(statechanges);fetchData(true)}}const setSingleTaskView=React.useCallback((event,task_id,task_url)=>{if(event.ctrlKey||event.metaKey||event.shiftKey){return}event.preventDefault();const new_page_url=api_url_base+task_id+"/";window.history.pushState({},document.title,new_page_url);debug_log("Task list changed to single task view for ",new_page_url.toString());let newresults=stateRef.current.results.filter(task=>{return task.id==task_id});if(newresults.length==0){newresults=null}setState({results:newresults,scrollToTopAfterUpdate:true,next:null,previous:null,pagefirsttaskposition:null,taskcount:null});fetchData(true)},[setState]);React.useEffect(()=>{function handlePopState(){debug_log("History navigation to",window.location.href);historynavigations+=1;setState({next:null,previous:null,pagefirsttaskposition:null,taskcount:null,scrollToTopAfterUpdate:false});fetchData(true,false)}const fetchinterval=pollInterval(()=>fetchData(false),TASKLIST_POLL_MS);const queueposinterval=pollInterval(fetchQueuePositions,QUEUEPOS_POLL_MS);const awayinterval=setInterval(countFinishedWhileAway,AWAY_POLL_MS);document.addEventListener("visibilitychange",handleVisibilityChange);window.addEventListener("popstate",handlePopState);fetchData(true);return()=>{clearInterval(fetchinterval);clearInterval(queueposinterval);clearInterval(awayinterval);document.removeEventListener("visibilitychange",handleVisibilityChange);window.removeEventListener("popstate",handlePopState)}},[]);React.useEffect(()=>{const title=pageTitle(singleTaskViewTaskId(state.dataurl),state.finishedwhileaway);if(document.title!=title){document.title=title}if(state.scrollToTopAfterUpdate){setState({scrollToTopAfterUpdate:false});window.scrollTo(0,0);window.dispatchEvent(new Event("resize"))}});const singletaskmode=singleTaskViewTaskId(state.dataurl)!=null;let pagehtml=[];if(!singletaskmode){pagehtml.push(React.createElement("div",{key:"header",className:"page-header"},React.createElement("h1",null,"Task Queue")))}else{pagehtml.push(React.createElement("div",{key:"header",className:"page-header"},React.createElement("h1",null,"Task ",singleTaskViewTaskId(state.dataurl))))}if(!singletaskmode||state.results!=null&&state.results.length>0&&state.results[0].user_id==user_id){pagehtml.push(React.createElement("ul",{key:"filters",id:"taskfilters"},React.createElement("li",{key:"all"},React.createElement("button",{type:"button",onClick:()=>setFilter(null),"aria-pressed":filterIsActive(null,state.dataurl),className:"btn "+filterclass(null,state.dataurl)},"All tasks")),React.createElement("li",{key:"started"},React.createElement("button",{type:"button",onClick:()=>setFilter("started"),"aria-pressed":filterIsActive("started",state.dataurl),className:"btn "+filterclass("started",state.dataurl)},"Running/Finished"))))}if(state.tasklist_last_fetch_time!=null){pagehtml.push(React.createElement("p",{key:"tasklistfetchstatus",id:"tasklistfetchstatus"},"Last updated: ",state.tasklist_last_fetch_time.toLocaleString()," ",React.createElement("span",{className:"errors"},state.tasklist_api_error)))}if(!singletaskmode){const allow_stack_rock=new URL(state.dataurl).searchParams.get("allow_stack_rock")=="true";pagehtml.push(React.createElement(NewRequest,{key:"newrequest",fetchData:fetchData,allow_stack_rock:allow_stack_rock}))}let tasklist;if(state.results==null){tasklist=React.createElement("ul",{key:"ultasklist",className:"tasks","aria-busy":"true"},React.createElement("li",{key:"message",className:"visually-hidden",role:"status"},"Loading tasks..."),[0,1,2].map(row=>React.createElement("li",{key:"skeleton"+row,className:"task taskskeleton","aria-hidden":"true"},React.createElement("div",{className:"taskinner"},React.createElement("p",{className:"placeholder-glow"},React.createElement("span",{className:"placeholder col-4"})),React.createElement("p",{className:"placeholder-glow"},React.createElement("span",{className:"placeholder col-7"})),React.createElement("p",{className:"placeholder-glow"},React.createElement("span",{className:"placeholder col-6"}))))))}else if(state.results.length==0){tasklist=filterIsActive("started",state.dataurl)?React.createElement("p",{key:"message",className:"tasksempty"},"Nothing running or finished yet. Queued tasks appear here once they start."):React.createElement("p",{key:"message",className:"tasksempty"},"No tasks yet. Request a position on the sky and its light curve will appear here.")}else{const pagetaskcount=state.results!=null?state.results.length:null;const waitEstimateFor=task=>!tracksQueuePosition(task)?null:formatWaitEstimate(estimateWaitSeconds({queuepos:task.queuepos,ownqueued:state.ownqueued,runnerstatus}));tasklist=[React.createElement("ul",{key:"ultasklist",className:"tasks"},state.results.map(task=>React.createElement(Task,{key:task.id,taskdata:task,fetchData:fetchData,setSingleTaskView:setSingleTaskView,hidePlot:pagetaskcount>10,waitestimate:waitEstimateFor(task)}))),React.createElement(Pager,{key:"pager",previous:state.previous,next:state.next,pagefirsttaskposition:state.pagefirsttaskposition,pagetaskcount:pagetaskcount,taskcount:state.taskcount,updateCursor:updateCursor})]}pagehtml.push(React.createElement("div",{key:"tasklist",id:"tasklist",className:singletaskmode?"singletaskdetail":null},tasklist));return pagehtml}const container=document.getElementById("taskpage");if(container){ReactDOM.createRoot(container).render(React.createElement(TaskPage,null))}
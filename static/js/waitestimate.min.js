@@ -1 +1 @@
-"use strict";export function estimateWaitSeconds({queuepos,ownqueued,runnerstatus}){if(queuepos==null||runnerstatus==null||runnerstatus.stale||runnerstatus.maintenance){return null}if(ownqueued==null){return null}const runtimes=runnerstatus.typical_runtime_seconds;const numslots=runnerstatus.numslots;const queuedusers=runnerstatus.distinct_queued_users;if(!(numslots>0)||queuedusers==null){return null}const concurrency=Math.max(1,Math.min(numslots,queuedusers));const ownahead=ownqueued.filter(task=>task.position<queuepos);const otherahead=queuepos-ownahead.length;let ownseconds=0;for(const task of ownahead){const median=runtimes?.[task.requesttype];if(!(median>0)){return null}ownseconds+=median}const otherpasses=Math.floor(otherahead/concurrency);let otherseconds=0;if(otherpasses>0){const meanpass=meanQueuedRuntimeSeconds(runnerstatus.queued_by_request_type,runtimes);if(meanpass==null){return null}otherseconds=otherpasses*meanpass}return Math.max(ownseconds,otherseconds)}function meanQueuedRuntimeSeconds(queuedbytype,runtimes){if(queuedbytype==null){return null}let tasks=0;let seconds=0;for(const[requesttype,count]of Object.entries(queuedbytype)){const median=runtimes?.[requesttype];if(!(count>0)||!(median>0)){continue}tasks+=count;seconds+=count*median}return tasks>0?seconds/tasks:null}export function formatWaitEstimate(seconds){if(seconds==null||!Number.isFinite(seconds)){return null}if(seconds<60){return"under a minute"}if(seconds<90*60){return"~"+Math.ceil(seconds/60)+" min"}if(seconds>=4*60*60){return"over 4 hours"}return"~"+Math.ceil(seconds/3600)+" hours"}export function formatDuration(seconds){if(seconds==null||!Number.isFinite(seconds)||seconds<0){return null}const whole=Math.round(seconds);if(whole<60){return whole+"s"}if(whole<3600){return Math.floor(whole/60)+"m "+String(whole%60).padStart(2,"0")+"s"}return Math.floor(whole/3600)+"h "+String(Math.floor(whole%3600/60)).padStart(2,"0")+"m"}
+"use strict";export function estimateWaitSeconds({queuepos,ownqueued,runnerstatus}){if(queuepos==null||runnerstatus==null||runnerstatus.stale||runnerstatus.maintenance||runnerstatus.draining){return null}if(ownqueued==null){return null}const own=ownqueued.find(task=>task.position===queuepos);if(own?.startestimate?.[0]>=0){return own.startestimate[0]}const runtimes=runnerstatus.typical_runtime_seconds;const numslots=runnerstatus.numslots;const queuedusers=runnerstatus.distinct_queued_users;if(!(numslots>0)||queuedusers==null){return null}const concurrency=Math.max(1,Math.min(numslots,queuedusers));const ownahead=ownqueued.filter(task=>task.position<queuepos);const otherahead=queuepos-ownahead.length;let ownseconds=0;for(const task of ownahead){const expected=task.expectedruntime>0?task.expectedruntime:runtimes?.[task.requesttype];if(!(expected>0)){return null}ownseconds+=expected}const otherpasses=Math.floor(otherahead/concurrency);let otherseconds=0;if(otherpasses>0){const meanpass=meanQueuedRuntimeSeconds(runnerstatus.queued_by_request_type,runtimes);if(meanpass==null){return null}otherseconds=otherpasses*meanpass}return Math.max(ownseconds,otherseconds)}function meanQueuedRuntimeSeconds(queuedbytype,runtimes){if(queuedbytype==null){return null}let tasks=0;let seconds=0;for(const[requesttype,count]of Object.entries(queuedbytype)){const median=runtimes?.[requesttype];if(!(count>0)||!(median>0)){continue}tasks+=count;seconds+=count*median}return tasks>0?seconds/tasks:null}export function formatWaitEstimate(seconds){if(seconds==null||!Number.isFinite(seconds)){return null}if(seconds<60){return"under a minute"}if(seconds<90*60){return"~"+Math.ceil(seconds/60)+" min"}if(seconds>=4*60*60){return"over 4 hours"}return"~"+Math.ceil(seconds/3600)+" hours"}export function formatDuration(seconds){if(seconds==null||!Number.isFinite(seconds)||seconds<0){return null}const whole=Math.round(seconds);if(whole<60){return whole+"s"}if(whole<3600){return Math.floor(whole/60)+"m "+String(whole%60).padStart(2,"0")+"s"}return Math.floor(whole/3600)+"h "+String(Math.floor(whole%3600/60)).padStart(2,"0")+"m"}